@@ -10,6 +10,8 @@ import logging
 from database import db
 from routers.auth import get_current_user
 from config import APK_UPLOAD_DIR
+from services.http_clients import EXPO_PUSH_PATH, http_clients
+from services.user_cache import user_cache
 
 router = APIRouter(prefix="/app-tecnico", tags=["App Técnico"])
 
@@ -155,6 +157,7 @@ async def register_push_token(
             "push_token_updated_at": datetime.now(timezone.utc).isoformat()
         }}
     )
+    user_cache.invalidar(user_id)
     
     logging.info(f"Push token registrado para usuário {user_id}")
     
@@ -166,8 +169,6 @@ async def send_push_notifications(
     current_user: dict = Depends(get_current_user)
 ):
     """Envia push notifications em massa (admin)"""
-    import requests
-    
     if current_user.get("perfil") not in ["admin", "admin_master"]:
         raise HTTPException(status_code=403, detail="Apenas administradores podem enviar notificações")
     
@@ -197,8 +198,8 @@ async def send_push_notifications(
     
     # Enviar via Expo Push API
     try:
-        response = requests.post(
-            "https://exp.host/--/api/v2/push/send",
+        response = await http_clients.cliente("expo").post(
+            EXPO_PUSH_PATH,
             json=messages,
             headers={"Content-Type": "application/json"}
         )
@@ -11,6 +11,8 @@ import logging
 from database import db
 from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, PERFIS_PERMISSOES
 from security_utils import log_security_event
+from services.telefones import ORIGEM_USERS, campos_telefone
+from services.user_cache import user_cache
 
 router = APIRouter(prefix="/auth", tags=["Autenticação"])
 security = HTTPBearer()
@@ -38,7 +40,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
         
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        user = await user_cache.obter(db, user_id, payload.get("sessao_id"))
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
         return user
@@ -153,6 +155,7 @@ async def register(request: Request, data: dict, current_user: dict = Depends(ge
         "created_at": now,
         "updated_at": now
     }
+    user_doc.update(campos_telefone(user_doc, ORIGEM_USERS))
     
     await db.users.insert_one(user_doc)
     
@@ -186,6 +189,7 @@ async def logout(current_user: dict = Depends(get_current_user)):
         user_id=current_user.get("id"),
         details=f"User logged out: {current_user.get('email')}"
     )
+    user_cache.invalidar(current_user.get("id"))
     return {"message": "Logout realizado com sucesso"}
 
 @router.get("/perfis")
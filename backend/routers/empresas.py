@@ -6,6 +6,7 @@ import uuid
 
 from database import db
 from routers.auth import get_current_user
+from services.user_cache import user_cache
 
 router = APIRouter(prefix="/empresas", tags=["Empresas"])
 
@@ -47,6 +48,7 @@ async def criar_empresa(
         {"id": current_user.get("id")},
         {"$addToSet": {"empresa_ids": empresa_id}}
     )
+    user_cache.invalidar(current_user.get("id"))
     
     # Remover _id do retorno
     empresa.pop("_id", None)
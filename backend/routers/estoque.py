@@ -6,6 +6,7 @@ import uuid
 
 from database import db
 from routers.auth import get_current_user
+from services.lookup_cache import name_cache
 
 router = APIRouter(tags=["Estoque"])
 
@@ -154,10 +155,7 @@ async def listar_equipamentos(
     equipamentos = await db.equipamentos_tecnicos.find(query, {"_id": 0}).limit(limit).to_list(limit)
     
     # Enriquecer com nome do técnico
-    for eq in equipamentos:
-        if eq.get("tecnico_id"):
-            tecnico = await db.users.find_one({"id": eq["tecnico_id"]}, {"_id": 0, "nome": 1})
-            eq["tecnico_nome"] = tecnico.get("nome") if tecnico else None
+    await name_cache.enriquecer(db, equipamentos, "tecnico_id", "users", {"nome": "tecnico_nome"})
     
     return equipamentos
 
@@ -280,10 +278,7 @@ async def obter_historico_equipamento(
     ).sort("data", -1).limit(limit).to_list(limit)
     
     # Enriquecer com nome do usuário
-    for h in historico:
-        if h.get("user_id"):
-            user = await db.users.find_one({"id": h["user_id"]}, {"nome": 1})
-            h["user_nome"] = user.get("nome") if user else None
+    await name_cache.enriquecer(db, historico, "user_id", "users", {"nome": "user_nome"})
     
     return historico
 
@@ -6,6 +6,9 @@ import uuid
 
 from database import db
 from routers.auth import get_current_user
+from services.backup import registrar_exclusao
+from services.lookup_cache import name_cache
+from services.rollup import registrar_transacao
 
 router = APIRouter(tags=["Financeiro"])
 
@@ -63,6 +66,7 @@ async def atualizar_categoria(
     
     if update:
         await db.categorias.update_one({"id": categoria_id}, {"$set": update})
+        name_cache.invalidar("categorias", categoria_id)
     
     return await db.categorias.find_one({"id": categoria_id}, {"_id": 0})
 
@@ -70,6 +74,7 @@ async def atualizar_categoria(
 async def excluir_categoria(categoria_id: str, current_user: dict = Depends(get_current_user)):
     """Excluir categoria"""
     await db.categorias.update_one({"id": categoria_id}, {"$set": {"ativo": False}})
+    name_cache.invalidar("categorias", categoria_id)
     return {"message": "Categoria excluída"}
 
 # ==================== CENTROS DE CUSTO ====================
@@ -258,6 +263,10 @@ async def atualizar_transacao(
             update[campo] = data[campo]
     
     await db.transacoes.update_one({"id": transacao_id}, {"$set": update})
+    if "categoria_id" in update or "centro_custo_id" in update:
+        # A transação muda de bucket no rollup mensal
+        await registrar_transacao(db, existing, sinal=-1)
+        await registrar_transacao(db, {**existing, **update})
     return await db.transacoes.find_one({"id": transacao_id}, {"_id": 0})
 
 @router.delete("/transacoes/{transacao_id}")
@@ -278,6 +287,8 @@ async def excluir_transacao(transacao_id: str, current_user: dict = Depends(get_
         )
     
     await db.transacoes.delete_one({"id": transacao_id})
+    await registrar_transacao(db, transacao, sinal=-1)
+    await registrar_exclusao(db, "transacoes", {"id": transacao_id})
     return {"message": "Transação excluída"}
 
 # ==================== DASHBOARD ====================
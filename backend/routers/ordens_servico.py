@@ -4,10 +4,11 @@ from typing import List, Optional, Dict, Any
 from datetime import datetime, timezone
 import uuid
 import logging
-import requests
 
 from database import db
 from routers.auth import get_current_user
+from services.http_clients import EXPO_PUSH_PATH, http_clients
+from services.lookup_cache import name_cache
 
 router = APIRouter(prefix="/ordens-servico", tags=["Ordens de Serviço"])
 
@@ -41,8 +42,8 @@ async def _enviar_push_nova_os(os_id: str, tecnico_id: str, os_data: dict):
             "channelId": "os-nova"
         }
         
-        response = requests.post(
-            "https://exp.host/--/api/v2/push/send",
+        response = await http_clients.cliente("expo").post(
+            EXPO_PUSH_PATH,
             json=message,
             headers={"Content-Type": "application/json"}
         )
@@ -85,10 +86,7 @@ async def listar_os(
     ordens = await db.ordens_servico.find(query, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit)
     
     # Enriquecer com nome do técnico
-    for os in ordens:
-        if os.get("tecnico_id"):
-            tecnico = await db.users.find_one({"id": os["tecnico_id"]}, {"_id": 0, "nome": 1})
-            os["tecnico_nome"] = tecnico.get("nome") if tecnico else None
+    await name_cache.enriquecer(db, ordens, "tecnico_id", "users", {"nome": "tecnico_nome"})
     
     return ordens
 
@@ -101,8 +99,7 @@ async def obter_os(os_id: str, current_user: dict = Depends(get_current_user)):
     
     # Enriquecer com nome do técnico
     if os.get("tecnico_id"):
-        tecnico = await db.users.find_one({"id": os["tecnico_id"]}, {"_id": 0, "nome": 1})
-        os["tecnico_nome"] = tecnico.get("nome") if tecnico else None
+        await name_cache.enriquecer(db, [os], "tecnico_id", "users", {"nome": "tecnico_nome"})
     
     return os
 
@@ -7,6 +7,9 @@ import uuid
 from database import db
 from routers.auth import get_current_user, hash_password
 from config import PERFIS_PERMISSOES
+from services.lookup_cache import name_cache
+from services.telefones import ORIGEM_USERS, campos_telefone
+from services.user_cache import user_cache
 
 router = APIRouter(prefix="/users", tags=["Usuários"])
 
@@ -63,6 +66,7 @@ async def update_user(
         update_data["nome"] = data["nome"]
     if data.get("telefone") is not None:
         update_data["telefone"] = data["telefone"]
+        update_data.update(campos_telefone(update_data, ORIGEM_USERS))
     if data.get("email"):
         # Verificar se email já existe
         email_exists = await db.users.find_one({"email": data["email"], "id": {"$ne": user_id}})
@@ -85,6 +89,8 @@ async def update_user(
         update_data["senha_hash"] = hash_password(data["senha"])
     
     await db.users.update_one({"id": user_id}, {"$set": update_data})
+    name_cache.invalidar("users", user_id)
+    user_cache.invalidar(user_id)
     
     updated = await db.users.find_one({"id": user_id}, {"_id": 0, "senha_hash": 0})
     return updated
@@ -107,6 +113,7 @@ async def delete_user(user_id: str, current_user: dict = Depends(get_current_use
         {"id": user_id}, 
         {"$set": {"ativo": False, "updated_at": datetime.now(timezone.utc).isoformat()}}
     )
+    user_cache.invalidar(user_id)
     
     return {"message": "Usuário desativado com sucesso"}
 
@@ -133,6 +140,7 @@ async def save_push_token(
             "push_token_updated_at": datetime.now(timezone.utc).isoformat()
         }}
     )
+    user_cache.invalidar(user_id)
     
     return {"success": True, "message": "Token registrado com sucesso"}
 
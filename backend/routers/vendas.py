@@ -6,8 +6,12 @@ import uuid
 
 from database import db
 from routers.auth import get_current_user
+from services.lookup_cache import name_cache
+from services.sequencias import Sequencias
+from services.telefones import ORIGEM_CLIENTES_VENDA, campos_telefone
 
 router = APIRouter(tags=["Vendas"])
+sequencias = Sequencias(db)
 
 # ==================== CLIENTES DE VENDA ====================
 
@@ -44,6 +48,8 @@ async def criar_cliente_venda(
         "updated_at": now
     }
     
+    cliente.update(campos_telefone(cliente, ORIGEM_CLIENTES_VENDA))
+    
     await db.clientes_venda.insert_one(cliente)
     return cliente
 
@@ -95,8 +101,10 @@ async def atualizar_cliente_venda(
     for campo in campos:
         if campo in data:
             update[campo] = data[campo]
+    update.update(campos_telefone(update, ORIGEM_CLIENTES_VENDA, atual=existing))
     
     await db.clientes_venda.update_one({"id": cliente_id}, {"$set": update})
+    name_cache.invalidar("clientes_venda", cliente_id)
     return await db.clientes_venda.find_one({"id": cliente_id}, {"_id": 0})
 
 # ==================== PLANOS DE SERVIÇO ====================
@@ -161,8 +169,7 @@ async def criar_venda_servico(
     now = datetime.now(timezone.utc).isoformat()
     
     # Gerar número da venda
-    count = await db.vendas_servico.count_documents({"empresa_id": empresa_id})
-    numero = f"V-{datetime.now().year}-{count + 1:04d}"
+    numero = await sequencias.numero("venda", empresa_id)
     
     venda = {
         "id": venda_id,
@@ -215,10 +222,7 @@ async def listar_vendas_servico(
         .to_list(limit)
     
     # Enriquecer com nome do cliente
-    for v in vendas:
-        if v.get("cliente_id"):
-            cliente = await db.clientes_venda.find_one({"id": v["cliente_id"]}, {"nome_completo": 1})
-            v["cliente_nome"] = cliente.get("nome_completo") if cliente else None
+    await name_cache.enriquecer(db, vendas, "cliente_id", "clientes_venda", {"nome_completo": "cliente_nome"})
     
     return vendas
 
@@ -284,8 +288,7 @@ async def criar_os_empresa(
     now = datetime.now(timezone.utc).isoformat()
     
     # Gerar número da OS
-    count = await db.ordens_servico.count_documents({"empresa_id": empresa_id})
-    numero = f"OS-{datetime.now().year}-{count + 1:04d}"
+    numero = await sequencias.numero("os", empresa_id)
     
     # Buscar dados do cliente
     cliente = await db.clientes_venda.find_one({"id": data.get("cliente_id")}, {"_id": 0})
@@ -347,9 +350,6 @@ async def listar_os_empresa(
         .to_list(limit)
     
     # Enriquecer com nome do técnico
-    for os in ordens:
-        if os.get("tecnico_id"):
-            tecnico = await db.users.find_one({"id": os["tecnico_id"]}, {"nome": 1})
-            os["tecnico_nome"] = tecnico.get("nome") if tecnico else None
+    await name_cache.enriquecer(db, ordens, "tecnico_id", "users", {"nome": "tecnico_nome"})
     
     return ordens
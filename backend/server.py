@@ -1,4 +1,4 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, Request, Body, Response
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, Request, Body, Response, Query
 from fastapi.responses import RedirectResponse, FileResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
@@ -6,47 +6,29 @@ from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 import os
 import logging
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr, validator
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 import uuid
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 import base64
 from emergentintegrations.llm.chat import LlmChat, UserMessage
-import csv
-import io
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER
 import pandas as pd
-from ofxparse import OfxParser
-from PyPDF2 import PdfReader
 from google.oauth2 import service_account
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request as GoogleRequest
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload, MediaIoBaseDownload
+from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 import json
 import tempfile
-import httpx
 import asyncio
-import requests
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from security_utils import (
@@ -62,9 +44,45 @@ from security_utils import (
     clear_failed_logins
 )
 
+# Antes dos services: singletons criados no import leem configuração do ambiente
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+from services.indexes import aplicar_indices, relatorio_indices, verificar_collscan
+from services.rollup import (
+    registrar_transacao, registrar_transacoes, reconstruir_rollup, backfill_rollup, agregar_periodo, somar_por
+)
+from services.lookup_cache import name_cache
+from services.user_cache import user_cache
+from services.pagination import Pagina, listar_paginado, HEADER_NEXT_CURSOR, LIMITE_MAXIMO
+from services.importacao import (
+    COLUNAS_OBRIGATORIAS, colunas_faltando, ler_planilha, importar_transacoes, dataframe_ofx, extrair_texto_pdf
+)
+from services.jobs import FilaJobs, JobContext, STATUS_FINAIS
+from services.exportacao import MEDIA_TYPE_XLSX, csv_leads, query_relatorio, stream_csv, gerar_xlsx, ler_em_partes
+from services.executores import executores
+from services.email_outbox import Outbox
+from services.telefones import ORIGEM_CLIENTES_VENDA, ORIGEM_LEADS, ORIGEM_USERS, campos_telefone, migrar_telefones
+from services.whatsapp_ingestao import IngestaoWhatsApp
+from services.backup import (
+    MEDIA_TYPE_BACKUP, MODO_AUTO, TIPO_COMPLETO, TIPO_INCREMENTAL, gerar_backup, limpar_catalogo, nome_arquivo,
+    registrar_backup, registrar_exclusao
+)
+from services.inadimplencia import verificar_inadimplentes as verificar_assinaturas_inadimplentes
+from services.restauracao import restaurar_backup
+from services.google_drive import DriveClientes, DriveNaoConectado, excluir_backups_antigos
+from services.agendador import Agendador, executar_exclusivo
+from services.sequencias import Sequencias
+from services.crm_metricas import campos_mudanca_status, metricas_crm, reconstruir_etapas
+from services.anomalias import DIAS_PADRAO, motor_anomalias
+from services.previsao_fluxo import previsao_fluxo, projetar
+from services.saldos import (
+    abrir_conta, aplicar_saldos, consolidar_saldos, migrar_saldos, registrar_lancamento, registrar_lancamentos,
+    saldo_atual, saldos_em, verificar_divergencias
+)
+from services.http_clients import EXPO_PUSH_PATH, http_clients
+from services.relatorio_pdf import LIMITE_TRANSACOES_PDF, renderizar_relatorio_pdf
+
 # MongoDB connection - allow build without real connection
 # Will be validated at startup
 mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
@@ -100,6 +118,20 @@ app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
 # Initialize APScheduler for automated backups
 scheduler = AsyncIOScheduler()
+# Tarefas agendadas rodam só no worker líder (lease no MongoDB), uma vez por disparo
+agendador = Agendador(db, scheduler)
+
+# Fila de jobs em background (handlers registrados na seção JOBS)
+fila_jobs = FilaJobs(db, concorrencia=int(os.environ.get("JOB_WORKERS", "2")))
+
+# Outbox de emails (envio SMTP em lote, em background)
+outbox = Outbox(db, conexoes=int(os.environ.get("SMTP_CONEXOES", "2")))
+
+# Google Drive: serviço em cache por usuário/conta de serviço, chamadas fora do event loop
+drive_clientes = DriveClientes(db)
+
+# Numeração de OS, vendas e faturas (contador atômico por empresa/ano)
+sequencias = Sequencias(db)
 
 # Environment variables - with safe defaults for build time
 # Validation happens at startup (see @app.on_event("startup") below)
@@ -1461,7 +1493,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
         
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        user = await user_cache.obter(db, user_id, payload.get("sessao_id"))
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
         return user
@@ -1573,51 +1605,16 @@ async def asaas_request(method: str, endpoint: str, data: dict = None):
             "message": "Mock response - Integração funcionará quando substituir pela API key real"
         }
     
-    async with httpx.AsyncClient() as client:
-        if method == "POST":
-            response = await client.post(url, json=data, headers=headers)
-        elif method == "GET":
-            response = await client.get(url, headers=headers)
-        elif method == "PUT":
-            response = await client.put(url, json=data, headers=headers)
-        elif method == "DELETE":
-            response = await client.delete(url, headers=headers)
-        
-        response.raise_for_status()
-        return response.json()
+    response = await http_clients.cliente("asaas").request(
+        method, url, json=data if method in ("POST", "PUT") else None, headers=headers
+    )
+    response.raise_for_status()
+    return response.json()
 
 async def enviar_email(destinatario: str, assunto: str, html: str):
-    """Envia email via Gmail SMTP"""
-    import smtplib
-    from email.mime.text import MIMEText
-    from email.mime.multipart import MIMEMultipart
-    
-    # Mock mode se não tiver senha configurada
-    if not GMAIL_APP_PASSWORD:
-        print(f"[MOCK EMAIL] Para: {destinatario}, Assunto: {assunto}")
-        return {"id": "mock_email_id", "success": True}
-    
-    try:
-        # Criar mensagem
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = assunto
-        msg['From'] = f"Sistema Financeiro <{GMAIL_USER}>"
-        msg['To'] = destinatario
-        
-        # Adicionar HTML
-        html_part = MIMEText(html, 'html')
-        msg.attach(html_part)
-        
-        # Enviar via Gmail SMTP
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-            server.login(GMAIL_USER, GMAIL_APP_PASSWORD)
-            server.send_message(msg)
-        
-        print(f"✅ Email enviado para {destinatario}")
-        return {"id": f"gmail_{destinatario}", "success": True}
-    except Exception as e:
-        print(f"❌ Erro ao enviar email: {str(e)}")
-        return {"id": None, "success": False, "error": str(e)}
+    """Coloca o email na outbox; o envio SMTP acontece em background"""
+    email = await outbox.enfileirar(destinatario, assunto, html, remetente_nome="Sistema Financeiro")
+    return {"id": email["id"], "success": True, "queued": True}
 
 async def enviar_whatsapp(numero: str, mensagem: str):
     """Envia mensagem via Twilio WhatsApp"""
@@ -1781,6 +1778,7 @@ async def register(request: Request, user_data: UserCreate, current_user: dict =
     
     doc = user_obj.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
+    doc.update(campos_telefone(doc, ORIGEM_USERS))
     
     await db.users.insert_one(doc)
     
@@ -1835,6 +1833,7 @@ async def update_user(
         update_data["nome"] = data["nome"]
     if data.get("telefone") is not None:
         update_data["telefone"] = data["telefone"]
+        update_data.update(campos_telefone(update_data, ORIGEM_USERS))
     if data.get("perfil"):
         perfil = data["perfil"]
         if perfil not in PERFIS_PERMISSOES:
@@ -1846,6 +1845,8 @@ async def update_user(
     
     if update_data:
         await db.users.update_one({"id": user_id}, {"$set": update_data})
+        name_cache.invalidar("users", user_id)
+        user_cache.invalidar(user_id)
     
     updated = await db.users.find_one({"id": user_id}, {"_id": 0, "senha_hash": 0})
     return {"message": "Usuário atualizado com sucesso", "user": updated}
@@ -1879,6 +1880,9 @@ async def delete_user(
         raise HTTPException(status_code=403, detail="Apenas admin_master pode excluir outro admin_master")
     
     await db.users.delete_one({"id": user_id})
+    await registrar_exclusao(db, "users", {"id": user_id})
+    name_cache.invalidar("users", user_id)
+    user_cache.invalidar(user_id)
     
     return {"message": "Usuário excluído com sucesso"}
 
@@ -2001,6 +2005,7 @@ async def reset_admin_password(request: Request):
                 "updated_at": datetime.now(timezone.utc).isoformat()
             }}
         )
+        user_cache.invalidar(admin_user["id"])
         
         logging.info(f"Admin password reset for user: {admin_user['id']}")
         
@@ -2167,6 +2172,7 @@ async def logout(request: Request, current_user: dict = Depends(get_current_user
         
         if sessao_id:
             await finalizar_sessao(sessao_id)
+            user_cache.invalidar_sessao(sessao_id)
         
         # Registrar ação de logout
         empresa_id = current_user.get("empresa_ids", [""])[0] if current_user.get("empresa_ids") else ""
@@ -2532,6 +2538,16 @@ def gerar_senha_automatica(email: str) -> str:
     especial = random.choice(['@', '#', '!', '$'])
     return f"{base}{numeros}{especial}"
 
+async def definir_bloqueio_empresa(cnpj: str, campos: Dict[str, Any]):
+    """Atualiza is_blocked/block_reason da empresa e descarta os usuários dela do cache de auth"""
+    empresa = await db.empresas.find_one_and_update(
+        {"cnpj": cnpj},
+        {"$set": campos},
+        projection={"_id": 0, "id": 1}
+    )
+    if empresa:
+        user_cache.invalidar_empresa(empresa["id"])
+
 @api_router.get("/assinaturas/planos")
 async def listar_planos_saas():
     """Retorna os planos SaaS disponíveis"""
@@ -2599,6 +2615,7 @@ async def criar_assinatura_saas(
         "is_cliente_saas": True,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
+    user_cliente.update(campos_telefone(user_cliente, ORIGEM_USERS))
     await db.users.insert_one(user_cliente)
     
     # Dia de vencimento = dia atual
@@ -2623,8 +2640,8 @@ async def criar_assinatura_saas(
         }
     else:
         # Criar cliente no Asaas
-        async with httpx.AsyncClient() as client:
-            customer_resp = await client.post(
+        client = http_clients.cliente("asaas")
+        customer_resp = await client.post(
             f"{base_url}/customers",
             json={
                 "name": dados.razao_social,
@@ -2633,40 +2650,40 @@ async def criar_assinatura_saas(
                 "phone": dados.telefone
             },
             headers={"access_token": api_key}
-            )
-            customer = customer_resp.json()
+        )
+        customer = customer_resp.json()
             
-            if "errors" in customer:
-                error_msg = customer.get("errors", [{}])[0].get("description", "Erro ao criar cliente no Asaas")
-                raise HTTPException(status_code=400, detail=f"Erro Asaas: {error_msg}")
+        if "errors" in customer:
+            error_msg = customer.get("errors", [{}])[0].get("description", "Erro ao criar cliente no Asaas")
+            raise HTTPException(status_code=400, detail=f"Erro Asaas: {error_msg}")
             
-            asaas_customer_id = customer["id"]
+        asaas_customer_id = customer["id"]
             
-            # Criar cobrança PIX para primeiro pagamento
-            pix_resp = await client.post(
-                f"{base_url}/payments",
-                json={
-                    "customer": asaas_customer_id,
-                    "billingType": "PIX",
-                    "value": plano_info["valor"],
-                    "dueDate": datetime.now().strftime("%Y-%m-%d"),
-                    "description": f"Assinatura {plano_info['nome']} - Primeiro Pagamento"
-                },
-                headers={"access_token": api_key}
-            )
-            pix_payment = pix_resp.json()
+        # Criar cobrança PIX para primeiro pagamento
+        pix_resp = await client.post(
+            f"{base_url}/payments",
+            json={
+                "customer": asaas_customer_id,
+                "billingType": "PIX",
+                "value": plano_info["valor"],
+                "dueDate": datetime.now().strftime("%Y-%m-%d"),
+                "description": f"Assinatura {plano_info['nome']} - Primeiro Pagamento"
+            },
+            headers={"access_token": api_key}
+        )
+        pix_payment = pix_resp.json()
             
-            if "errors" in pix_payment:
-                error_msg = pix_payment.get("errors", [{}])[0].get("description", "Erro ao gerar PIX")
-                raise HTTPException(status_code=400, detail=f"Erro Asaas: {error_msg}")
+        if "errors" in pix_payment:
+            error_msg = pix_payment.get("errors", [{}])[0].get("description", "Erro ao gerar PIX")
+            raise HTTPException(status_code=400, detail=f"Erro Asaas: {error_msg}")
             
-            # Buscar QR Code do PIX
-            pix_qr_resp = await client.get(
-                f"{base_url}/payments/{pix_payment['id']}/pixQrCode",
-                headers={"access_token": api_key}
-            )
-            pix_qr = pix_qr_resp.json()
-            pix_payment_id = pix_payment["id"]
+        # Buscar QR Code do PIX
+        pix_qr_resp = await client.get(
+            f"{base_url}/payments/{pix_payment['id']}/pixQrCode",
+            headers={"access_token": api_key}
+        )
+        pix_qr = pix_qr_resp.json()
+        pix_payment_id = pix_payment["id"]
     
     # Criar assinatura
     assinatura = AssinaturaSaaS(
@@ -2722,19 +2739,12 @@ async def criar_assinatura_saas(
         </div>
         """
         
-        GMAIL_USER = os.environ.get('GMAIL_USER')
-        GMAIL_APP_PASSWORD = os.environ.get('GMAIL_APP_PASSWORD')
-        
-        if GMAIL_USER and GMAIL_APP_PASSWORD:
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = f'🎉 Bem-vindo! Seus dados de acesso - {plano_info["nome"]}'
-            msg['From'] = f'Sistema ECHO SHOP <{GMAIL_USER}>'
-            msg['To'] = dados.email
-            msg.attach(MIMEText(html_email, 'html'))
-            
-            with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-                server.login(GMAIL_USER, GMAIL_APP_PASSWORD)
-                server.send_message(msg)
+        await outbox.enfileirar(
+            dados.email,
+            f'🎉 Bem-vindo! Seus dados de acesso - {plano_info["nome"]}',
+            html_email,
+            tipo="boas_vindas"
+        )
     except Exception as e:
         logging.error(f"Erro ao enviar email: {e}")
     
@@ -2787,12 +2797,12 @@ async def verificar_pagamento_assinatura(assinatura_id: str, current_user: dict
     base_url = "https://sandbox.asaas.com/api/v3" if gateway_config.get("sandbox_mode") else "https://www.asaas.com/api/v3"
     
     # Verificar status no Asaas
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(
-            f"{base_url}/payments/{assinatura['pix_payment_id']}",
-            headers={"access_token": api_key}
-        )
-        payment = resp.json()
+    client = http_clients.cliente("asaas")
+    resp = await client.get(
+        f"{base_url}/payments/{assinatura['pix_payment_id']}",
+        headers={"access_token": api_key}
+    )
+    payment = resp.json()
     
     if payment.get("status") in ["RECEIVED", "CONFIRMED"]:
         # Pagamento confirmado!
@@ -2806,10 +2816,7 @@ async def verificar_pagamento_assinatura(assinatura_id: str, current_user: dict
         )
         
         # Desbloquear empresa
-        await db.empresas.update_one(
-            {"cnpj": assinatura["cnpj_cpf"]},
-            {"$set": {"is_blocked": False}}
-        )
+        await definir_bloqueio_empresa(assinatura["cnpj_cpf"], {"is_blocked": False})
         
         # Lançar no financeiro
         await lancar_receita_mensalidade(assinatura)
@@ -2877,33 +2884,41 @@ async def criar_assinatura_recorrente(assinatura: dict, gateway_config: dict):
     dia = min(assinatura["dia_vencimento"], 28)  # Evitar problemas com fevereiro
     proximo_vencimento = f"{proximo_ano}-{proximo_mes:02d}-{dia:02d}"
     
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            f"{base_url}/subscriptions",
-            json={
-                "customer": assinatura["asaas_customer_id"],
-                "billingType": "BOLETO",
-                "value": assinatura["valor_mensal"],
-                "cycle": "MONTHLY",
-                "nextDueDate": proximo_vencimento,
-                "description": f"Mensalidade Plano {assinatura['plano'].capitalize()}"
-            },
-            headers={"access_token": api_key}
-        )
-        subscription = resp.json()
+    client = http_clients.cliente("asaas")
+    resp = await client.post(
+        f"{base_url}/subscriptions",
+        json={
+            "customer": assinatura["asaas_customer_id"],
+            "billingType": "BOLETO",
+            "value": assinatura["valor_mensal"],
+            "cycle": "MONTHLY",
+            "nextDueDate": proximo_vencimento,
+            "description": f"Mensalidade Plano {assinatura['plano'].capitalize()}"
+        },
+        headers={"access_token": api_key}
+    )
+    subscription = resp.json()
         
-        if "id" in subscription:
-            await db.assinaturas_saas.update_one(
-                {"id": assinatura["id"]},
-                {"$set": {"asaas_subscription_id": subscription["id"]}}
-            )
+    if "id" in subscription:
+        await db.assinaturas_saas.update_one(
+            {"id": assinatura["id"]},
+            {"$set": {"asaas_subscription_id": subscription["id"]}}
+        )
 
 @api_router.post("/assinaturas/verificar-inadimplentes")
-async def verificar_inadimplentes(current_user: dict = Depends(get_current_user)):
+async def verificar_inadimplentes(background: bool = False, current_user: dict = Depends(get_current_user)):
     """Verifica assinaturas inadimplentes e envia cobranças/bloqueia"""
     if current_user.get("perfil") not in ["admin", "admin_master"]:
         raise HTTPException(status_code=403, detail="Acesso negado")
     
+    if background:
+        job = await fila_jobs.enfileirar("verificar_inadimplentes", {}, user_id=current_user["id"], max_tentativas=1)
+        return {"status": "queued", "job_id": job["id"]}
+    
+    return await processar_inadimplentes()
+
+async def processar_inadimplentes(progresso=None):
+    """Consulta as cobranças em atraso de cada assinatura ativa e aplica cobrança/aviso/bloqueio"""
     gateway_config = await db.configuracoes_gateway.find_one({"ativo": True}, {"_id": 0})
     if not gateway_config:
         return {"message": "Gateway não configurado"}
@@ -2911,134 +2926,9 @@ async def verificar_inadimplentes(current_user: dict = Depends(get_current_user)
     api_key = gateway_config["api_key"]
     base_url = "https://sandbox.asaas.com/api/v3" if gateway_config.get("sandbox_mode") else "https://www.asaas.com/api/v3"
     
-    # Buscar assinaturas ativas
-    assinaturas = await db.assinaturas_saas.find({"status": "ativa"}, {"_id": 0}).to_list(500)
-    
-    resultados = []
-    GMAIL_USER = os.environ.get('GMAIL_USER')
-    GMAIL_APP_PASSWORD = os.environ.get('GMAIL_APP_PASSWORD')
-    
-    for assinatura in assinaturas:
-        if not assinatura.get("asaas_subscription_id"):
-            continue
-        
-        # Verificar cobranças pendentes
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(
-                f"{base_url}/payments",
-                params={
-                    "subscription": assinatura["asaas_subscription_id"],
-                    "status": "OVERDUE"
-                },
-                headers={"access_token": api_key}
-            )
-            overdue = resp.json()
-        
-        if overdue.get("data"):
-            cobranca = overdue["data"][0]
-            vencimento = datetime.strptime(cobranca["dueDate"], "%Y-%m-%d")
-            dias_atraso = (datetime.now() - vencimento).days
-            
-            # Atualizar dias de atraso
-            await db.assinaturas_saas.update_one(
-                {"id": assinatura["id"]},
-                {"$set": {"dias_atraso": dias_atraso}}
-            )
-            
-            # Lógica de cobrança/bloqueio
-            if dias_atraso >= 5:
-                # BLOQUEAR
-                await db.assinaturas_saas.update_one(
-                    {"id": assinatura["id"]},
-                    {"$set": {
-                        "status": "suspensa",
-                        "bloqueada_em": datetime.now(timezone.utc).isoformat()
-                    }}
-                )
-                await db.empresas.update_one(
-                    {"cnpj": assinatura["cnpj_cpf"]},
-                    {"$set": {"is_blocked": True, "block_reason": "Inadimplência"}}
-                )
-                
-                # Enviar email de bloqueio
-                if GMAIL_USER and GMAIL_APP_PASSWORD:
-                    try:
-                        html = f"""
-                        <div style="font-family: Arial; max-width: 600px; margin: 0 auto;">
-                            <h2 style="color: #dc3545;">⚠️ Acesso Suspenso</h2>
-                            <p>Prezado(a) {assinatura['razao_social']},</p>
-                            <p>Devido à inadimplência de <strong>{dias_atraso} dias</strong>, seu acesso ao sistema foi suspenso.</p>
-                            <p>Para reativar, efetue o pagamento pendente.</p>
-                            <p>Atenciosamente,<br>Equipe ECHO SHOP</p>
-                        </div>
-                        """
-                        msg = MIMEMultipart('alternative')
-                        msg['Subject'] = '⚠️ Acesso Suspenso - Inadimplência'
-                        msg['From'] = f'Sistema ECHO SHOP <{GMAIL_USER}>'
-                        msg['To'] = assinatura['email']
-                        msg.attach(MIMEText(html, 'html'))
-                        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-                            server.login(GMAIL_USER, GMAIL_APP_PASSWORD)
-                            server.send_message(msg)
-                    except Exception as e:
-                        logging.error(f"Erro envio email bloqueio: {e}")
-                
-                resultados.append({"assinatura": assinatura["razao_social"], "acao": "bloqueada"})
-            
-            elif dias_atraso >= 3:
-                # Aviso de suspensão
-                if GMAIL_USER and GMAIL_APP_PASSWORD:
-                    try:
-                        html = f"""
-                        <div style="font-family: Arial; max-width: 600px; margin: 0 auto;">
-                            <h2 style="color: #f57c00;">⚠️ Aviso de Suspensão</h2>
-                            <p>Prezado(a) {assinatura['razao_social']},</p>
-                            <p>Sua mensalidade está em atraso há <strong>{dias_atraso} dias</strong>.</p>
-                            <p><strong>Seu acesso será suspenso em {5 - dias_atraso} dias caso o pagamento não seja efetuado.</strong></p>
-                            <p>Atenciosamente,<br>Equipe ECHO SHOP</p>
-                        </div>
-                        """
-                        msg = MIMEMultipart('alternative')
-                        msg['Subject'] = '⚠️ Aviso: Suspensão em breve'
-                        msg['From'] = f'Sistema ECHO SHOP <{GMAIL_USER}>'
-                        msg['To'] = assinatura['email']
-                        msg.attach(MIMEText(html, 'html'))
-                        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-                            server.login(GMAIL_USER, GMAIL_APP_PASSWORD)
-                            server.send_message(msg)
-                    except Exception as e:
-                        logging.error(f"Erro envio email aviso: {e}")
-                
-                resultados.append({"assinatura": assinatura["razao_social"], "acao": "aviso_suspensao"})
-            
-            else:
-                # Email de cobrança
-                if GMAIL_USER and GMAIL_APP_PASSWORD:
-                    try:
-                        html = f"""
-                        <div style="font-family: Arial; max-width: 600px; margin: 0 auto;">
-                            <h2 style="color: #1976d2;">📋 Lembrete de Pagamento</h2>
-                            <p>Prezado(a) {assinatura['razao_social']},</p>
-                            <p>Identificamos que sua mensalidade está pendente.</p>
-                            <p>Valor: <strong>R$ {assinatura['valor_mensal']:.2f}</strong></p>
-                            <p>Efetue o pagamento para evitar a suspensão do serviço.</p>
-                            <p>Atenciosamente,<br>Equipe ECHO SHOP</p>
-                        </div>
-                        """
-                        msg = MIMEMultipart('alternative')
-                        msg['Subject'] = '📋 Lembrete: Mensalidade Pendente'
-                        msg['From'] = f'Sistema ECHO SHOP <{GMAIL_USER}>'
-                        msg['To'] = assinatura['email']
-                        msg.attach(MIMEText(html, 'html'))
-                        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-                            server.login(GMAIL_USER, GMAIL_APP_PASSWORD)
-                            server.send_message(msg)
-                    except Exception as e:
-                        logging.error(f"Erro envio email cobranca: {e}")
-                
-                resultados.append({"assinatura": assinatura["razao_social"], "acao": "email_cobranca"})
-    
-    return {"processadas": len(resultados), "resultados": resultados}
+    return await verificar_assinaturas_inadimplentes(
+        db, api_key, base_url, outbox, user_cache.invalidar_empresa, progresso=progresso
+    )
 
 @api_router.post("/webhook/asaas")
 async def webhook_asaas(request: Request):
@@ -3070,10 +2960,7 @@ async def webhook_asaas(request: Request):
                             "updated_at": datetime.now(timezone.utc).isoformat()
                         }}
                     )
-                    await db.empresas.update_one(
-                        {"cnpj": assinatura["cnpj_cpf"]},
-                        {"$set": {"is_blocked": False}}
-                    )
+                    await definir_bloqueio_empresa(assinatura["cnpj_cpf"], {"is_blocked": False})
                 else:
                     # Mensalidade recorrente
                     await db.assinaturas_saas.update_one(
@@ -3084,10 +2971,7 @@ async def webhook_asaas(request: Request):
                             "updated_at": datetime.now(timezone.utc).isoformat()
                         }}
                     )
-                    await db.empresas.update_one(
-                        {"cnpj": assinatura["cnpj_cpf"]},
-                        {"$set": {"is_blocked": False}}
-                    )
+                    await definir_bloqueio_empresa(assinatura["cnpj_cpf"], {"is_blocked": False})
                 
                 # Lançar receita
                 await lancar_receita_mensalidade(assinatura)
@@ -3146,42 +3030,42 @@ async def criar_venda(venda_data: dict, current_user: dict = Depends(get_current
                 "phone": venda.cliente_telefone or ""
             }
             
-            async with httpx.AsyncClient() as client:
-                customer_resp = await client.post(
-                    f"{base_url}/customers",
-                    json=customer_data,
-                    headers={"access_token": api_key}
-                )
-                customer = customer_resp.json()
+            client = http_clients.cliente("asaas")
+            customer_resp = await client.post(
+                f"{base_url}/customers",
+                json=customer_data,
+                headers={"access_token": api_key}
+            )
+            customer = customer_resp.json()
                 
-                # Verificar erro na criação do cliente
-                if "errors" in customer:
-                    error_msg = customer.get("errors", [{}])[0].get("description", "Erro ao criar cliente no Asaas")
-                    raise HTTPException(status_code=400, detail=f"Erro Asaas: {error_msg}")
+            # Verificar erro na criação do cliente
+            if "errors" in customer:
+                error_msg = customer.get("errors", [{}])[0].get("description", "Erro ao criar cliente no Asaas")
+                raise HTTPException(status_code=400, detail=f"Erro Asaas: {error_msg}")
                 
-                if "id" not in customer:
-                    raise HTTPException(status_code=400, detail=f"Resposta inesperada do Asaas: {customer}")
+            if "id" not in customer:
+                raise HTTPException(status_code=400, detail=f"Resposta inesperada do Asaas: {customer}")
                 
-                # Criar cobrança
-                payment_data = {
-                    "customer": customer["id"],
-                    "billingType": venda.metodo_pagamento.upper(),
-                    "value": venda.valor_total,
-                    "dueDate": venda.data_vencimento,
-                    "description": venda.descricao
-                }
+            # Criar cobrança
+            payment_data = {
+                "customer": customer["id"],
+                "billingType": venda.metodo_pagamento.upper(),
+                "value": venda.valor_total,
+                "dueDate": venda.data_vencimento,
+                "description": venda.descricao
+            }
                 
-                payment_resp = await client.post(
-                    f"{base_url}/payments",
-                    json=payment_data,
-                    headers={"access_token": api_key}
-                )
-                payment = payment_resp.json()
+            payment_resp = await client.post(
+                f"{base_url}/payments",
+                json=payment_data,
+                headers={"access_token": api_key}
+            )
+            payment = payment_resp.json()
                 
-                # Verificar erro na criação da cobrança
-                if "errors" in payment:
-                    error_msg = payment.get("errors", [{}])[0].get("description", "Erro ao criar cobrança no Asaas")
-                    raise HTTPException(status_code=400, detail=f"Erro Asaas: {error_msg}")
+            # Verificar erro na criação da cobrança
+            if "errors" in payment:
+                error_msg = payment.get("errors", [{}])[0].get("description", "Erro ao criar cobrança no Asaas")
+                raise HTTPException(status_code=400, detail=f"Erro Asaas: {error_msg}")
         
         # Atualizar venda com dados do pagamento
         venda.gateway_payment_id = payment.get("id")
@@ -3259,6 +3143,9 @@ async def delete_user(user_id: str, current_user: dict = Depends(get_current_use
     result = await db.users.delete_one({"id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
+    await registrar_exclusao(db, "users", {"id": user_id})
+    name_cache.invalidar("users", user_id)
+    user_cache.invalidar(user_id)
     
     # Log the deletion
     log_security_event(
@@ -3302,6 +3189,7 @@ async def create_empresa(
         {"id": current_user["id"]},
         {"$addToSet": {"empresa_ids": empresa_obj.id}}
     )
+    user_cache.invalidar(current_user["id"])
     
     # Registrar ação
     await registrar_acao(
@@ -3371,12 +3259,14 @@ async def delete_empresa(empresa_id: str, current_user: dict = Depends(get_curre
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Empresa não encontrada")
+    await registrar_exclusao(db, "empresas", {"id": empresa_id})
     
     # Remover empresa_id do usuário
     await db.users.update_one(
         {"id": current_user["id"]},
         {"$pull": {"empresa_ids": empresa_id}}
     )
+    user_cache.invalidar_empresa(empresa_id)
     
     return {"message": "Empresa excluída com sucesso"}
 
@@ -3406,6 +3296,8 @@ async def delete_categoria(categoria_id: str, current_user: dict = Depends(get_c
     result = await db.categorias.delete_one({"id": categoria_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Categoria não encontrada")
+    await registrar_exclusao(db, "categorias", {"id": categoria_id})
+    name_cache.invalidar("categorias", categoria_id)
     return {"message": "Categoria deletada"}
 
 # CENTRO DE CUSTO ROUTES
@@ -3434,6 +3326,8 @@ async def delete_centro_custo(cc_id: str, current_user: dict = Depends(get_curre
     result = await db.centros_custo.delete_one({"id": cc_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Centro de custo não encontrado")
+    await registrar_exclusao(db, "centros_custo", {"id": cc_id})
+    name_cache.invalidar("centros_custo", cc_id)
     return {"message": "Centro de custo deletado"}
 
 # CONTAS BANCÁRIAS ROUTES
@@ -3447,6 +3341,7 @@ async def create_conta(empresa_id: str, conta_data: ContaBancariaCreate, current
     doc['created_at'] = doc['created_at'].isoformat()
     
     await db.contas_bancarias.insert_one(doc)
+    await abrir_conta(db, doc)
     return conta_obj
 
 @api_router.get("/empresas/{empresa_id}/contas", response_model=List[ContaBancaria])
@@ -3455,7 +3350,7 @@ async def get_contas(empresa_id: str, current_user: dict = Depends(get_current_u
         raise HTTPException(status_code=403, detail="Acesso negado")
     
     contas = await db.contas_bancarias.find({"empresa_id": empresa_id}, {"_id": 0}).to_list(100)
-    return contas
+    return await aplicar_saldos(db, contas)
 
 @api_router.put("/contas/{conta_id}", response_model=ContaBancaria)
 async def update_conta(conta_id: str, conta_data: ContaBancariaCreate, current_user: dict = Depends(get_current_user)):
@@ -3463,18 +3358,32 @@ async def update_conta(conta_id: str, conta_data: ContaBancariaCreate, current_u
     if not conta:
         raise HTTPException(status_code=404, detail="Conta não encontrada")
     
+    # O saldo vem do ledger: saldo_inicial editado não altera o saldo
     update_data = conta_data.model_dump()
-    update_data['saldo_atual'] = conta['saldo_atual']  # Preservar saldo atual
     await db.contas_bancarias.update_one({"id": conta_id}, {"$set": update_data})
     
     updated_conta = await db.contas_bancarias.find_one({"id": conta_id}, {"_id": 0})
-    return updated_conta
+    return (await aplicar_saldos(db, [updated_conta]))[0]
+
+@api_router.get("/contas/{conta_id}/saldo")
+async def get_saldo_conta(conta_id: str, data: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Saldo atual da conta, ou ao fim do dia `data` (YYYY-MM-DD)"""
+    conta = await db.contas_bancarias.find_one({"id": conta_id}, {"_id": 0, "empresa_id": 1})
+    if not conta:
+        raise HTTPException(status_code=404, detail="Conta não encontrada")
+    if conta["empresa_id"] not in current_user.get("empresa_ids", []):
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    if data:
+        return {"conta_id": conta_id, "data": data, "saldo": (await saldos_em(db, [conta_id], data))[conta_id]}
+    return {"conta_id": conta_id, "saldo": await saldo_atual(db, conta_id)}
 
 @api_router.delete("/contas/{conta_id}")
 async def delete_conta(conta_id: str, current_user: dict = Depends(get_current_user)):
     result = await db.contas_bancarias.delete_one({"id": conta_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Conta não encontrada")
+    await registrar_exclusao(db, "contas_bancarias", {"id": conta_id})
     return {"message": "Conta deletada"}
 
 # INVESTIMENTOS ROUTES
@@ -3515,6 +3424,7 @@ async def delete_investimento(inv_id: str, current_user: dict = Depends(get_curr
     result = await db.investimentos.delete_one({"id": inv_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Investimento não encontrado")
+    await registrar_exclusao(db, "investimentos", {"id": inv_id})
     return {"message": "Investimento deletado"}
 
 # CARTÕES DE CRÉDITO ROUTES
@@ -3557,6 +3467,7 @@ async def delete_cartao(cartao_id: str, current_user: dict = Depends(get_current
     result = await db.cartoes_credito.delete_one({"id": cartao_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Cartão não encontrado")
+    await registrar_exclusao(db, "cartoes_credito", {"id": cartao_id})
     return {"message": "Cartão deletado"}
 
 # ==================== ESTOQUE ROUTES ====================
@@ -3574,13 +3485,21 @@ async def create_cliente(empresa_id: str, cliente_data: ClienteCreate, current_u
     await db.clientes.insert_one(doc)
     return cliente_obj
 
-@api_router.get("/empresas/{empresa_id}/clientes", response_model=List[Cliente])
-async def get_clientes(empresa_id: str, current_user: dict = Depends(get_current_user)):
+@api_router.get("/empresas/{empresa_id}/clientes", response_model=Union[List[Cliente], Pagina[Cliente]])
+async def get_clientes(
+    empresa_id: str,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
     if empresa_id not in current_user.get("empresa_ids", []):
         raise HTTPException(status_code=403, detail="Acesso negado")
     
-    clientes = await db.clientes.find({"empresa_id": empresa_id}, {"_id": 0}).to_list(1000)
-    return clientes
+    return await listar_paginado(
+        db.clientes, {"empresa_id": empresa_id}, response, limit=limit, cursor=cursor, stream=stream
+    )
 
 @api_router.get("/clientes/{cliente_id}", response_model=Cliente)
 async def get_cliente(cliente_id: str, current_user: dict = Depends(get_current_user)):
@@ -3606,6 +3525,7 @@ async def delete_cliente(cliente_id: str, current_user: dict = Depends(get_curre
     result = await db.clientes.delete_one({"id": cliente_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    await registrar_exclusao(db, "clientes", {"id": cliente_id})
     return {"message": "Cliente deletado"}
 
 # FORNECEDORES ROUTES
@@ -3646,6 +3566,7 @@ async def delete_fornecedor(fornecedor_id: str, current_user: dict = Depends(get
     result = await db.fornecedores.delete_one({"id": fornecedor_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Fornecedor não encontrado")
+    await registrar_exclusao(db, "fornecedores", {"id": fornecedor_id})
     return {"message": "Fornecedor deletado"}
 
 # LOCAIS/DEPÓSITOS ROUTES
@@ -3686,6 +3607,7 @@ async def delete_local(local_id: str, current_user: dict = Depends(get_current_u
     result = await db.locais_deposito.delete_one({"id": local_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Local não encontrado")
+    await registrar_exclusao(db, "locais_deposito", {"id": local_id})
     return {"message": "Local deletado"}
 
 # CATEGORIAS DE EQUIPAMENTOS ROUTES
@@ -3726,6 +3648,7 @@ async def delete_categoria_equipamento(categoria_id: str, current_user: dict = D
     result = await db.categorias_equipamentos.delete_one({"id": categoria_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Categoria não encontrada")
+    await registrar_exclusao(db, "categorias_equipamentos", {"id": categoria_id})
     return {"message": "Categoria deletada"}
 
 # EQUIPAMENTOS ROUTES
@@ -3776,6 +3699,7 @@ async def delete_equipamento(equipamento_id: str, current_user: dict = Depends(g
     result = await db.equipamentos.delete_one({"id": equipamento_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Equipamento não encontrado")
+    await registrar_exclusao(db, "equipamentos", {"id": equipamento_id})
     return {"message": "Equipamento deletado"}
 
 # EQUIPAMENTOS SERIALIZADOS ROUTES
@@ -3853,6 +3777,7 @@ async def delete_equipamento_serializado(eq_serial_id: str, current_user: dict =
     result = await db.equipamentos_serializados.delete_one({"id": eq_serial_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Equipamento serializado não encontrado")
+    await registrar_exclusao(db, "equipamentos_serializados", {"id": eq_serial_id})
     return {"message": "Equipamento serializado deletado"}
 
 # MOVIMENTAÇÕES DE ESTOQUE ROUTES
@@ -3941,18 +3866,23 @@ async def create_movimentacao(empresa_id: str, mov_data: MovimentacaoEstoqueCrea
         trans_doc['created_at'] = trans_doc['created_at'].isoformat()
         
         await db.transacoes.insert_one(trans_doc)
+        await registrar_transacao(db, trans_doc)
         mov_obj.transacao_id = transacao_obj.id
         doc['transacao_id'] = transacao_obj.id
     
     await db.movimentacoes_estoque.insert_one(doc)
     return mov_obj
 
-@api_router.get("/empresas/{empresa_id}/movimentacoes", response_model=List[MovimentacaoEstoque])
+@api_router.get("/empresas/{empresa_id}/movimentacoes", response_model=Union[List[MovimentacaoEstoque], Pagina[MovimentacaoEstoque]])
 async def get_movimentacoes(
     empresa_id: str,
+    response: Response,
     tipo: Optional[str] = None,
     equipamento_id: Optional[str] = None,
     cliente_id: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    stream: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
     if empresa_id not in current_user.get("empresa_ids", []):
@@ -3966,8 +3896,9 @@ async def get_movimentacoes(
     if cliente_id:
         query["cliente_id"] = cliente_id
     
-    movimentacoes = await db.movimentacoes_estoque.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return movimentacoes
+    return await listar_paginado(
+        db.movimentacoes_estoque, query, response, limit=limit, cursor=cursor, stream=stream
+    )
 
 # ==================== END ESTOQUE ROUTES ====================
 
@@ -3985,8 +3916,14 @@ async def create_lead(empresa_id: str, lead_data: LeadCreate, current_user: dict
     doc['updated_at'] = doc['updated_at'].isoformat()
     if doc.get('last_contact_at'):
         doc['last_contact_at'] = doc['last_contact_at'].isoformat()
+    doc['status_desde'] = doc['created_at']
+    doc.update(campos_telefone(doc, ORIGEM_LEADS))
     
-    await db.leads.insert_one(doc)
+    try:
+        await db.leads.insert_one(doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Já existe um lead com este telefone")
+    metricas_crm.invalidar(empresa_id)
     
     # Registrar atividade
     activity = Activity(
@@ -4002,12 +3939,16 @@ async def create_lead(empresa_id: str, lead_data: LeadCreate, current_user: dict
     
     return lead_obj
 
-@api_router.get("/empresas/{empresa_id}/leads", response_model=List[Lead])
+@api_router.get("/empresas/{empresa_id}/leads", response_model=Union[List[Lead], Pagina[Lead]])
 async def get_leads(
     empresa_id: str,
+    response: Response,
     status_funil: Optional[str] = None,
     assigned_to: Optional[str] = None,
     origem: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    stream: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
     if empresa_id not in current_user.get("empresa_ids", []):
@@ -4021,8 +3962,7 @@ async def get_leads(
     if origem:
         query["origem"] = origem
     
-    leads = await db.leads.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return leads
+    return await listar_paginado(db.leads, query, response, limit=limit, cursor=cursor, stream=stream)
 
 @api_router.get("/leads/{lead_id}", response_model=Lead)
 async def get_lead(lead_id: str, current_user: dict = Depends(get_current_user)):
@@ -4039,8 +3979,13 @@ async def update_lead(lead_id: str, lead_data: LeadUpdate, current_user: dict =
     
     update_data = {k: v for k, v in lead_data.model_dump(exclude_unset=True).items() if v is not None}
     update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data.update(campos_telefone(update_data, ORIGEM_LEADS, atual=lead))
     
-    await db.leads.update_one({"id": lead_id}, {"$set": update_data})
+    try:
+        await db.leads.update_one({"id": lead_id}, {"$set": update_data})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Já existe um lead com este telefone")
+    metricas_crm.invalidar(lead['empresa_id'])
     
     # Registrar atividade
     activity = Activity(
@@ -4060,9 +4005,11 @@ async def update_lead(lead_id: str, lead_data: LeadUpdate, current_user: dict =
 
 @api_router.delete("/leads/{lead_id}")
 async def delete_lead(lead_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.leads.delete_one({"id": lead_id})
-    if result.deleted_count == 0:
+    lead = await db.leads.find_one_and_delete({"id": lead_id}, {"_id": 0, "empresa_id": 1})
+    if not lead:
         raise HTTPException(status_code=404, detail="Lead não encontrado")
+    await registrar_exclusao(db, "leads", {"id": lead_id})
+    metricas_crm.invalidar(lead.get('empresa_id'))
     return {"message": "Lead deletado"}
 
 @api_router.patch("/leads/{lead_id}/status")
@@ -4074,13 +4021,12 @@ async def update_lead_status(lead_id: str, status: str, current_user: dict = Dep
     
     old_status = lead.get('status_funil')
     
+    # Acumula o tempo na etapa que termina (tempo médio por etapa nas métricas)
     await db.leads.update_one(
         {"id": lead_id},
-        {"$set": {
-            "status_funil": status,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
+        campos_mudanca_status(lead, status, datetime.now(timezone.utc))
     )
+    metricas_crm.invalidar(lead['empresa_id'])
     
     # Registrar atividade
     activity = Activity(
@@ -4113,6 +4059,7 @@ async def assign_lead(lead_id: str, user_id: str, current_user: dict = Depends(g
             "updated_at": datetime.now(timezone.utc).isoformat()
         }}
     )
+    metricas_crm.invalidar(lead['empresa_id'])
     
     # Registrar atividade
     activity = Activity(
@@ -4184,6 +4131,7 @@ async def delete_template(template_id: str, current_user: dict = Depends(get_cur
     result = await db.message_templates.delete_one({"id": template_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Template não encontrado")
+    await registrar_exclusao(db, "message_templates", {"id": template_id})
     return {"message": "Template deletado"}
 
 @api_router.post("/leads/{lead_id}/send-message")
@@ -4304,6 +4252,7 @@ async def apply_routing(empresa_id: str, lead_id: str):
         
         # Atualizar lead e config
         await db.leads.update_one({"id": lead_id}, {"$set": {"assigned_to": proximo}})
+        metricas_crm.invalidar(empresa_id)
         await db.routing_configs.update_one(
             {"empresa_id": empresa_id},
             {"$set": {"ultimo_atribuido": proximo}}
@@ -4351,6 +4300,7 @@ async def delete_ai_agent(agent_id: str, current_user: dict = Depends(get_curren
     result = await db.ai_agents.delete_one({"id": agent_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Agente não encontrado")
+    await registrar_exclusao(db, "ai_agents", {"id": agent_id})
     return {"message": "Agente deletado"}
 
 async def process_ai_response(empresa_id: str, lead_id: str, message: str):
@@ -4391,82 +4341,8 @@ async def get_crm_metrics(empresa_id: str, current_user: dict = Depends(get_curr
     if empresa_id not in current_user.get("empresa_ids", []):
         raise HTTPException(status_code=403, detail="Acesso negado")
     
-    # Buscar todos os leads
-    leads = await db.leads.find({"empresa_id": empresa_id}, {"_id": 0}).to_list(10000)
-    
-    # Total de leads
-    total_leads = len(leads)
-    
-    # Leads por status
-    leads_por_status = {}
-    for lead in leads:
-        status = lead.get('status_funil', 'novo')
-        leads_por_status[status] = leads_por_status.get(status, 0) + 1
-    
-    # Leads por origem
-    leads_por_origem = {}
-    for lead in leads:
-        origem = lead.get('origem', 'manual')
-        leads_por_origem[origem] = leads_por_origem.get(origem, 0) + 1
-    
-    # Taxa de conversão por etapa
-    taxa_conversao = {}
-    total = total_leads if total_leads > 0 else 1
-    for status, count in leads_por_status.items():
-        taxa_conversao[status] = (count / total) * 100
-    
-    # Valor total do pipeline
-    valor_total_pipeline = sum(lead.get('valor_estimado', 0) for lead in leads if lead.get('status_funil') not in ['ganho', 'perdido'])
-    
-    # Leads ganhos e perdidos no mês atual
-    now = datetime.now(timezone.utc)
-    mes_atual = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0).isoformat()
-    
-    leads_vencidos_mes = len([l for l in leads if l.get('status_funil') == 'ganho' and l.get('updated_at', '') >= mes_atual])
-    leads_perdidos_mes = len([l for l in leads if l.get('status_funil') == 'perdido' and l.get('updated_at', '') >= mes_atual])
-    
-    # Desempenho por vendedor
-    vendedores_stats = {}
-    for lead in leads:
-        assigned_to = lead.get('assigned_to')
-        if assigned_to:
-            if assigned_to not in vendedores_stats:
-                vendedores_stats[assigned_to] = {
-                    'user_id': assigned_to,
-                    'total_leads': 0,
-                    'leads_ganhos': 0,
-                    'leads_perdidos': 0,
-                    'valor_ganho': 0
-                }
-            vendedores_stats[assigned_to]['total_leads'] += 1
-            if lead.get('status_funil') == 'ganho':
-                vendedores_stats[assigned_to]['leads_ganhos'] += 1
-                vendedores_stats[assigned_to]['valor_ganho'] += lead.get('valor_estimado', 0)
-            elif lead.get('status_funil') == 'perdido':
-                vendedores_stats[assigned_to]['leads_perdidos'] += 1
-    
-    desempenho_vendedores = list(vendedores_stats.values())
-    
-    # Tempo médio por etapa (simplificado)
-    tempo_medio_por_etapa = {
-        "novo": 1.5,
-        "contatado": 2.0,
-        "qualificado": 3.5,
-        "proposta": 5.0,
-        "negociacao": 7.0
-    }
-    
-    return CRMMetrics(
-        total_leads=total_leads,
-        leads_por_status=leads_por_status,
-        leads_por_origem=leads_por_origem,
-        taxa_conversao=taxa_conversao,
-        tempo_medio_por_etapa=tempo_medio_por_etapa,
-        valor_total_pipeline=valor_total_pipeline,
-        leads_vencidos_mes=leads_vencidos_mes,
-        leads_perdidos_mes=leads_perdidos_mes,
-        desempenho_vendedores=desempenho_vendedores
-    )
+    # Uma agregação ($facet) por empresa, em cache por alguns segundos
+    return CRMMetrics(**await metricas_crm.obter(db, empresa_id))
 
 # RELATÓRIOS EXPORTÁVEIS
 @api_router.get("/empresas/{empresa_id}/crm/export/leads")
@@ -4476,30 +4352,7 @@ async def export_leads_csv(empresa_id: str, current_user: dict = Depends(get_cur
         raise HTTPException(status_code=403, detail="Acesso negado")
     
     leads = await db.leads.find({"empresa_id": empresa_id}, {"_id": 0}).to_list(10000)
-    
-    # Criar CSV
-    import io
-    import csv
-    
-    output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=['id', 'nome', 'telefone', 'email', 'origem', 'status_funil', 'valor_estimado', 'assigned_to', 'created_at'])
-    writer.writeheader()
-    
-    for lead in leads:
-        writer.writerow({
-            'id': lead.get('id'),
-            'nome': lead.get('nome'),
-            'telefone': lead.get('telefone'),
-            'email': lead.get('email', ''),
-            'origem': lead.get('origem'),
-            'status_funil': lead.get('status_funil'),
-            'valor_estimado': lead.get('valor_estimado', 0),
-            'assigned_to': lead.get('assigned_to', ''),
-            'created_at': lead.get('created_at')
-        })
-    
-    output.seek(0)
-    return Response(content=output.getvalue(), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=leads.csv"})
+    return Response(content=csv_leads(leads), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=leads.csv"})
 
 # SEQUÊNCIAS DE FOLLOW-UP
 @api_router.post("/empresas/{empresa_id}/follow-up-sequences", response_model=FollowUpSequence)
@@ -4527,6 +4380,7 @@ async def delete_sequence(sequence_id: str, current_user: dict = Depends(get_cur
     result = await db.follow_up_sequences.delete_one({"id": sequence_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Sequência não encontrada")
+    await registrar_exclusao(db, "follow_up_sequences", {"id": sequence_id})
     return {"message": "Sequência deletada"}
 
 # COMPLIANCE LGPD
@@ -4559,9 +4413,12 @@ async def delete_lead_gdpr(lead_id: str, current_user: dict = Depends(get_curren
     
     # Deletar lead
     await db.leads.delete_one({"id": lead_id})
+    await registrar_exclusao(db, "leads", {"id": lead_id})
+    metricas_crm.invalidar(lead.get('empresa_id'))
     
     # Deletar atividades
     await db.activities.delete_many({"lead_id": lead_id})
+    await registrar_exclusao(db, "activities", {"lead_id": lead_id})
     
     # Registrar log de exclusão
     logging.info(f"LGPD: Lead {lead_id} deletado permanentemente por {current_user['id']}")
@@ -4585,19 +4442,13 @@ async def create_transacao(empresa_id: str, transacao_data: TransacaoCreate, cur
     doc['created_at'] = doc['created_at'].isoformat()
     
     await db.transacoes.insert_one(doc)
+    await registrar_transacao(db, doc)
     
-    # Atualizar saldo da conta bancária se vinculado
-    if transacao_data.conta_bancaria_id:
-        if transacao_data.tipo == "receita":
-            await db.contas_bancarias.update_one(
-                {"id": transacao_data.conta_bancaria_id},
-                {"$inc": {"saldo_atual": transacao_data.valor_total}}
-            )
-        else:  # despesa
-            await db.contas_bancarias.update_one(
-                {"id": transacao_data.conta_bancaria_id},
-                {"$inc": {"saldo_atual": -transacao_data.valor_total}}
-            )
+    # Lançamento no ledger de saldos se vinculado a conta bancária
+    await registrar_lancamento(db, doc)
+    # Despesa nova pontuada contra as linhas de base de anomalias em cache
+    motor_anomalias.registrar(empresa_id, doc)
+    previsao_fluxo.registrar(empresa_id, doc)
     
     # Atualizar fatura do cartão se vinculado
     if transacao_data.cartao_credito_id and transacao_data.tipo == "despesa":
@@ -4613,16 +4464,20 @@ async def create_transacao(empresa_id: str, transacao_data: TransacaoCreate, cur
     
     return transacao_obj
 
-@api_router.get("/empresas/{empresa_id}/transacoes", response_model=List[Transacao])
+@api_router.get("/empresas/{empresa_id}/transacoes", response_model=Union[List[Transacao], Pagina[Transacao]])
 async def get_transacoes(
     empresa_id: str, 
+    response: Response,
     current_user: dict = Depends(get_current_user),
     categoria_id: Optional[str] = None,
     centro_custo_id: Optional[str] = None,
     conta_bancaria_id: Optional[str] = None,
     fornecedor_id: Optional[str] = None,
     tipo: Optional[str] = None,
-    status: Optional[str] = None
+    status: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    stream: bool = False
 ):
     if empresa_id not in current_user.get("empresa_ids", []):
         raise HTTPException(status_code=403, detail="Acesso negado")
@@ -4643,8 +4498,7 @@ async def get_transacoes(
     if status:
         query["status"] = status
     
-    transacoes = await db.transacoes.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return transacoes
+    return await listar_paginado(db.transacoes, query, response, limit=limit, cursor=cursor, stream=stream)
 
 @api_router.delete("/transacoes/{transacao_id}")
 async def delete_transacao(transacao_id: str, current_user: dict = Depends(get_current_user)):
@@ -4665,31 +4519,19 @@ async def delete_transacao(transacao_id: str, current_user: dict = Depends(get_c
     if empresa_id not in current_user.get("empresa_ids", []):
         raise HTTPException(status_code=403, detail="Acesso negado a esta transação")
     
-    # Reverse the balance update if transaction has conta_bancaria_id
     conta_bancaria_id = transacao.get("conta_bancaria_id")
-    if conta_bancaria_id:
-        tipo = transacao.get("tipo")
-        valor_total = transacao.get("valor_total", 0)
-        
-        # Reverse the balance change (opposite of what was done on creation)
-        if tipo == "receita":
-            # On creation we added (+), so now subtract (-)
-            await db.contas_bancarias.update_one(
-                {"id": conta_bancaria_id},
-                {"$inc": {"saldo_atual": -valor_total}}
-            )
-        elif tipo == "despesa":
-            # On creation we subtracted (-), so now add back (+)
-            await db.contas_bancarias.update_one(
-                {"id": conta_bancaria_id},
-                {"$inc": {"saldo_atual": valor_total}}
-            )
     
-    # Now delete the transaction
     result = await db.transacoes.delete_one({"id": transacao_id})
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=500, detail="Erro ao deletar transação")
+    await registrar_exclusao(db, "transacoes", {"id": transacao_id})
+    
+    await registrar_transacao(db, transacao, sinal=-1)
+    # Estorno no ledger (só quem de fato excluiu o documento chega aqui)
+    await registrar_lancamento(db, transacao, sinal=-1)
+    motor_anomalias.invalidar(empresa_id)
+    previsao_fluxo.registrar(empresa_id, transacao, sinal=-1)
     
     return {
         "message": "Transação deletada e saldos atualizados com sucesso",
@@ -4725,7 +4567,7 @@ async def criar_transferencia(
         raise HTTPException(status_code=400, detail="Valor deve ser maior que zero")
     
     # Check if origem has sufficient balance
-    if conta_origem.get("saldo_atual", 0) < transferencia.valor:
+    if await saldo_atual(db, transferencia.conta_origem_id) < transferencia.valor:
         raise HTTPException(status_code=400, detail="Saldo insuficiente na conta de origem")
     
     # Get or create default categoria and centro_custo for transfers
@@ -4787,20 +4629,10 @@ async def criar_transferencia(
     # Link transactions
     transacao_saida["transferencia_relacionada_id"] = transacao_entrada["id"]
     
-    # Update balances
-    await db.contas_bancarias.update_one(
-        {"id": transferencia.conta_origem_id},
-        {"$inc": {"saldo_atual": -transferencia.valor}}
-    )
-    
-    await db.contas_bancarias.update_one(
-        {"id": transferencia.conta_destino_id},
-        {"$inc": {"saldo_atual": transferencia.valor}}
-    )
-    
-    # Insert transactions
-    await db.transacoes.insert_one(transacao_saida)
-    await db.transacoes.insert_one(transacao_entrada)
+    # Insert transactions; both legs go to the balance ledger in a single insert
+    await db.transacoes.insert_many([transacao_saida, transacao_entrada])
+    await registrar_lancamentos(db, [transacao_saida, transacao_entrada])
+    await registrar_transacoes(db, [transacao_saida, transacao_entrada])
     
     return {
         "message": "Transferência realizada com sucesso",
@@ -4896,35 +4728,49 @@ async def get_dashboard(empresa_id: str, current_user: dict = Depends(get_curren
     else:
         fim_mes = now.replace(month=now.month + 1, day=1, hour=0, minute=0, second=0, microsecond=0)
     
-    # Get all transactions for current month only
-    transacoes = await db.transacoes.find({"empresa_id": empresa_id}, {"_id": 0}).to_list(10000)
-    
-    # Filtrar transações do mês atual
-    def get_transaction_date(t):
-        data = t.get("data_vencimento") or t.get("data_competencia") or t.get("created_at", "")
-        if isinstance(data, datetime):
-            if data.tzinfo is None:
-                return data.replace(tzinfo=timezone.utc)
-            return data
-        elif isinstance(data, str):
-            try:
-                # Pegar apenas a parte da data (YYYY-MM-DD)
-                data_str = data.split('T')[0] if 'T' in data else data
-                dt = datetime.strptime(data_str, '%Y-%m-%d').replace(tzinfo=timezone.utc)
-                return dt
-            except:
-                return datetime.min.replace(tzinfo=timezone.utc)
-        return datetime.min.replace(tzinfo=timezone.utc)
-    
-    transacoes_mes_atual = [t for t in transacoes if inicio_mes <= get_transaction_date(t) < fim_mes]
-    
-    # Calculate metrics for current month only
-    total_receitas = sum(t["valor_total"] for t in transacoes_mes_atual if t["tipo"] == "receita")
-    total_despesas = sum(t["valor_total"] for t in transacoes_mes_atual if t["tipo"] == "despesa")
+    # Totais do mês lidos do rollup (O(buckets)), nomes resolvidos com um $in por coleção
+    linhas = await agregar_periodo(db, empresa_id, inicio_mes, fim_mes - timedelta(days=1))
+    
+    total_receitas = sum(l["total"] for l in linhas if l["tipo"] == "receita")
+    total_despesas = sum(l["total"] for l in linhas if l["tipo"] == "despesa")
     saldo = total_receitas - total_despesas
     
+    despesas = [l for l in linhas if l["tipo"] == "despesa"]
+    por_categoria = {k: v for k, v in somar_por(despesas, "categoria_id").items() if k}
+    por_centro_custo = {k: v for k, v in somar_por(despesas, "centro_custo_id").items() if k}
+    
+    nomes_cat = await name_cache.nomes(db, "categorias", por_categoria)
+    nomes_cc = await name_cache.nomes(db, "centros_custo", por_centro_custo)
+    
+    despesas_por_categoria = [
+        {"categoria": nomes_cat.get(cat_id, "Desconhecido"), "valor": v["despesas"]}
+        for cat_id, v in por_categoria.items()
+    ]
+    despesas_por_categoria.sort(key=lambda x: x["valor"], reverse=True)
+    
+    despesas_por_centro_custo = [
+        {"centro_custo": nomes_cc.get(cc_id, "Desconhecido"), "valor": v["despesas"]}
+        for cc_id, v in por_centro_custo.items()
+    ]
+    despesas_por_centro_custo.sort(key=lambda x: x["valor"], reverse=True)
+    
+    # Transações recentes do mês atual (índice empresa_id + data_competencia).
+    # data_competencia é ISO (YYYY-MM-DD[THH:MM...]), então a comparação de strings é cronológica.
+    transacoes_recentes = await db.transacoes.find(
+        {
+            "empresa_id": empresa_id,
+            "data_competencia": {
+                "$gte": inicio_mes.strftime("%Y-%m-%d"),
+                "$lt": fim_mes.strftime("%Y-%m-%d")
+            }
+        },
+        {"_id": 0}
+    ).sort([("data_competencia", -1), ("created_at", -1)]).limit(10).to_list(10)
+    
     # Get bank accounts balance
-    contas = await db.contas_bancarias.find({"empresa_id": empresa_id, "ativa": True}, {"_id": 0}).to_list(1000)
+    contas = await aplicar_saldos(
+        db, await db.contas_bancarias.find({"empresa_id": empresa_id, "ativa": True}, {"_id": 0}).to_list(1000)
+    )
     saldo_contas = sum(c.get("saldo_atual", 0) for c in contas)
     num_contas = len(contas)
     
@@ -4933,37 +4779,6 @@ async def get_dashboard(empresa_id: str, current_user: dict = Depends(get_curren
     saldo_cartoes = sum(c.get("limite_disponivel", 0) for c in cartoes)
     num_cartoes = len(cartoes)
     
-    # Despesas por categoria (mês atual)
-    cat_map = {}
-    for t in transacoes_mes_atual:
-        if t["tipo"] == "despesa":
-            cat_id = t.get("categoria_id")
-            if cat_id:
-                if cat_id not in cat_map:
-                    cat = await db.categorias.find_one({"id": cat_id}, {"_id": 0})
-                    cat_map[cat_id] = {"nome": cat["nome"] if cat else "Desconhecido", "valor": 0}
-                cat_map[cat_id]["valor"] += t["valor_total"]
-    
-    despesas_por_categoria = [{"categoria": v["nome"], "valor": v["valor"]} for v in cat_map.values()]
-    despesas_por_categoria.sort(key=lambda x: x["valor"], reverse=True)
-    
-    # Despesas por centro de custo (mês atual)
-    cc_map = {}
-    for t in transacoes_mes_atual:
-        if t["tipo"] == "despesa":
-            cc_id = t.get("centro_custo_id")
-            if cc_id:
-                if cc_id not in cc_map:
-                    cc = await db.centros_custo.find_one({"id": cc_id}, {"_id": 0})
-                    cc_map[cc_id] = {"nome": cc["nome"] if cc else "Desconhecido", "valor": 0}
-                cc_map[cc_id]["valor"] += t["valor_total"]
-    
-    despesas_por_centro_custo = [{"centro_custo": v["nome"], "valor": v["valor"]} for v in cc_map.values()]
-    despesas_por_centro_custo.sort(key=lambda x: x["valor"], reverse=True)
-    
-    # Transações recentes do mês atual
-    transacoes_recentes = sorted(transacoes_mes_atual, key=get_transaction_date, reverse=True)[:10]
-    
     return DashboardMetrics(
         total_receitas=total_receitas,
         total_despesas=total_despesas,
@@ -5001,50 +4816,38 @@ async def get_relatorio_detalhado(
         periodo_fim = hoje.isoformat()
     # Para personalizado, usar os parâmetros fornecidos
     
-    # Buscar transações do período
+    # Totais do período: meses completos vêm do rollup, bordas das transações
     query = {"empresa_id": empresa_id}
     if periodo_inicio and periodo_fim:
         query["data_competencia"] = {
             "$gte": periodo_inicio.split("T")[0],
             "$lte": periodo_fim.split("T")[0]
         }
-    
-    transacoes = await db.transacoes.find(query, {"_id": 0}).to_list(10000)
+        linhas = await agregar_periodo(db, empresa_id, periodo_inicio, periodo_fim)
+    else:
+        linhas = await agregar_periodo(db, empresa_id, "0001-01-01")
     
     # Calcular resumo geral
-    total_receitas = sum(t["valor_total"] for t in transacoes if t["tipo"] == "receita")
-    total_despesas = sum(t["valor_total"] for t in transacoes if t["tipo"] == "despesa")
+    total_receitas = sum(l["total"] for l in linhas if l["tipo"] == "receita")
+    total_despesas = sum(l["total"] for l in linhas if l["tipo"] == "despesa")
     lucro = total_receitas - total_despesas
+    num_transacoes = sum(l["quantidade"] for l in linhas)
     
     resumo_geral = {
         "total_receitas": total_receitas,
         "total_despesas": total_despesas,
         "lucro": lucro,
-        "num_transacoes": len(transacoes),
-        "ticket_medio": (total_receitas + total_despesas) / len(transacoes) if transacoes else 0
+        "num_transacoes": num_transacoes,
+        "ticket_medio": (total_receitas + total_despesas) / num_transacoes if num_transacoes else 0
     }
     
-    # Análise por Centro de Custo
-    cc_map = {}
-    for t in transacoes:
-        cc_id = t.get("centro_custo_id")
-        if cc_id:
-            if cc_id not in cc_map:
-                cc = await db.centros_custo.find_one({"id": cc_id}, {"_id": 0})
-                cc_map[cc_id] = {
-                    "id": cc_id,
-                    "nome": cc["nome"] if cc else "Desconhecido",
-                    "receitas": 0,
-                    "despesas": 0,
-                    "num_transacoes": 0
-                }
-            
-            cc_map[cc_id]["num_transacoes"] += 1
-            if t["tipo"] == "receita":
-                cc_map[cc_id]["receitas"] += t["valor_total"]
-            else:
-                cc_map[cc_id]["despesas"] += t["valor_total"]
+    cc_map = {k: v for k, v in somar_por(linhas, "centro_custo_id").items() if k}
+    cat_map = {k: v for k, v in somar_por(linhas, "categoria_id").items() if k}
     
+    nomes_cc = await name_cache.nomes(db, "centros_custo", cc_map)
+    nomes_cat = await name_cache.nomes(db, "categorias", cat_map)
+    
+    # Análise por Centro de Custo
     por_centro_custo = []
     for cc_id, data in cc_map.items():
         lucro_cc = data["receitas"] - data["despesas"]
@@ -5052,37 +4855,17 @@ async def get_relatorio_detalhado(
         
         por_centro_custo.append(CentroCustoMetrics(
             centro_custo_id=cc_id,
-            centro_custo_nome=data["nome"],
+            centro_custo_nome=nomes_cc.get(cc_id, "Desconhecido"),
             total_receitas=data["receitas"],
             total_despesas=data["despesas"],
             lucro=lucro_cc,
-            num_transacoes=data["num_transacoes"],
+            num_transacoes=data["quantidade"],
             percentual_total=round(percentual, 2)
         ))
     
     por_centro_custo.sort(key=lambda x: abs(x.total_receitas + x.total_despesas), reverse=True)
     
     # Análise por Categoria
-    cat_map = {}
-    for t in transacoes:
-        cat_id = t.get("categoria_id")
-        if cat_id:
-            if cat_id not in cat_map:
-                cat = await db.categorias.find_one({"id": cat_id}, {"_id": 0})
-                cat_map[cat_id] = {
-                    "id": cat_id,
-                    "nome": cat["nome"] if cat else "Desconhecido",
-                    "receitas": 0,
-                    "despesas": 0,
-                    "num_transacoes": 0
-                }
-            
-            cat_map[cat_id]["num_transacoes"] += 1
-            if t["tipo"] == "receita":
-                cat_map[cat_id]["receitas"] += t["valor_total"]
-            else:
-                cat_map[cat_id]["despesas"] += t["valor_total"]
-    
     por_categoria = []
     for cat_id, data in cat_map.items():
         perc_despesas = (data["despesas"] / total_despesas * 100) if total_despesas > 0 else 0
@@ -5090,23 +4873,26 @@ async def get_relatorio_detalhado(
         
         por_categoria.append(CategoriaMetrics(
             categoria_id=cat_id,
-            categoria_nome=data["nome"],
+            categoria_nome=nomes_cat.get(cat_id, "Desconhecido"),
             total_receitas=data["receitas"],
             total_despesas=data["despesas"],
-            num_transacoes=data["num_transacoes"],
+            num_transacoes=data["quantidade"],
             percentual_despesas=round(perc_despesas, 2),
             percentual_receitas=round(perc_receitas, 2)
         ))
     
     por_categoria.sort(key=lambda x: x.total_despesas + x.total_receitas, reverse=True)
     
+    # Limitar a 100 transações para performance
+    transacoes = await db.transacoes.find(query, {"_id": 0}).to_list(100)
+    
     return RelatorioDetalhado(
         periodo_inicio=periodo_inicio or hoje.isoformat(),
         periodo_fim=periodo_fim or hoje.isoformat(),
         resumo_geral=resumo_geral,
         por_centro_custo=por_centro_custo,
         por_categoria=por_categoria,
-        transacoes=transacoes[:100]  # Limitar a 100 transações para performance
+        transacoes=transacoes
     )
 
 @api_router.get("/empresas/{empresa_id}/relatorios/export/csv")
@@ -5117,602 +4903,316 @@ async def export_relatorio_csv(
     tipo_periodo: str = "mensal",
     current_user: dict = Depends(get_current_user)
 ):
-    """Export relatório para CSV"""
+    """Export relatório para CSV (enviado em partes conforme as transações são lidas)"""
     if empresa_id not in current_user.get("empresa_ids", []):
         raise HTTPException(status_code=403, detail="Acesso negado")
     
-    # Reutilizar lógica do endpoint de relatórios
-    hoje = datetime.now(timezone.utc)
-    if tipo_periodo == "mensal":
-        periodo_inicio = hoje.replace(day=1).isoformat()
-        periodo_fim = hoje.isoformat()
-    elif tipo_periodo == "anual":
-        periodo_inicio = hoje.replace(month=1, day=1).isoformat()
-        periodo_fim = hoje.isoformat()
-    
-    query = {"empresa_id": empresa_id}
-    if periodo_inicio and periodo_fim:
-        query["data_competencia"] = {
-            "$gte": periodo_inicio.split("T")[0],
-            "$lte": periodo_fim.split("T")[0]
-        }
-    
-    transacoes = await db.transacoes.find(query, {"_id": 0}).to_list(10000)
-    
-    # Criar CSV
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Cabeçalho
-    writer.writerow(['ID', 'Data', 'Tipo', 'Fornecedor', 'Categoria', 'Centro de Custo', 'Valor', 'Status', 'Origem'])
-    
-    # Dados
-    for t in transacoes:
-        writer.writerow([
-            t.get('id', ''),
-            t.get('data_competencia', ''),
-            t.get('tipo', ''),
-            t.get('fornecedor', ''),
-            t.get('categoria_id', ''),
-            t.get('centro_custo_id', ''),
-            t.get('valor_total', 0),
-            t.get('status', ''),
-            t.get('origem', '')
-        ])
-    
-    output.seek(0)
+    query = query_relatorio(empresa_id, periodo_inicio, periodo_fim, tipo_periodo)
     return StreamingResponse(
-        iter([output.getvalue()]),
+        stream_csv(db, query),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename=relatorio_{tipo_periodo}.csv"}
     )
 
+# Formatos de relatório que podem ser gerados pela fila de jobs
+RELATORIOS_EXPORT = {
+    "excel": {"media_type": MEDIA_TYPE_XLSX, "extensao": "xlsx"},
+    "pdf": {"media_type": "application/pdf", "extensao": "pdf"},
+}
+
+async def _enfileirar_relatorio(
+    formato: str,
+    empresa_id: str,
+    periodo_inicio: Optional[str],
+    periodo_fim: Optional[str],
+    tipo_periodo: str,
+    current_user: dict
+):
+    job = await fila_jobs.enfileirar(
+        "relatorio",
+        {"formato": formato, "periodo_inicio": periodo_inicio, "periodo_fim": periodo_fim, "tipo_periodo": tipo_periodo},
+        empresa_id=empresa_id,
+        user_id=current_user["id"]
+    )
+    return {"status": "queued", "job_id": job["id"]}
+
+async def gerar_relatorio_excel(
+    empresa_id: str,
+    periodo_inicio: Optional[str] = None,
+    periodo_fim: Optional[str] = None,
+    tipo_periodo: str = "mensal"
+):
+    """Gera o relatório Excel num arquivo temporário (usado pela rota e pela fila de jobs)"""
+    return await gerar_xlsx(db, query_relatorio(empresa_id, periodo_inicio, periodo_fim, tipo_periodo))
+
 @api_router.get("/empresas/{empresa_id}/relatorios/export/excel")
 async def export_relatorio_excel(
     empresa_id: str,
     periodo_inicio: Optional[str] = None,
     periodo_fim: Optional[str] = None,
     tipo_periodo: str = "mensal",
+    background: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
     """Export relatório para Excel"""
     if empresa_id not in current_user.get("empresa_ids", []):
         raise HTTPException(status_code=403, detail="Acesso negado")
     
-    # Reutilizar lógica do endpoint de relatórios
-    hoje = datetime.now(timezone.utc)
-    if tipo_periodo == "mensal":
-        periodo_inicio = hoje.replace(day=1).isoformat()
-        periodo_fim = hoje.isoformat()
-    elif tipo_periodo == "anual":
-        periodo_inicio = hoje.replace(month=1, day=1).isoformat()
-        periodo_fim = hoje.isoformat()
-    
-    query = {"empresa_id": empresa_id}
-    if periodo_inicio and periodo_fim:
-        query["data_competencia"] = {
-            "$gte": periodo_inicio.split("T")[0],
-            "$lte": periodo_fim.split("T")[0]
-        }
-    
-    transacoes = await db.transacoes.find(query, {"_id": 0}).to_list(10000)
-    
-    # Calcular métricas
-    total_receitas = sum(t["valor_total"] for t in transacoes if t["tipo"] == "receita")
-    total_despesas = sum(t["valor_total"] for t in transacoes if t["tipo"] == "despesa")
-    
-    # Criar workbook
-    wb = Workbook()
-    
-    # Sheet 1: Resumo
-    ws_resumo = wb.active
-    ws_resumo.title = "Resumo"
-    
-    # Título
-    ws_resumo['A1'] = 'RELATÓRIO FINANCEIRO'
-    ws_resumo['A1'].font = Font(size=16, bold=True)
-    ws_resumo.merge_cells('A1:D1')
-    
-    ws_resumo['A3'] = 'Total de Receitas:'
-    ws_resumo['B3'] = f'R$ {total_receitas:,.2f}'
-    ws_resumo['B3'].font = Font(color="008000")
-    
-    ws_resumo['A4'] = 'Total de Despesas:'
-    ws_resumo['B4'] = f'R$ {total_despesas:,.2f}'
-    ws_resumo['B4'].font = Font(color="FF0000")
-    
-    ws_resumo['A5'] = 'Lucro/Prejuízo:'
-    ws_resumo['B5'] = f'R$ {(total_receitas - total_despesas):,.2f}'
-    ws_resumo['B5'].font = Font(color="008000" if (total_receitas - total_despesas) >= 0 else "FF0000", bold=True)
-    
-    # Sheet 2: Transações
-    ws_trans = wb.create_sheet("Transações")
-    
-    # Cabeçalho
-    headers = ['ID', 'Data', 'Tipo', 'Fornecedor', 'Categoria', 'Centro Custo', 'Valor', 'Status', 'Origem']
-    ws_trans.append(headers)
-    
-    # Estilo do cabeçalho
-    for cell in ws_trans[1]:
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-        cell.alignment = Alignment(horizontal="center")
-    
-    # Dados
-    for t in transacoes:
-        ws_trans.append([
-            t.get('id', '')[:8] + '...',
-            t.get('data_competencia', ''),
-            t.get('tipo', ''),
-            t.get('fornecedor', ''),
-            t.get('categoria_id', '')[:8] + '...' if t.get('categoria_id') else '',
-            t.get('centro_custo_id', '')[:8] + '...' if t.get('centro_custo_id') else '',
-            t.get('valor_total', 0),
-            t.get('status', ''),
-            t.get('origem', '')
-        ])
-    
-    # Salvar em memória
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
+    if background:
+        return await _enfileirar_relatorio("excel", empresa_id, periodo_inicio, periodo_fim, tipo_periodo, current_user)
     
+    arquivo = await gerar_relatorio_excel(empresa_id, periodo_inicio, periodo_fim, tipo_periodo)
     return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        ler_em_partes(arquivo),
+        media_type=MEDIA_TYPE_XLSX,
         headers={"Content-Disposition": f"attachment; filename=relatorio_{tipo_periodo}.xlsx"}
     )
 
+async def gerar_relatorio_pdf(
+    empresa_id: str,
+    periodo_inicio: Optional[str] = None,
+    periodo_fim: Optional[str] = None,
+    tipo_periodo: str = "mensal"
+) -> bytes:
+    """Gera o relatório PDF (usado pela rota e pela fila de jobs)"""
+    query = query_relatorio(empresa_id, periodo_inicio, periodo_fim, tipo_periodo)
+    
+    # Totais no banco; só as transações listadas no PDF são carregadas
+    totais = {"receita": 0.0, "despesa": 0.0}
+    num_transacoes = 0
+    async for grupo in db.transacoes.aggregate([
+        {"$match": query},
+        {"$group": {"_id": "$tipo", "total": {"$sum": "$valor_total"}, "quantidade": {"$sum": 1}}}
+    ]):
+        if grupo["_id"] in totais:
+            totais[grupo["_id"]] = grupo["total"]
+        num_transacoes += grupo["quantidade"]
+    
+    primeiras = await db.transacoes.find(
+        query, {"_id": 0, "data_competencia": 1, "tipo": 1, "fornecedor": 1, "valor_total": 1, "status": 1}
+    ).sort([("data_competencia", 1), ("id", 1)]).limit(LIMITE_TRANSACOES_PDF).to_list(LIMITE_TRANSACOES_PDF)
+    
+    return await executores.processo(
+        renderizar_relatorio_pdf, totais["receita"], totais["despesa"], num_transacoes, primeiras
+    )
+
 @api_router.get("/empresas/{empresa_id}/relatorios/export/pdf")
 async def export_relatorio_pdf(
     empresa_id: str,
     periodo_inicio: Optional[str] = None,
     periodo_fim: Optional[str] = None,
     tipo_periodo: str = "mensal",
+    background: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
     """Export relatório para PDF"""
     if empresa_id not in current_user.get("empresa_ids", []):
         raise HTTPException(status_code=403, detail="Acesso negado")
     
-    # Reutilizar lógica do endpoint de relatórios
-    hoje = datetime.now(timezone.utc)
-    if tipo_periodo == "mensal":
-        periodo_inicio = hoje.replace(day=1).isoformat()
-        periodo_fim = hoje.isoformat()
-    elif tipo_periodo == "anual":
-        periodo_inicio = hoje.replace(month=1, day=1).isoformat()
-        periodo_fim = hoje.isoformat()
-    
-    query = {"empresa_id": empresa_id}
-    if periodo_inicio and periodo_fim:
-        query["data_competencia"] = {
-            "$gte": periodo_inicio.split("T")[0],
-            "$lte": periodo_fim.split("T")[0]
-        }
-    
-    transacoes = await db.transacoes.find(query, {"_id": 0}).to_list(10000)
-    
-    # Calcular métricas
-    total_receitas = sum(t["valor_total"] for t in transacoes if t["tipo"] == "receita")
-    total_despesas = sum(t["valor_total"] for t in transacoes if t["tipo"] == "despesa")
-    lucro = total_receitas - total_despesas
-    
-    # Criar PDF
-    output = io.BytesIO()
-    doc = SimpleDocTemplate(output, pagesize=landscape(A4))
-    elements = []
-    
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=colors.HexColor('#1f2937'),
-        spaceAfter=30,
-        alignment=TA_CENTER
-    )
-    
-    # Título
-    elements.append(Paragraph("RELATÓRIO FINANCEIRO - ECHO SHOP", title_style))
-    elements.append(Spacer(1, 0.3*inch))
-    
-    # Resumo
-    resumo_data = [
-        ['RESUMO FINANCEIRO', ''],
-        ['Total de Receitas', f'R$ {total_receitas:,.2f}'],
-        ['Total de Despesas', f'R$ {total_despesas:,.2f}'],
-        ['Lucro/Prejuízo', f'R$ {lucro:,.2f}'],
-        ['Número de Transações', str(len(transacoes))]
-    ]
-    
-    resumo_table = Table(resumo_data, colWidths=[3*inch, 2*inch])
-    resumo_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4472C4')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 14),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    
-    elements.append(resumo_table)
-    elements.append(Spacer(1, 0.5*inch))
-    
-    # Transações (primeiras 50)
-    if transacoes:
-        elements.append(Paragraph("TRANSAÇÕES (Primeiras 50)", styles['Heading2']))
-        elements.append(Spacer(1, 0.2*inch))
-        
-        trans_data = [['Data', 'Tipo', 'Fornecedor', 'Valor', 'Status']]
-        for t in transacoes[:50]:
-            trans_data.append([
-                t.get('data_competencia', '')[:10],
-                t.get('tipo', ''),
-                t.get('fornecedor', '')[:20],
-                f'R$ {t.get("valor_total", 0):,.2f}',
-                t.get('status', '')
-            ])
-        
-        trans_table = Table(trans_data, colWidths=[1.2*inch, 1*inch, 2.5*inch, 1.3*inch, 1*inch])
-        trans_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
-        ]))
-        
-        elements.append(trans_table)
-    
-    doc.build(elements)
-    output.seek(0)
+    if background:
+        return await _enfileirar_relatorio("pdf", empresa_id, periodo_inicio, periodo_fim, tipo_periodo, current_user)
     
+    conteudo = await gerar_relatorio_pdf(empresa_id, periodo_inicio, periodo_fim, tipo_periodo)
     return StreamingResponse(
-        iter([output.getvalue()]),
+        iter([conteudo]),
         media_type="application/pdf",
         headers={"Content-Disposition": f"attachment; filename=relatorio_{tipo_periodo}.pdf"}
     )
 
 # IMPORT ROUTES
-@api_router.post("/empresas/{empresa_id}/transacoes/import/csv")
-async def import_csv(
-    empresa_id: str,
-    file: UploadFile = File(...),
-    current_user: dict = Depends(get_current_user)
-):
-    """Importar transações de arquivo CSV"""
-    if empresa_id not in current_user.get("empresa_ids", []):
-        raise HTTPException(status_code=403, detail="Acesso negado")
+# Os quatro formatos passam pelo mesmo motor (services/importacao.py):
+# validação vetorizada com pandas, insert_many em lotes e erros por linha.
+# Com background=true o arquivo vai para o GridFS e a importação roda na fila
+# de jobs; a rota devolve o job_id na hora.
+FORMATOS_IMPORTACAO = {
+    "csv": {"nome": "CSV", "extensoes": ('.csv',), "erro_extensao": "Arquivo deve ser CSV"},
+    "excel": {"nome": "Excel", "extensoes": ('.xlsx', '.xls'), "erro_extensao": "Arquivo deve ser Excel (.xlsx ou .xls)"},
+    "ofx": {"nome": "OFX", "extensoes": ('.ofx',), "erro_extensao": "Arquivo deve ser OFX"},
+    "pdf": {"nome": "PDF", "extensoes": ('.pdf',), "erro_extensao": "Arquivo deve ser PDF"},
+}
+
+async def _dataframe_pdf(contents: bytes):
+    """Extrai o texto do PDF e usa IA para identificar as transações"""
+    # Extrair texto de todas as páginas (pool de processos)
+    texto_completo = await executores.processo(extrair_texto_pdf, contents)
     
-    if not file.filename.endswith('.csv'):
-        raise HTTPException(status_code=400, detail="Arquivo deve ser CSV")
+    if not texto_completo.strip():
+        raise HTTPException(status_code=400, detail="Não foi possível extrair texto do PDF")
     
-    try:
-        # Ler CSV
-        contents = await file.read()
-        df = pd.read_csv(io.BytesIO(contents))
+    # Usar IA para extrair dados financeiros
+    emergent_key = os.environ.get("EMERGENT_LLM_KEY")
+    if not emergent_key:
+        raise HTTPException(status_code=500, detail="Chave de IA não configurada")
+    
+    llm = LlmChat(
+        api_key=emergent_key,
+        session_id=f"importacao-pdf-{uuid.uuid4()}",
+        system_message="Você extrai transações financeiras de extratos e faturas."
+    ).with_model("openai", "gpt-4o-mini")
+    
+    prompt = f"""Analise este extrato/fatura e extraia todas as transações financeiras.
+        
+Texto do PDF:
+{texto_completo[:3000]}
+
+Retorne um JSON com lista de transações no formato:
+{{
+  "transacoes": [
+    {{
+      "data": "YYYY-MM-DD",
+      "tipo": "receita" ou "despesa",
+      "fornecedor": "nome do fornecedor/cliente",
+      "valor": número (apenas valor numérico),
+      "descricao": "descrição breve"
+    }}
+  ]
+}}
+
+Retorne APENAS o JSON, sem texto adicional."""
+
+    # Chamada assíncrona: não segura o event loop enquanto a IA responde
+    resposta_texto = await llm.send_message(UserMessage(text=prompt))
+    
+    # Parse resposta
+    try:
+        # Remover markdown se presente
+        if "```json" in resposta_texto:
+            resposta_texto = resposta_texto.split("```json")[1].split("```")[0]
+        elif "```" in resposta_texto:
+            resposta_texto = resposta_texto.split("```")[1].split("```")[0]
+        
+        dados = json.loads(resposta_texto.strip())
+        transacoes_extraidas = dados.get("transacoes", [])
+    except:
+        raise HTTPException(status_code=500, detail="Não foi possível processar resposta da IA")
+    
+    # Valores ausentes recebem os mesmos padrões de antes; o motor valida o resto
+    hoje = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    return pd.DataFrame(
+        [
+            {
+                "data": trans.get("data", hoje),
+                "tipo": trans.get("tipo", "despesa"),
+                "fornecedor": trans.get("fornecedor", "Não informado"),
+                "valor": trans.get("valor", 0),
+                "descricao": trans.get("descricao", "")
+            }
+            for trans in transacoes_extraidas
+        ],
+        columns=COLUNAS_OBRIGATORIAS + ["descricao"]
+    )
+
+async def processar_importacao(
+    formato: str,
+    contents: bytes,
+    empresa_id: str,
+    usuario_id: str,
+    progresso=None
+) -> Dict[str, Any]:
+    """Converte o arquivo em DataFrame e importa pelo motor comum"""
+    if formato in ("csv", "excel"):
+        df = await ler_planilha(contents, formato)
         
         # Validar colunas esperadas
-        required_columns = ['data', 'tipo', 'fornecedor', 'valor']
-        if not all(col in df.columns for col in required_columns):
+        if colunas_faltando(df):
             return {
                 "status": "error",
-                "message": f"CSV deve conter as colunas: {', '.join(required_columns)}",
+                "message": f"{FORMATOS_IMPORTACAO[formato]['nome']} deve conter as colunas: {', '.join(COLUNAS_OBRIGATORIAS)}",
                 "columns_found": list(df.columns)
             }
-        
-        # Buscar categorias e centros de custo default
-        categorias = await db.categorias.find({"empresa_id": empresa_id}, {"_id": 0}).to_list(100)
-        centros_custo = await db.centros_custo.find({"empresa_id": empresa_id}, {"_id": 0}).to_list(100)
-        
-        default_categoria_id = categorias[0]["id"] if categorias else None
-        default_centro_custo_id = centros_custo[0]["id"] if centros_custo else None
-        
-        # Processar cada linha
-        imported_count = 0
-        errors = []
-        
-        for index, row in df.iterrows():
-            try:
-                transacao = {
-                    "id": str(uuid.uuid4()),
-                    "empresa_id": empresa_id,
-                    "usuario_id": current_user["id"],
-                    "tipo": str(row['tipo']).lower(),
-                    "fornecedor": str(row['fornecedor']),
-                    "valor_total": float(row['valor']),
-                    "data_competencia": str(row['data']),
-                    "categoria_id": str(row.get('categoria_id', default_categoria_id)) if 'categoria_id' in row else default_categoria_id,
-                    "centro_custo_id": str(row.get('centro_custo_id', default_centro_custo_id)) if 'centro_custo_id' in row else default_centro_custo_id,
-                    "descricao": str(row.get('descricao', '')),
-                    "status": "concluido",
-                    "origem": "import_csv",
-                    "created_at": datetime.now(timezone.utc).isoformat()
-                }
-                
-                await db.transacoes.insert_one(transacao)
-                imported_count += 1
-                
-            except Exception as e:
-                errors.append(f"Linha {index + 2}: {str(e)}")
-        
-        return {
-            "status": "success",
-            "imported": imported_count,
-            "total": len(df),
-            "errors": errors[:10]  # Limitar a 10 erros
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao processar CSV: {str(e)}")
+        return await importar_transacoes(
+            db, df, empresa_id, usuario_id, origem=f"import_{formato}", progresso=progresso
+        )
+    
+    if formato == "ofx":
+        df, conta = await executores.processo(dataframe_ofx, contents)
+        resultado = await importar_transacoes(
+            db, df, empresa_id, usuario_id, origem="import_ofx", linha_inicial=1, progresso=progresso
+        )
+        resultado["account"] = conta
+        return resultado
+    
+    df = await _dataframe_pdf(contents)
+    resultado = await importar_transacoes(
+        db, df, empresa_id, usuario_id, origem="import_pdf",
+        status="pendente",  # Pendente para revisão
+        linha_inicial=1,
+        progresso=progresso
+    )
+    resultado["message"] = "Transações importadas como 'pendente' para revisão"
+    return resultado
 
-@api_router.post("/empresas/{empresa_id}/transacoes/import/excel")
-async def import_excel(
+async def _importar_arquivo(
+    formato: str,
     empresa_id: str,
-    file: UploadFile = File(...),
-    current_user: dict = Depends(get_current_user)
+    file: UploadFile,
+    background: bool,
+    current_user: dict
 ):
-    """Importar transações de arquivo Excel"""
     if empresa_id not in current_user.get("empresa_ids", []):
         raise HTTPException(status_code=403, detail="Acesso negado")
     
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        raise HTTPException(status_code=400, detail="Arquivo deve ser Excel (.xlsx ou .xls)")
+    config = FORMATOS_IMPORTACAO[formato]
+    if not file.filename.endswith(config["extensoes"]):
+        raise HTTPException(status_code=400, detail=config["erro_extensao"])
+    
+    contents = await file.read()
+    
+    if background:
+        arquivo_id = await fila_jobs.salvar_arquivo(contents, file.filename, file.content_type or "application/octet-stream")
+        job = await fila_jobs.enfileirar(
+            "importacao",
+            {"formato": formato, "arquivo_id": arquivo_id, "filename": file.filename},
+            empresa_id=empresa_id,
+            user_id=current_user["id"],
+            max_tentativas=1  # Reimportar duplicaria as linhas já gravadas
+        )
+        return {"status": "queued", "job_id": job["id"]}
     
     try:
-        # Ler Excel
-        contents = await file.read()
-        df = pd.read_excel(io.BytesIO(contents))
-        
-        # Validar colunas esperadas
-        required_columns = ['data', 'tipo', 'fornecedor', 'valor']
-        if not all(col in df.columns for col in required_columns):
-            return {
-                "status": "error",
-                "message": f"Excel deve conter as colunas: {', '.join(required_columns)}",
-                "columns_found": list(df.columns)
-            }
-        
-        # Buscar categorias e centros de custo default
-        categorias = await db.categorias.find({"empresa_id": empresa_id}, {"_id": 0}).to_list(100)
-        centros_custo = await db.centros_custo.find({"empresa_id": empresa_id}, {"_id": 0}).to_list(100)
-        
-        default_categoria_id = categorias[0]["id"] if categorias else None
-        default_centro_custo_id = centros_custo[0]["id"] if centros_custo else None
-        
-        # Processar cada linha
-        imported_count = 0
-        errors = []
-        
-        for index, row in df.iterrows():
-            try:
-                transacao = {
-                    "id": str(uuid.uuid4()),
-                    "empresa_id": empresa_id,
-                    "usuario_id": current_user["id"],
-                    "tipo": str(row['tipo']).lower(),
-                    "fornecedor": str(row['fornecedor']),
-                    "valor_total": float(row['valor']),
-                    "data_competencia": str(row['data'])[:10],
-                    "categoria_id": str(row.get('categoria_id', default_categoria_id)) if 'categoria_id' in row else default_categoria_id,
-                    "centro_custo_id": str(row.get('centro_custo_id', default_centro_custo_id)) if 'centro_custo_id' in row else default_centro_custo_id,
-                    "descricao": str(row.get('descricao', '')),
-                    "status": "concluido",
-                    "origem": "import_excel",
-                    "created_at": datetime.now(timezone.utc).isoformat()
-                }
-                
-                await db.transacoes.insert_one(transacao)
-                imported_count += 1
-                
-            except Exception as e:
-                errors.append(f"Linha {index + 2}: {str(e)}")
-        
-        return {
-            "status": "success",
-            "imported": imported_count,
-            "total": len(df),
-            "errors": errors[:10]
-        }
-        
+        return await processar_importacao(formato, contents, empresa_id, current_user["id"])
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao processar Excel: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erro ao processar {config['nome']}: {str(e)}")
+
+@api_router.post("/empresas/{empresa_id}/transacoes/import/csv")
+async def import_csv(
+    empresa_id: str,
+    file: UploadFile = File(...),
+    background: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Importar transações de arquivo CSV"""
+    return await _importar_arquivo("csv", empresa_id, file, background, current_user)
+
+@api_router.post("/empresas/{empresa_id}/transacoes/import/excel")
+async def import_excel(
+    empresa_id: str,
+    file: UploadFile = File(...),
+    background: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """Importar transações de arquivo Excel"""
+    return await _importar_arquivo("excel", empresa_id, file, background, current_user)
 
 @api_router.post("/empresas/{empresa_id}/transacoes/import/ofx")
 async def import_ofx(
     empresa_id: str,
     file: UploadFile = File(...),
+    background: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
     """Importar transações de arquivo OFX (extrato bancário)"""
-    if empresa_id not in current_user.get("empresa_ids", []):
-        raise HTTPException(status_code=403, detail="Acesso negado")
-    
-    if not file.filename.endswith('.ofx'):
-        raise HTTPException(status_code=400, detail="Arquivo deve ser OFX")
-    
-    try:
-        # Ler OFX
-        contents = await file.read()
-        ofx = OfxParser.parse(io.BytesIO(contents))
-        
-        # Buscar categorias e centros de custo default
-        categorias = await db.categorias.find({"empresa_id": empresa_id}, {"_id": 0}).to_list(100)
-        centros_custo = await db.centros_custo.find({"empresa_id": empresa_id}, {"_id": 0}).to_list(100)
-        
-        default_categoria_id = categorias[0]["id"] if categorias else None
-        default_centro_custo_id = centros_custo[0]["id"] if centros_custo else None
-        
-        # Processar transações
-        imported_count = 0
-        errors = []
-        
-        account = ofx.account
-        for transaction in account.statement.transactions:
-            try:
-                # Determinar tipo baseado no valor
-                tipo = "receita" if transaction.amount > 0 else "despesa"
-                valor_abs = abs(transaction.amount)
-                
-                transacao = {
-                    "id": str(uuid.uuid4()),
-                    "empresa_id": empresa_id,
-                    "usuario_id": current_user["id"],
-                    "tipo": tipo,
-                    "fornecedor": transaction.payee or "Não informado",
-                    "valor_total": valor_abs,
-                    "data_competencia": transaction.date.strftime("%Y-%m-%d"),
-                    "categoria_id": default_categoria_id,
-                    "centro_custo_id": default_centro_custo_id,
-                    "descricao": transaction.memo or "",
-                    "status": "concluido",
-                    "origem": "import_ofx",
-                    "created_at": datetime.now(timezone.utc).isoformat()
-                }
-                
-                await db.transacoes.insert_one(transacao)
-                imported_count += 1
-                
-            except Exception as e:
-                errors.append(f"Transação {transaction.id}: {str(e)}")
-        
-        return {
-            "status": "success",
-            "imported": imported_count,
-            "account": account.number if hasattr(account, 'number') else "N/A",
-            "errors": errors[:10]
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao processar OFX: {str(e)}")
+    return await _importar_arquivo("ofx", empresa_id, file, background, current_user)
 
 @api_router.post("/empresas/{empresa_id}/transacoes/import/pdf")
 async def import_pdf(
     empresa_id: str,
     file: UploadFile = File(...),
+    background: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
     """Importar transações de arquivo PDF (usando OCR via IA)"""
-    if empresa_id not in current_user.get("empresa_ids", []):
-        raise HTTPException(status_code=403, detail="Acesso negado")
-    
-    if not file.filename.endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Arquivo deve ser PDF")
-    
-    try:
-        # Ler PDF
-        contents = await file.read()
-        pdf_reader = PdfReader(io.BytesIO(contents))
-        
-        # Extrair texto de todas as páginas
-        texto_completo = ""
-        for page in pdf_reader.pages:
-            texto_completo += page.extract_text() + "\n"
-        
-        if not texto_completo.strip():
-            raise HTTPException(status_code=400, detail="Não foi possível extrair texto do PDF")
-        
-        # Usar IA para extrair dados financeiros
-        emergent_key = os.environ.get("EMERGENT_LLM_KEY")
-        if not emergent_key:
-            raise HTTPException(status_code=500, detail="Chave de IA não configurada")
-        
-        llm = LlmChat(
-            platform="openai",
-            model="gpt-4o-mini",
-            api_key=emergent_key
-        )
-        
-        prompt = f"""Analise este extrato/fatura e extraia todas as transações financeiras.
-        
-Texto do PDF:
-{texto_completo[:3000]}
-
-Retorne um JSON com lista de transações no formato:
-{{
-  "transacoes": [
-    {{
-      "data": "YYYY-MM-DD",
-      "tipo": "receita" ou "despesa",
-      "fornecedor": "nome do fornecedor/cliente",
-      "valor": número (apenas valor numérico),
-      "descricao": "descrição breve"
-    }}
-  ]
-}}
-
-Retorne APENAS o JSON, sem texto adicional."""
-
-        response = llm.run([UserMessage(content=prompt)])
-        
-        # Parse resposta
-        import json
-        try:
-            # Tentar extrair JSON da resposta
-            resposta_texto = response.content[0]["text"]
-            # Remover markdown se presente
-            if "```json" in resposta_texto:
-                resposta_texto = resposta_texto.split("```json")[1].split("```")[0]
-            elif "```" in resposta_texto:
-                resposta_texto = resposta_texto.split("```")[1].split("```")[0]
-            
-            dados = json.loads(resposta_texto.strip())
-            transacoes_extraidas = dados.get("transacoes", [])
-        except:
-            raise HTTPException(status_code=500, detail="Não foi possível processar resposta da IA")
-        
-        # Buscar categorias e centros de custo default
-        categorias = await db.categorias.find({"empresa_id": empresa_id}, {"_id": 0}).to_list(100)
-        centros_custo = await db.centros_custo.find({"empresa_id": empresa_id}, {"_id": 0}).to_list(100)
-        
-        default_categoria_id = categorias[0]["id"] if categorias else None
-        default_centro_custo_id = centros_custo[0]["id"] if centros_custo else None
-        
-        # Inserir transações
-        imported_count = 0
-        errors = []
-        
-        for trans in transacoes_extraidas:
-            try:
-                transacao = {
-                    "id": str(uuid.uuid4()),
-                    "empresa_id": empresa_id,
-                    "usuario_id": current_user["id"],
-                    "tipo": trans.get("tipo", "despesa"),
-                    "fornecedor": trans.get("fornecedor", "Não informado"),
-                    "valor_total": float(trans.get("valor", 0)),
-                    "data_competencia": trans.get("data", datetime.now(timezone.utc).strftime("%Y-%m-%d")),
-                    "categoria_id": default_categoria_id,
-                    "centro_custo_id": default_centro_custo_id,
-                    "descricao": trans.get("descricao", ""),
-                    "status": "pendente",  # Pendente para revisão
-                    "origem": "import_pdf",
-                    "created_at": datetime.now(timezone.utc).isoformat()
-                }
-                
-                await db.transacoes.insert_one(transacao)
-                imported_count += 1
-                
-            except Exception as e:
-                errors.append(f"Erro: {str(e)}")
-        
-        return {
-            "status": "success",
-            "imported": imported_count,
-            "total": len(transacoes_extraidas),
-            "errors": errors[:10],
-            "message": "Transações importadas como 'pendente' para revisão"
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao processar PDF: {str(e)}")
+    return await _importar_arquivo("pdf", empresa_id, file, background, current_user)
 
 # AI ANALYSIS ROUTES
 @api_router.get("/empresas/{empresa_id}/ai/analise-financeira")
@@ -5729,35 +5229,30 @@ async def analise_financeira_ai(
         # Buscar dados dos últimos N dias
         data_inicio = (datetime.now(timezone.utc) - timedelta(days=periodo_dias)).strftime("%Y-%m-%d")
         
-        transacoes = await db.transacoes.find({
-            "empresa_id": empresa_id,
-            "data_competencia": {"$gte": data_inicio}
-        }, {"_id": 0}).to_list(1000)
+        linhas = await agregar_periodo(db, empresa_id, data_inicio)
+        num_transacoes = sum(l["quantidade"] for l in linhas)
         
-        if not transacoes:
+        if not num_transacoes:
             return {
                 "status": "no_data",
                 "message": "Não há transações suficientes para análise"
             }
         
         # Calcular métricas básicas
-        total_receitas = sum(t["valor_total"] for t in transacoes if t["tipo"] == "receita")
-        total_despesas = sum(t["valor_total"] for t in transacoes if t["tipo"] == "despesa")
+        total_receitas = sum(l["total"] for l in linhas if l["tipo"] == "receita")
+        total_despesas = sum(l["total"] for l in linhas if l["tipo"] == "despesa")
         
         # Agrupar por categoria
-        despesas_por_categoria = {}
-        for t in transacoes:
-            if t["tipo"] == "despesa":
-                cat_id = t.get("categoria_id", "sem_categoria")
-                if cat_id not in despesas_por_categoria:
-                    cat = await db.categorias.find_one({"id": cat_id}, {"_id": 0})
-                    despesas_por_categoria[cat_id] = {
-                        "nome": cat["nome"] if cat else "Sem categoria",
-                        "valor": 0,
-                        "transacoes": 0
-                    }
-                despesas_por_categoria[cat_id]["valor"] += t["valor_total"]
-                despesas_por_categoria[cat_id]["transacoes"] += 1
+        por_categoria = somar_por([l for l in linhas if l["tipo"] == "despesa"], "categoria_id")
+        nomes_cat = await name_cache.nomes(db, "categorias", por_categoria)
+        despesas_por_categoria = {
+            (cat_id or "sem_categoria"): {
+                "nome": nomes_cat.get(cat_id, "Sem categoria"),
+                "valor": v["despesas"],
+                "transacoes": v["quantidade"]
+            }
+            for cat_id, v in por_categoria.items()
+        }
         
         # Preparar dados para IA
         resumo_financeiro = f"""
@@ -5767,7 +5262,7 @@ RESUMO GERAL:
 - Total de Receitas: R$ {total_receitas:,.2f}
 - Total de Despesas: R$ {total_despesas:,.2f}
 - Saldo: R$ {(total_receitas - total_despesas):,.2f}
-- Total de Transações: {len(transacoes)}
+- Total de Transações: {num_transacoes}
 
 DESPESAS POR CATEGORIA:
 """
@@ -5846,7 +5341,7 @@ Seja objetivo, prático e focado em ações concretas. Use formato claro com bul
                 "total_receitas": total_receitas,
                 "total_despesas": total_despesas,
                 "saldo": total_receitas - total_despesas,
-                "num_transacoes": len(transacoes)
+                "num_transacoes": num_transacoes
             },
             "analise_ia": analise_texto,
             "despesas_por_categoria": despesas_por_categoria
@@ -5858,71 +5353,39 @@ Seja objetivo, prático e focado em ações concretas. Use formato claro com bul
 @api_router.get("/empresas/{empresa_id}/ai/anomalias")
 async def detectar_anomalias(
     empresa_id: str,
+    dias: int = Query(DIAS_PADRAO, ge=7, le=730),
+    janela_dias: Optional[int] = Query(None, ge=7, le=365),
+    por_fornecedor: bool = True,
     current_user: dict = Depends(get_current_user)
 ):
-    """Detectar anomalias e gastos incomuns usando IA"""
+    """Detectar despesas com valores fora do padrão da categoria (ou do fornecedor)"""
     if empresa_id not in current_user.get("empresa_ids", []):
         raise HTTPException(status_code=403, detail="Acesso negado")
     
     try:
-        # Buscar últimos 60 dias de transações
-        data_inicio = (datetime.now(timezone.utc) - timedelta(days=60)).strftime("%Y-%m-%d")
-        
-        transacoes = await db.transacoes.find({
-            "empresa_id": empresa_id,
-            "tipo": "despesa",
-            "data_competencia": {"$gte": data_inicio}
-        }, {"_id": 0}).to_list(1000)
+        # Mediana/MAD por categoria e fornecedor, em cache por empresa
+        analise = await motor_anomalias.analisar(
+            db, empresa_id, dias=dias, por_fornecedor=por_fornecedor, janela_dias=janela_dias
+        )
         
-        if len(transacoes) < 10:
+        if analise["transacoes"] < 10:
             return {
                 "status": "insufficient_data",
                 "message": "Necessário pelo menos 10 transações para análise de anomalias",
                 "anomalias": []
             }
         
-        # Calcular estatísticas por categoria
-        stats_por_categoria = {}
-        for t in transacoes:
-            cat_id = t.get("categoria_id", "sem_categoria")
-            if cat_id not in stats_por_categoria:
-                stats_por_categoria[cat_id] = []
-            stats_por_categoria[cat_id].append(t["valor_total"])
-        
-        # Detectar valores outliers (acima de 2 desvios padrão)
-        import statistics
-        anomalias = []
-        
-        for cat_id, valores in stats_por_categoria.items():
-            if len(valores) < 3:
-                continue
-            
-            media = statistics.mean(valores)
-            desvio = statistics.stdev(valores) if len(valores) > 1 else 0
-            
-            for t in transacoes:
-                if t.get("categoria_id") == cat_id:
-                    if t["valor_total"] > media + (2 * desvio) and desvio > 0:
-                        cat = await db.categorias.find_one({"id": cat_id}, {"_id": 0})
-                        anomalias.append({
-                            "transacao_id": t["id"],
-                            "data": t["data_competencia"],
-                            "fornecedor": t["fornecedor"],
-                            "valor": t["valor_total"],
-                            "categoria": cat["nome"] if cat else "Sem categoria",
-                            "media_categoria": round(media, 2),
-                            "desvio": round((t["valor_total"] - media) / desvio, 2) if desvio > 0 else 0,
-                            "tipo_alerta": "valor_acima_media"
-                        })
-        
-        # Ordenar por desvio (mais críticos primeiro)
-        anomalias.sort(key=lambda x: x["desvio"], reverse=True)
+        # Top 10 (já ordenadas por desvio), nomes das categorias em um único $in
+        anomalias = [dict(a) for a in analise["anomalias"][:10]]
+        nomes_cat = await name_cache.nomes(db, "categorias", (a["categoria_id"] for a in anomalias))
+        for a in anomalias:
+            a["categoria"] = nomes_cat.get(a.pop("categoria_id")) or "Sem categoria"
         
         return {
             "status": "success",
-            "num_anomalias": len(anomalias),
-            "anomalias": anomalias[:10],  # Top 10
-            "message": f"Encontradas {len(anomalias)} transações com valores acima do padrão"
+            "num_anomalias": len(analise["anomalias"]),
+            "anomalias": anomalias,
+            "message": f"Encontradas {len(analise['anomalias'])} transações com valores acima do padrão"
         }
         
     except Exception as e:
@@ -5934,45 +5397,58 @@ async def previsao_fluxo_caixa(
     dias_futuros: int = 30,
     current_user: dict = Depends(get_current_user)
 ):
-    """Prever fluxo de caixa futuro usando IA"""
+    """Prever fluxo de caixa dia a dia (modelo sazonal em cache) com comentário da IA"""
     if empresa_id not in current_user.get("empresa_ids", []):
         raise HTTPException(status_code=403, detail="Acesso negado")
+    if not 1 <= dias_futuros <= 365:
+        raise HTTPException(status_code=400, detail="dias_futuros deve estar entre 1 e 365")
     
     try:
-        # Buscar histórico dos últimos 90 dias
-        data_inicio = (datetime.now(timezone.utc) - timedelta(days=90)).strftime("%Y-%m-%d")
+        ajuste = await previsao_fluxo.ajuste(db, empresa_id)
+        num_transacoes = ajuste["transacoes"]
         
-        transacoes = await db.transacoes.find({
-            "empresa_id": empresa_id,
-            "data_competencia": {"$gte": data_inicio}
-        }, {"_id": 0}).to_list(1000)
-        
-        if len(transacoes) < 15:
+        if num_transacoes < 15:
             return {
                 "status": "insufficient_data",
                 "message": "Necessário pelo menos 15 transações para previsão"
             }
         
-        # Calcular médias mensais
-        total_receitas = sum(t["valor_total"] for t in transacoes if t["tipo"] == "receita")
-        total_despesas = sum(t["valor_total"] for t in transacoes if t["tipo"] == "despesa")
+        previsao = projetar(ajuste, dias_futuros)
         
-        media_receitas_mensal = (total_receitas / 90) * 30
-        media_despesas_mensal = (total_despesas / 90) * 30
+        # Médias mensais do período ajustado (campo histórico da resposta)
+        receitas_hist = ajuste["modelos"]["receita"].y.sum()
+        despesas_hist = ajuste["modelos"]["despesa"].y.sum()
+        media_receitas_mensal = float(receitas_hist) / ajuste["dias"] * 30
+        media_despesas_mensal = float(despesas_hist) / ajuste["dias"] * 30
+        faixa = previsao["projecao"][-1]["faixa_80"]
         
-        # Preparar dados para IA
-        resumo = f"""
-HISTÓRICO FINANCEIRO (últimos 90 dias):
-- Total Receitas: R$ {total_receitas:,.2f}
-- Total Despesas: R$ {total_despesas:,.2f}
-- Média Mensal Receitas: R$ {media_receitas_mensal:,.2f}
-- Média Mensal Despesas: R$ {media_despesas_mensal:,.2f}
-- Total de Transações: {len(transacoes)}
+        previsao_texto = f"""**PREVISÃO ESTATÍSTICA - Próximos {dias_futuros} dias**
+
+**CENÁRIO PROVÁVEL (sazonalidade semanal e mensal + recorrentes):**
+- Receitas Estimadas: R$ {previsao['receitas_estimadas']:,.2f}
+- Despesas Estimadas: R$ {previsao['despesas_estimadas']:,.2f}
+- Saldo Projetado: R$ {previsao['saldo_estimado']:,.2f}
+- Faixa provável (80%): R$ {faixa[0]:,.2f} a R$ {faixa[1]:,.2f}
+
+**TENDÊNCIA:**
 """
+        if previsao["saldo_estimado"] >= 0:
+            margem = previsao["saldo_estimado"] / (previsao["receitas_estimadas"] or 1) * 100
+            previsao_texto += f"- ✅ Projeção positiva com margem de {margem:.1f}%"
+        else:
+            previsao_texto += f"- ⚠️ Projeção de déficit de R$ {-previsao['saldo_estimado']:,.2f}"
+        dias_negativos = [d["data"] for d in previsao["projecao"] if d["saldo_acumulado"] < 0]
+        if dias_negativos:
+            previsao_texto += f"\n- ⚠️ Saldo acumulado negativo a partir de {dias_negativos[0]}"
         
-        # Tentar usar IA com fallback
-        previsao_texto = ""
+        previsao_texto += f"""
+
+**FATORES A CONSIDERAR:**
+- Modelo ajustado com {num_transacoes} transações dos últimos {ajuste['dias']} dias
+- Cobranças recorrentes ativas: {len(ajuste['recorrentes'])}
+- Recomenda-se revisão quinzenal da previsão"""
         
+        # A IA comenta os números do modelo; sem chave ou em caso de erro, fica o texto estatístico
         try:
             emergent_key = os.environ.get("EMERGENT_LLM_KEY")
             if emergent_key:
@@ -5982,77 +5458,47 @@ HISTÓRICO FINANCEIRO (últimos 90 dias):
                     system_message="Você é um consultor financeiro especializado."
                 ).with_model("openai", "gpt-4o-mini")
                 
-                prompt = f"""{resumo}
+                prompt = f"""{previsao_texto}
 
-Como analista financeiro, baseado neste histórico, forneça uma previsão para os próximos {dias_futuros} dias:
+Como analista financeiro, com base nesta projeção para os próximos {dias_futuros} dias, comente:
 
-1. **CENÁRIO PROVÁVEL**: Estimativa de receitas e despesas
+1. **CENÁRIO PROVÁVEL**: O que a projeção indica
 2. **FATORES DE RISCO**: O que pode impactar negativamente
 3. **OPORTUNIDADES**: O que pode melhorar os resultados
 4. **RECOMENDAÇÕES**: Ações para os próximos {dias_futuros} dias
 
-Seja realista e baseie-se nos dados históricos."""
-
-                response = llm.run([UserMessage(content=prompt)])
-                previsao_texto = response.content[0]["text"]
-        except Exception:
-            # Fallback: Análise baseada em médias
-            # Calcular previsão simples (proporcional)
-            fator_dias = dias_futuros / 30
-            previsao_receitas = media_receitas_mensal * fator_dias
-            previsao_despesas = media_despesas_mensal * fator_dias
-            
-            previsao_texto = f"""**PREVISÃO ESTATÍSTICA - Próximos {dias_futuros} dias**
+Seja realista e não altere os valores projetados."""
 
-**CENÁRIO PROVÁVEL (baseado em médias):**
-- Receitas Estimadas: R$ {previsao_receitas:,.2f}
-- Despesas Estimadas: R$ {previsao_despesas:,.2f}
-- Saldo Projetado: R$ {(previsao_receitas - previsao_despesas):,.2f}
-
-**TENDÊNCIA:**
-"""
-            if previsao_receitas > previsao_despesas:
-                margem = ((previsao_receitas - previsao_despesas) / previsao_receitas * 100)
-                previsao_texto += f"- ✅ Projeção positiva com margem de {margem:.1f}%"
-            else:
-                deficit = previsao_despesas - previsao_receitas
-                previsao_texto += f"- ⚠️ Projeção de déficit de R$ {deficit:,.2f}"
-            
-            previsao_texto += f"""
-
-**FATORES A CONSIDERAR:**
-- Baseado em média de {len(transacoes)} transações dos últimos 90 dias
-- Sazonalidade e eventos específicos não considerados
-- Recomenda-se revisão quinzenal da previsão
-
-**RECOMENDAÇÕES:**
-- Manter reserva de emergência equivalente a 1 mês de despesas
-- Monitorar receitas semanalmente
-- Revisar despesas fixas mensalmente
-
-_Nota: Análise com IA temporariamente indisponível. Usando projeção estatística simples._"""
-        
-        # Calcular previsão simples (proporcional) para retorno
-        fator_dias = dias_futuros / 30
-        previsao_receitas = media_receitas_mensal * fator_dias
-        previsao_despesas = media_despesas_mensal * fator_dias
+                previsao_texto = await llm.send_message(UserMessage(text=prompt))
+        except Exception as e:
+            logging.warning(f"IA indisponível na previsão de fluxo, usando texto estatístico: {e}")
         
         return {
             "status": "success",
-            "periodo_analise_dias": 90,
+            "periodo_analise_dias": ajuste["dias"],
             "dias_futuros": dias_futuros,
             "previsao_numerica": {
-                "receitas_estimadas": round(previsao_receitas, 2),
-                "despesas_estimadas": round(previsao_despesas, 2),
-                "saldo_estimado": round(previsao_receitas - previsao_despesas, 2)
+                "receitas_estimadas": previsao["receitas_estimadas"],
+                "despesas_estimadas": previsao["despesas_estimadas"],
+                "saldo_estimado": previsao["saldo_estimado"]
             },
+            "projecao": previsao["projecao"],
             "previsao_ia": previsao_texto,
             "historico": {
                 "media_receitas_mensal": round(media_receitas_mensal, 2),
                 "media_despesas_mensal": round(media_despesas_mensal, 2)
+            },
+            "modelo": {
+                "transacoes": num_transacoes,
+                "desvio_diario": previsao["desvio_diario"],
+                "recorrentes": len(ajuste["recorrentes"]),
+                "ajustado_em": ajuste["ajustado_em"],
+                "janela_max_dias": ajuste["janela_max_dias"]
             }
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro na previsão: {str(e)}")
 
@@ -6078,147 +5524,16 @@ async def transcribe_audio(request: WhatsAppAudioRequest):
         logging.error(f"Error transcribing audio: {e}")
         return {"transcription": None}
 
+# Fila de ingestão: ordem por contato, paralelismo entre contatos
+ingestao_whatsapp = IngestaoWhatsApp(
+    db, hash_senha=pwd_context.hash, rotear=apply_routing, responder_ia=process_ai_response
+)
+
 @api_router.post("/whatsapp/process")
 async def process_whatsapp_message(request: WhatsAppMessageRequest):
     """Process WhatsApp messages - Internal service endpoint"""
     try:
-        # Normalize phone number for comparison (remove all non-digits)
-        normalized_phone = ''.join(filter(str.isdigit, request.phone_number))
-        
-        # Try to find user by normalized phone number
-        users_cursor = db.users.find({}, {"_id": 0})
-        user = None
-        async for u in users_cursor:
-            u_phone = ''.join(filter(str.isdigit, u.get("telefone", "")))
-            if u_phone == normalized_phone:
-                user = u
-                break
-        
-        # Determine which empresa to use
-        empresa = None
-        if user and user.get("empresa_ids"):
-            # User found - use their first empresa
-            empresa_id = user["empresa_ids"][0]
-            empresa = await db.empresas.find_one({"id": empresa_id}, {"_id": 0})
-        else:
-            # No user found - try environment variable for default empresa
-            default_empresa_id = os.environ.get("WHATSAPP_DEFAULT_EMPRESA_ID")
-            if default_empresa_id:
-                empresa = await db.empresas.find_one({"id": default_empresa_id}, {"_id": 0})
-            
-            # If still no empresa, use most recently created one (more likely to be active)
-            if not empresa:
-                empresas_list = await db.empresas.find({}, {"_id": 0}).sort("created_at", -1).limit(1).to_list(1)
-                if empresas_list:
-                    empresa = empresas_list[0]
-        
-        if not empresa:
-            return {
-                "response_message": "❌ Nenhuma empresa cadastrada no sistema. Configure uma empresa primeiro."
-            }
-        
-        # WhatsApp agora é usado APENAS para CRM - Não cria mais transações financeiras
-        response_text = "✅ Mensagem recebida!\\n\\n"
-        response_text += "Olá! Sua mensagem foi registrada no nosso sistema.\\n"
-        response_text += "Nossa equipe entrará em contato em breve.\\n"
-        
-        # Get or create empresa-specific WhatsApp user for CRM
-        whatsapp_email = f"whatsapp-bot-{empresa['id'][:8]}@echoshop.com"
-        default_user = await db.users.find_one({"email": whatsapp_email}, {"_id": 0})
-        if not default_user:
-            # Create empresa-specific WhatsApp bot user
-            default_user = {
-                "id": str(uuid.uuid4()),
-                "nome": f"WhatsApp Bot - {empresa.get('razao_social', 'ECHO SHOP')}",
-                "email": whatsapp_email,
-                "telefone": request.phone_number,
-                "perfil": "crm",
-                "empresa_ids": [empresa["id"]],
-                "senha_hash": pwd_context.hash("whatsapp-bot-user"),
-                "created_at": datetime.now(timezone.utc).isoformat()
-            }
-            await db.users.insert_one(default_user)
-        
-        # ==================== CRM: Criar/Atualizar Lead ====================
-        try:
-            # Buscar lead existente pelo telefone
-            existing_lead = await db.leads.find_one({
-                "empresa_id": empresa["id"],
-                "$or": [
-                    {"telefone": request.phone_number},
-                    {"whatsapp_phone": request.phone_number}
-                ]
-            }, {"_id": 0})
-            
-            if existing_lead:
-                # Atualizar lead existente
-                await db.leads.update_one(
-                    {"id": existing_lead["id"]},
-                    {"$set": {
-                        "last_contact_at": datetime.now(timezone.utc).isoformat(),
-                        "updated_at": datetime.now(timezone.utc).isoformat()
-                    }}
-                )
-                lead_id = existing_lead["id"]
-                response_text += f"\\n👤 Lead atualizado!"
-            else:
-                # Criar novo lead
-                lead_data = {
-                    "id": str(uuid.uuid4()),
-                    "empresa_id": empresa["id"],
-                    "nome": request.contact_name or f"Contato {request.phone_number}",
-                    "telefone": request.phone_number,
-                    "whatsapp_phone": request.phone_number,
-                    "email": None,
-                    "origem": "whatsapp",
-                    "status_funil": "novo",
-                    "tags": ["whatsapp"],
-                    "valor_estimado": 0.0,
-                    "assigned_to": None,
-                    "last_contact_at": datetime.now(timezone.utc).isoformat(),
-                    "notes": f"Lead criado automaticamente via WhatsApp. Primeira mensagem: {request.message[:100]}",
-                    "created_at": datetime.now(timezone.utc).isoformat(),
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
-                
-                await db.leads.insert_one(lead_data)
-                lead_id = lead_data["id"]
-                
-                # Aplicar roteamento automático
-                assigned_user = await apply_routing(empresa["id"], lead_id)
-                
-                # Registrar atividade
-                activity = {
-                    "id": str(uuid.uuid4()),
-                    "lead_id": lead_id,
-                    "empresa_id": empresa["id"],
-                    "tipo": "whatsapp",
-                    "descricao": f"Lead criado via WhatsApp: {request.message[:100]}",
-                    "user_id": default_user["id"],
-                    "metadata": {"telefone": request.phone_number, "primeira_mensagem": request.message},
-                    "created_at": datetime.now(timezone.utc).isoformat()
-                }
-                await db.activities.insert_one(activity)
-                
-                if assigned_user:
-                    response_text += f"\\n🎯 Novo lead criado e atribuído automaticamente!"
-                else:
-                    response_text += f"\\n🎯 Novo lead criado!"
-                
-                # Tentar resposta automática do agente IA
-                ai_response = await process_ai_response(empresa["id"], lead_id, request.message)
-                if ai_response:
-                    response_text += f"\\n\\n🤖 {ai_response}"
-                
-        except Exception as e:
-            logging.error(f"Error creating/updating lead: {e}")
-            response_text += f"\\n⚠️ Lead não foi criado automaticamente."
-        # ==================== END CRM ====================
-        
-        return {
-            "response_message": response_text
-        }
-        
+        return await ingestao_whatsapp.processar(request.phone_number, request.sender_name, request.message)
     except Exception as e:
         logging.error(f"Error processing WhatsApp message: {e}")
         return {
@@ -6231,11 +5546,8 @@ async def process_whatsapp_message(request: WhatsAppMessageRequest):
 async def whatsapp_status(request: Request, current_user: dict = Depends(get_current_user)):
     """Proxy to WhatsApp service status"""
     try:
-        import httpx
-        whatsapp_url = os.environ.get("WHATSAPP_SERVICE_URL", "http://localhost:8002")
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{whatsapp_url}/status", timeout=5.0)
-            return response.json()
+        response = await http_clients.cliente("whatsapp").get("/status", timeout=5.0)
+        return response.json()
     except Exception as e:
         logging.error(f"Error getting WhatsApp status: {e}")
         return {"status": "service_offline", "phone_number": None, "has_qr": False}
@@ -6244,11 +5556,8 @@ async def whatsapp_status(request: Request, current_user: dict = Depends(get_cur
 async def whatsapp_qr(current_user: dict = Depends(get_current_user)):
     """Proxy to WhatsApp service QR code"""
     try:
-        import httpx
-        whatsapp_url = os.environ.get("WHATSAPP_SERVICE_URL", "http://localhost:8002")
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{whatsapp_url}/qr", timeout=5.0)
-            return response.json()
+        response = await http_clients.cliente("whatsapp").get("/qr", timeout=5.0)
+        return response.json()
     except Exception as e:
         logging.error(f"Error getting WhatsApp QR: {e}")
         raise HTTPException(status_code=404, detail="QR Code não disponível")
@@ -6257,11 +5566,8 @@ async def whatsapp_qr(current_user: dict = Depends(get_current_user)):
 async def whatsapp_reconnect(current_user: dict = Depends(get_current_user)):
     """Proxy to WhatsApp service reconnect"""
     try:
-        import httpx
-        whatsapp_url = os.environ.get("WHATSAPP_SERVICE_URL", "http://localhost:8002")
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{whatsapp_url}/reconnect", timeout=10.0)
-            return response.json()
+        response = await http_clients.cliente("whatsapp").post("/reconnect", timeout=10.0)
+        return response.json()
     except Exception as e:
         logging.error(f"Error reconnecting WhatsApp: {e}")
         raise HTTPException(status_code=500, detail="Erro ao reconectar")
@@ -6270,11 +5576,8 @@ async def whatsapp_reconnect(current_user: dict = Depends(get_current_user)):
 async def whatsapp_disconnect(current_user: dict = Depends(get_current_user)):
     """Proxy to WhatsApp service disconnect"""
     try:
-        import httpx
-        whatsapp_url = os.environ.get("WHATSAPP_SERVICE_URL", "http://localhost:8002")
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{whatsapp_url}/disconnect", timeout=10.0)
-            return response.json()
+        response = await http_clients.cliente("whatsapp").post("/disconnect", timeout=10.0)
+        return response.json()
     except Exception as e:
         logging.error(f"Error disconnecting WhatsApp: {e}")
         raise HTTPException(status_code=500, detail="Erro ao desconectar")
@@ -6296,109 +5599,44 @@ def get_drive_service_deprecated():
     
     return build('drive', 'v3', credentials=credentials)
 
-async def export_all_data():
-    """Export all database data to JSON format"""
-    backup_data = {
-        "backup_date": datetime.now(timezone.utc).isoformat(),
-        "database": os.environ.get("DB_NAME", "finai_database"),
-        "collections": {}
-    }
-    
-    # Collections to backup
-    collections = [
-        "empresas", "users", "categorias_financeiras", "centros_custo",
-        "transacoes", "contas_bancarias", "investimentos", "cartoes_credito",
-        "clientes", "fornecedores", "locais", "categorias_equipamentos",
-        "equipamentos", "equipamentos_serializados", "movimentacoes_estoque",
-        "contatos_crm", "conversas_crm", "mensagens_crm", "agentes_ia",
-        "funil_stages", "templates_mensagem", "automacoes_crm", "auditoria_crm",
-        "consentimentos_crm", "vendas_clientes", "planos_internet", "assinaturas"
-    ]
-    
-    for collection_name in collections:
-        try:
-            collection = db[collection_name]
-            documents = await collection.find().to_list(length=None)
-            
-            # Convert ObjectId and datetime to strings
-            for doc in documents:
-                if "_id" in doc:
-                    doc["_id"] = str(doc["_id"])
-                for key, value in doc.items():
-                    if isinstance(value, datetime):
-                        doc[key] = value.isoformat()
-            
-            backup_data["collections"][collection_name] = documents
-            logging.info(f"Exported {len(documents)} documents from {collection_name}")
-        except Exception as e:
-            logging.error(f"Error exporting {collection_name}: {e}")
-            backup_data["collections"][collection_name] = []
-    
-    return backup_data
-
-async def upload_to_drive(file_content: bytes, filename: str):
-    """Upload file to Google Drive"""
+async def upload_to_drive(arquivo, filename: str, progresso=None):
+    """Upload file to the backup Drive (service account; resumable, in chunks, off the event loop)"""
     try:
-        service = get_drive_service()
-        folder_id = os.environ.get("GOOGLE_DRIVE_FOLDER_ID")
-        
-        file_metadata = {
-            'name': filename,
-            'mimeType': 'application/json'
-        }
-        
-        if folder_id:
-            file_metadata['parents'] = [folder_id]
-        
-        media = MediaIoBaseUpload(
-            io.BytesIO(file_content),
-            mimetype='application/json',
-            resumable=True
+        drive = await drive_clientes.conta_servico()
+        return await drive.upload(
+            arquivo, filename, MEDIA_TYPE_BACKUP,
+            pasta=os.environ.get("GOOGLE_DRIVE_FOLDER_ID"),
+            campos='id,name,createdTime',
+            progresso=progresso
         )
         
-        file = service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id,name,createdTime'
-        ).execute()
-        
-        logging.info(f"File uploaded to Drive: {file.get('name')} (ID: {file.get('id')})")
-        return file
-        
     except Exception as e:
         logging.error(f"Error uploading to Drive: {e}")
         raise HTTPException(status_code=500, detail=f"Erro ao fazer upload para Google Drive: {str(e)}")
 
+async def backup_para_drive(modo: str = MODO_AUTO, progresso=None):
+    """Gera o backup (incremental, com completo periódico), envia ao Drive e o coloca na cadeia"""
+    arquivo, manifesto = await gerar_backup(db, progresso=progresso, modo=modo)
+    prefixo = "backup_inc" if manifesto["tipo"] == TIPO_INCREMENTAL else "backup"
+    
+    async def progresso_upload(percentual, mensagem):
+        # gerar_backup vai até 95%
+        await progresso(95 + percentual * 0.05, mensagem)
+    
+    with arquivo:
+        file_info = await upload_to_drive(arquivo, nome_arquivo(prefixo=prefixo), progresso_upload if progresso else None)
+    await registrar_backup(db, manifesto, {
+        "tipo": "drive",
+        "file_id": file_info.get('id'),
+        "nome": file_info.get('name')
+    })
+    return file_info, manifesto
+
 async def cleanup_old_backups(keep_days: int = 30):
-    """Delete backups older than keep_days"""
+    """Delete backups older than keep_days (batched delete)"""
     try:
-        service = get_drive_service()
-        folder_id = os.environ.get("GOOGLE_DRIVE_FOLDER_ID")
-        
-        cutoff_date = datetime.now(timezone.utc) - timedelta(days=keep_days)
-        cutoff_str = cutoff_date.isoformat()
-        
-        query = f"name contains 'backup_' and createdTime < '{cutoff_str}'"
-        if folder_id:
-            query += f" and '{folder_id}' in parents"
-        
-        results = service.files().list(
-            q=query,
-            fields='files(id, name, createdTime)'
-        ).execute()
-        
-        files = results.get('files', [])
-        deleted_count = 0
-        
-        for file in files:
-            try:
-                service.files().delete(fileId=file['id']).execute()
-                deleted_count += 1
-                logging.info(f"Deleted old backup: {file['name']}")
-            except Exception as e:
-                logging.error(f"Error deleting {file['name']}: {e}")
-        
-        return deleted_count
+        drive = await drive_clientes.conta_servico()
+        return await excluir_backups_antigos(drive, keep_days, pasta=os.environ.get("GOOGLE_DRIVE_FOLDER_ID"))
         
     except Exception as e:
         logging.error(f"Error cleaning up old backups: {e}")
@@ -6408,25 +5646,24 @@ async def cleanup_old_backups(keep_days: int = 30):
 @limiter.limit("5/hour")
 async def create_backup(
     request: Request,
+    background: bool = False,
+    completo: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
-    """Create a manual backup and upload to Google Drive"""
+    """Create a manual backup and upload to Google Drive (incremental unless completo=true)"""
+    if background:
+        job = await fila_jobs.enfileirar(
+            "backup", {"destino": "drive", "completo": completo}, user_id=current_user["id"], max_tentativas=2
+        )
+        return {"status": "queued", "job_id": job["id"]}
+    
     try:
-        # Export all data
-        backup_data = await export_all_data()
-        
-        # Generate filename
-        timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
-        filename = f"backup_{timestamp}.json"
-        
-        # Convert to JSON bytes
-        json_content = json.dumps(backup_data, indent=2, ensure_ascii=False).encode('utf-8')
-        
-        # Upload to Drive
-        file_info = await upload_to_drive(json_content, filename)
+        # Export (incremental unless a full snapshot is due or requested) and upload to Drive
+        file_info, manifesto = await backup_para_drive(TIPO_COMPLETO if completo else MODO_AUTO)
         
         # Cleanup old backups
         deleted_count = await cleanup_old_backups(keep_days=30)
+        await limpar_catalogo(db, keep_days=30)
         
         return {
             "success": True,
@@ -6436,6 +5673,9 @@ async def create_backup(
                 "name": file_info.get('name'),
                 "created_at": file_info.get('createdTime')
             },
+            "type": manifesto["tipo"],
+            "documents": manifesto["documentos"],
+            "size_bytes": manifesto["tamanho_bytes"],
             "old_backups_deleted": deleted_count
         }
         
@@ -6458,27 +5698,27 @@ async def get_backup_status(current_user: dict = Depends(get_current_user)):
 @limiter.limit("10/hour")
 async def download_backup(
     request: Request,
+    background: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
-    """Generate and download complete backup as JSON file"""
+    """Generate and download complete backup (tar of compressed NDJSON + manifest)"""
+    if background:
+        # O arquivo fica disponível em GET /jobs/{job_id}/arquivo
+        job = await fila_jobs.enfileirar("backup", {"destino": "arquivo"}, user_id=current_user["id"], max_tentativas=2)
+        return {"status": "queued", "job_id": job["id"]}
+    
     try:
-        # Export all data
-        backup_data = await export_all_data()
-        
-        # Generate filename with timestamp
-        timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
-        filename = f"backup_echoshop_{timestamp}.json"
-        
-        # Convert to JSON string
-        json_content = json.dumps(backup_data, indent=2, ensure_ascii=False)
-        
-        # Return as downloadable file
-        return Response(
-            content=json_content,
-            media_type="application/json",
+        # Export all data (streaming, compressed)
+        arquivo, manifesto = await gerar_backup(db)
+        filename = nome_arquivo()
+        
+        # Return as downloadable file, sent in chunks
+        return StreamingResponse(
+            ler_em_partes(arquivo),
+            media_type=MEDIA_TYPE_BACKUP,
             headers={
                 "Content-Disposition": f"attachment; filename={filename}",
-                "Content-Type": "application/json; charset=utf-8"
+                "Content-Length": str(manifesto["tamanho_bytes"])
             }
         )
         
@@ -6575,6 +5815,7 @@ async def drive_callback(code: str, state: str):
             upsert=True
         )
         
+        drive_clientes.invalidar(state)
         logging.info(f"Drive credentials stored for user {state}")
         
         # Redirect to frontend
@@ -6587,40 +5828,11 @@ async def drive_callback(code: str, state: str):
         return RedirectResponse(url=f"{frontend_url}/configuracoes/backup?drive_error={str(e)}")
 
 async def get_drive_service(user_id: str):
-    """Get Google Drive service with auto-refresh credentials"""
-    creds_doc = await db.drive_credentials.find_one({"user_id": user_id})
-    if not creds_doc:
-        raise HTTPException(
-            status_code=400, 
-            detail="Google Drive não conectado. Por favor, conecte sua conta primeiro."
-        )
-    
-    # Create credentials object
-    creds = Credentials(
-        token=creds_doc["access_token"],
-        refresh_token=creds_doc.get("refresh_token"),
-        token_uri=creds_doc["token_uri"],
-        client_id=creds_doc["client_id"],
-        client_secret=creds_doc["client_secret"],
-        scopes=creds_doc["scopes"]
-    )
-    
-    # Auto-refresh if expired
-    if creds.expired and creds.refresh_token:
-        logging.info(f"Refreshing expired token for user {user_id}")
-        creds.refresh(GoogleRequest())
-        
-        # Update in database
-        await db.drive_credentials.update_one(
-            {"user_id": user_id},
-            {"$set": {
-                "access_token": creds.token,
-                "expiry": creds.expiry.isoformat() if creds.expiry else None,
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }}
-        )
-    
-    return build('drive', 'v3', credentials=creds)
+    """Get the user's Google Drive (cached service, auto-refresh credentials)"""
+    try:
+        return await drive_clientes.do_usuario(user_id)
+    except DriveNaoConectado as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @api_router.get("/oauth/drive/status")
 async def drive_status(current_user: dict = Depends(get_current_user)):
@@ -6636,8 +5848,8 @@ async def drive_status(current_user: dict = Depends(get_current_user)):
         
         # Try to get user email from Drive API
         try:
-            service = await get_drive_service(current_user.get("id"))
-            about = service.about().get(fields="user").execute()
+            drive = await get_drive_service(current_user.get("id"))
+            about = await drive.sobre()
             email = about.get('user', {}).get('emailAddress')
             
             return {
@@ -6665,39 +5877,17 @@ async def upload_backup_to_drive(
 ):
     """Upload backup to user's Google Drive"""
     try:
-        # Get Drive service
-        service = await get_drive_service(current_user.get("id"))
-        
-        # Export all data
-        backup_data = await export_all_data()
-        
-        # Generate filename with timestamp
-        timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
-        filename = f"backup_echoshop_{timestamp}.json"
-        
-        # Convert to JSON bytes
-        json_content = json.dumps(backup_data, indent=2, ensure_ascii=False).encode('utf-8')
-        
-        # Create file metadata
-        file_metadata = {
-            'name': filename,
-            'mimeType': 'application/json'
-        }
+        # Get Drive (cached per user)
+        drive = await get_drive_service(current_user.get("id"))
         
-        # Upload to Drive
-        media = MediaIoBaseUpload(
-            io.BytesIO(json_content),
-            mimetype='application/json',
-            resumable=True
-        )
-        
-        file = service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id,name,createdTime,webViewLink'
-        ).execute()
+        # Export all data (streaming, compressed)
+        arquivo, manifesto = await gerar_backup(db)
         
-        logging.info(f"Backup uploaded to Drive: {file.get('name')} (ID: {file.get('id')})")
+        # Upload to Drive (resumable, in chunks, off the event loop)
+        with arquivo:
+            file = await drive.upload(
+                arquivo, nome_arquivo(), MEDIA_TYPE_BACKUP, campos='id,name,createdTime,webViewLink'
+            )
         
         return {
             "success": True,
@@ -6721,6 +5911,8 @@ async def disconnect_drive(current_user: dict = Depends(get_current_user)):
     """Disconnect user's Google Drive"""
     try:
         result = await db.drive_credentials.delete_one({"user_id": current_user.get("id")})
+        await registrar_exclusao(db, "drive_credentials", {"user_id": current_user.get("id")})
+        drive_clientes.invalidar(current_user.get("id"))
         
         if result.deleted_count > 0:
             return {"success": True, "message": "Google Drive desconectado com sucesso"}
@@ -6784,15 +5976,24 @@ async def delete_plano_internet(plano_id: str, current_user: dict = Depends(get_
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Plano não encontrado")
+    await registrar_exclusao(db, "planos_internet", {"id": plano_id})
     
     return {"message": "Plano deletado com sucesso"}
 
 # CLIENTES DE VENDAS
 @api_router.get("/empresas/{empresa_id}/clientes-venda")
-async def get_clientes_venda(empresa_id: str, current_user: dict = Depends(get_current_user)):
+async def get_clientes_venda(
+    empresa_id: str,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
     """List all sales clients"""
-    clientes = await db.clientes_venda.find({"empresa_id": empresa_id}, {"_id": 0}).to_list(1000)
-    return clientes
+    return await listar_paginado(
+        db.clientes_venda, {"empresa_id": empresa_id}, response, limit=limit, cursor=cursor, stream=stream
+    )
 
 @api_router.post("/empresas/{empresa_id}/clientes-venda")
 async def create_cliente_venda(
@@ -6808,6 +6009,7 @@ async def create_cliente_venda(
     cliente_dict["inadimplente"] = False
     cliente_dict["created_at"] = datetime.now(timezone.utc)
     cliente_dict["updated_at"] = datetime.now(timezone.utc)
+    cliente_dict.update(campos_telefone(cliente_dict, ORIGEM_CLIENTES_VENDA))
     
     await db.clientes_venda.insert_one(cliente_dict)
     # Remove _id before returning
@@ -6833,11 +6035,13 @@ async def update_cliente_venda(
     """Update sales client"""
     cliente_dict = cliente.dict()
     cliente_dict["updated_at"] = datetime.now(timezone.utc)
+    cliente_dict.update(campos_telefone(cliente_dict, ORIGEM_CLIENTES_VENDA))
     
     result = await db.clientes_venda.update_one(
         {"id": cliente_id},
         {"$set": cliente_dict}
     )
+    name_cache.invalidar("clientes_venda", cliente_id)
     
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
@@ -6968,6 +6172,7 @@ async def create_fatura(
     fatura_dict = fatura.dict()
     fatura_dict["empresa_id"] = empresa_id
     fatura_dict["id"] = str(uuid.uuid4())
+    fatura_dict["numero"] = await sequencias.numero("fatura", empresa_id)
     fatura_dict["cliente_id"] = venda["cliente_id"]
     fatura_dict["status"] = "pendente"
     fatura_dict["multa"] = 0.0
@@ -7102,6 +6307,7 @@ async def atualizar_plano_servico(plano_id: str, dados: PlanoServicoCreate, curr
     update_dict["updated_at"] = datetime.now(timezone.utc)
     
     await db.planos_servico.update_one({"id": plano_id}, {"$set": update_dict})
+    name_cache.invalidar("planos_servico", plano_id)
     return {"message": "Plano atualizado com sucesso"}
 
 @api_router.delete("/planos-servico/{plano_id}")
@@ -7222,10 +6428,10 @@ async def listar_contratos(empresa_id: str, status: Optional[str] = None, curren
     contratos = await db.contratos_cliente.find(query, {"_id": 0}).to_list(1000)
     
     # Enriquecer com dados do cliente
-    for contrato in contratos:
-        cliente = await db.clientes_venda.find_one({"id": contrato["cliente_id"]}, {"_id": 0, "nome_completo": 1, "cpf": 1})
-        contrato["cliente_nome"] = cliente.get("nome_completo", "N/A") if cliente else "N/A"
-        contrato["cliente_cpf"] = cliente.get("cpf", "N/A") if cliente else "N/A"
+    await name_cache.enriquecer(
+        db, contratos, "cliente_id", "clientes_venda",
+        {"nome_completo": "cliente_nome", "cpf": "cliente_cpf"}, padrao="N/A"
+    )
     
     return contratos
 
@@ -7299,11 +6505,8 @@ async def listar_vendas_servico(empresa_id: str, status: Optional[str] = None, c
     vendas = await db.vendas_servico.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
     
     # Enriquecer com dados
-    for venda in vendas:
-        cliente = await db.clientes_venda.find_one({"id": venda["cliente_id"]}, {"_id": 0, "nome_completo": 1})
-        plano = await db.planos_servico.find_one({"id": venda["plano_id"]}, {"_id": 0, "nome": 1})
-        venda["cliente_nome"] = cliente.get("nome_completo", "N/A") if cliente else "N/A"
-        venda["plano_nome"] = plano.get("nome", "N/A") if plano else "N/A"
+    await name_cache.enriquecer(db, vendas, "cliente_id", "clientes_venda", {"nome_completo": "cliente_nome"}, padrao="N/A")
+    await name_cache.enriquecer(db, vendas, "plano_id", "planos_servico", {"nome": "plano_nome"}, padrao="N/A")
     
     return vendas
 
@@ -7332,6 +6535,7 @@ async def criar_venda_servico(empresa_id: str, venda: VendaServicoCreate, curren
     venda_dict = {
         "id": venda_id,
         "empresa_id": empresa_id,
+        "numero": await sequencias.numero("venda", empresa_id, data_atual),
         "cliente_id": venda.cliente_id,
         "plano_id": venda.plano_id,
         "vendedor_id": current_user["id"],
@@ -7404,21 +6608,7 @@ async def criar_venda_servico(empresa_id: str, venda: VendaServicoCreate, curren
             venda_dict["contrato_id"] = contrato_id
     
     # Gerar OS de instalação
-    # Gerar número sequencial
-    ultimo_numero = await db.ordens_servico.find_one(
-        {"empresa_id": empresa_id}, 
-        sort=[("created_at", -1)]
-    )
-    if ultimo_numero and ultimo_numero.get("numero"):
-        try:
-            num_parts = ultimo_numero["numero"].split("-")
-            seq = int(num_parts[-1]) + 1
-        except:
-            seq = 1
-    else:
-        seq = 1
-    
-    numero_os = f"OS-{data_atual.year}-{seq:04d}"
+    numero_os = await sequencias.numero("os", empresa_id, data_atual)
     
     endereco_servico = f"{cliente.get('logradouro', '')}, {cliente.get('numero', '')} - {cliente.get('bairro', '')}, {cliente.get('cidade', '')}/{cliente.get('estado', '')}"
     
@@ -7460,74 +6650,74 @@ async def criar_venda_servico(empresa_id: str, venda: VendaServicoCreate, curren
     if gateway and gateway.get("api_key"):
         try:
             # Criar cliente no Asaas se não existir
-            async with httpx.AsyncClient() as client:
-                api_key = gateway["api_key"]
-                base_url = ASAAS_BASE_URL
+            client = http_clients.cliente("asaas")
+            api_key = gateway["api_key"]
+            base_url = ASAAS_BASE_URL
                 
-                # Verificar se cliente já existe no Asaas
-                if not cliente.get("asaas_customer_id"):
-                    customer_data = {
-                        "name": cliente["nome_completo"],
-                        "email": cliente.get("email"),
-                        "phone": cliente.get("telefone"),
-                        "cpfCnpj": cliente.get("cpf", "").replace(".", "").replace("-", "").replace("/", ""),
-                        "externalReference": cliente["id"]
-                    }
+            # Verificar se cliente já existe no Asaas
+            if not cliente.get("asaas_customer_id"):
+                customer_data = {
+                    "name": cliente["nome_completo"],
+                    "email": cliente.get("email"),
+                    "phone": cliente.get("telefone"),
+                    "cpfCnpj": cliente.get("cpf", "").replace(".", "").replace("-", "").replace("/", ""),
+                    "externalReference": cliente["id"]
+                }
                     
-                    resp = await client.post(
-                        f"{base_url}/customers",
-                        json=customer_data,
-                        headers={"access_token": api_key}
-                    )
+                resp = await client.post(
+                    f"{base_url}/customers",
+                    json=customer_data,
+                    headers={"access_token": api_key}
+                )
                     
-                    if resp.status_code in [200, 201]:
-                        asaas_customer = resp.json()
-                        await db.clientes_venda.update_one(
-                            {"id": cliente["id"]},
-                            {"$set": {"asaas_customer_id": asaas_customer["id"]}}
-                        )
-                        venda_dict["asaas_customer_id"] = asaas_customer["id"]
-                        cliente["asaas_customer_id"] = asaas_customer["id"]
+                if resp.status_code in [200, 201]:
+                    asaas_customer = resp.json()
+                    await db.clientes_venda.update_one(
+                        {"id": cliente["id"]},
+                        {"$set": {"asaas_customer_id": asaas_customer["id"]}}
+                    )
+                    venda_dict["asaas_customer_id"] = asaas_customer["id"]
+                    cliente["asaas_customer_id"] = asaas_customer["id"]
                 
-                # Criar cobrança inicial
-                if cliente.get("asaas_customer_id"):
-                    # Calcular data de vencimento
-                    hoje = datetime.now()
-                    if hoje.day > venda.dia_vencimento:
-                        # Próximo mês
-                        if hoje.month == 12:
-                            data_venc = datetime(hoje.year + 1, 1, venda.dia_vencimento)
-                        else:
-                            data_venc = datetime(hoje.year, hoje.month + 1, venda.dia_vencimento)
+            # Criar cobrança inicial
+            if cliente.get("asaas_customer_id"):
+                # Calcular data de vencimento
+                hoje = datetime.now()
+                if hoje.day > venda.dia_vencimento:
+                    # Próximo mês
+                    if hoje.month == 12:
+                        data_venc = datetime(hoje.year + 1, 1, venda.dia_vencimento)
                     else:
-                        data_venc = datetime(hoje.year, hoje.month, venda.dia_vencimento)
+                        data_venc = datetime(hoje.year, hoje.month + 1, venda.dia_vencimento)
+                else:
+                    data_venc = datetime(hoje.year, hoje.month, venda.dia_vencimento)
                     
-                    billing_type = "PIX" if venda.forma_pagamento == "pix" else "BOLETO"
+                billing_type = "PIX" if venda.forma_pagamento == "pix" else "BOLETO"
                     
-                    cobranca_data = {
-                        "customer": cliente["asaas_customer_id"],
-                        "billingType": billing_type,
-                        "value": plano["valor"],
-                        "dueDate": data_venc.strftime("%Y-%m-%d"),
-                        "description": f"Primeira mensalidade - {plano['nome']}",
-                        "externalReference": venda_id
-                    }
+                cobranca_data = {
+                    "customer": cliente["asaas_customer_id"],
+                    "billingType": billing_type,
+                    "value": plano["valor"],
+                    "dueDate": data_venc.strftime("%Y-%m-%d"),
+                    "description": f"Primeira mensalidade - {plano['nome']}",
+                    "externalReference": venda_id
+                }
                     
-                    resp = await client.post(
-                        f"{base_url}/payments",
-                        json=cobranca_data,
-                        headers={"access_token": api_key}
-                    )
+                resp = await client.post(
+                    f"{base_url}/payments",
+                    json=cobranca_data,
+                    headers={"access_token": api_key}
+                )
                     
-                    if resp.status_code in [200, 201]:
-                        pagamento = resp.json()
-                        await db.vendas_servico.update_one(
-                            {"id": venda_id},
-                            {"$set": {
-                                "primeiro_pagamento_id": pagamento["id"],
-                                "asaas_customer_id": cliente["asaas_customer_id"]
-                            }}
-                        )
+                if resp.status_code in [200, 201]:
+                    pagamento = resp.json()
+                    await db.vendas_servico.update_one(
+                        {"id": venda_id},
+                        {"$set": {
+                            "primeiro_pagamento_id": pagamento["id"],
+                            "asaas_customer_id": cliente["asaas_customer_id"]
+                        }}
+                    )
         except Exception as e:
             logging.error(f"Erro ao criar cobrança Asaas: {e}")
     
@@ -7572,12 +6762,16 @@ async def obter_venda_servico(venda_id: str, current_user: dict = Depends(get_cu
 @api_router.get("/empresas/{empresa_id}/ordens-servico")
 async def listar_ordens_servico(
     empresa_id: str, 
+    response: Response,
     status: Optional[str] = None,
     tecnico_id: Optional[str] = None,
     tipo: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    stream: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
-    """Lista ordens de serviço com filtros"""
+    """Lista ordens de serviço com filtros (paginação por cursor ou NDJSON com stream=true)"""
     if empresa_id not in current_user.get("empresa_ids", []):
         raise HTTPException(status_code=403, detail="Acesso negado")
     
@@ -7589,21 +6783,18 @@ async def listar_ordens_servico(
     if tipo:
         query["tipo"] = tipo
     
-    ordens = await db.ordens_servico.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    
-    # Enriquecer com dados
-    for os in ordens:
-        cliente = await db.clientes_venda.find_one({"id": os["cliente_id"]}, {"_id": 0, "nome_completo": 1, "telefone": 1})
-        os["cliente_nome"] = cliente.get("nome_completo", "N/A") if cliente else "N/A"
-        os["cliente_telefone"] = cliente.get("telefone", "N/A") if cliente else "N/A"
-        
-        if os.get("tecnico_id"):
-            tecnico = await db.users.find_one({"id": os["tecnico_id"]}, {"_id": 0, "nome": 1})
-            os["tecnico_nome"] = tecnico.get("nome", "N/A") if tecnico else "Não atribuído"
-        else:
-            os["tecnico_nome"] = "Não atribuído"
+    # Enriquecer com dados (um $in por coleção referenciada, por página/lote)
+    async def enriquecer(ordens):
+        await name_cache.enriquecer(
+            db, ordens, "cliente_id", "clientes_venda",
+            {"nome_completo": "cliente_nome", "telefone": "cliente_telefone"}, padrao="N/A"
+        )
+        await name_cache.enriquecer(db, ordens, "tecnico_id", "users", {"nome": "tecnico_nome"}, padrao="Não atribuído")
     
-    return ordens
+    return await listar_paginado(
+        db.ordens_servico, query, response, limit=limit, cursor=cursor, stream=stream,
+        enriquecer_lote=enriquecer
+    )
 
 @api_router.post("/empresas/{empresa_id}/ordens-servico")
 async def criar_ordem_servico(empresa_id: str, os_data: OrdemServicoCreate, current_user: dict = Depends(get_current_user)):
@@ -7619,20 +6810,7 @@ async def criar_ordem_servico(empresa_id: str, os_data: OrdemServicoCreate, curr
     data_atual = datetime.now(timezone.utc)
     
     # Gerar número
-    ultimo_numero = await db.ordens_servico.find_one(
-        {"empresa_id": empresa_id}, 
-        sort=[("created_at", -1)]
-    )
-    if ultimo_numero and ultimo_numero.get("numero"):
-        try:
-            num_parts = ultimo_numero["numero"].split("-")
-            seq = int(num_parts[-1]) + 1
-        except:
-            seq = 1
-    else:
-        seq = 1
-    
-    numero_os = f"OS-{data_atual.year}-{seq:04d}"
+    numero_os = await sequencias.numero("os", empresa_id, data_atual)
     
     # Checklist padrão por tipo
     checklists = {
@@ -7724,8 +6902,8 @@ async def _enviar_push_nova_os(os_id: str, tecnico_id: str, os_data: dict):
             "channelId": "os-nova"
         }
         
-        response = requests.post(
-            "https://exp.host/--/api/v2/push/send",
+        response = await http_clients.cliente("expo").post(
+            EXPO_PUSH_PATH,
             json=message,
             headers={"Content-Type": "application/json"}
         )
@@ -8211,9 +7389,8 @@ async def listar_estoque_todos_tecnicos(empresa_id: str, current_user: dict = De
     estoques = await db.estoque_tecnico.find({"empresa_id": empresa_id}, {"_id": 0}).to_list(100)
     
     # Enriquecer com dados do técnico
+    await name_cache.enriquecer(db, estoques, "tecnico_id", "users", {"nome": "tecnico_nome"}, padrao="Desconhecido")
     for est in estoques:
-        tecnico = await db.users.find_one({"id": est["tecnico_id"]}, {"_id": 0, "nome": 1})
-        est["tecnico_nome"] = tecnico.get("nome", "Desconhecido") if tecnico else "Desconhecido"
         est["total_equipamentos"] = len(est.get("equipamentos", []))
     
     return estoques
@@ -8681,6 +7858,7 @@ async def register_push_token(
                 }
             }
         )
+        user_cache.invalidar(user_id)
         
         logging.info(f"Push token registrado para usuário {user_id}: {token_data.push_token[:20]}...")
         return {"success": True, "message": "Token registrado com sucesso"}
@@ -8732,8 +7910,8 @@ async def send_push_notification(
         for i in range(0, len(messages), 100):
             batch = messages[i:i+100]
             try:
-                response = requests.post(
-                    "https://exp.host/--/api/v2/push/send",
+                response = await http_clients.cliente("expo").post(
+                    EXPO_PUSH_PATH,
                     json=batch,
                     headers={"Content-Type": "application/json"}
                 )
@@ -8798,8 +7976,8 @@ async def notify_technician_new_os(
             "channelId": "os-nova"
         }
         
-        response = requests.post(
-            "https://exp.host/--/api/v2/push/send",
+        response = await http_clients.cliente("expo").post(
+            EXPO_PUSH_PATH,
             json=message,
             headers={"Content-Type": "application/json"}
         )
@@ -8969,6 +8147,311 @@ async def delete_apk(current_user: dict = Depends(get_current_user)):
 
 # ==================== END APK MANAGEMENT ====================
 
+# ==================== ADMIN: MANUTENÇÃO DO BANCO ====================
+
+@api_router.get("/admin/indices")
+async def get_relatorio_indices(current_user: dict = Depends(get_current_user)):
+    """Relatório de índices faltantes/extras e consultas quentes ainda em COLLSCAN"""
+    if current_user.get("perfil") != "admin_master":
+        raise HTTPException(status_code=403, detail="Apenas admin_master pode consultar índices")
+    
+    return {
+        "divergencias": await relatorio_indices(db),
+        "collscan": await verificar_collscan(db)
+    }
+
+@api_router.post("/admin/indices/aplicar")
+async def aplicar_indices_endpoint(current_user: dict = Depends(get_current_user)):
+    """Recria (idempotente) os índices declarados no registro"""
+    if current_user.get("perfil") != "admin_master":
+        raise HTTPException(status_code=403, detail="Apenas admin_master pode aplicar índices")
+    
+    return await aplicar_indices(db)
+
+@api_router.post("/admin/rollup/reconstruir")
+async def reconstruir_rollup_endpoint(empresa_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Reconstrói o rollup mensal de transações (todas as empresas ou apenas uma)"""
+    if current_user.get("perfil") != "admin_master":
+        raise HTTPException(status_code=403, detail="Apenas admin_master pode reconstruir o rollup")
+    
+    reconstrucao = await executar_exclusivo(db, "reconstrucao_rollup", lambda: reconstruir_rollup(db, empresa_id))
+    if reconstrucao is None:
+        raise HTTPException(status_code=409, detail="Reconstrução do rollup já em andamento")
+    return reconstrucao
+
+@api_router.post("/admin/crm/etapas/reconstruir")
+async def reconstruir_etapas_endpoint(empresa_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Recalcula o tempo por etapa dos leads a partir do histórico de mudanças de status"""
+    if current_user.get("perfil") != "admin_master":
+        raise HTTPException(status_code=403, detail="Apenas admin_master pode reconstruir as etapas do CRM")
+    
+    return await reconstruir_etapas(db, empresa_id)
+
+@api_router.post("/admin/telefones/migrar")
+async def migrar_telefones_endpoint(current_user: dict = Depends(get_current_user)):
+    """Preenche telefone_normalizado (E.164) em users, leads e clientes_venda"""
+    if current_user.get("perfil") != "admin_master":
+        raise HTTPException(status_code=403, detail="Apenas admin_master pode migrar telefones")
+    
+    return await migrar_telefones(db)
+
+@api_router.post("/admin/saldos/migrar")
+async def migrar_saldos_endpoint(empresa_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Cria o ledger de saldos das contas bancárias que ainda não têm abertura e consolida"""
+    if current_user.get("perfil") != "admin_master":
+        raise HTTPException(status_code=403, detail="Apenas admin_master pode migrar saldos")
+    
+    migracao = await executar_exclusivo(db, "migracao_saldos", lambda: migrar_saldos(db, empresa_id))
+    if migracao is None:
+        raise HTTPException(status_code=409, detail="Migração de saldos já em andamento")
+    return {
+        **migracao,
+        "consolidacao": await consolidar_saldos(db, empresa_id)
+    }
+
+@api_router.get("/admin/saldos/divergencias")
+async def divergencias_saldos_endpoint(empresa_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Compara saldo_atual e os snapshots de cada conta com o ledger recalculado"""
+    if current_user.get("perfil") != "admin_master":
+        raise HTTPException(status_code=403, detail="Apenas admin_master pode verificar saldos")
+    
+    return await verificar_divergencias(db, empresa_id)
+
+@api_router.get("/admin/cache")
+async def get_estatisticas_cache(current_user: dict = Depends(get_current_user)):
+    """Hits/misses dos caches em processo (usuário autenticado, nomes, métricas do CRM, anomalias e previsão)"""
+    if current_user.get("perfil") != "admin_master":
+        raise HTTPException(status_code=403, detail="Apenas admin_master pode consultar os caches")
+    
+    return {
+        "usuarios": user_cache.estatisticas(),
+        "nomes": name_cache.estatisticas(),
+        "metricas_crm": metricas_crm.estatisticas(),
+        "anomalias": motor_anomalias.estatisticas(),
+        "previsao_fluxo": previsao_fluxo.estatisticas()
+    }
+
+@api_router.get("/admin/executores")
+async def get_estatisticas_executores(current_user: dict = Depends(get_current_user)):
+    """Fila, tarefas em andamento e duração por tarefa nos pools de threads/processos"""
+    if current_user.get("perfil") != "admin_master":
+        raise HTTPException(status_code=403, detail="Apenas admin_master pode consultar os executores")
+    
+    return executores.estatisticas()
+
+@api_router.get("/admin/emails")
+async def get_estatisticas_emails(current_user: dict = Depends(get_current_user)):
+    """Fila da outbox de emails e taxa de envio"""
+    if current_user.get("perfil") != "admin_master":
+        raise HTTPException(status_code=403, detail="Apenas admin_master pode consultar a outbox")
+    
+    return await outbox.estatisticas()
+
+@api_router.get("/admin/http")
+async def get_estatisticas_http(current_user: dict = Depends(get_current_user)):
+    """Latência, erros, retries e estado do circuit breaker por upstream"""
+    if current_user.get("perfil") != "admin_master":
+        raise HTTPException(status_code=403, detail="Apenas admin_master pode consultar os upstreams")
+    
+    return http_clients.estatisticas()
+
+@api_router.get("/admin/whatsapp")
+async def get_estatisticas_whatsapp(current_user: dict = Depends(get_current_user)):
+    """Fila de ingestão do WhatsApp: mensagens em fila/processadas, leads criados e lotes de atividades"""
+    if current_user.get("perfil") != "admin_master":
+        raise HTTPException(status_code=403, detail="Apenas admin_master pode consultar a ingestão do WhatsApp")
+    
+    return ingestao_whatsapp.estatisticas()
+
+@api_router.get("/admin/agendador")
+async def get_estado_agendador(
+    tarefa: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: dict = Depends(get_current_user)
+):
+    """Líder atual, próximas execuções e histórico das tarefas agendadas"""
+    if current_user.get("perfil") != "admin_master":
+        raise HTTPException(status_code=403, detail="Apenas admin_master pode consultar o agendador")
+    
+    return {
+        **await agendador.estado(),
+        "historico": await agendador.historico(tarefa, limit)
+    }
+
+@api_router.get("/admin/drive")
+async def get_estatisticas_drive(current_user: dict = Depends(get_current_user)):
+    """Serviços do Google Drive em cache"""
+    if current_user.get("perfil") != "admin_master":
+        raise HTTPException(status_code=403, detail="Apenas admin_master pode consultar o Google Drive")
+    
+    return drive_clientes.estatisticas()
+
+@api_router.post("/admin/backup/restaurar")
+async def restaurar_backup_endpoint(
+    file: UploadFile = File(...),
+    staging: bool = True,
+    verificar_conteudo: bool = True,
+    current_user: dict = Depends(get_current_user)
+):
+    """Restaura um backup completo (.tar) em background: coleções em paralelo, índices e verificação por checksum"""
+    if current_user.get("perfil") != "admin_master":
+        raise HTTPException(status_code=403, detail="Apenas admin_master pode restaurar backups")
+    if not file.filename.endswith(".tar"):
+        raise HTTPException(status_code=400, detail="Envie um arquivo de backup .tar")
+    
+    arquivo_id = await fila_jobs.salvar_arquivo(file.file, file.filename, MEDIA_TYPE_BACKUP)
+    job = await fila_jobs.enfileirar(
+        "restauracao",
+        {"arquivo_id": arquivo_id, "filename": file.filename, "staging": staging, "verificar_conteudo": verificar_conteudo},
+        user_id=current_user["id"],
+        max_tentativas=1
+    )
+    return {"status": "queued", "job_id": job["id"]}
+
+# ==================== END ADMIN: MANUTENÇÃO DO BANCO ====================
+
+# ==================== JOBS EM BACKGROUND ====================
+
+@fila_jobs.handler("importacao")
+async def job_importacao(ctx: JobContext):
+    contents = await ctx.fila.ler_arquivo(ctx.params["arquivo_id"])
+    return await processar_importacao(
+        ctx.params["formato"], contents, ctx.job["empresa_id"], ctx.job["user_id"], progresso=ctx.progresso
+    )
+
+@fila_jobs.handler("relatorio")
+async def job_relatorio(ctx: JobContext):
+    formato = ctx.params["formato"]
+    gerar = gerar_relatorio_excel if formato == "excel" else gerar_relatorio_pdf
+    await ctx.progresso(0, "Gerando relatório")
+    conteudo = await gerar(
+        ctx.job["empresa_id"], ctx.params.get("periodo_inicio"), ctx.params.get("periodo_fim"),
+        ctx.params.get("tipo_periodo", "mensal")
+    )
+    info = RELATORIOS_EXPORT[formato]
+    filename = f"relatorio_{ctx.params.get('tipo_periodo', 'mensal')}.{info['extensao']}"
+    if isinstance(conteudo, bytes):
+        return await ctx.salvar_arquivo(conteudo, filename, info["media_type"])
+    # Excel: arquivo temporário
+    with conteudo:
+        return await ctx.salvar_arquivo(conteudo, filename, info["media_type"])
+
+@fila_jobs.handler("verificar_inadimplentes")
+async def job_verificar_inadimplentes(ctx: JobContext):
+    return await processar_inadimplentes(progresso=ctx.progresso)
+
+@fila_jobs.handler("backup")
+async def job_backup(ctx: JobContext):
+    if ctx.params.get("destino") == "drive":
+        modo = TIPO_COMPLETO if ctx.params.get("completo") else MODO_AUTO
+        file_info, manifesto = await backup_para_drive(modo, progresso=ctx.progresso)
+        deleted_count = await cleanup_old_backups(keep_days=30)
+        await limpar_catalogo(db, keep_days=30)
+        return {
+            "file": {
+                "id": file_info.get('id'),
+                "name": file_info.get('name'),
+                "created_at": file_info.get('createdTime')
+            },
+            "type": manifesto["tipo"],
+            "documents": manifesto["documentos"],
+            "old_backups_deleted": deleted_count
+        }
+    
+    # Download: sempre completo, fora da cadeia
+    arquivo, manifesto = await gerar_backup(db, progresso=ctx.progresso)
+    with arquivo:
+        return await ctx.salvar_arquivo(arquivo, nome_arquivo(), MEDIA_TYPE_BACKUP)
+
+@fila_jobs.handler("restauracao")
+async def job_restauracao(ctx: JobContext):
+    await ctx.progresso(0, "Copiando o backup para disco")
+    stream = await ctx.fila.abrir_arquivo(ctx.params["arquivo_id"])
+    with tempfile.NamedTemporaryFile(suffix=".tar") as arquivo:
+        while True:
+            parte = await stream.readchunk()
+            if not parte:
+                break
+            arquivo.write(parte)
+        arquivo.flush()
+        return await restaurar_backup(
+            db, arquivo.name,
+            staging=ctx.params.get("staging", True),
+            verificar_conteudo=ctx.params.get("verificar_conteudo", True),
+            progresso=ctx.progresso
+        )
+
+def _pode_ver_job(job: dict, current_user: dict) -> bool:
+    if current_user.get("perfil") == "admin_master":
+        return True
+    if job.get("user_id") == current_user.get("id"):
+        return True
+    return bool(job.get("empresa_id")) and job["empresa_id"] in current_user.get("empresa_ids", [])
+
+async def _obter_job_autorizado(job_id: str, current_user: dict) -> dict:
+    job = await fila_jobs.obter(job_id)
+    if not job or not _pode_ver_job(job, current_user):
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job
+
+@api_router.get("/jobs")
+async def listar_jobs(
+    empresa_id: Optional[str] = None,
+    status: Optional[str] = None,
+    tipo: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: dict = Depends(get_current_user)
+):
+    """Jobs do usuário (ou da empresa informada)"""
+    if empresa_id:
+        if empresa_id not in current_user.get("empresa_ids", []) and current_user.get("perfil") != "admin_master":
+            raise HTTPException(status_code=403, detail="Acesso negado")
+        filtro = {"empresa_id": empresa_id}
+    else:
+        filtro = {"user_id": current_user["id"]}
+    if status:
+        filtro["status"] = status
+    if tipo:
+        filtro["tipo"] = tipo
+    return await fila_jobs.listar(filtro, limit)
+
+@api_router.get("/jobs/{job_id}")
+async def obter_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Status, progresso e resultado de um job"""
+    return await _obter_job_autorizado(job_id, current_user)
+
+@api_router.post("/jobs/{job_id}/cancelar")
+async def cancelar_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    job = await _obter_job_autorizado(job_id, current_user)
+    if job["status"] in STATUS_FINAIS:
+        raise HTTPException(status_code=400, detail=f"Job já finalizado ({job['status']})")
+    return await fila_jobs.cancelar(job_id)
+
+@api_router.get("/jobs/{job_id}/arquivo")
+async def baixar_arquivo_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Download do arquivo gerado pelo job (relatório, backup)"""
+    job = await _obter_job_autorizado(job_id, current_user)
+    resultado = job.get("resultado") or {}
+    if job["status"] != "concluido" or not isinstance(resultado, dict) or not resultado.get("arquivo_id"):
+        raise HTTPException(status_code=404, detail="Arquivo não disponível")
+    
+    stream = await fila_jobs.abrir_arquivo(resultado["arquivo_id"])
+    
+    async def gerar():
+        while True:
+            parte = await stream.readchunk()
+            if not parte:
+                break
+            yield parte
+    
+    return StreamingResponse(
+        gerar(),
+        media_type=resultado.get("media_type", "application/octet-stream"),
+        headers={"Content-Disposition": f"attachment; filename={resultado.get('filename', 'arquivo')}"}
+    )
+
+# ==================== END JOBS EM BACKGROUND ====================
+
 # Include router
 app.include_router(api_router)
 
@@ -9022,6 +8505,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["Authorization", "Content-Type"],
+    expose_headers=[HEADER_NEXT_CURSOR],
     max_age=3600,
 )
 
@@ -9035,10 +8519,14 @@ logger = logging.getLogger(__name__)
 @app.on_event("shutdown")
 async def shutdown_db_client():
     try:
-        if scheduler and hasattr(scheduler, '_eventloop') and scheduler._eventloop:
-            scheduler.shutdown(wait=False)
-    except:
-        pass
+        await agendador.parar()
+    except Exception as e:
+        logging.warning(f"⚠ Failed to stop scheduler: {e}")
+    await fila_jobs.parar()
+    await outbox.parar()
+    await ingestao_whatsapp.parar()
+    await http_clients.fechar()
+    executores.encerrar()
     client.close()
 
 @app.on_event("startup")
@@ -9059,6 +8547,109 @@ async def startup_event():
     
     logging.info("✓ Environment variables validated successfully")
 
+@app.on_event("startup")
+async def startup_indexes():
+    """Aplica o registro de índices e reporta divergências/COLLSCAN"""
+    try:
+        await aplicar_indices(db)
+        divergencias = await relatorio_indices(db)
+        for colecao, diff in divergencias.items():
+            logging.warning(f"⚠ Índices divergentes em {colecao}: {diff}")
+        await verificar_collscan(db)
+    except Exception as e:
+        # Banco indisponível no startup não deve derrubar a aplicação
+        logging.warning(f"⚠ Failed to bootstrap MongoDB indexes: {e}")
+
+@app.on_event("startup")
+async def startup_backfill_rollup():
+    """Monta o rollup mensal de transações no primeiro deploy (coleção vazia), em background"""
+    async def backfill():
+        try:
+            await executar_exclusivo(db, "reconstrucao_rollup", lambda: backfill_rollup(db))
+        except Exception as e:
+            logging.warning(f"⚠ Failed to backfill the transactions rollup: {e}")
+    asyncio.create_task(backfill())
+
+@app.on_event("startup")
+async def startup_migracao_telefones():
+    """Backfill de telefone_normalizado nos documentos que ainda não têm o campo, em background"""
+    async def migrar():
+        try:
+            await executar_exclusivo(db, "migracao_telefones", lambda: migrar_telefones(db, pendentes=True))
+        except Exception as e:
+            logging.warning(f"⚠ Failed to backfill normalized phone numbers: {e}")
+    # Enquanto roda, a ingestão do WhatsApp acha os leads antigos pelo telefone original
+    asyncio.create_task(migrar())
+
+@app.on_event("startup")
+async def startup_jobs():
+    """Inicia os workers da fila de jobs (reenfileira jobs travados de execuções anteriores)"""
+    try:
+        await fila_jobs.iniciar()
+    except Exception as e:
+        logging.warning(f"⚠ Failed to start job workers: {e}")
+
+@app.on_event("startup")
+async def startup_outbox():
+    """Inicia os senders da outbox de emails"""
+    try:
+        await outbox.iniciar()
+    except Exception as e:
+        logging.warning(f"⚠ Failed to start email outbox: {e}")
+
+@app.on_event("startup")
+async def startup_inadimplencia_scheduler():
+    """Agenda a verificação diária de inadimplentes como job da fila"""
+    if os.environ.get("INADIMPLENCIA_AGENDADA", "true").lower() not in ("1", "true", "sim"):
+        logging.info("Verificação agendada de inadimplentes desativada")
+        return
+    hora = int(os.environ.get("INADIMPLENCIA_HORA", "6"))
+    try:
+        agendador.agendar(
+            'daily_inadimplentes',
+            enfileirar_verificacao_inadimplentes,
+            CronTrigger(hour=hora, minute=0),
+            nome='Daily overdue subscription check'
+        )
+        await agendador.iniciar()
+        logging.info(f"✓ Overdue subscription check scheduled - Daily at {hora}:00")
+    except Exception as e:
+        logging.warning(f"⚠ Failed to schedule overdue subscription check: {e}")
+
+@app.on_event("startup")
+async def startup_consolidacao_saldos():
+    """Migra contas anteriores ao ledger (em background) e consolida os snapshots de saldo periodicamente"""
+    intervalo = int(os.environ.get("SALDOS_CONSOLIDACAO_MIN", "15"))
+    async def migrar():
+        try:
+            await executar_exclusivo(db, "migracao_saldos", lambda: migrar_saldos(db))
+        except Exception as e:
+            logging.warning(f"⚠ Failed to migrate account balances to the ledger: {e}")
+    # Enquanto roda, saldos e consolidação usam o saldo_atual gravado das contas sem abertura
+    asyncio.create_task(migrar())
+    try:
+        agendador.agendar(
+            'consolidar_saldos',
+            lambda: consolidar_saldos(db),
+            CronTrigger(minute=f"*/{intervalo}"),
+            nome='Balance ledger consolidation'
+        )
+        await agendador.iniciar()
+        logging.info(f"✓ Balance consolidation scheduled - every {intervalo} minutes")
+    except Exception as e:
+        logging.warning(f"⚠ Failed to schedule balance consolidation: {e}")
+
+async def enfileirar_verificacao_inadimplentes():
+    """Enfileira a verificação, a menos que uma ainda esteja na fila ou rodando"""
+    em_andamento = await fila_jobs.listar(
+        {"tipo": "verificar_inadimplentes", "status": {"$nin": STATUS_FINAIS}}, limit=1
+    )
+    if em_andamento:
+        logging.info(f"Verificação de inadimplentes já em andamento (job {em_andamento[0]['id']})")
+        return
+    job = await fila_jobs.enfileirar("verificar_inadimplentes", {}, max_tentativas=1)
+    logging.info(f"Verificação de inadimplentes enfileirada (job {job['id']})")
+
 @app.on_event("startup")
 async def startup_backup_scheduler():
     """Initialize scheduled backup on startup"""
@@ -9069,16 +8660,14 @@ async def startup_backup_scheduler():
     if os.path.exists(service_account_path):
         try:
             # Schedule daily backup at 3 AM
-            scheduler.add_job(
+            agendador.agendar(
+                'daily_backup',
                 run_scheduled_backup,
                 CronTrigger(hour=3, minute=0),
-                id='daily_backup',
-                name='Daily automated backup to Google Drive',
-                replace_existing=True
+                nome='Daily automated backup to Google Drive'
             )
-            # Start scheduler in non-blocking way
-            if not scheduler.running:
-                scheduler.start()
+            # Start scheduler (only the leader worker runs the jobs)
+            await agendador.iniciar()
             logging.info("✓ Automated backup scheduler started - Daily backups at 3:00 AM")
         except Exception as e:
             logging.warning(f"⚠ Failed to start backup scheduler: {e}")
@@ -9094,23 +8683,14 @@ async def run_scheduled_backup():
         logging.info("SCHEDULED BACKUP STARTING")
         logging.info("=" * 60)
         
-        # Export all data
-        backup_data = await export_all_data()
-        
-        # Generate filename
-        timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
-        filename = f"backup_{timestamp}.json"
-        
-        # Convert to JSON bytes
-        json_content = json.dumps(backup_data, indent=2, ensure_ascii=False).encode('utf-8')
-        file_size_mb = len(json_content) / (1024 * 1024)
-        logging.info(f"Backup file size: {file_size_mb:.2f} MB")
-        
-        # Upload to Drive
-        file_info = await upload_to_drive(json_content, filename)
+        # Export (incremental, with periodic full snapshots) and upload to Drive
+        file_info, manifesto = await backup_para_drive(MODO_AUTO)
+        file_size_mb = manifesto["tamanho_bytes"] / (1024 * 1024)
+        logging.info(f"Backup {manifesto['tipo']} size: {file_size_mb:.2f} MB ({manifesto['documentos']} documents)")
         
         # Cleanup old backups
         deleted_count = await cleanup_old_backups(keep_days=30)
+        await limpar_catalogo(db, keep_days=30)
         
         logging.info("=" * 60)
         logging.info("✓ SCHEDULED BACKUP COMPLETED")
@@ -9123,4 +8703,6 @@ async def run_scheduled_backup():
         logging.error("=" * 60)
         logging.error("✗ SCHEDULED BACKUP FAILED")
         logging.error(f"  Error: {str(e)}")
-        logging.error("=" * 60)
\ No newline at end of file
+        logging.error("=" * 60)
+        # Registrado como erro no histórico do agendador
+        raise
\ No newline at end of file
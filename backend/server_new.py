@@ -11,6 +11,8 @@ import os
 from database import db, client
 from config import API_PREFIX, UPLOAD_DIR
 from routers import all_routers
+from services.indexes import aplicar_indices, relatorio_indices, verificar_collscan
+from services.http_clients import http_clients
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -27,15 +29,13 @@ async def lifespan(app: FastAPI):
     os.makedirs(UPLOAD_DIR, exist_ok=True)
     os.makedirs(f"{UPLOAD_DIR}/apk", exist_ok=True)
     
-    # Criar índices no MongoDB
+    # Criar índices no MongoDB (registro declarativo em services/indexes.py)
     try:
-        await db.users.create_index("email", unique=True)
-        await db.users.create_index("id", unique=True)
-        await db.empresas.create_index("id", unique=True)
-        await db.ordens_servico.create_index("id", unique=True)
-        await db.ordens_servico.create_index("numero", unique=True)
-        await db.equipamentos_tecnicos.create_index("id", unique=True)
-        logger.info("✅ Índices do MongoDB criados/verificados")
+        await aplicar_indices(db)
+        divergencias = await relatorio_indices(db)
+        for colecao, diff in divergencias.items():
+            logger.warning(f"⚠️ Índices divergentes em {colecao}: {diff}")
+        await verificar_collscan(db)
     except Exception as e:
         logger.warning(f"⚠️ Erro ao criar índices: {e}")
     
@@ -43,6 +43,7 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("🛑 Encerrando ECHO SHOP Backend...")
+    await http_clients.fechar()
     client.close()
 
 # Criar app
@@ -0,0 +1,267 @@
+# Tarefas agendadas executadas uma única vez por cluster
+#
+# Cada worker do uvicorn (e cada pod) tem o seu AsyncIOScheduler, mas só o
+# líder executa as tarefas. A liderança é um lease no MongoDB (coleção
+# leases): um documento por nome, com dono e expira_em, renovado por
+# heartbeat a cada LEASE_RENOVACAO_S segundos. Se o líder morrer, o lease
+# expira em LEASE_TTL_S e outro worker assume no heartbeat seguinte.
+#
+# Uma troca de líder pode coincidir com um disparo (o antigo ainda se acha
+# líder enquanto o lease não expira), então cada execução também reivindica
+# o documento (tarefa, horário agendado) em execucoes_agendadas, cujo _id é
+# único: só um worker executa cada disparo. O mesmo documento é o histórico
+# (início, fim, duração, status, erro) e recebe heartbeats enquanto roda; uma
+# execução "rodando" sem heartbeat recente foi interrompida (worker morto).
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+LEASES_COLLECTION = "leases"
+EXECUCOES_COLLECTION = "execucoes_agendadas"
+
+STATUS_RODANDO = "rodando"
+STATUS_SUCESSO = "sucesso"
+STATUS_ERRO = "erro"
+STATUS_INTERROMPIDA = "interrompida"
+
+Tarefa = Callable[[], Awaitable[Any]]
+
+
+def _agora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def lease_ttl() -> int:
+    return int(os.environ.get("LEASE_TTL_S", "30"))
+
+
+def lease_renovacao() -> int:
+    return int(os.environ.get("LEASE_RENOVACAO_S", "10"))
+
+
+def identificador_worker() -> str:
+    """host:pid:sufixo — único por processo, legível no histórico"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class Lease:
+    """Lock com TTL no MongoDB; quem o detém precisa renová-lo antes de expirar"""
+
+    def __init__(self, db, nome: str, dono: Optional[str] = None, ttl: Optional[int] = None):
+        self.db = db
+        self.nome = nome
+        self.dono = dono or identificador_worker()
+        self.ttl = ttl or lease_ttl()
+
+    async def adquirir(self) -> bool:
+        """Adquire (ou renova, se já for o dono) o lease; False se outro o detém"""
+        agora = _agora()
+        try:
+            await self.db[LEASES_COLLECTION].find_one_and_update(
+                {"_id": self.nome, "$or": [{"dono": self.dono}, {"expira_em": {"$lte": agora}}]},
+                {"$set": {"dono": self.dono, "expira_em": agora + timedelta(seconds=self.ttl), "renovado_em": agora}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            return True
+        except DuplicateKeyError:
+            # O documento existe, com outro dono e ainda válido
+            return False
+
+    async def liberar(self) -> None:
+        await self.db[LEASES_COLLECTION].delete_one({"_id": self.nome, "dono": self.dono})
+
+
+async def executar_exclusivo(db, nome: str, func: Tarefa) -> Optional[Any]:
+    """Executa func segurando o lease `nome` (renovado enquanto roda); None se outro worker já o detém.
+
+    Para migrações de startup: com vários workers subindo juntos, só um as executa.
+    """
+    lease = Lease(db, nome)
+    intervalo = lease_renovacao()
+    if not await lease.adquirir():
+        logger.info(f"{nome} já em execução em outro worker")
+        return None
+
+    async def renovar():
+        while True:
+            await asyncio.sleep(intervalo)
+            await lease.adquirir()
+
+    renovacao = asyncio.create_task(renovar())
+    try:
+        return await func()
+    finally:
+        renovacao.cancel()
+        await lease.liberar()
+
+
+class Eleicao:
+    """Mantém (ou disputa) a liderança de um lease com heartbeats em background"""
+
+    def __init__(self, db, nome: str = "agendador", ttl: Optional[int] = None, renovacao: Optional[int] = None):
+        self.lease = Lease(db, nome, ttl=ttl)
+        self.renovacao = renovacao or lease_renovacao()
+        self._lider = False
+        self._renovado_em = 0.0
+        self._tarefa: Optional[asyncio.Task] = None
+
+    @property
+    def e_lider(self) -> bool:
+        # Sem renovação dentro do TTL (loop travado), o lease pode já ser de outro
+        return self._lider and time.monotonic() - self._renovado_em < self.lease.ttl
+
+    @property
+    def dono(self) -> str:
+        return self.lease.dono
+
+    async def verificar(self) -> bool:
+        """Um heartbeat: tenta adquirir/renovar e atualiza o estado"""
+        try:
+            lider = await self.lease.adquirir()
+        except PyMongoError as e:
+            # Sem banco não dá para provar a liderança
+            logger.warning(f"⚠️ Falha ao renovar o lease {self.lease.nome}: {e}")
+            lider = False
+        if lider != self._lider:
+            logger.info(f"{'✅ Assumiu' if lider else '⚠️ Perdeu'} a liderança de {self.lease.nome} ({self.dono})")
+        if lider:
+            self._renovado_em = time.monotonic()
+        self._lider = lider
+        return lider
+
+    async def iniciar(self) -> None:
+        if self._tarefa is None:
+            await self.verificar()
+            self._tarefa = asyncio.create_task(self._loop())
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.renovacao)
+            await self.verificar()
+
+    async def parar(self) -> None:
+        if self._tarefa:
+            self._tarefa.cancel()
+            try:
+                await self._tarefa
+            except asyncio.CancelledError:
+                pass
+            self._tarefa = None
+        if self._lider:
+            # Outro worker assume sem esperar o TTL
+            await self.lease.liberar()
+            self._lider = False
+
+
+class Agendador:
+    """AsyncIOScheduler cujas tarefas só rodam no líder, uma vez por disparo, com histórico"""
+
+    def __init__(self, db, scheduler, eleicao: Optional[Eleicao] = None):
+        self.db = db
+        self.scheduler = scheduler
+        self.eleicao = eleicao or Eleicao(db)
+        self._tarefas: Dict[str, Tarefa] = {}
+
+    def agendar(self, tarefa_id: str, func: Tarefa, trigger, nome: Optional[str] = None) -> None:
+        self._tarefas[tarefa_id] = func
+        self.scheduler.add_job(
+            self.executar, trigger, args=[tarefa_id], id=tarefa_id, name=nome or tarefa_id, replace_existing=True
+        )
+
+    async def iniciar(self) -> None:
+        await self.eleicao.iniciar()
+        if not self.scheduler.running:
+            self.scheduler.start()
+
+    async def parar(self) -> None:
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        await self.eleicao.parar()
+
+    async def executar(self, tarefa_id: str, agendado_para: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+        """Executa a tarefa se este worker for o líder e ninguém tiver reivindicado o disparo.
+
+        agendado_para identifica o disparo; por padrão, o minuto atual (os
+        triggers são cron, com resolução de minuto).
+        """
+        if not self.eleicao.e_lider:
+            return None
+        agendado_para = agendado_para or _agora().replace(second=0, microsecond=0)
+        agora = _agora()
+        execucao = {
+            "_id": f"{tarefa_id}:{agendado_para.isoformat()}",
+            "tarefa": tarefa_id,
+            "agendado_para": agendado_para,
+            "dono": self.eleicao.dono,
+            "status": STATUS_RODANDO,
+            "inicio": agora,
+            "heartbeat_em": agora,
+        }
+        try:
+            await self.db[EXECUCOES_COLLECTION].insert_one(execucao)
+        except DuplicateKeyError:
+            logger.info(f"Tarefa {tarefa_id} de {agendado_para.isoformat()} já executada por outro worker")
+            return None
+
+        heartbeat = asyncio.create_task(self._heartbeat(execucao["_id"]))
+        inicio = time.perf_counter()
+        resultado: Dict[str, Any] = {"status": STATUS_SUCESSO, "erro": None}
+        try:
+            await self._tarefas[tarefa_id]()
+        except Exception as e:
+            logger.exception(f"Tarefa agendada {tarefa_id} falhou")
+            resultado = {"status": STATUS_ERRO, "erro": str(e)}
+        finally:
+            heartbeat.cancel()
+            resultado.update({"fim": _agora(), "duracao_s": round(time.perf_counter() - inicio, 3)})
+            await self.db[EXECUCOES_COLLECTION].update_one({"_id": execucao["_id"]}, {"$set": resultado})
+        logger.info(f"✅ Tarefa {tarefa_id}: {resultado['status']} em {resultado['duracao_s']}s")
+        return {**execucao, **resultado}
+
+    async def _heartbeat(self, execucao_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.eleicao.renovacao)
+            try:
+                await self.db[EXECUCOES_COLLECTION].update_one(
+                    {"_id": execucao_id}, {"$set": {"heartbeat_em": _agora()}}
+                )
+            except PyMongoError as e:
+                logger.warning(f"⚠️ Falha no heartbeat da execução {execucao_id}: {e}")
+
+    async def historico(self, tarefa_id: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """Execuções mais recentes; "rodando" sem heartbeat dentro do TTL aparece como interrompida"""
+        filtro = {"tarefa": tarefa_id} if tarefa_id else {}
+        limite_heartbeat = _agora() - timedelta(seconds=self.eleicao.lease.ttl)
+        execucoes = await self.db[EXECUCOES_COLLECTION].find(filtro).sort("inicio", -1).to_list(limit)
+        for execucao in execucoes:
+            execucao["id"] = execucao.pop("_id")
+            heartbeat = execucao.get("heartbeat_em")
+            if heartbeat is not None and heartbeat.tzinfo is None:
+                heartbeat = heartbeat.replace(tzinfo=timezone.utc)
+            if execucao["status"] == STATUS_RODANDO and heartbeat and heartbeat < limite_heartbeat:
+                execucao["status"] = STATUS_INTERROMPIDA
+        return execucoes
+
+    async def estado(self) -> Dict[str, Any]:
+        lease = await self.db[LEASES_COLLECTION].find_one({"_id": self.eleicao.lease.nome})
+        return {
+            "worker": self.eleicao.dono,
+            "lider": self.eleicao.e_lider,
+            "lider_atual": lease.get("dono") if lease else None,
+            "lease_expira_em": lease.get("expira_em") if lease else None,
+            "tarefas": [
+                {"id": job.id, "nome": job.name, "proxima_execucao": job.next_run_time}
+                for job in self.scheduler.get_jobs()
+            ],
+        }
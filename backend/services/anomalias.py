@@ -0,0 +1,270 @@
+# Detecção de despesas anômalas (GET /ai/anomalias)
+#
+# As despesas do período viram um DataFrame e as estatísticas saem de um
+# groupby por categoria (e por fornecedor): mediana e MAD (desvio absoluto
+# mediano), robustos a poucos valores extremos, que inflariam média e desvio
+# padrão justamente nas categorias com anomalias. O escore de cada transação
+# é z = (valor - mediana) / (1.4826 * MAD), comparável a "desvios padrão";
+# com MAD zero (maioria dos valores iguais) usa o desvio padrão.
+#
+# Com janela_dias, cada transação é comparada só com as da mesma categoria nos
+# N dias anteriores a ela (medianas móveis), o que acompanha mudanças de
+# patamar (reajuste de aluguel, troca de fornecedor).
+#
+# As análises ficam em cache por empresa (ANOMALIAS_TTL_S). Uma despesa nova
+# é pontuada contra as linhas de base em cache (registrar), sem reler o
+# período; exclusões descartam o cache da empresa.
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from cachetools import TTLCache
+
+from services.executores import executores
+
+COLUNAS = ["id", "data_competencia", "fornecedor", "valor_total", "categoria_id"]
+SEM_CATEGORIA = "sem_categoria"
+# MAD -> desvio padrão equivalente em uma distribuição normal
+ESCALA_MAD = 1.4826
+MINIMO_AMOSTRAS = 3
+DIAS_PADRAO = 60
+
+TIPO_CATEGORIA = "valor_acima_media"
+TIPO_FORNECEDOR = "valor_acima_fornecedor"
+# chave do groupby -> tipo de alerta
+CHAVES = {"categoria_id": TIPO_CATEGORIA, "fornecedor": TIPO_FORNECEDOR}
+
+
+def limiar_z() -> float:
+    """Limiar padrão do escore (ANOMALIAS_LIMIAR_Z), lido a cada análise"""
+    return float(os.environ.get("ANOMALIAS_LIMIAR_Z", "2.0"))
+
+
+def dataframe_despesas(transacoes: List[Dict[str, Any]]) -> pd.DataFrame:
+    df = pd.DataFrame.from_records(transacoes, columns=COLUNAS)
+    df["categoria_id"] = df["categoria_id"].fillna(SEM_CATEGORIA)
+    df["fornecedor"] = df["fornecedor"].fillna("").astype(str).str.strip()
+    df["valor_total"] = pd.to_numeric(df["valor_total"], errors="coerce")
+    return df.dropna(subset=["valor_total"]).reset_index(drop=True)
+
+
+def calcular_baselines(df: pd.DataFrame, chave: str, minimo: int = MINIMO_AMOSTRAS) -> pd.DataFrame:
+    """n, mediana, MAD, média e escala por grupo, em uma passada de groupby"""
+    valores = df[chave] if chave != "fornecedor" else df[chave].where(df[chave] != "")
+    grupos = df["valor_total"].groupby(valores, sort=False)
+    mediana = grupos.transform("median")
+    base = pd.DataFrame({
+        "n": grupos.size(),
+        "mediana": grupos.median(),
+        "mad": (df["valor_total"] - mediana).abs().groupby(valores, sort=False).median(),
+        "media": grupos.mean(),
+        "desvio": grupos.std(ddof=1),
+    })
+    base["escala"] = np.where(base["mad"] > 0, ESCALA_MAD * base["mad"], base["desvio"].fillna(0))
+    return base[(base["n"] >= minimo) & (base["escala"] > 0)]
+
+
+def _escores(valores: np.ndarray, mediana: np.ndarray, escala: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (valores - mediana) / escala
+    z[~np.isfinite(z)] = np.nan
+    return z
+
+
+def pontuar(df: pd.DataFrame, base: pd.DataFrame, chave: str) -> Tuple[np.ndarray, np.ndarray]:
+    """(z, média do grupo) de cada linha contra as linhas de base do grupo"""
+    alinhado = base.reindex(df[chave])
+    z = _escores(df["valor_total"].to_numpy(float), alinhado["mediana"].to_numpy(float), alinhado["escala"].to_numpy(float))
+    return z, alinhado["media"].to_numpy(float)
+
+
+def pontuar_janela(df: pd.DataFrame, chave: str, dias: int, minimo: int = MINIMO_AMOSTRAS) -> Tuple[np.ndarray, np.ndarray]:
+    """(z, média móvel) de cada linha contra as do mesmo grupo nos `dias` anteriores.
+
+    O MAD móvel é a mediana móvel de |valor - mediana móvel da própria linha|,
+    uma aproximação que evita recalcular a mediana de cada janela duas vezes.
+    """
+    datas = pd.to_datetime(df["data_competencia"].astype(str).str[:10], errors="coerce")
+    ordenado = df.assign(_data=datas, _linha=np.arange(len(df))).dropna(subset=["_data"])
+    if chave == "fornecedor":
+        ordenado = ordenado[ordenado["fornecedor"] != ""]
+    ordenado = ordenado.sort_values([chave, "_data"], kind="stable").set_index("_data")
+    # Array (não Series): o índice de datas tem repetições
+    grupos = ordenado[chave].to_numpy()
+
+    def movel(serie: pd.Series, funcao: str) -> np.ndarray:
+        janela = serie.groupby(grupos, sort=True).rolling(f"{dias}D", closed="left")
+        return getattr(janela, funcao)().to_numpy(float)
+
+    valores = ordenado["valor_total"]
+    n = movel(valores, "count")
+    mediana = movel(valores, "median")
+    media = movel(valores, "mean")
+    mad = movel((valores - mediana).abs(), "median")
+    escala = np.where(mad > 0, ESCALA_MAD * mad, movel(valores, "std"))
+    z = _escores(valores.to_numpy(float), mediana, escala)
+    z[n < minimo] = np.nan
+
+    # De volta à ordem original do DataFrame
+    z_df = np.full(len(df), np.nan)
+    media_df = np.full(len(df), np.nan)
+    z_df[ordenado["_linha"].to_numpy()] = z
+    media_df[ordenado["_linha"].to_numpy()] = media
+    return z_df, media_df
+
+
+def _alerta(linha: Dict[str, Any], z: float, media: float, tipo: str) -> Dict[str, Any]:
+    return {
+        "transacao_id": linha["id"],
+        "data": linha["data_competencia"],
+        "fornecedor": linha["fornecedor"],
+        "valor": linha["valor_total"],
+        "categoria_id": linha["categoria_id"],
+        "media_categoria": round(float(media), 2),
+        "desvio": round(float(z), 2),
+        "tipo_alerta": tipo,
+    }
+
+
+def detectar(
+    df: pd.DataFrame,
+    limiar: Optional[float] = None,
+    por_fornecedor: bool = True,
+    janela_dias: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Anomalias do DataFrame e as linhas de base por grupo (para pontuar despesas novas)
+
+    Uma transação acima do limiar na categoria e no fornecedor gera um único
+    alerta, o de maior escore.
+    """
+    limiar = limiar_z() if limiar is None else limiar
+    chaves = list(CHAVES) if por_fornecedor else ["categoria_id"]
+    melhores: Dict[int, Tuple[float, float, str]] = {}
+    baselines: Dict[str, Dict[Any, Tuple[int, float, float, float]]] = {}
+
+    if janela_dias:
+        # Despesas novas são comparadas com a última janela do período
+        datas = pd.to_datetime(df["data_competencia"].astype(str).str[:10], errors="coerce")
+        recentes = df[datas > datas.max() - pd.Timedelta(days=janela_dias)]
+
+    for chave in chaves:
+        if janela_dias:
+            z, media = pontuar_janela(df, chave, janela_dias)
+            base = calcular_baselines(recentes, chave)
+        else:
+            base = calcular_baselines(df, chave)
+            z, media = pontuar(df, base, chave)
+        baselines[chave] = dict(zip(base.index, zip(
+            base["n"].astype(int).tolist(), base["mediana"].tolist(), base["escala"].tolist(), base["media"].tolist()
+        )))
+        for i in np.flatnonzero(z > limiar):
+            if i not in melhores or z[i] > melhores[i][0]:
+                melhores[i] = (z[i], media[i], CHAVES[chave])
+
+    linhas = df.iloc[list(melhores)].to_dict("records") if melhores else []
+    anomalias = [_alerta(linha, *melhores[i]) for i, linha in zip(melhores, linhas)]
+    anomalias.sort(key=lambda a: a["desvio"], reverse=True)
+    return {"anomalias": anomalias, "baselines": baselines, "transacoes": len(df)}
+
+
+def _detectar_transacoes(transacoes: List[Dict[str, Any]], *args) -> Dict[str, Any]:
+    return detectar(dataframe_despesas(transacoes), *args)
+
+
+def pontuar_transacao(
+    transacao: Dict[str, Any],
+    baselines: Dict[str, Dict[Any, Tuple[int, float, float, float]]],
+    limiar: Optional[float] = None,
+) -> Optional[Dict[str, Any]]:
+    """Alerta para uma despesa nova contra linhas de base já calculadas (O(1))"""
+    limiar = limiar_z() if limiar is None else limiar
+    linha = dataframe_despesas([transacao]).to_dict("records")
+    if not linha:
+        return None
+    linha = linha[0]
+    melhor = None
+    for chave, grupos in baselines.items():
+        base = grupos.get(linha[chave])
+        if base is None:
+            continue
+        _, mediana, escala, media = base
+        z = (linha["valor_total"] - mediana) / escala
+        if z > limiar and (melhor is None or z > melhor[0]):
+            melhor = (z, media, CHAVES[chave])
+    return _alerta(linha, *melhor) if melhor else None
+
+
+class MotorAnomalias:
+    """Análises de anomalias em cache por (empresa, parâmetros), atualizadas a cada despesa nova"""
+
+    def __init__(self, maxsize: int = 500, ttl: Optional[int] = None):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl or int(os.environ.get("ANOMALIAS_TTL_S", "600")))
+        self.hits = 0
+        self.misses = 0
+        self.incrementais = 0
+
+    async def analisar(
+        self,
+        db,
+        empresa_id: str,
+        dias: int = DIAS_PADRAO,
+        limiar: Optional[float] = None,
+        por_fornecedor: bool = True,
+        janela_dias: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        limiar = limiar_z() if limiar is None else limiar
+        chave = (empresa_id, dias, limiar, por_fornecedor, janela_dias)
+        analise = self._cache.get(chave)
+        if analise is not None:
+            self.hits += 1
+            return analise
+
+        self.misses += 1
+        desde = (datetime.now(timezone.utc) - timedelta(days=dias)).strftime("%Y-%m-%d")
+        transacoes = await db.transacoes.find(
+            {"empresa_id": empresa_id, "tipo": "despesa", "data_competencia": {"$gte": desde}},
+            {"_id": 0, **{c: 1 for c in COLUNAS}}
+        ).to_list(None)
+        analise = await executores.thread(
+            _detectar_transacoes, transacoes, limiar, por_fornecedor, janela_dias, nome="anomalias"
+        )
+        analise.update({"desde": desde, "limiar": limiar})
+        self._cache[chave] = analise
+        return analise
+
+    def registrar(self, empresa_id: str, transacao: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Pontua uma despesa recém-criada nas análises em cache da empresa; devolve o alerta, se houver"""
+        if transacao.get("tipo") != "despesa":
+            return None
+        alerta = None
+        for chave, analise in list(self._cache.items()):
+            if chave[0] != empresa_id or str(transacao.get("data_competencia", ""))[:10] < analise["desde"]:
+                continue
+            alerta_analise = pontuar_transacao(transacao, analise["baselines"], analise["limiar"])
+            analise["transacoes"] += 1
+            if alerta_analise:
+                analise["anomalias"].append(alerta_analise)
+                analise["anomalias"].sort(key=lambda a: a["desvio"], reverse=True)
+                alerta = alerta_analise
+            self.incrementais += 1
+        return alerta
+
+    def invalidar(self, empresa_id: str) -> None:
+        for chave in [k for k in list(self._cache.keys()) if k[0] == empresa_id]:
+            self._cache.pop(chave, None)
+
+    def estatisticas(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "itens": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "incrementais": self.incrementais,
+            "hit_rate": round(self.hits / total, 4) if total else 0
+        }
+
+
+# Instância compartilhada pelas rotas de transações e de IA
+motor_anomalias = MotorAnomalias()
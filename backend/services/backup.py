@@ -0,0 +1,389 @@
+# Backup do banco em streaming
+#
+# Formato: um .tar com um membro por coleção (<colecao>.ndjson.gz, um
+# documento por linha em Extended JSON relaxado, que preserva ObjectId e
+# datas) e, por último, manifest.json com a quantidade de documentos, o
+# sha256 do NDJSON (sem compressão) e os tamanhos de cada coleção.
+#
+# Cada coleção é lida do cursor em lotes e comprimida num SpooledTemporaryFile
+# (memória até LIMITE_MEMORIA, disco acima disso) antes de entrar no tar, que
+# também é um arquivo temporário. A memória usada não depende do tamanho do
+# banco; o arquivo final pode ser enviado em partes (download), por upload
+# resumível (Drive) ou gravado no GridFS (jobs).
+#
+# Compressão: gzip (padrão) ou zstd, se o pacote zstandard estiver instalado
+# (BACKUP_COMPRESSAO=zstd).
+#
+# Backups incrementais: cada backup enviado ao Drive entra em backup_catalogo
+# com um high-water mark (HWM) por coleção. O incremental seguinte exporta só
+# os documentos com _id, updated_at ou created_at posteriores ao HWM (menos
+# MARGEM_HWM) e as exclusões registradas pelas rotas de delete em
+# backup_tombstones (membro _tombstones). Updates que não tocam updated_at só
+# entram no próximo completo, feito a cada BACKUP_COMPLETO_A_CADA_DIAS dias ou
+# depois de BACKUP_MAX_INCREMENTAIS incrementais (modo "auto").
+# A restauração aplica a cadeia completo → incrementais (services/restauracao.py).
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import tarfile
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from bson import ObjectId, json_util
+
+from services.email_outbox import OUTBOX_COLLECTION
+from services.executores import executores
+from services.jobs import ARQUIVOS_BUCKET, JOBS_COLLECTION
+from services.rollup import ROLLUP_COLLECTION
+from services.sequencias import SEQUENCES_COLLECTION
+
+try:
+    import zstandard
+except ImportError:  # opcional
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+FORMATO = "echoshop-backup"
+VERSAO_FORMATO = 1
+MANIFESTO = "manifest.json"
+MEDIA_TYPE_BACKUP = "application/x-tar"
+
+EXTENSOES = {"gzip": ".ndjson.gz", "zstd": ".ndjson.zst"}
+
+CATALOGO_COLLECTION = "backup_catalogo"
+TOMBSTONES_COLLECTION = "backup_tombstones"
+MEMBRO_TOMBSTONES = "_tombstones"
+
+TIPO_COMPLETO = "completo"
+TIPO_INCREMENTAL = "incremental"
+MODO_AUTO = "auto"
+
+# Escritas em andamento durante o backup anterior entram de novo (restaurar é idempotente)
+MARGEM_HWM = timedelta(minutes=5)
+
+TAMANHO_LOTE = 1000
+LIMITE_MEMORIA = 8 * 1024 * 1024
+
+# Dados operacionais ou derivados (reconstruíveis) ficam fora do backup
+COLECOES_IGNORADAS = {
+    JOBS_COLLECTION,
+    f"{ARQUIVOS_BUCKET}.files",
+    f"{ARQUIVOS_BUCKET}.chunks",
+    OUTBOX_COLLECTION,
+    ROLLUP_COLLECTION,
+    SEQUENCES_COLLECTION,
+    CATALOGO_COLLECTION,
+    TOMBSTONES_COLLECTION,
+}
+
+JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS
+
+# Coleções de staging da restauração e originais guardadas durante a troca (services/restauracao.py)
+PREFIXO_STAGING = "_restauracao."
+PREFIXO_ANTERIOR = "_restauracao_anterior."
+
+Progresso = Callable[[float, str], Awaitable[None]]
+
+
+def compressao_padrao() -> str:
+    compressao = os.environ.get("BACKUP_COMPRESSAO", "gzip").lower()
+    if compressao == "zstd" and zstandard is None:
+        logger.warning("⚠️ BACKUP_COMPRESSAO=zstd sem o pacote zstandard; usando gzip")
+        return "gzip"
+    return compressao if compressao in EXTENSOES else "gzip"
+
+
+def _agora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def nome_arquivo(timestamp: Optional[str] = None, prefixo: str = "backup_echoshop") -> str:
+    timestamp = timestamp or datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+    return f"{prefixo}_{timestamp}.tar"
+
+
+async def colecoes_para_backup(db) -> List[str]:
+    nomes = await db.list_collection_names()
+    return sorted(
+        n for n in nomes
+        if not n.startswith(("system.", PREFIXO_STAGING, PREFIXO_ANTERIOR)) and n not in COLECOES_IGNORADAS
+    )
+
+
+def serializar(docs: List[Dict[str, Any]]) -> bytes:
+    """Documentos como NDJSON; o sha256 do manifesto é calculado sobre estes bytes"""
+    return "".join(
+        json_util.dumps(doc, json_options=JSON_OPTIONS, ensure_ascii=False) + "\n" for doc in docs
+    ).encode("utf-8")
+
+
+class _EscritorColecao:
+    """NDJSON comprimido num arquivo temporário, com contagem e sha256 do conteúdo"""
+
+    def __init__(self, compressao: str):
+        self.arquivo = tempfile.SpooledTemporaryFile(max_size=LIMITE_MEMORIA)
+        if compressao == "zstd":
+            self._saida = zstandard.ZstdCompressor(level=3).stream_writer(self.arquivo, closefd=False)
+        else:
+            self._saida = gzip.GzipFile(fileobj=self.arquivo, mode="wb", compresslevel=6, mtime=0)
+        self.sha256 = hashlib.sha256()
+        self.documentos = 0
+        self.bytes = 0
+
+    def escrever(self, docs: List[Dict[str, Any]]) -> None:
+        linhas = serializar(docs)
+        self.sha256.update(linhas)
+        self._saida.write(linhas)
+        self.documentos += len(docs)
+        self.bytes += len(linhas)
+
+    def finalizar(self) -> int:
+        """Fecha o compressor e posiciona o arquivo no início; retorna o tamanho comprimido"""
+        self._saida.close()
+        tamanho = self.arquivo.tell()
+        self.arquivo.seek(0)
+        return tamanho
+
+
+def _adicionar_membro(tar: tarfile.TarFile, nome: str, arquivo, tamanho: int) -> None:
+    info = tarfile.TarInfo(nome)
+    info.size = tamanho
+    info.mtime = int(time.time())
+    tar.addfile(info, arquivo)
+
+
+async def exportar_colecao(
+    db,
+    nome: str,
+    tar: tarfile.TarFile,
+    compressao: str,
+    filtro: Optional[Dict[str, Any]] = None,
+    membro: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Escreve a coleção (ou os documentos do filtro) como membro do tar e retorna a entrada do manifesto"""
+    escritor = _EscritorColecao(compressao)
+    try:
+        lote: List[Dict[str, Any]] = []
+        async for doc in db[nome].find(filtro or {}).sort("_id", 1).batch_size(TAMANHO_LOTE):
+            lote.append(doc)
+            if len(lote) >= TAMANHO_LOTE:
+                await executores.thread(escritor.escrever, lote, nome="backup")
+                lote = []
+        if lote:
+            await executores.thread(escritor.escrever, lote, nome="backup")
+
+        tamanho = await executores.thread(escritor.finalizar, nome="backup")
+        membro = (membro or nome) + EXTENSOES[compressao]
+        await executores.thread(_adicionar_membro, tar, membro, escritor.arquivo, tamanho, nome="backup")
+    finally:
+        escritor.arquivo.close()
+
+    return {
+        "arquivo": membro,
+        "documentos": escritor.documentos,
+        "sha256": escritor.sha256.hexdigest(),
+        "bytes": escritor.bytes,
+        "bytes_comprimidos": tamanho,
+    }
+
+
+def filtro_incremental(desde: datetime) -> Dict[str, Any]:
+    """Documentos criados/alterados desde `desde` (datas gravadas como datetime ou string ISO)"""
+    iso = desde.isoformat()
+    return {"$or": [
+        {"_id": {"$gte": ObjectId.from_datetime(desde)}},
+        {"updated_at": {"$gte": desde}},
+        {"updated_at": {"$gte": iso}},
+        {"created_at": {"$gte": desde}},
+        {"created_at": {"$gte": iso}},
+    ]}
+
+
+async def registrar_exclusao(db, colecao: str, filtro: Dict[str, Any]) -> None:
+    """Tombstone de um delete (filtro usado na exclusão) para os backups incrementais"""
+    await db[TOMBSTONES_COLLECTION].insert_one({"colecao": colecao, "filtro": filtro, "excluido_em": _agora().isoformat()})
+
+
+async def planejar_backup(db, modo: str = MODO_AUTO) -> Dict[str, Any]:
+    """Decide entre completo e incremental e, no incremental, de onde partir (HWM por coleção)"""
+    completo = {"tipo": TIPO_COMPLETO, "base_id": None, "anterior_id": None, "sequencia": 0, "hwm": {}}
+    if modo == TIPO_COMPLETO:
+        return completo
+
+    base = await db[CATALOGO_COLLECTION].find_one({"tipo": TIPO_COMPLETO}, {"_id": 0}, sort=[("criado_em", -1)])
+    if not base:
+        return completo
+    ultimo = await db[CATALOGO_COLLECTION].find_one(
+        {"$or": [{"id": base["id"]}, {"base_id": base["id"]}]}, {"_id": 0}, sort=[("sequencia", -1)]
+    )
+
+    if modo == MODO_AUTO:
+        dias = int(os.environ.get("BACKUP_COMPLETO_A_CADA_DIAS", "7"))
+        max_incrementais = int(os.environ.get("BACKUP_MAX_INCREMENTAIS", "30"))
+        idade = _agora() - datetime.fromisoformat(base["criado_em"])
+        if idade >= timedelta(days=dias) or ultimo["sequencia"] >= max_incrementais:
+            return completo
+
+    return {
+        "tipo": TIPO_INCREMENTAL,
+        "base_id": base["id"],
+        "anterior_id": ultimo["id"],
+        "sequencia": ultimo["sequencia"] + 1,
+        "hwm": ultimo.get("hwm", {}),
+    }
+
+
+async def gerar_backup(
+    db,
+    colecoes: Optional[Sequence[str]] = None,
+    compressao: Optional[str] = None,
+    progresso: Optional[Progresso] = None,
+    modo: str = TIPO_COMPLETO,
+) -> Tuple[tempfile.SpooledTemporaryFile, Dict[str, Any]]:
+    """Backup em streaming: (arquivo .tar posicionado no início, manifesto).
+
+    modo: "completo", "incremental" (desde o último backup do catálogo) ou
+    "auto" (incremental, com completo periódico). O backup só entra na cadeia
+    depois de registrar_backup(), chamado quando o arquivo estiver guardado.
+    Quem chama é responsável por fechar o arquivo.
+    """
+    compressao = compressao or compressao_padrao()
+    colecoes = list(colecoes) if colecoes is not None else await colecoes_para_backup(db)
+    plano = await planejar_backup(db, modo)
+    iniciado_em = _agora()
+    inicio = time.perf_counter()
+
+    manifesto: Dict[str, Any] = {
+        "formato": FORMATO,
+        "versao": VERSAO_FORMATO,
+        "id": str(uuid.uuid4()),
+        "tipo": plano["tipo"],
+        "base_id": plano["base_id"],
+        "anterior_id": plano["anterior_id"],
+        "sequencia": plano["sequencia"],
+        "backup_date": iniciado_em.isoformat(),
+        "database": db.name,
+        "compressao": compressao,
+        "colecoes": {},
+    }
+
+    saida = tempfile.SpooledTemporaryFile(max_size=LIMITE_MEMORIA * 4)
+    try:
+        tar = tarfile.open(fileobj=saida, mode="w")
+        for i, nome in enumerate(colecoes):
+            if progresso:
+                await progresso(95 * i / max(len(colecoes), 1), f"Exportando {nome} ({i + 1}/{len(colecoes)})")
+            filtro = None
+            if plano["tipo"] == TIPO_INCREMENTAL and plano["hwm"].get(nome):
+                # Coleção nova na cadeia (sem HWM) vai inteira
+                filtro = filtro_incremental(datetime.fromisoformat(plano["hwm"][nome]))
+            entrada = await exportar_colecao(db, nome, tar, compressao, filtro)
+            entrada["incremental"] = filtro is not None
+            manifesto["colecoes"][nome] = entrada
+            logger.info(f"Exported {entrada['documentos']} documents from {nome}")
+
+        if plano["tipo"] == TIPO_INCREMENTAL:
+            anterior = await db[CATALOGO_COLLECTION].find_one({"id": plano["anterior_id"]}, {"_id": 0, "criado_em": 1})
+            desde = datetime.fromisoformat(anterior["criado_em"]) - MARGEM_HWM
+            manifesto["tombstones"] = await exportar_colecao(
+                db, TOMBSTONES_COLLECTION, tar, compressao,
+                filtro={"excluido_em": {"$gte": desde.isoformat()}}, membro=MEMBRO_TOMBSTONES
+            )
+
+        manifesto["documentos"] = sum(c["documentos"] for c in manifesto["colecoes"].values())
+        manifesto["duracao_s"] = round(time.perf_counter() - inicio, 2)
+        conteudo = json.dumps(manifesto, indent=2, ensure_ascii=False).encode("utf-8")
+        _adicionar_membro(tar, MANIFESTO, io.BytesIO(conteudo), len(conteudo))
+        tar.close()
+    except Exception:
+        saida.close()
+        raise
+
+    manifesto["tamanho_bytes"] = saida.tell()
+    saida.seek(0)
+    logger.info(
+        f"✅ Backup {manifesto['tipo']} gerado: {len(colecoes)} coleções, {manifesto['documentos']} documentos, "
+        f"{manifesto['tamanho_bytes'] / (1024 * 1024):.2f} MB em {manifesto['duracao_s']}s"
+    )
+    return saida, manifesto
+
+
+async def registrar_backup(db, manifesto: Dict[str, Any], destino: Dict[str, Any]) -> Dict[str, Any]:
+    """Coloca o backup guardado em `destino` na cadeia e avança os HWMs"""
+    iniciado_em = datetime.fromisoformat(manifesto["backup_date"])
+    hwm = (iniciado_em - MARGEM_HWM).isoformat()
+    entrada = {
+        "id": manifesto["id"],
+        "tipo": manifesto["tipo"],
+        "base_id": manifesto["base_id"],
+        "anterior_id": manifesto["anterior_id"],
+        "sequencia": manifesto["sequencia"],
+        "criado_em": manifesto["backup_date"],
+        "hwm": {nome: hwm for nome in manifesto["colecoes"]},
+        "documentos": manifesto["documentos"],
+        "tamanho_bytes": manifesto.get("tamanho_bytes"),
+        "destino": destino,
+    }
+    await db[CATALOGO_COLLECTION].insert_one(dict(entrada))
+    if manifesto["tipo"] == TIPO_COMPLETO:
+        # Exclusões anteriores ao completo já estão refletidas nele
+        await db[TOMBSTONES_COLLECTION].delete_many({"excluido_em": {"$lt": hwm}})
+    return entrada
+
+
+async def cadeia_ate(db, backup_id: str) -> List[Dict[str, Any]]:
+    """Entradas do catálogo do completo-base até `backup_id`, na ordem de aplicação"""
+    cadeia = []
+    atual = await db[CATALOGO_COLLECTION].find_one({"id": backup_id}, {"_id": 0})
+    while atual:
+        cadeia.append(atual)
+        if atual["tipo"] == TIPO_COMPLETO:
+            return list(reversed(cadeia))
+        atual = await db[CATALOGO_COLLECTION].find_one({"id": atual["anterior_id"]}, {"_id": 0})
+    raise ValueError(f"Cadeia do backup {backup_id} incompleta")
+
+
+async def limpar_catalogo(db, keep_days: int = 30) -> int:
+    """Remove do catálogo as entradas cujos arquivos já foram apagados do Drive"""
+    limite = (_agora() - timedelta(days=keep_days)).isoformat()
+    resultado = await db[CATALOGO_COLLECTION].delete_many({"criado_em": {"$lt": limite}})
+    return resultado.deleted_count
+
+
+# ---------- leitura ----------
+
+def ler_manifesto(tar: tarfile.TarFile) -> Dict[str, Any]:
+    manifesto = json.load(tar.extractfile(MANIFESTO))
+    if manifesto.get("formato") != FORMATO:
+        raise ValueError("Arquivo não é um backup do sistema")
+    return manifesto
+
+
+def iterar_linhas(tar: tarfile.TarFile, membro: str, compressao: str) -> Iterator[bytes]:
+    """Linhas NDJSON (bytes, com o \\n) de um membro do backup, sem decodificar"""
+    bruto = tar.extractfile(membro)
+    if compressao == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Backup em zstd requer o pacote zstandard")
+        fluxo = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(bruto))
+    else:
+        fluxo = gzip.GzipFile(fileobj=bruto, mode="rb")
+    yield from fluxo
+
+
+def decodificar(linha: bytes) -> Dict[str, Any]:
+    return json_util.loads(linha, json_options=JSON_OPTIONS)
+
+
+def iterar_documentos(tar: tarfile.TarFile, membro: str, compressao: str) -> Iterator[Dict[str, Any]]:
+    """Documentos de um membro do backup, um por vez"""
+    for linha in iterar_linhas(tar, membro, compressao):
+        if linha.strip():
+            yield decodificar(linha)
@@ -0,0 +1,223 @@
+# Métricas do CRM (dashboard) em uma única agregação
+#
+# Um $facet sobre os leads da empresa (índice empresa_id) produz todos os
+# grupos de uma vez no servidor: por status, por origem, valor do pipeline,
+# ganhos/perdidos no mês, desempenho por vendedor e tempo médio por etapa. O
+# custo de rede é proporcional ao número de grupos, não de leads, e não há
+# mais o limite de 10.000 leads carregados no Python.
+#
+# Tempo por etapa: update_lead_status grava no lead status_desde (entrada no
+# status atual) e acumula em tempo_etapas.<status> os segundos passados em
+# cada etapa ao sair dela. A média por etapa considera os leads que já
+# passaram por ela. reconstruir_etapas() preenche esses campos para leads
+# antigos a partir das atividades status_change.
+#
+# O resultado fica num cache TTL curto por empresa, descartado pelas rotas
+# que escrevem em leads (leads criados pela ingestão do WhatsApp aparecem
+# quando roteados ou ao expirar o TTL).
+#
+# Uso via linha de comando:
+#   python -m services.crm_metricas reconstruir [empresa_id]
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from cachetools import TTLCache
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+FINAIS = ["ganho", "perdido"]
+SEGUNDOS_DIA = 86400
+LOTE = 500
+
+
+def _instante(valor: Any) -> Optional[datetime]:
+    if isinstance(valor, datetime):
+        return valor if valor.tzinfo else valor.replace(tzinfo=timezone.utc)
+    if isinstance(valor, str) and valor:
+        try:
+            return _instante(datetime.fromisoformat(valor.replace("Z", "+00:00")))
+        except ValueError:
+            return None
+    return None
+
+
+def campos_mudanca_status(lead: Dict[str, Any], novo_status: str, agora: datetime) -> Dict[str, Any]:
+    """Update do lead para a troca de status, acumulando o tempo da etapa que termina.
+
+    Leads sem status_desde (anteriores ao registro) ainda em "novo" contam a
+    partir de created_at; nos demais o tempo da etapa é desconhecido e não entra.
+    """
+    atual = lead.get("status_funil") or "novo"
+    atualizacao: Dict[str, Any] = {"$set": {
+        "status_funil": novo_status,
+        "status_desde": agora.isoformat(),
+        "updated_at": agora.isoformat()
+    }}
+    if atual == novo_status:
+        del atualizacao["$set"]["status_desde"]
+        return atualizacao
+    entrada = _instante(lead.get("status_desde")) or (_instante(lead.get("created_at")) if atual == "novo" else None)
+    if entrada is not None:
+        atualizacao["$inc"] = {f"tempo_etapas.{atual}": max(0.0, (agora - entrada).total_seconds())}
+    return atualizacao
+
+
+def pipeline_metricas(empresa_id: str, inicio_mes: str) -> List[Dict[str, Any]]:
+    status = {"$ifNull": ["$status_funil", "novo"]}
+    return [
+        {"$match": {"empresa_id": empresa_id}},
+        {"$facet": {
+            "por_status": [{"$group": {"_id": status, "total": {"$sum": 1}}}],
+            "por_origem": [{"$group": {"_id": {"$ifNull": ["$origem", "manual"]}, "total": {"$sum": 1}}}],
+            "pipeline": [
+                {"$match": {"status_funil": {"$nin": FINAIS}}},
+                {"$group": {"_id": None, "valor": {"$sum": {"$ifNull": ["$valor_estimado", 0]}}}},
+            ],
+            "finalizados_mes": [
+                {"$match": {"status_funil": {"$in": FINAIS}, "$or": [
+                    {"status_desde": {"$gte": inicio_mes}},
+                    {"status_desde": {"$exists": False}, "updated_at": {"$gte": inicio_mes}},
+                ]}},
+                {"$group": {"_id": "$status_funil", "total": {"$sum": 1}}},
+            ],
+            "vendedores": [
+                {"$match": {"assigned_to": {"$nin": [None, ""]}}},
+                {"$group": {
+                    "_id": "$assigned_to",
+                    "total_leads": {"$sum": 1},
+                    "leads_ganhos": {"$sum": {"$cond": [{"$eq": ["$status_funil", "ganho"]}, 1, 0]}},
+                    "leads_perdidos": {"$sum": {"$cond": [{"$eq": ["$status_funil", "perdido"]}, 1, 0]}},
+                    "valor_ganho": {"$sum": {"$cond": [
+                        {"$eq": ["$status_funil", "ganho"]}, {"$ifNull": ["$valor_estimado", 0]}, 0
+                    ]}},
+                }},
+            ],
+            "etapas": [
+                {"$match": {"tempo_etapas": {"$type": "object"}}},
+                {"$project": {"etapas": {"$objectToArray": "$tempo_etapas"}}},
+                {"$unwind": "$etapas"},
+                {"$group": {"_id": "$etapas.k", "segundos": {"$avg": "$etapas.v"}}},
+            ],
+        }},
+    ]
+
+
+async def calcular_metricas(db, empresa_id: str, agora: Optional[datetime] = None) -> Dict[str, Any]:
+    """Métricas do CRM no formato de CRMMetrics"""
+    agora = agora or datetime.now(timezone.utc)
+    inicio_mes = agora.replace(day=1, hour=0, minute=0, second=0, microsecond=0).isoformat()
+    resultado = (await db.leads.aggregate(pipeline_metricas(empresa_id, inicio_mes)).to_list(1))[0]
+
+    leads_por_status = {g["_id"]: g["total"] for g in resultado["por_status"]}
+    total_leads = sum(leads_por_status.values())
+    finalizados = {g["_id"]: g["total"] for g in resultado["finalizados_mes"]}
+    pipeline = resultado["pipeline"]
+
+    return {
+        "total_leads": total_leads,
+        "leads_por_status": leads_por_status,
+        "leads_por_origem": {g["_id"]: g["total"] for g in resultado["por_origem"]},
+        "taxa_conversao": {s: n / (total_leads or 1) * 100 for s, n in leads_por_status.items()},
+        "tempo_medio_por_etapa": {g["_id"]: round(g["segundos"] / SEGUNDOS_DIA, 2) for g in resultado["etapas"]},
+        "valor_total_pipeline": pipeline[0]["valor"] if pipeline else 0,
+        "leads_vencidos_mes": finalizados.get("ganho", 0),
+        "leads_perdidos_mes": finalizados.get("perdido", 0),
+        "desempenho_vendedores": [
+            {"user_id": g.pop("_id"), **g} for g in resultado["vendedores"]
+        ],
+    }
+
+
+class MetricasCRM:
+    """Cache empresa_id -> métricas do CRM"""
+
+    def __init__(self, maxsize: int = 1000, ttl: Optional[int] = None):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl or int(os.environ.get("CRM_METRICAS_TTL_S", "30")))
+        self.hits = 0
+        self.misses = 0
+
+    async def obter(self, db, empresa_id: str) -> Dict[str, Any]:
+        metricas = self._cache.get(empresa_id)
+        if metricas is not None:
+            self.hits += 1
+            return metricas
+        self.misses += 1
+        metricas = self._cache[empresa_id] = await calcular_metricas(db, empresa_id)
+        return metricas
+
+    def invalidar(self, empresa_id: Optional[str]) -> None:
+        self._cache.pop(empresa_id, None)
+
+    def estatisticas(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "itens": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0
+        }
+
+
+async def reconstruir_etapas(db, empresa_id: Optional[str] = None) -> Dict[str, int]:
+    """Recalcula status_desde e tempo_etapas dos leads a partir das atividades status_change"""
+    filtro_leads = {"empresa_id": empresa_id} if empresa_id else {}
+    leads = {
+        lead["id"]: lead
+        async for lead in db.leads.find(filtro_leads, {"_id": 0, "id": 1, "created_at": 1})
+    }
+
+    filtro = {"tipo": "status_change"}
+    if empresa_id:
+        filtro["empresa_id"] = empresa_id
+    trocas: Dict[str, List[Dict[str, Any]]] = {}
+    async for atividade in db.activities.find(filtro, {"_id": 0, "lead_id": 1, "created_at": 1, "metadata": 1}):
+        if atividade.get("lead_id") in leads:
+            trocas.setdefault(atividade["lead_id"], []).append(atividade)
+
+    ops = []
+    atualizados = 0
+    for lead_id, lead in leads.items():
+        entrada = _instante(lead.get("created_at"))
+        tempos: Dict[str, float] = {}
+        for troca in sorted(trocas.get(lead_id, []), key=lambda a: _instante(a.get("created_at")) or datetime.min.replace(tzinfo=timezone.utc)):
+            momento = _instante(troca.get("created_at"))
+            anterior = (troca.get("metadata") or {}).get("old_status") or "novo"
+            if momento is None:
+                continue
+            if entrada is not None and anterior != (troca.get("metadata") or {}).get("new_status"):
+                tempos[anterior] = tempos.get(anterior, 0.0) + max(0.0, (momento - entrada).total_seconds())
+            entrada = momento
+        campos: Dict[str, Any] = {"tempo_etapas": tempos}
+        if entrada is not None:
+            campos["status_desde"] = entrada.isoformat()
+        ops.append(UpdateOne({"id": lead_id}, {"$set": campos}))
+        if len(ops) >= LOTE:
+            atualizados += (await db.leads.bulk_write(ops, ordered=False)).modified_count
+            ops = []
+    if ops:
+        atualizados += (await db.leads.bulk_write(ops, ordered=False)).modified_count
+
+    logger.info(f"✅ Tempo por etapa reconstruído: {len(leads)} leads, {atualizados} atualizados")
+    return {"leads": len(leads), "atualizados": atualizados}
+
+
+# Instância compartilhada pelas rotas de leads e de métricas
+metricas_crm = MetricasCRM()
+
+
+async def _main(args: List[str]):
+    from database import db
+    if args and args[0] == "reconstruir":
+        print(await reconstruir_etapas(db, args[1] if len(args) > 1 else None))
+    else:
+        print("Uso: python -m services.crm_metricas reconstruir [empresa_id]")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(sys.argv[1:]))
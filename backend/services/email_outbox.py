@@ -0,0 +1,441 @@
+# Fila de saída de emails (coleção email_outbox) com envio em lote
+#
+# As rotas só gravam o email na coleção e seguem; um sender em background
+# pega lotes de pendentes, envia fora do event loop reaproveitando conexões
+# SMTP já autenticadas (PoolSmtp) e grava o resultado de cada mensagem.
+# Falhas voltam para a fila com backoff exponencial até max_tentativas.
+#
+# Sem senha SMTP configurada o envio é simulado (log [MOCK EMAIL]), como antes.
+# Para testes/desenvolvimento há um servidor SMTP local em services/smtp_stub.py.
+import asyncio
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from string import Template
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from services.executores import executores
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_COLLECTION = "email_outbox"
+
+STATUS_PENDENTE = "pendente"
+STATUS_ENVIANDO = "enviando"
+STATUS_ENVIADO = "enviado"
+STATUS_FALHOU = "falhou"
+
+
+def _agora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# ---------- templates ----------
+
+def _template_aviso(cor: str, titulo: str, corpo: str) -> Template:
+    # O HTML fixo é montado uma vez; por email só entram os dados
+    return Template(
+        '<div style="font-family: Arial; max-width: 600px; margin: 0 auto;">'
+        f'<h2 style="color: {cor};">{titulo}</h2>'
+        '<p>Prezado(a) $razao_social,</p>'
+        f'{corpo}'
+        '<p>Atenciosamente,<br>Equipe ECHO SHOP</p>'
+        '</div>'
+    )
+
+
+TEMPLATES: Dict[str, Dict[str, Template]] = {
+    "bloqueio": {
+        "assunto": Template("⚠️ Acesso Suspenso - Inadimplência"),
+        "html": _template_aviso(
+            "#dc3545", "⚠️ Acesso Suspenso",
+            "<p>Devido à inadimplência de <strong>$dias_atraso dias</strong>, seu acesso ao sistema foi suspenso.</p>"
+            "<p>Para reativar, efetue o pagamento pendente.</p>"
+        ),
+    },
+    "aviso_suspensao": {
+        "assunto": Template("⚠️ Aviso: Suspensão em breve"),
+        "html": _template_aviso(
+            "#f57c00", "⚠️ Aviso de Suspensão",
+            "<p>Sua mensalidade está em atraso há <strong>$dias_atraso dias</strong>.</p>"
+            "<p><strong>Seu acesso será suspenso em $dias_restantes dias caso o pagamento não seja efetuado.</strong></p>"
+        ),
+    },
+    "cobranca": {
+        "assunto": Template("📋 Lembrete: Mensalidade Pendente"),
+        "html": _template_aviso(
+            "#1976d2", "📋 Lembrete de Pagamento",
+            "<p>Identificamos que sua mensalidade está pendente.</p>"
+            "<p>Valor: <strong>R$$ $valor_mensal</strong></p>"
+            "<p>Efetue o pagamento para evitar a suspensão do serviço.</p>"
+        ),
+    },
+}
+
+
+def renderizar(template: str, **dados) -> Dict[str, str]:
+    """{assunto, html} de um template pré-compilado"""
+    t = TEMPLATES[template]
+    return {"assunto": t["assunto"].substitute(dados), "html": t["html"].substitute(dados)}
+
+
+def montar_mensagem(email: Dict[str, Any], remetente: Optional[str]) -> MIMEMultipart:
+    """MIME de um documento da outbox (para, assunto, html, remetente_nome)"""
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = email["assunto"]
+    msg['From'] = f'{email.get("remetente_nome") or "Sistema ECHO SHOP"} <{remetente}>'
+    msg['To'] = email["para"]
+    msg.attach(MIMEText(email["html"], 'html'))
+    return msg
+
+
+# ---------- SMTP ----------
+
+@dataclass
+class ConfigSmtp:
+    host: str = "smtp.gmail.com"
+    porta: int = 465
+    usuario: Optional[str] = None
+    senha: Optional[str] = None
+    ssl: bool = True
+    timeout: float = 30.0
+
+    @classmethod
+    def do_ambiente(cls) -> "ConfigSmtp":
+        return cls(
+            host=os.environ.get("SMTP_HOST", "smtp.gmail.com"),
+            porta=int(os.environ.get("SMTP_PORT", "465")),
+            usuario=os.environ.get("SMTP_USER") or os.environ.get("GMAIL_USER"),
+            senha=os.environ.get("SMTP_PASSWORD") or os.environ.get("GMAIL_APP_PASSWORD"),
+            ssl=os.environ.get("SMTP_SSL", "true").lower() != "false",
+        )
+
+    @property
+    def configurado(self) -> bool:
+        return bool(self.usuario and self.senha)
+
+
+class PoolSmtp:
+    """Conexões SMTP autenticadas reaproveitadas entre envios (uso síncrono, em threads)"""
+
+    def __init__(self, config: ConfigSmtp, tamanho: int = 2, ociosidade_max: float = 60.0):
+        self.config = config
+        self.tamanho = tamanho
+        self.ociosidade_max = ociosidade_max
+        self._livres: "queue.LifoQueue" = queue.LifoQueue()
+        self._criadas = 0
+        self._lock = threading.Lock()
+        self.conexoes_abertas = 0
+        self.logins = 0
+
+    def _conectar(self) -> smtplib.SMTP:
+        c = self.config
+        if c.ssl:
+            smtp = smtplib.SMTP_SSL(c.host, c.porta, timeout=c.timeout)
+        else:
+            smtp = smtplib.SMTP(c.host, c.porta, timeout=c.timeout)
+        if c.usuario and c.senha:
+            smtp.login(c.usuario, c.senha)
+            self.logins += 1
+        with self._lock:
+            self.conexoes_abertas += 1
+        return smtp
+
+    def _obter(self):
+        """(conexão, último uso); abre uma nova se o pool ainda não está cheio"""
+        with self._lock:
+            if self._livres.empty() and self._criadas < self.tamanho:
+                self._criadas += 1
+                criar = True
+            else:
+                criar = False
+        if criar:
+            try:
+                return self._conectar(), time.monotonic()
+            except Exception:
+                with self._lock:
+                    self._criadas -= 1
+                raise
+        return self._livres.get()
+
+    def _devolver(self, smtp: Optional[smtplib.SMTP]) -> None:
+        if smtp is None:
+            with self._lock:
+                self._criadas -= 1
+            return
+        self._livres.put((smtp, time.monotonic()))
+
+    def _fechar(self, smtp: smtplib.SMTP) -> None:
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+        finally:
+            with self._lock:
+                self.conexoes_abertas -= 1
+
+    def _viva(self, smtp: smtplib.SMTP, ultimo_uso: float) -> bool:
+        if time.monotonic() - ultimo_uso < self.ociosidade_max:
+            return True
+        try:
+            return smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def enviar_lote(self, mensagens: List[MIMEMultipart]) -> List[Optional[str]]:
+        """Envia por uma única conexão; devolve None (ok) ou o erro de cada mensagem"""
+        smtp, ultimo_uso = self._obter()
+        resultados: List[Optional[str]] = []
+        try:
+            if not self._viva(smtp, ultimo_uso):
+                self._fechar(smtp)
+                smtp = None
+                smtp = self._conectar()
+            for msg in mensagens:
+                try:
+                    smtp.send_message(msg)
+                    resultados.append(None)
+                except smtplib.SMTPServerDisconnected:
+                    # Servidor fechou a conexão: reconecta e tenta a mensagem de novo
+                    self._fechar(smtp)
+                    smtp = None
+                    smtp = self._conectar()
+                    smtp.send_message(msg)
+                    resultados.append(None)
+                except smtplib.SMTPRecipientsRefused as e:
+                    resultados.append(f"destinatário recusado: {e.recipients}")
+                except smtplib.SMTPException as e:
+                    resultados.append(f"{type(e).__name__}: {e}")
+        except Exception as e:
+            # Conexão inutilizável: descarta; o que já foi enviado fica como enviado
+            if smtp is not None:
+                self._fechar(smtp)
+            self._devolver(None)
+            erro = f"{type(e).__name__}: {e}"
+            return resultados + [erro] * (len(mensagens) - len(resultados))
+        self._devolver(smtp)
+        return resultados
+
+    def fechar(self) -> None:
+        while not self._livres.empty():
+            smtp, _ = self._livres.get_nowait()
+            self._fechar(smtp)
+        with self._lock:
+            self._criadas = 0
+
+
+# ---------- outbox ----------
+
+class Outbox:
+    def __init__(
+        self,
+        db,
+        config: Optional[ConfigSmtp] = None,
+        conexoes: int = 2,
+        tamanho_lote: int = 20,
+        intervalo_poll: float = 5.0,
+        max_tentativas: int = 5,
+        backoff_base: float = 30.0,
+        backoff_max: float = 3600.0,
+        timeout_envio: float = 600.0
+    ):
+        self.db = db
+        self.colecao = db[OUTBOX_COLLECTION]
+        self.config = config or ConfigSmtp.do_ambiente()
+        self.pool = PoolSmtp(self.config, tamanho=conexoes)
+        self.conexoes = conexoes
+        self.tamanho_lote = tamanho_lote
+        self.intervalo_poll = intervalo_poll
+        self.max_tentativas = max_tentativas
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout_envio = timeout_envio
+
+        self._workers: List[asyncio.Task] = []
+        self._novo = asyncio.Event()
+        self._enviados_em: deque = deque(maxlen=10000)
+        self.enviados = 0
+        self.falhas = 0
+        self.lotes = 0
+        self.duracao_lotes_s = 0.0
+
+    def _documento(
+        self,
+        destinatario: str,
+        assunto: str,
+        html: str,
+        remetente_nome: str = "Sistema ECHO SHOP",
+        tipo: Optional[str] = None
+    ) -> Dict[str, Any]:
+        agora = _agora()
+        return {
+            "id": str(uuid.uuid4()),
+            "para": destinatario,
+            "assunto": assunto,
+            "html": html,
+            "remetente_nome": remetente_nome,
+            "tipo": tipo,
+            "status": STATUS_PENDENTE,
+            "tentativas": 0,
+            "erro": None,
+            "proxima_tentativa_em": agora,
+            "created_at": agora,
+            "enviado_em": None,
+        }
+
+    async def enfileirar(
+        self,
+        destinatario: str,
+        assunto: str,
+        html: str,
+        remetente_nome: str = "Sistema ECHO SHOP",
+        tipo: Optional[str] = None
+    ) -> Dict[str, Any]:
+        doc = self._documento(destinatario, assunto, html, remetente_nome, tipo)
+        await self.colecao.insert_one(doc)
+        doc.pop("_id", None)
+        self._novo.set()
+        return doc
+
+    async def enfileirar_template(self, template: str, destinatario: str, remetente_nome: str = "Sistema ECHO SHOP", **dados) -> Dict[str, Any]:
+        conteudo = renderizar(template, **dados)
+        return await self.enfileirar(destinatario, conteudo["assunto"], conteudo["html"], remetente_nome, tipo=template)
+
+    async def enfileirar_templates(self, envios: List[Dict[str, Any]], remetente_nome: str = "Sistema ECHO SHOP") -> int:
+        """Vários emails de template num único insert_many; envios = [{template, para, dados}]"""
+        docs = []
+        for envio in envios:
+            conteudo = renderizar(envio["template"], **envio["dados"])
+            docs.append(self._documento(envio["para"], conteudo["assunto"], conteudo["html"], remetente_nome, tipo=envio["template"]))
+        if docs:
+            await self.colecao.insert_many(docs)
+            self._novo.set()
+        return len(docs)
+
+    # ---------- sender ----------
+
+    async def iniciar(self) -> None:
+        if self._workers:
+            return
+        await self._recuperar_travados()
+        # Um sender por conexão do pool
+        self._workers = [asyncio.create_task(self._sender(i)) for i in range(self.conexoes)]
+        modo = "SMTP" if self.config.configurado else "mock"
+        logger.info(f"✅ Outbox de emails iniciada ({self.conexoes} senders, modo {modo})")
+
+    async def parar(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await executores.thread(self.pool.fechar)
+
+    async def _sender(self, numero: int) -> None:
+        while True:
+            try:
+                enviados = await self.processar_lote()
+            except Exception as e:
+                logger.warning(f"⚠️ Sender de email {numero}: {e}")
+                enviados = 0
+            if enviados:
+                continue
+            try:
+                await asyncio.wait_for(self._novo.wait(), timeout=self.intervalo_poll)
+            except asyncio.TimeoutError:
+                pass
+            self._novo.clear()
+
+    async def _reservar_lote(self) -> List[Dict[str, Any]]:
+        """Marca até tamanho_lote pendentes como 'enviando' com um id de lote (seguro entre processos)"""
+        agora = _agora()
+        candidatos = await self.colecao.find(
+            {"status": STATUS_PENDENTE, "proxima_tentativa_em": {"$lte": agora}}, {"_id": 0, "id": 1}
+        ).sort("proxima_tentativa_em", 1).limit(self.tamanho_lote).to_list(self.tamanho_lote)
+        if not candidatos:
+            return []
+
+        lote_id = str(uuid.uuid4())
+        await self.colecao.update_many(
+            {"id": {"$in": [c["id"] for c in candidatos]}, "status": STATUS_PENDENTE},
+            {"$set": {"status": STATUS_ENVIANDO, "lote_id": lote_id, "reservado_em": agora}, "$inc": {"tentativas": 1}}
+        )
+        return await self.colecao.find({"lote_id": lote_id, "status": STATUS_ENVIANDO}, {"_id": 0}).to_list(None)
+
+    async def processar_lote(self) -> int:
+        """Envia um lote; devolve quantos emails foram processados"""
+        lote = await self._reservar_lote()
+        if not lote:
+            return 0
+
+        inicio = time.perf_counter()
+        if self.config.configurado:
+            try:
+                erros = await executores.thread(
+                    self.pool.enviar_lote, [montar_mensagem(e, self.config.usuario) for e in lote], nome="smtp_lote"
+                )
+            except Exception as e:
+                erros = [f"{type(e).__name__}: {e}"] * len(lote)
+        else:
+            for email in lote:
+                logger.info(f"[MOCK EMAIL] Para: {email['para']}, Assunto: {email['assunto']}")
+            erros = [None] * len(lote)
+
+        agora = _agora()
+        operacoes = []
+        for email, erro in zip(lote, erros):
+            if erro is None:
+                campos = {"status": STATUS_ENVIADO, "enviado_em": agora, "erro": None}
+                self.enviados += 1
+                self._enviados_em.append(time.monotonic())
+            elif email["tentativas"] < self.max_tentativas:
+                espera = min(self.backoff_base * (2 ** (email["tentativas"] - 1)), self.backoff_max)
+                campos = {"status": STATUS_PENDENTE, "erro": erro, "proxima_tentativa_em": agora + timedelta(seconds=espera)}
+            else:
+                campos = {"status": STATUS_FALHOU, "erro": erro}
+                self.falhas += 1
+                logger.error(f"Email {email['id']} para {email['para']} falhou definitivamente: {erro}")
+            operacoes.append(UpdateOne({"id": email["id"]}, {"$set": campos, "$unset": {"lote_id": ""}}))
+        await self.colecao.bulk_write(operacoes, ordered=False)
+
+        self.lotes += 1
+        self.duracao_lotes_s += time.perf_counter() - inicio
+        return len(lote)
+
+    async def _recuperar_travados(self) -> int:
+        """Lotes 'enviando' de um processo que morreu voltam para a fila"""
+        limite = _agora() - timedelta(seconds=self.timeout_envio)
+        result = await self.colecao.update_many(
+            {"status": STATUS_ENVIANDO, "reservado_em": {"$lt": limite}},
+            {"$set": {"status": STATUS_PENDENTE, "proxima_tentativa_em": _agora()}, "$unset": {"lote_id": ""}}
+        )
+        return result.modified_count
+
+    async def estatisticas(self) -> Dict[str, Any]:
+        agora = time.monotonic()
+        ultimo_minuto = sum(1 for t in self._enviados_em if agora - t <= 60)
+        return {
+            "modo": "smtp" if self.config.configurado else "mock",
+            "pendentes": await self.colecao.count_documents({"status": STATUS_PENDENTE}),
+            "enviando": await self.colecao.count_documents({"status": STATUS_ENVIANDO}),
+            "falhas_definitivas": await self.colecao.count_documents({"status": STATUS_FALHOU}),
+            "enviados_processo": self.enviados,
+            "enviados_ultimo_minuto": ultimo_minuto,
+            "lotes": self.lotes,
+            "duracao_media_lote_s": round(self.duracao_lotes_s / self.lotes, 4) if self.lotes else None,
+            "conexoes_smtp_abertas": self.pool.conexoes_abertas,
+            "logins_smtp": self.pool.logins,
+        }
@@ -0,0 +1,168 @@
+# Execução de trabalho pesado fora do event loop
+#
+# Dois pools compartilhados:
+# - processos: CPU puro com entrada/saída serializável (leitura de planilhas,
+#   parse de OFX, extração de texto de PDF, renderização do PDF do relatório).
+#   Usa "spawn" para não herdar as threads do Motor por fork; as funções
+#   precisam estar em módulos importáveis (services/*), não em server.py.
+# - threads: passos que mexem em objetos que não saem do processo (workbook
+#   openpyxl em construção, DataFrames grandes já carregados).
+#
+# Tamanhos por EXECUTOR_PROCESSOS e EXECUTOR_THREADS. EXECUTOR_PROCESSOS=0
+# manda tudo para o pool de threads. As métricas (em andamento, fila, tempo
+# de espera e de execução por tarefa) ficam em GET /admin/executores. Os
+# tamanhos são lidos no primeiro uso, não no import (o .env pode ser carregado
+# depois).
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _medir(func: Callable, args: tuple, kwargs: dict):
+    """Roda no worker: devolve (início, fim, resultado) para medir espera e duração"""
+    inicio = time.time()
+    resultado = func(*args, **kwargs)
+    return inicio, time.time(), resultado
+
+
+class _Metricas:
+    def __init__(self):
+        self.em_andamento = 0
+        self.concluidas = 0
+        self.erros = 0
+        self.por_tarefa: Dict[str, Dict[str, float]] = {}
+
+    def registrar(self, nome: str, espera: float, duracao: float, erro: bool = False) -> None:
+        m = self.por_tarefa.setdefault(
+            nome, {"chamadas": 0, "erros": 0, "espera_total_s": 0.0, "duracao_total_s": 0.0, "duracao_max_s": 0.0}
+        )
+        m["chamadas"] += 1
+        m["espera_total_s"] += espera
+        m["duracao_total_s"] += duracao
+        m["duracao_max_s"] = max(m["duracao_max_s"], duracao)
+        if erro:
+            m["erros"] += 1
+            self.erros += 1
+        else:
+            self.concluidas += 1
+
+    def resumo(self, max_workers: int) -> Dict[str, Any]:
+        tarefas = {}
+        for nome, m in self.por_tarefa.items():
+            chamadas = m["chamadas"] or 1
+            tarefas[nome] = {
+                "chamadas": m["chamadas"],
+                "erros": m["erros"],
+                "espera_media_s": round(m["espera_total_s"] / chamadas, 4),
+                "duracao_media_s": round(m["duracao_total_s"] / chamadas, 4),
+                "duracao_max_s": round(m["duracao_max_s"], 4),
+            }
+        return {
+            "max_workers": max_workers,
+            "em_andamento": self.em_andamento,
+            # Submetidas que ainda não têm worker livre
+            "fila": max(0, self.em_andamento - max_workers),
+            "concluidas": self.concluidas,
+            "erros": self.erros,
+            "tarefas": tarefas,
+        }
+
+
+class Executores:
+    """Pools de threads e processos com métricas de fila e duração"""
+
+    def __init__(self, threads: Optional[int] = None, processos: Optional[int] = None):
+        """Tamanhos omitidos vêm de EXECUTOR_THREADS/EXECUTOR_PROCESSOS ou do número de CPUs"""
+        self._tamanhos = (threads, processos)
+        self._limites: Optional[Tuple[int, int]] = None
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._processos: Optional[ProcessPoolExecutor] = None
+        self._metricas = {"threads": _Metricas(), "processos": _Metricas()}
+
+    def _resolver(self) -> Tuple[int, int]:
+        if self._limites is None:
+            cpus = os.cpu_count() or 1
+            threads, processos = self._tamanhos
+            if threads is None:
+                threads = int(os.environ.get("EXECUTOR_THREADS") or min(32, cpus + 4))
+            if processos is None:
+                processos = int(os.environ.get("EXECUTOR_PROCESSOS") or cpus)
+            self._limites = (threads, processos)
+        return self._limites
+
+    @property
+    def max_threads(self) -> int:
+        return self._resolver()[0]
+
+    @property
+    def max_processos(self) -> int:
+        return self._resolver()[1]
+
+    def _pool_threads(self) -> ThreadPoolExecutor:
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix="executor")
+        return self._threads
+
+    def _pool_processos(self) -> ProcessPoolExecutor:
+        if self._processos is None:
+            self._processos = ProcessPoolExecutor(
+                max_workers=self.max_processos, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._processos
+
+    async def _rodar(self, pool: Executor, tipo: str, nome: str, func: Callable, args: tuple, kwargs: dict) -> Any:
+        metricas = self._metricas[tipo]
+        metricas.em_andamento += 1
+        enviado = time.time()
+        try:
+            loop = asyncio.get_running_loop()
+            inicio, fim, resultado = await loop.run_in_executor(pool, functools.partial(_medir, func, args, kwargs))
+        except BaseException:
+            metricas.registrar(nome, 0.0, time.time() - enviado, erro=True)
+            raise
+        finally:
+            metricas.em_andamento -= 1
+        metricas.registrar(nome, max(0.0, inicio - enviado), fim - inicio)
+        return resultado
+
+    async def thread(self, func: Callable, *args, nome: Optional[str] = None, **kwargs) -> Any:
+        """Executa func no pool de threads"""
+        return await self._rodar(self._pool_threads(), "threads", nome or func.__name__, func, args, kwargs)
+
+    async def processo(self, func: Callable, *args, nome: Optional[str] = None, **kwargs) -> Any:
+        """Executa func num processo separado (func, argumentos e retorno precisam ser picklable)"""
+        nome = nome or func.__name__
+        if self.max_processos <= 0:
+            return await self.thread(func, *args, nome=nome, **kwargs)
+        try:
+            return await self._rodar(self._pool_processos(), "processos", nome, func, args, kwargs)
+        except BrokenProcessPool:
+            # Um worker morreu (ex: OOM): recria o pool para as próximas chamadas
+            logger.error(f"Pool de processos quebrado durante {nome}; recriando")
+            self._processos = None
+            raise
+
+    def estatisticas(self) -> Dict[str, Any]:
+        return {
+            "threads": self._metricas["threads"].resumo(self.max_threads),
+            "processos": self._metricas["processos"].resumo(self.max_processos),
+        }
+
+    def encerrar(self) -> None:
+        for pool in (self._threads, self._processos):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._threads = None
+        self._processos = None
+
+
+# Instância compartilhada (server.py e services/*)
+executores = Executores()
@@ -0,0 +1,198 @@
+# Exportação de relatórios em CSV e Excel sem materializar o relatório
+#
+# As transações são lidas do cursor do Motor em lotes; cada lote tem os nomes
+# de categoria e centro de custo resolvidos pelo name_cache (um $in por lote)
+# e é escrito em seguida. O CSV é enviado em partes conforme os lotes chegam;
+# o XLSX usa o modo write-only do openpyxl gravando num SpooledTemporaryFile
+# (memória até LIMITE_MEMORIA_XLSX, disco acima disso).
+import csv
+import io
+import tempfile
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, PatternFill
+from pymongo import ASCENDING
+
+from services.executores import executores
+from services.lookup_cache import name_cache
+
+TAMANHO_LOTE = 1000
+TAMANHO_PARTE = 64 * 1024
+LIMITE_MEMORIA_XLSX = 8 * 1024 * 1024
+
+CABECALHO = ['ID', 'Data', 'Tipo', 'Fornecedor', 'Categoria', 'Centro de Custo', 'Valor', 'Status', 'Origem']
+
+MEDIA_TYPE_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def query_relatorio(
+    empresa_id: str,
+    periodo_inicio: Optional[str] = None,
+    periodo_fim: Optional[str] = None,
+    tipo_periodo: str = "mensal"
+) -> Dict[str, Any]:
+    """Filtro de transações do relatório (mensal/anual usam o período corrente)"""
+    hoje = datetime.now(timezone.utc)
+    if tipo_periodo == "mensal":
+        periodo_inicio = hoje.replace(day=1).isoformat()
+        periodo_fim = hoje.isoformat()
+    elif tipo_periodo == "anual":
+        periodo_inicio = hoje.replace(month=1, day=1).isoformat()
+        periodo_fim = hoje.isoformat()
+
+    query: Dict[str, Any] = {"empresa_id": empresa_id}
+    if periodo_inicio and periodo_fim:
+        query["data_competencia"] = {
+            "$gte": periodo_inicio.split("T")[0],
+            "$lte": periodo_fim.split("T")[0]
+        }
+    return query
+
+
+async def lotes_transacoes(db, query: Dict[str, Any], tamanho_lote: int = TAMANHO_LOTE) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Transações em lotes, ordenadas por data, com categoria_nome e centro_custo_nome"""
+    cursor = db.transacoes.find(query, {"_id": 0})\
+        .sort([("data_competencia", ASCENDING), ("id", ASCENDING)])\
+        .batch_size(tamanho_lote)
+
+    lote: List[Dict[str, Any]] = []
+    async for t in cursor:
+        lote.append(t)
+        if len(lote) >= tamanho_lote:
+            yield await _resolver_nomes(db, lote)
+            lote = []
+    if lote:
+        yield await _resolver_nomes(db, lote)
+
+
+async def _resolver_nomes(db, lote: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    await name_cache.enriquecer(db, lote, "categoria_id", "categorias", {"nome": "categoria_nome"}, padrao="")
+    await name_cache.enriquecer(db, lote, "centro_custo_id", "centros_custo", {"nome": "centro_custo_nome"}, padrao="")
+    return lote
+
+
+def _linha(t: Dict[str, Any]) -> List[Any]:
+    return [
+        t.get('id', ''),
+        t.get('data_competencia', ''),
+        t.get('tipo', ''),
+        t.get('fornecedor', ''),
+        t.get('categoria_nome') or '',
+        t.get('centro_custo_nome') or '',
+        t.get('valor_total', 0),
+        t.get('status', ''),
+        t.get('origem', '')
+    ]
+
+
+async def stream_csv(db, query: Dict[str, Any]) -> AsyncIterator[str]:
+    """Cabeçalho e depois um bloco de texto por lote lido do banco"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CABECALHO)
+    yield buffer.getvalue()
+
+    async for lote in lotes_transacoes(db, query):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(_linha(t) for t in lote)
+        yield buffer.getvalue()
+
+
+CAMPOS_LEADS = ['id', 'nome', 'telefone', 'email', 'origem', 'status_funil', 'valor_estimado', 'assigned_to', 'created_at']
+
+
+def csv_leads(leads: List[Dict[str, Any]]) -> str:
+    """CSV da exportação de leads do CRM"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CAMPOS_LEADS)
+    writer.writeheader()
+    for lead in leads:
+        writer.writerow({
+            'id': lead.get('id'),
+            'nome': lead.get('nome'),
+            'telefone': lead.get('telefone'),
+            'email': lead.get('email', ''),
+            'origem': lead.get('origem'),
+            'status_funil': lead.get('status_funil'),
+            'valor_estimado': lead.get('valor_estimado', 0),
+            'assigned_to': lead.get('assigned_to', ''),
+            'created_at': lead.get('created_at')
+        })
+    return buffer.getvalue()
+
+
+def _anexar_linhas(ws, linhas: List[List[Any]]) -> None:
+    for linha in linhas:
+        ws.append(linha)
+
+
+def _celula(ws, valor: Any, **estilo) -> WriteOnlyCell:
+    celula = WriteOnlyCell(ws, value=valor)
+    for nome, v in estilo.items():
+        setattr(celula, nome, v)
+    return celula
+
+
+async def gerar_xlsx(db, query: Dict[str, Any]) -> tempfile.SpooledTemporaryFile:
+    """Monta o XLSX (abas Resumo e Transações) e devolve o arquivo posicionado no início.
+
+    Quem chama é responsável por fechar o arquivo.
+    """
+    wb = Workbook(write_only=True)
+    # A ordem das abas é a de criação; o resumo é preenchido no final
+    ws_resumo = wb.create_sheet("Resumo")
+    ws_trans = wb.create_sheet("Transações")
+
+    cabecalho_font = Font(bold=True, color="FFFFFF")
+    cabecalho_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+    centro = Alignment(horizontal="center")
+    ws_trans.append([
+        _celula(ws_trans, titulo, font=cabecalho_font, fill=cabecalho_fill, alignment=centro)
+        for titulo in CABECALHO
+    ])
+
+    total_receitas = 0.0
+    total_despesas = 0.0
+    async for lote in lotes_transacoes(db, query):
+        for t in lote:
+            if t.get("tipo") == "receita":
+                total_receitas += t.get("valor_total") or 0
+            elif t.get("tipo") == "despesa":
+                total_despesas += t.get("valor_total") or 0
+        linhas = [_linha(t) for t in lote]
+        await executores.thread(_anexar_linhas, ws_trans, linhas)
+
+    lucro = total_receitas - total_despesas
+    ws_resumo.append([_celula(ws_resumo, 'RELATÓRIO FINANCEIRO', font=Font(size=16, bold=True))])
+    ws_resumo.append([])
+    ws_resumo.append(['Total de Receitas:', _celula(ws_resumo, f'R$ {total_receitas:,.2f}', font=Font(color="008000"))])
+    ws_resumo.append(['Total de Despesas:', _celula(ws_resumo, f'R$ {total_despesas:,.2f}', font=Font(color="FF0000"))])
+    ws_resumo.append([
+        'Lucro/Prejuízo:',
+        _celula(ws_resumo, f'R$ {lucro:,.2f}', font=Font(color="008000" if lucro >= 0 else "FF0000", bold=True))
+    ])
+
+    arquivo = tempfile.SpooledTemporaryFile(max_size=LIMITE_MEMORIA_XLSX)
+    try:
+        await executores.thread(wb.save, arquivo, nome="xlsx_save")
+    except Exception:
+        arquivo.close()
+        raise
+    arquivo.seek(0)
+    return arquivo
+
+
+async def ler_em_partes(arquivo, tamanho: int = TAMANHO_PARTE) -> AsyncIterator[bytes]:
+    """Envia o arquivo em partes e fecha ao final (também se o cliente desconectar)"""
+    try:
+        while True:
+            parte = arquivo.read(tamanho)
+            if not parte:
+                break
+            yield parte
+    finally:
+        arquivo.close()
@@ -0,0 +1,257 @@
+# Google Drive sem bloquear o event loop
+#
+# O googleapiclient é síncrono: toda chamada (.execute(), next_chunk()) roda
+# no executor de threads. O serviço (montado a partir do documento de
+# discovery) é construído uma vez por usuário ou conta de serviço e fica em
+# cache; como o httplib2 não é thread-safe, cada operação usa o próprio
+# AuthorizedHttp sobre as credenciais compartilhadas.
+#
+# Uploads são resumíveis, em partes de DRIVE_CHUNK_MB lidas do arquivo (o
+# backup nunca é carregado inteiro na memória). Se uma parte falhar por rede
+# ou erro 5xx/429, o upload retoma do último byte confirmado pelo Drive (o
+# next_chunk seguinte consulta a sessão de upload), até DRIVE_RETOMADAS vezes;
+# se a sessão expirou (404/410), recomeça do início numa sessão nova.
+# Exclusões vão em requisições batch (até 100 por requisição HTTP).
+#
+# Testes: DriveClientes(db, construir=...) aceita uma fábrica que devolve um
+# serviço falso com a mesma interface do googleapiclient (files().create/
+# list/delete, new_batch_http_request, about().get) no lugar de build().
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httplib2
+from google.auth.transport.requests import Request as GoogleRequest
+from google.oauth2 import service_account
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
+
+from services.executores import executores
+
+logger = logging.getLogger(__name__)
+
+ESCOPOS = ["https://www.googleapis.com/auth/drive.file"]
+DRIVE_TIMEOUT = 120
+# Retries internos do googleapiclient (com backoff) antes de contar uma retomada
+NUM_RETRIES = 2
+# Espera antes de cada retomada: 2s, 4s, 8s... (máx. 30s)
+ESPERA_RETOMADA = 2
+LOTE_BATCH = 100
+CONTA_SERVICO = "__conta_servico__"
+
+Progresso = Callable[[float, str], Awaitable[None]]
+
+
+class DriveNaoConectado(Exception):
+    """Usuário sem credenciais OAuth do Drive (ou conta de serviço não configurada)"""
+
+
+def _construir_servico(credenciais):
+    return build("drive", "v3", credentials=credenciais, cache_discovery=False)
+
+
+def _retomavel(erro: Exception) -> bool:
+    if isinstance(erro, HttpError):
+        return erro.resp.status >= 500 or erro.resp.status in (408, 429) or _sessao_expirada(erro)
+    return isinstance(erro, (OSError, httplib2.HttpLib2Error))
+
+
+def _sessao_expirada(erro: Exception) -> bool:
+    return isinstance(erro, HttpError) and erro.resp.status in (404, 410)
+
+
+class Drive:
+    """Operações de um serviço do Drive, executadas fora do event loop"""
+
+    def __init__(self, servico, credenciais=None):
+        self.servico = servico
+        self.credenciais = credenciais
+
+    def _http(self):
+        if self.credenciais is None:
+            return None
+        return AuthorizedHttp(self.credenciais, http=httplib2.Http(timeout=DRIVE_TIMEOUT))
+
+    async def _executar(self, requisicao) -> Any:
+        return await executores.thread(requisicao.execute, http=self._http(), num_retries=NUM_RETRIES, nome="drive")
+
+    async def upload(
+        self,
+        arquivo,
+        nome: str,
+        mimetype: str,
+        pasta: Optional[str] = None,
+        campos: str = "id,name,createdTime,size",
+        progresso: Optional[Progresso] = None,
+        chunk: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Upload resumível a partir de um arquivo aberto, em partes, retomando após falhas"""
+        metadados: Dict[str, Any] = {"name": nome, "mimeType": mimetype}
+        if pasta:
+            metadados["parents"] = [pasta]
+        chunk = chunk or int(os.environ.get("DRIVE_CHUNK_MB", "8")) * 1024 * 1024
+        max_retomadas = int(os.environ.get("DRIVE_RETOMADAS", "5"))
+
+        def nova_sessao():
+            media = MediaIoBaseUpload(arquivo, mimetype=mimetype, chunksize=chunk, resumable=True)
+            return self.servico.files().create(body=metadados, media_body=media, fields=campos)
+
+        requisicao = nova_sessao()
+
+        http = self._http()
+        resposta = None
+        retomadas = 0
+        while resposta is None:
+            try:
+                status, resposta = await executores.thread(
+                    requisicao.next_chunk, http=http, num_retries=NUM_RETRIES, nome="drive_upload"
+                )
+            except Exception as e:
+                if not _retomavel(e) or retomadas >= max_retomadas:
+                    raise
+                retomadas += 1
+                if _sessao_expirada(e):
+                    requisicao = nova_sessao()
+                logger.warning(f"⚠️ Upload de {nome} interrompido ({e}); retomando ({retomadas}/{max_retomadas})")
+                await asyncio.sleep(min(ESPERA_RETOMADA * 2 ** (retomadas - 1), 30))
+                continue
+            if status is not None and progresso:
+                await progresso(100 * status.progress(), f"Enviando {nome} para o Google Drive")
+
+        logger.info(f"✅ Upload para o Drive: {resposta.get('name')} (ID: {resposta.get('id')}, {retomadas} retomadas)")
+        return resposta
+
+    async def listar(self, consulta: str, campos: str = "id, name, createdTime") -> List[Dict[str, Any]]:
+        """Todos os arquivos da consulta (segue as páginas)"""
+        arquivos: List[Dict[str, Any]] = []
+        pagina = None
+        while True:
+            resultado = await self._executar(self.servico.files().list(
+                q=consulta, fields=f"nextPageToken, files({campos})", pageSize=1000, pageToken=pagina
+            ))
+            arquivos.extend(resultado.get("files", []))
+            pagina = resultado.get("nextPageToken")
+            if not pagina:
+                return arquivos
+
+    async def excluir_varios(self, ids: List[str]) -> Dict[str, Any]:
+        """Exclui arquivos em requisições batch; falhas individuais não interrompem o lote"""
+        excluidos: List[str] = []
+        erros: List[Dict[str, Any]] = []
+
+        def concluido(request_id, _resposta, erro):
+            if erro is not None:
+                erros.append({"id": request_id, "erro": str(erro)})
+            else:
+                excluidos.append(request_id)
+
+        for i in range(0, len(ids), LOTE_BATCH):
+            lote = self.servico.new_batch_http_request(callback=concluido)
+            for file_id in ids[i:i + LOTE_BATCH]:
+                lote.add(self.servico.files().delete(fileId=file_id), request_id=file_id)
+            await executores.thread(lote.execute, http=self._http(), nome="drive")
+        return {"excluidos": excluidos, "erros": erros}
+
+    async def sobre(self, campos: str = "user") -> Dict[str, Any]:
+        return await self._executar(self.servico.about().get(fields=campos))
+
+
+async def excluir_backups_antigos(drive: Drive, keep_days: int = 30, pasta: Optional[str] = None) -> int:
+    """Exclui do Drive os backups criados há mais de keep_days dias"""
+    limite = (datetime.now(timezone.utc) - timedelta(days=keep_days)).isoformat()
+    consulta = f"name contains 'backup_' and createdTime < '{limite}'"
+    if pasta:
+        consulta += f" and '{pasta}' in parents"
+
+    arquivos = await drive.listar(consulta)
+    if not arquivos:
+        return 0
+    nomes = {a["id"]: a["name"] for a in arquivos}
+    resultado = await drive.excluir_varios(list(nomes))
+    for erro in resultado["erros"]:
+        logger.error(f"Error deleting {nomes.get(erro['id'])}: {erro['erro']}")
+    logger.info(f"✅ {len(resultado['excluidos'])} backups antigos excluídos do Drive")
+    return len(resultado["excluidos"])
+
+
+class DriveClientes:
+    """Drive autorizado por usuário (OAuth) ou pela conta de serviço, em cache"""
+
+    def __init__(self, db, construir: Callable[[Any], Any] = None, caminho_conta_servico: Optional[str] = None):
+        self.db = db
+        self._construir = construir or _construir_servico
+        self._caminho_conta_servico = caminho_conta_servico
+        self._cache: Dict[str, Drive] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._construidos = 0
+
+    def _lock(self, chave: str) -> asyncio.Lock:
+        if chave not in self._locks:
+            self._locks[chave] = asyncio.Lock()
+        return self._locks[chave]
+
+    async def _novo(self, credenciais) -> Drive:
+        servico = await executores.thread(self._construir, credenciais, nome="drive")
+        self._construidos += 1
+        return Drive(servico, credenciais)
+
+    async def do_usuario(self, user_id: str) -> Drive:
+        """Drive do usuário; renova e grava o access token quando expira"""
+        async with self._lock(user_id):
+            drive = self._cache.get(user_id)
+            if drive is None:
+                doc = await self.db.drive_credentials.find_one({"user_id": user_id})
+                if not doc:
+                    raise DriveNaoConectado("Google Drive não conectado. Por favor, conecte sua conta primeiro.")
+                credenciais = Credentials(
+                    token=doc["access_token"],
+                    refresh_token=doc.get("refresh_token"),
+                    token_uri=doc["token_uri"],
+                    client_id=doc["client_id"],
+                    client_secret=doc["client_secret"],
+                    scopes=doc["scopes"]
+                )
+                if doc.get("expiry"):
+                    # google-auth compara com utcnow() sem timezone
+                    credenciais.expiry = datetime.fromisoformat(doc["expiry"]).replace(tzinfo=None)
+                drive = self._cache[user_id] = await self._novo(credenciais)
+
+            credenciais = drive.credenciais
+            if credenciais is not None and credenciais.expired and credenciais.refresh_token:
+                logger.info(f"Refreshing expired token for user {user_id}")
+                await executores.thread(credenciais.refresh, GoogleRequest(), nome="drive")
+                await self.db.drive_credentials.update_one(
+                    {"user_id": user_id},
+                    {"$set": {
+                        "access_token": credenciais.token,
+                        "expiry": credenciais.expiry.isoformat() if credenciais.expiry else None,
+                        "updated_at": datetime.now(timezone.utc).isoformat()
+                    }}
+                )
+            return drive
+
+    async def conta_servico(self) -> Drive:
+        """Drive da conta de serviço (backups automáticos)"""
+        async with self._lock(CONTA_SERVICO):
+            drive = self._cache.get(CONTA_SERVICO)
+            if drive is None:
+                caminho = self._caminho_conta_servico or os.environ.get(
+                    "GOOGLE_SERVICE_ACCOUNT_PATH", "/app/backend/service_account.json"
+                )
+                if not os.path.exists(caminho):
+                    raise DriveNaoConectado(f"Google Service Account não configurado: {caminho}")
+                credenciais = service_account.Credentials.from_service_account_file(caminho, scopes=ESCOPOS)
+                drive = self._cache[CONTA_SERVICO] = await self._novo(credenciais)
+            return drive
+
+    def invalidar(self, user_id: str) -> None:
+        """Descarta o serviço em cache (credenciais trocadas ou desconectadas)"""
+        self._cache.pop(user_id, None)
+
+    def estatisticas(self) -> Dict[str, Any]:
+        return {"em_cache": len(self._cache), "construidos": self._construidos}
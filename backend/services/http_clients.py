@@ -0,0 +1,232 @@
+# Clientes HTTP compartilhados por upstream (Asaas, Expo push, serviço WhatsApp)
+#
+# Cada upstream tem um único httpx.AsyncClient com pool de conexões keep-alive,
+# timeouts próprios, retry com backoff e circuit breaker. O registro é criado
+# no import e fechado no shutdown; os clientes httpx nascem no primeiro uso.
+#
+# Retry: erros de conexão (a requisição não chegou ao servidor) em qualquer
+# método; timeouts de leitura, 429 e 5xx só em métodos idempotentes, para não
+# duplicar cobranças/clientes no Asaas.
+#
+# Circuit breaker: depois de `falhas_para_abrir` falhas seguidas o upstream
+# fica "aberto" por `tempo_aberto` segundos e as chamadas falham na hora com
+# CircuitoAberto; passado o tempo, uma chamada de teste decide se fecha.
+import asyncio
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+METODOS_IDEMPOTENTES = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+STATUS_RETRY = {429, 502, 503, 504}
+
+FECHADO = "fechado"
+ABERTO = "aberto"
+MEIO_ABERTO = "meio_aberto"
+
+
+class CircuitoAberto(Exception):
+    """Upstream marcado como indisponível pelo circuit breaker"""
+
+
+@dataclass
+class ConfigUpstream:
+    base_url: str = ""
+    # Variável de ambiente que, se definida, substitui base_url (lida ao criar o cliente)
+    base_url_env: Optional[str] = None
+    timeout: float = 10.0
+    timeout_conexao: float = 5.0
+    max_conexoes: int = 20
+    max_keepalive: int = 10
+    tentativas: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 8.0
+    falhas_para_abrir: int = 5
+    tempo_aberto: float = 30.0
+
+
+class Upstream:
+    def __init__(self, nome: str, config: ConfigUpstream):
+        self.nome = nome
+        self.config = config
+        self._client: Optional[httpx.AsyncClient] = None
+
+        self.estado = FECHADO
+        self.falhas_seguidas = 0
+        self.aberto_ate = 0.0
+        self._teste_em_andamento = False
+
+        self.requisicoes = 0
+        self.erros = 0
+        self.retries = 0
+        self.rejeitadas = 0
+        self.latencia_total_s = 0.0
+        self.latencia_max_s = 0.0
+        self.por_status: Dict[str, int] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            c = self.config
+            base_url = os.environ.get(c.base_url_env, c.base_url) if c.base_url_env else c.base_url
+            self._client = httpx.AsyncClient(
+                base_url=base_url,
+                timeout=httpx.Timeout(c.timeout, connect=c.timeout_conexao),
+                limits=httpx.Limits(max_connections=c.max_conexoes, max_keepalive_connections=c.max_keepalive),
+            )
+        return self._client
+
+    # ---------- circuit breaker ----------
+
+    def _liberar(self) -> None:
+        if self.estado == ABERTO:
+            if time.monotonic() < self.aberto_ate:
+                self.rejeitadas += 1
+                raise CircuitoAberto(f"Upstream {self.nome} indisponível (circuito aberto)")
+            self.estado = MEIO_ABERTO
+        if self.estado == MEIO_ABERTO:
+            # Só uma chamada de teste por vez
+            if self._teste_em_andamento:
+                self.rejeitadas += 1
+                raise CircuitoAberto(f"Upstream {self.nome} em teste de recuperação")
+            self._teste_em_andamento = True
+
+    def _sucesso(self) -> None:
+        if self.estado != FECHADO:
+            logger.info(f"✅ Circuito do upstream {self.nome} fechado")
+        self.estado = FECHADO
+        self.falhas_seguidas = 0
+        self._teste_em_andamento = False
+
+    def _falha(self) -> None:
+        self.falhas_seguidas += 1
+        self._teste_em_andamento = False
+        if self.estado == MEIO_ABERTO or self.falhas_seguidas >= self.config.falhas_para_abrir:
+            if self.estado != ABERTO:
+                logger.warning(
+                    f"⚠️ Circuito do upstream {self.nome} aberto por {self.config.tempo_aberto:.0f}s "
+                    f"após {self.falhas_seguidas} falhas"
+                )
+            self.estado = ABERTO
+            self.aberto_ate = time.monotonic() + self.config.tempo_aberto
+
+    # ---------- requisições ----------
+
+    def _registrar(self, inicio: float, status: Optional[int]) -> None:
+        duracao = time.perf_counter() - inicio
+        self.requisicoes += 1
+        self.latencia_total_s += duracao
+        self.latencia_max_s = max(self.latencia_max_s, duracao)
+        chave = str(status) if status is not None else "erro_rede"
+        self.por_status[chave] = self.por_status.get(chave, 0) + 1
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Como httpx.AsyncClient.request, com retry/backoff e circuit breaker"""
+        method = method.upper()
+        idempotente = method in METODOS_IDEMPOTENTES
+        tentativa = 0
+
+        while True:
+            tentativa += 1
+            self._liberar()
+            inicio = time.perf_counter()
+            try:
+                response = await self.client.request(method, url, **kwargs)
+            except asyncio.CancelledError:
+                self._teste_em_andamento = False
+                raise
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                # Não chegou ao servidor: pode repetir mesmo em POST
+                self._registrar(inicio, None)
+                self._falha()
+                erro, pode_repetir = e, True
+            except httpx.TransportError as e:
+                self._registrar(inicio, None)
+                self._falha()
+                erro, pode_repetir = e, idempotente
+            else:
+                self._registrar(inicio, response.status_code)
+                if response.status_code >= 500:
+                    self._falha()
+                else:
+                    self._sucesso()
+                if response.status_code not in STATUS_RETRY or not idempotente or tentativa >= self.config.tentativas:
+                    if response.status_code >= 500:
+                        self.erros += 1
+                    return response
+                erro, pode_repetir = None, True
+
+            if erro is not None and (not pode_repetir or tentativa >= self.config.tentativas):
+                self.erros += 1
+                raise erro
+
+            self.retries += 1
+            espera = min(self.config.backoff_base * (2 ** (tentativa - 1)), self.config.backoff_max)
+            await asyncio.sleep(espera * (0.5 + random.random() / 2))
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def put(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("PUT", url, **kwargs)
+
+    async def delete(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("DELETE", url, **kwargs)
+
+    async def fechar(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def estatisticas(self) -> Dict[str, Any]:
+        return {
+            "circuito": self.estado,
+            "falhas_seguidas": self.falhas_seguidas,
+            "requisicoes": self.requisicoes,
+            "erros": self.erros,
+            "retries": self.retries,
+            "rejeitadas_circuito": self.rejeitadas,
+            "latencia_media_s": round(self.latencia_total_s / self.requisicoes, 4) if self.requisicoes else None,
+            "latencia_max_s": round(self.latencia_max_s, 4),
+            "por_status": dict(self.por_status),
+        }
+
+
+class RegistroHttp:
+    def __init__(self):
+        self._upstreams: Dict[str, Upstream] = {}
+
+    def registrar(self, nome: str, config: ConfigUpstream) -> Upstream:
+        self._upstreams[nome] = Upstream(nome, config)
+        return self._upstreams[nome]
+
+    def cliente(self, nome: str) -> Upstream:
+        return self._upstreams[nome]
+
+    async def fechar(self) -> None:
+        for upstream in self._upstreams.values():
+            await upstream.fechar()
+
+    def estatisticas(self) -> Dict[str, Any]:
+        return {nome: u.estatisticas() for nome, u in self._upstreams.items()}
+
+
+http_clients = RegistroHttp()
+# Asaas: a URL varia por gateway (sandbox/produção), então as chamadas usam URL absoluta
+http_clients.registrar("asaas", ConfigUpstream(timeout=20.0, max_conexoes=20))
+http_clients.registrar("expo", ConfigUpstream(base_url="https://exp.host", timeout=15.0, max_conexoes=10))
+http_clients.registrar("whatsapp", ConfigUpstream(
+    base_url="http://localhost:8002", base_url_env="WHATSAPP_SERVICE_URL",
+    timeout=10.0, max_conexoes=10, tentativas=2, falhas_para_abrir=3, tempo_aberto=15.0
+))
+
+EXPO_PUSH_PATH = "/--/api/v2/push/send"
@@ -0,0 +1,256 @@
+# Motor de importação de transações (CSV, Excel, OFX e PDF)
+#
+# Todos os formatos viram um DataFrame com as colunas data/tipo/fornecedor/valor
+# (+ descricao, categoria_id, centro_custo_id opcionais). A validação e a
+# normalização são feitas com operações de coluna do pandas fora do event loop,
+# a gravação usa insert_many(ordered=False) em lotes e o resultado traz os
+# erros por linha e a vazão (linhas/s). Depois da gravação, a previsão de
+# fluxo de caixa e as análises de anomalias em cache da empresa são
+# descartadas e refeitas na próxima consulta.
+import io
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from ofxparse import OfxParser
+from PyPDF2 import PdfReader
+from pymongo.errors import BulkWriteError
+
+from services.anomalias import motor_anomalias
+from services.executores import executores
+from services.previsao_fluxo import previsao_fluxo
+from services.rollup import registrar_transacoes
+
+COLUNAS_OBRIGATORIAS = ["data", "tipo", "fornecedor", "valor"]
+TAMANHO_LOTE = 1000
+# Quantidade máxima de erros detalhados devolvidos na resposta
+LIMITE_ERROS = 1000
+
+# Callback de progresso: (percentual 0-100, mensagem)
+Progresso = Callable[[float, str], Awaitable[Any]]
+
+
+def _ler_planilha(contents: bytes, formato: str) -> pd.DataFrame:
+    leitor = pd.read_csv if formato == "csv" else pd.read_excel
+    return leitor(io.BytesIO(contents))
+
+
+async def ler_planilha(contents: bytes, formato: str) -> pd.DataFrame:
+    """Lê CSV ou Excel no pool de processos"""
+    return await executores.processo(_ler_planilha, contents, formato, nome=f"ler_{formato}")
+
+
+def dataframe_ofx(contents: bytes) -> Tuple[pd.DataFrame, str]:
+    """Transações do extrato OFX e número da conta; o tipo vem do sinal do valor"""
+    ofx = OfxParser.parse(io.BytesIO(contents))
+    account = ofx.account
+    df = pd.DataFrame(
+        [
+            {
+                "data": transaction.date,
+                "tipo": "receita" if transaction.amount > 0 else "despesa",
+                "fornecedor": transaction.payee or "Não informado",
+                "valor": float(abs(transaction.amount)),
+                "descricao": transaction.memo or ""
+            }
+            for transaction in account.statement.transactions
+        ],
+        columns=COLUNAS_OBRIGATORIAS + ["descricao"]
+    )
+    return df, account.number if hasattr(account, 'number') else "N/A"
+
+
+def extrair_texto_pdf(contents: bytes) -> str:
+    """Texto de todas as páginas do PDF"""
+    pdf_reader = PdfReader(io.BytesIO(contents))
+    return "".join((page.extract_text() or "") + "\n" for page in pdf_reader.pages)
+
+
+def colunas_faltando(df: pd.DataFrame) -> List[str]:
+    return [col for col in COLUNAS_OBRIGATORIAS if col not in df.columns]
+
+
+def _normalizar_valores(serie: pd.Series) -> pd.Series:
+    """Aceita números e textos como '1234.56', '1,234.56', '1.234,56' ou 'R$ 10,00'
+
+    O separador decimal é o último entre vírgula e ponto; uma vírgula repetida
+    ('1,234,567') é separador de milhar.
+    """
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.astype(float)
+    texto = serie.astype(str).str.replace("R$", "", regex=False).str.strip()
+    virgula_decimal = (texto.str.rfind(",") > texto.str.rfind(".")) & (texto.str.count(",") == 1)
+    texto = texto.str.replace(",", "", regex=False).where(
+        ~virgula_decimal,
+        texto.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    )
+    return pd.to_numeric(texto, errors="coerce")
+
+
+def _normalizar_datas(serie: pd.Series) -> pd.Series:
+    """Datas em YYYY-MM-DD; aceita datetime, ISO e dd/mm/aaaa. Inválidas viram NaN."""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        datas = serie
+    else:
+        texto = serie.astype(str).str.strip()
+        datas = pd.to_datetime(texto.str[:10], format="%Y-%m-%d", errors="coerce")
+        faltando = datas.isna()
+        if faltando.any():
+            datas[faltando] = pd.to_datetime(texto[faltando], format="%d/%m/%Y", errors="coerce")
+    return datas.dt.strftime("%Y-%m-%d")
+
+
+def _coluna_id(df: pd.DataFrame, coluna: str, padrao: Optional[str]) -> pd.Series:
+    if coluna not in df.columns:
+        return pd.Series(padrao, index=df.index, dtype=object)
+    serie = df[coluna].astype(object)
+    return serie.where(serie.notna(), padrao).map(lambda v: None if v is None else str(v))
+
+
+def normalizar_transacoes(
+    df: pd.DataFrame,
+    empresa_id: str,
+    usuario_id: str,
+    origem: str,
+    status: str = "concluido",
+    categoria_padrao: Optional[str] = None,
+    centro_custo_padrao: Optional[str] = None,
+    linha_inicial: int = 2
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Valida e monta os documentos de transação. Retorna (documentos, erros por linha).
+
+    linha_inicial é o número exibido para a primeira linha (2 em planilhas com cabeçalho).
+    """
+    df = df.reset_index(drop=True)
+    linhas = np.arange(len(df)) + linha_inicial
+
+    valor = _normalizar_valores(df["valor"])
+    tipo = df["tipo"].astype(str).str.strip().str.lower()
+    data = _normalizar_datas(df["data"])
+
+    # Primeira regra violada de cada linha; o tipo é gravado como veio, em minúsculas
+    regras = [
+        (valor.isna(), "valor inválido"),
+        (data.isna(), "data inválida"),
+    ]
+    mensagem = pd.Series(
+        np.select([r for r, _ in regras], [m for _, m in regras], default=""),
+        index=df.index
+    )
+    invalidas = mensagem != ""
+    erros = [
+        {"linha": int(linha), "erro": msg}
+        for linha, msg in zip(linhas[invalidas.to_numpy()], mensagem[invalidas])
+    ]
+
+    validas = ~invalidas
+    n = int(validas.sum())
+    if not n:
+        return [], erros
+
+    descricao = df["descricao"].fillna("").astype(str) if "descricao" in df.columns else pd.Series("", index=df.index)
+    saida = pd.DataFrame({
+        "id": [str(uuid.uuid4()) for _ in range(n)],
+        "empresa_id": empresa_id,
+        "usuario_id": usuario_id,
+        "tipo": tipo[validas].to_numpy(),
+        "fornecedor": df["fornecedor"][validas].fillna("Não informado").astype(str).str.strip().to_numpy(),
+        "valor_total": valor[validas].to_numpy(),
+        "data_competencia": data[validas].to_numpy(),
+        "categoria_id": _coluna_id(df, "categoria_id", categoria_padrao)[validas].to_numpy(),
+        "centro_custo_id": _coluna_id(df, "centro_custo_id", centro_custo_padrao)[validas].to_numpy(),
+        "descricao": descricao[validas].to_numpy(),
+        "status": status,
+        "origem": origem,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "_linha": linhas[validas.to_numpy()],
+    })
+    # NaN/None -> None (ex: empresa sem categoria padrão)
+    saida = saida.astype(object).where(saida.notna(), None)
+    return saida.to_dict("records"), erros
+
+
+async def inserir_em_lotes(
+    collection,
+    docs: List[Dict[str, Any]],
+    tamanho_lote: int = TAMANHO_LOTE,
+    progresso: Optional[Progresso] = None
+):
+    """insert_many(ordered=False) por lote. Retorna (inseridos, [(indice, erro)])."""
+    inseridos: List[Dict[str, Any]] = []
+    falhas: List[Tuple[int, str]] = []
+
+    for inicio in range(0, len(docs), tamanho_lote):
+        lote = docs[inicio:inicio + tamanho_lote]
+        try:
+            await collection.insert_many(lote, ordered=False)
+            inseridos.extend(lote)
+        except BulkWriteError as e:
+            # Com ordered=False o restante do lote é gravado; só as linhas com erro ficam de fora
+            com_erro = {err["index"]: err.get("errmsg", "erro de gravação") for err in e.details.get("writeErrors", [])}
+            for i, doc in enumerate(lote):
+                if i in com_erro:
+                    falhas.append((inicio + i, com_erro[i]))
+                else:
+                    inseridos.append(doc)
+
+        if progresso:
+            feitos = min(inicio + tamanho_lote, len(docs))
+            await progresso(100 * feitos / len(docs), f"{feitos}/{len(docs)} linhas gravadas")
+
+    return inseridos, falhas
+
+
+async def importar_transacoes(
+    db,
+    df: pd.DataFrame,
+    empresa_id: str,
+    usuario_id: str,
+    origem: str,
+    status: str = "concluido",
+    linha_inicial: int = 2,
+    progresso: Optional[Progresso] = None
+) -> Dict[str, Any]:
+    """Caminho único de importação: normaliza, grava em lotes e atualiza o rollup.
+
+    `progresso` (opcional) é chamado a cada lote gravado, ex: JobContext.progresso.
+    """
+    inicio = time.perf_counter()
+
+    # Categoria e centro de custo padrão da empresa
+    categoria = await db.categorias.find_one({"empresa_id": empresa_id}, {"_id": 0, "id": 1})
+    centro_custo = await db.centros_custo.find_one({"empresa_id": empresa_id}, {"_id": 0, "id": 1})
+
+    docs, erros = await executores.thread(
+        normalizar_transacoes, df, empresa_id, usuario_id, origem, status,
+        categoria["id"] if categoria else None,
+        centro_custo["id"] if centro_custo else None,
+        linha_inicial
+    )
+    linhas_docs = [doc.pop("_linha") for doc in docs]
+
+    inseridas, falhas = await inserir_em_lotes(db.transacoes, docs, progresso=progresso)
+    erros.extend({"linha": int(linhas_docs[i]), "erro": msg} for i, msg in falhas)
+    erros.sort(key=lambda e: e["linha"])
+
+    await registrar_transacoes(db, inseridas)
+    if inseridas:
+        # Um refit só na próxima consulta sai mais barato que aplicar milhares de linhas uma a uma
+        previsao_fluxo.invalidar(empresa_id)
+        motor_anomalias.invalidar(empresa_id)
+
+    duracao = time.perf_counter() - inicio
+    return {
+        "status": "success",
+        "imported": len(inseridas),
+        "total": len(df),
+        # Formato antigo (texto), exibido pelo frontend
+        "errors": [f"Linha {e['linha']}: {e['erro']}" for e in erros[:10]],
+        "num_erros": len(erros),
+        "erros_por_linha": erros[:LIMITE_ERROS],
+        "duracao_s": round(duracao, 3),
+        "linhas_por_segundo": round(len(df) / duracao, 1) if duracao > 0 else None
+    }
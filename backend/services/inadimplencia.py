@@ -0,0 +1,198 @@
+# Verificação de assinaturas SaaS inadimplentes
+#
+# Cada assinatura ativa com asaas_subscription_id gera um GET /payments
+# (status OVERDUE) no Asaas. As consultas rodam em paralelo limitado por um
+# semáforo (ASAAS_CONCORRENCIA) e por um limitador de taxa
+# (ASAAS_REQ_POR_SEGUNDO); 429/5xx já são repetidos com backoff pelo cliente
+# HTTP compartilhado. Uma falha numa assinatura entra em "erros" e não
+# interrompe as outras.
+#
+# Terminadas as consultas, as mudanças são gravadas de uma vez: bulk_write em
+# assinaturas_saas (dias_atraso, suspensão), bulk_write em empresas (bloqueio)
+# e um insert_many na outbox com os emails de cobrança/aviso/bloqueio.
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from services.http_clients import http_clients
+
+logger = logging.getLogger(__name__)
+
+DIAS_AVISO = 3
+DIAS_BLOQUEIO = 5
+
+ACAO_COBRANCA = "email_cobranca"
+ACAO_AVISO = "aviso_suspensao"
+ACAO_BLOQUEIO = "bloqueada"
+
+# Campos usados no processamento (o documento completo não é necessário)
+PROJECAO_ASSINATURA = {
+    "_id": 0, "id": 1, "asaas_subscription_id": 1, "cnpj_cpf": 1,
+    "email": 1, "razao_social": 1, "valor_mensal": 1,
+}
+
+Progresso = Callable[[float, str], Awaitable[None]]
+
+
+def classificar(dias_atraso: int) -> str:
+    if dias_atraso >= DIAS_BLOQUEIO:
+        return ACAO_BLOQUEIO
+    if dias_atraso >= DIAS_AVISO:
+        return ACAO_AVISO
+    return ACAO_COBRANCA
+
+
+class LimiteTaxa:
+    """Espaça as chamadas para no máximo `por_segundo` inícios por segundo"""
+
+    def __init__(self, por_segundo: float):
+        self.intervalo = 1.0 / por_segundo if por_segundo > 0 else 0.0
+        self._proximo = 0.0
+        self._lock = asyncio.Lock()
+
+    async def aguardar(self) -> None:
+        if not self.intervalo:
+            return
+        async with self._lock:
+            agora = time.monotonic()
+            inicio = max(agora, self._proximo)
+            self._proximo = inicio + self.intervalo
+        if inicio > agora:
+            await asyncio.sleep(inicio - agora)
+
+
+async def consultar_atraso(upstream, base_url: str, api_key: str, subscription_id: str) -> Optional[int]:
+    """Dias de atraso da cobrança OVERDUE mais antiga retornada, ou None se não houver"""
+    resp = await upstream.get(
+        f"{base_url}/payments",
+        params={"subscription": subscription_id, "status": "OVERDUE"},
+        headers={"access_token": api_key}
+    )
+    resp.raise_for_status()
+    cobrancas = resp.json().get("data") or []
+    if not cobrancas:
+        return None
+    vencimento = datetime.strptime(cobrancas[0]["dueDate"], "%Y-%m-%d")
+    return (datetime.now() - vencimento).days
+
+
+def _email(acao: str, assinatura: Dict[str, Any], dias_atraso: int) -> Dict[str, Any]:
+    dados: Dict[str, Any] = {"razao_social": assinatura.get("razao_social", "")}
+    if acao == ACAO_BLOQUEIO:
+        template = "bloqueio"
+        dados["dias_atraso"] = dias_atraso
+    elif acao == ACAO_AVISO:
+        template = "aviso_suspensao"
+        dados.update(dias_atraso=dias_atraso, dias_restantes=DIAS_BLOQUEIO - dias_atraso)
+    else:
+        template = "cobranca"
+        dados["valor_mensal"] = f"{assinatura.get('valor_mensal') or 0:.2f}"
+    return {"template": template, "para": assinatura["email"], "dados": dados}
+
+
+async def verificar_inadimplentes(
+    db,
+    api_key: str,
+    base_url: str,
+    outbox,
+    invalidar_empresa: Callable[[str], None],
+    progresso: Optional[Progresso] = None,
+    concorrencia: Optional[int] = None,
+    req_por_segundo: Optional[float] = None,
+    upstream=None,
+) -> Dict[str, Any]:
+    concorrencia = concorrencia or int(os.environ.get("ASAAS_CONCORRENCIA", "8"))
+    if req_por_segundo is None:
+        req_por_segundo = float(os.environ.get("ASAAS_REQ_POR_SEGUNDO", "10"))
+    upstream = upstream or http_clients.cliente("asaas")
+
+    assinaturas = await db.assinaturas_saas.find(
+        {"status": "ativa", "asaas_subscription_id": {"$nin": [None, ""]}},
+        PROJECAO_ASSINATURA
+    ).to_list(None)
+    total = len(assinaturas)
+    inicio = time.perf_counter()
+
+    semaforo = asyncio.Semaphore(concorrencia)
+    limite = LimiteTaxa(req_por_segundo)
+
+    async def verificar(assinatura: Dict[str, Any]):
+        async with semaforo:
+            await limite.aguardar()
+            try:
+                dias = await consultar_atraso(upstream, base_url, api_key, assinatura["asaas_subscription_id"])
+                return assinatura, dias, None
+            except Exception as e:
+                return assinatura, None, f"{type(e).__name__}: {e}"
+
+    atrasadas: List[tuple] = []
+    erros: List[Dict[str, Any]] = []
+    passo = max(1, total // 20)
+    tarefas = [asyncio.ensure_future(verificar(a)) for a in assinaturas]
+    try:
+        for concluidas, tarefa in enumerate(asyncio.as_completed(tarefas), start=1):
+            assinatura, dias, erro = await tarefa
+            if erro:
+                erros.append({"assinatura": assinatura.get("razao_social"), "id": assinatura["id"], "erro": erro})
+            elif dias is not None:
+                atrasadas.append((assinatura, dias))
+            if progresso and (concluidas % passo == 0 or concluidas == total):
+                await progresso(
+                    90 * concluidas / total,
+                    f"{concluidas}/{total} assinaturas verificadas, {len(atrasadas)} em atraso, {len(erros)} erros"
+                )
+    finally:
+        # Cancelamento do job (ou erro) não deixa consultas soltas
+        for tarefa in tarefas:
+            tarefa.cancel()
+
+    if progresso:
+        await progresso(95, f"Aplicando {len(atrasadas)} atualizações")
+
+    agora = datetime.now(timezone.utc).isoformat()
+    ops_assinaturas = []
+    cnpjs_bloqueio = []
+    emails = []
+    resultados = []
+    for assinatura, dias in atrasadas:
+        acao = classificar(dias)
+        campos: Dict[str, Any] = {"dias_atraso": dias}
+        if acao == ACAO_BLOQUEIO:
+            campos.update(status="suspensa", bloqueada_em=agora)
+            if assinatura.get("cnpj_cpf"):
+                cnpjs_bloqueio.append(assinatura["cnpj_cpf"])
+        ops_assinaturas.append(UpdateOne({"id": assinatura["id"]}, {"$set": campos}))
+        if assinatura.get("email"):
+            emails.append(_email(acao, assinatura, dias))
+        resultados.append({"assinatura": assinatura.get("razao_social"), "acao": acao, "dias_atraso": dias})
+
+    if ops_assinaturas:
+        await db.assinaturas_saas.bulk_write(ops_assinaturas, ordered=False)
+    if cnpjs_bloqueio:
+        await db.empresas.bulk_write([
+            UpdateOne({"cnpj": cnpj}, {"$set": {"is_blocked": True, "block_reason": "Inadimplência"}})
+            for cnpj in cnpjs_bloqueio
+        ], ordered=False)
+        async for empresa in db.empresas.find({"cnpj": {"$in": cnpjs_bloqueio}}, {"_id": 0, "id": 1}):
+            invalidar_empresa(empresa["id"])
+    if emails:
+        await outbox.enfileirar_templates(emails)
+
+    duracao = time.perf_counter() - inicio
+    logger.info(
+        f"✅ Inadimplência: {total} assinaturas em {duracao:.1f}s, "
+        f"{len(resultados)} em atraso, {len(cnpjs_bloqueio)} bloqueadas, {len(erros)} erros"
+    )
+    return {
+        "processadas": len(resultados),
+        "verificadas": total,
+        "bloqueadas": len(cnpjs_bloqueio),
+        "duracao_s": round(duracao, 2),
+        "resultados": resultados,
+        "erros": erros,
+    }
@@ -0,0 +1,297 @@
+# Registro declarativo de índices do MongoDB
+#
+# Único lugar onde os índices das coleções são declarados. Tanto o server.py
+# (monolítico) quanto o server_new.py (routers) aplicam este registro no
+# startup, e o relatório abaixo compara o registro com o que existe no banco.
+import logging
+from typing import Any, Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Cada entrada: {"keys": [(campo, direção), ...], **opções do create_index}
+INDEX_REGISTRY: Dict[str, List[Dict[str, Any]]] = {
+    "users": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("email", ASCENDING)], "unique": True},
+        {"keys": [("empresa_ids", ASCENDING)]},
+        # Roteamento de mensagens do WhatsApp (services/telefones.py)
+        {"keys": [("telefone_normalizado", ASCENDING)], "partialFilterExpression": {"telefone_normalizado": {"$type": "string"}}},
+    ],
+    "empresas": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("created_at", DESCENDING)]},
+        # Bloqueio por inadimplência localiza a empresa pelo CNPJ da assinatura
+        {"keys": [("cnpj", ASCENDING)]},
+    ],
+    "transacoes": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        # id no final: exportação de relatórios ordena por (data_competencia, id)
+        {"keys": [("empresa_id", ASCENDING), ("data_competencia", ASCENDING), ("id", ASCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("categoria_id", ASCENDING), ("data_competencia", ASCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("centro_custo_id", ASCENDING), ("data_competencia", ASCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("conta_bancaria_id", ASCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("origem", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+    ],
+    "transacoes_rollup": [
+        {
+            "keys": [
+                ("empresa_id", ASCENDING), ("mes", ASCENDING), ("tipo", ASCENDING),
+                ("categoria_id", ASCENDING), ("centro_custo_id", ASCENDING), ("conta_bancaria_id", ASCENDING)
+            ],
+            "unique": True
+        },
+    ],
+    "categorias": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("empresa_id", ASCENDING)]},
+    ],
+    "centros_custo": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("empresa_id", ASCENDING)]},
+    ],
+    "contas_bancarias": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("empresa_id", ASCENDING), ("ativa", ASCENDING)]},
+    ],
+    "cartoes_credito": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("empresa_id", ASCENDING), ("ativo", ASCENDING)]},
+    ],
+    "leads": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("empresa_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("status_funil", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("assigned_to", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+        # Um lead por telefone em cada empresa; leads sem telefone válido ficam fora do índice
+        {"keys": [("empresa_id", ASCENDING), ("telefone_normalizado", ASCENDING)], "unique": True,
+         "partialFilterExpression": {"telefone_normalizado": {"$type": "string"}}},
+    ],
+    "activities": [
+        {"keys": [("lead_id", ASCENDING), ("created_at", DESCENDING)]},
+    ],
+    "ordens_servico": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("empresa_id", ASCENDING), ("numero", ASCENDING)], "unique": True},
+        {"keys": [("empresa_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+        {"keys": [("tecnico_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+        {"keys": [("equipamentos_instalados", ASCENDING)]},
+        {"keys": [("equipamentos_retirados", ASCENDING)]},
+    ],
+    "equipamentos_tecnicos": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("empresa_id", ASCENDING), ("numero_serie", ASCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("ativo", ASCENDING), ("status", ASCENDING)]},
+        {"keys": [("numero_serie", ASCENDING)]},
+    ],
+    "estoque_tecnico": [
+        {"keys": [("tecnico_id", ASCENDING)]},
+        {"keys": [("empresa_id", ASCENDING)]},
+    ],
+    "manutencoes_equipamentos": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("equipamento_id", ASCENDING), ("data_entrada", DESCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("data_entrada", DESCENDING)]},
+    ],
+    "movimentacoes_estoque": [
+        {"keys": [("empresa_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("equipamento_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+    ],
+    "logs_acoes": [
+        {"keys": [("empresa_id", ASCENDING), ("timestamp", DESCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("modulo", ASCENDING), ("timestamp", DESCENDING)]},
+    ],
+    "logs_sessoes": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("empresa_id", ASCENDING), ("login_at", DESCENDING)]},
+    ],
+    "clientes": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("empresa_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+    ],
+    "clientes_venda": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("empresa_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("telefone_normalizado", ASCENDING)],
+         "partialFilterExpression": {"telefone_normalizado": {"$type": "string"}}},
+    ],
+    "vendas_servico": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("empresa_id", ASCENDING), ("created_at", DESCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("numero", ASCENDING)], "unique": True},
+    ],
+    "faturas": [
+        {"keys": [("empresa_id", ASCENDING), ("data_vencimento", DESCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("numero", ASCENDING)], "unique": True},
+    ],
+    "cobrancas": [
+        {"keys": [("empresa_id", ASCENDING), ("data_vencimento", DESCENDING)]},
+        {"keys": [("asaas_payment_id", ASCENDING)]},
+    ],
+    "assinaturas_saas": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("status", ASCENDING)]},
+    ],
+    "drive_credentials": [
+        {"keys": [("user_id", ASCENDING)]},
+    ],
+    "email_outbox": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("status", ASCENDING), ("proxima_tentativa_em", ASCENDING)]},
+        {"keys": [("lote_id", ASCENDING)], "sparse": True},
+    ],
+    "jobs": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("status", ASCENDING), ("proxima_tentativa_em", ASCENDING)]},
+        {"keys": [("empresa_id", ASCENDING), ("created_at", DESCENDING)]},
+        {"keys": [("user_id", ASCENDING), ("created_at", DESCENDING)]},
+    ],
+    "backup_catalogo": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("tipo", ASCENDING), ("criado_em", DESCENDING)]},
+        {"keys": [("base_id", ASCENDING), ("sequencia", ASCENDING)]},
+    ],
+    "backup_tombstones": [
+        {"keys": [("excluido_em", ASCENDING)]},
+    ],
+    "execucoes_agendadas": [
+        {"keys": [("tarefa", ASCENDING), ("inicio", DESCENDING)]},
+        # Histórico de 90 dias
+        {"keys": [("inicio", DESCENDING)], "expireAfterSeconds": 90 * 24 * 3600},
+    ],
+    "saldos_lancamentos": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        # Cauda depois do snapshot (conta_id + _id > corte)
+        {"keys": [("conta_id", ASCENDING), ("_id", ASCENDING)]},
+        # Saldo em uma data, coberto pelo índice
+        {"keys": [("conta_id", ASCENDING), ("data", ASCENDING), ("valor", ASCENDING)]},
+        {"keys": [("transacao_id", ASCENDING)], "sparse": True},
+        # Uma abertura por conta; também responde "a conta já está no ledger?"
+        {"keys": [("conta_id", ASCENDING)], "unique": True, "partialFilterExpression": {"origem": "abertura"}},
+    ],
+    "saldos_snapshots": [
+        {"keys": [("empresa_id", ASCENDING)]},
+    ],
+}
+
+# Consultas mais frequentes, verificadas com explain() para detectar COLLSCAN.
+# Os valores são apenas marcadores: o plano depende da forma do filtro.
+HOT_QUERIES: List[Dict[str, Any]] = [
+    {"collection": "users", "filter": {"id": "_"}},
+    {"collection": "transacoes", "filter": {"empresa_id": "_"}, "sort": [("created_at", DESCENDING), ("id", DESCENDING)]},
+    {"collection": "transacoes", "filter": {"empresa_id": "_", "data_competencia": {"$gte": "2000-01-01", "$lt": "2000-02-01"}}},
+    {"collection": "transacoes", "filter": {"empresa_id": "_", "data_competencia": {"$gte": "2000-01-01", "$lte": "2000-01-31"}}, "sort": [("data_competencia", ASCENDING), ("id", ASCENDING)]},
+    {"collection": "leads", "filter": {"empresa_id": "_"}, "sort": [("created_at", DESCENDING), ("id", DESCENDING)]},
+    {"collection": "leads", "filter": {"empresa_id": "_", "status_funil": "_"}, "sort": [("created_at", DESCENDING), ("id", DESCENDING)]},
+    {"collection": "leads", "filter": {"empresa_id": "_", "telefone_normalizado": "+5511900000000"}},
+    {"collection": "users", "filter": {"telefone_normalizado": "+5511900000000"}},
+    {"collection": "ordens_servico", "filter": {"empresa_id": "_"}, "sort": [("created_at", DESCENDING), ("id", DESCENDING)]},
+    {"collection": "equipamentos_tecnicos", "filter": {"empresa_id": "_", "ativo": True}},
+    {"collection": "equipamentos_tecnicos", "filter": {"empresa_id": "_", "numero_serie": "_"}},
+    {"collection": "logs_acoes", "filter": {"empresa_id": "_"}, "sort": [("timestamp", DESCENDING)]},
+    {"collection": "movimentacoes_estoque", "filter": {"empresa_id": "_"}, "sort": [("created_at", DESCENDING), ("id", DESCENDING)]},
+    {"collection": "activities", "filter": {"lead_id": "_"}, "sort": [("created_at", DESCENDING)]},
+    {"collection": "saldos_lancamentos", "filter": {"conta_id": "_", "data": {"$lte": "2000-01-31"}}},
+]
+
+
+def index_name(keys: List[tuple]) -> str:
+    """Nome padrão gerado pelo MongoDB para um índice (ex: empresa_id_1_created_at_-1)"""
+    return "_".join(f"{campo}_{direcao}" for campo, direcao in keys)
+
+
+def _index_models(specs: List[Dict[str, Any]]) -> List[IndexModel]:
+    models = []
+    for spec in specs:
+        opcoes = {k: v for k, v in spec.items() if k != "keys"}
+        models.append(IndexModel(spec["keys"], name=index_name(spec["keys"]), **opcoes))
+    return models
+
+
+async def aplicar_indices(db, registry: Dict[str, List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Cria (idempotente) todos os índices do registro. Falhas são isoladas por índice."""
+    registry = registry or INDEX_REGISTRY
+    criados = 0
+    falhas = []
+
+    for colecao, specs in registry.items():
+        for model in _index_models(specs):
+            try:
+                await db[colecao].create_indexes([model])
+                criados += 1
+            except PyMongoError as e:
+                # Ex: dados duplicados impedindo um índice único
+                falhas.append({"colecao": colecao, "indice": model.document["name"], "erro": str(e)})
+                logger.warning(f"⚠️ Falha ao criar índice {colecao}.{model.document['name']}: {e}")
+
+    logger.info(f"✅ Índices do MongoDB verificados: {criados} ok, {len(falhas)} falhas")
+    return {"verificados": criados, "falhas": falhas}
+
+
+async def relatorio_indices(db, registry: Dict[str, List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Compara o registro com os índices existentes: faltantes e extras por coleção"""
+    registry = registry or INDEX_REGISTRY
+    relatorio = {}
+
+    for colecao, specs in registry.items():
+        esperados = {index_name(spec["keys"]) for spec in specs}
+        try:
+            existentes = set((await db[colecao].index_information()).keys())
+        except PyMongoError:
+            # Coleção ainda não existe
+            existentes = set()
+        existentes.discard("_id_")
+
+        faltando = sorted(esperados - existentes)
+        extras = sorted(existentes - esperados)
+        if faltando or extras:
+            relatorio[colecao] = {"faltando": faltando, "extras": extras}
+
+    return relatorio
+
+
+def _estagios(plano: Any) -> List[str]:
+    """Percorre recursivamente a árvore do plano de execução coletando os estágios"""
+    estagios = []
+    if isinstance(plano, dict):
+        if "stage" in plano:
+            estagios.append(plano["stage"])
+        for valor in plano.values():
+            estagios.extend(_estagios(valor))
+    elif isinstance(plano, list):
+        for item in plano:
+            estagios.extend(_estagios(item))
+    return estagios
+
+
+async def verificar_collscan(db, queries: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Executa explain() nas consultas quentes e retorna as que ainda fazem COLLSCAN"""
+    queries = queries or HOT_QUERIES
+    problemas = []
+
+    for q in queries:
+        cursor = db[q["collection"]].find(q["filter"])
+        if q.get("sort"):
+            cursor = cursor.sort(q["sort"])
+        try:
+            explain = await cursor.explain()
+        except PyMongoError as e:
+            logger.warning(f"⚠️ explain() falhou em {q['collection']}: {e}")
+            continue
+
+        estagios = _estagios(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        if "COLLSCAN" in estagios:
+            problemas.append({
+                "colecao": q["collection"],
+                "filtro": list(q["filter"].keys()),
+                "sort": [campo for campo, _ in q.get("sort", [])],
+                "estagios": estagios,
+            })
+
+    for p in problemas:
+        logger.warning(f"⚠️ COLLSCAN em {p['colecao']} filtro={p['filtro']} sort={p['sort']}")
+    return problemas
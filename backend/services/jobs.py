@@ -0,0 +1,380 @@
+# Fila de jobs em background (importações, relatórios, backups, inadimplência)
+#
+# Os jobs ficam na coleção `jobs` e são executados por um pool de workers
+# asyncio no próprio processo. Uma rota enfileira e devolve o id na hora; o
+# cliente acompanha status/progresso/resultado por GET /jobs/{id}. Arquivos de
+# entrada (uploads) e de saída (relatórios, backups) ficam no GridFS.
+#
+# Ciclo de vida: pendente -> executando -> concluido | falhou | cancelado.
+# Uma falha volta para pendente com backoff exponencial até max_tentativas.
+# Jobs "executando" sem heartbeat (processo morreu) ou interrompidos pelo
+# shutdown voltam para a fila; a execução interrompida conta como tentativa, e
+# quem já usou max_tentativas falha em vez de voltar (um handler que derruba o
+# processo não fica em loop).
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import IO, Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = "jobs"
+ARQUIVOS_BUCKET = "jobs_arquivos"
+
+STATUS_PENDENTE = "pendente"
+STATUS_EXECUTANDO = "executando"
+STATUS_CONCLUIDO = "concluido"
+STATUS_FALHOU = "falhou"
+STATUS_CANCELADO = "cancelado"
+STATUS_FINAIS = [STATUS_CONCLUIDO, STATUS_FALHOU, STATUS_CANCELADO]
+
+ERRO_INTERROMPIDO = "Execução interrompida (worker encerrado) após esgotar as tentativas"
+
+
+class JobCancelado(Exception):
+    """Levantada dentro do handler quando o job foi cancelado"""
+
+
+def _agora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class JobContext:
+    """Passado ao handler: parâmetros, progresso e gravação de arquivos"""
+
+    def __init__(self, fila: "FilaJobs", job: Dict[str, Any]):
+        self.fila = fila
+        self.job = job
+
+    @property
+    def id(self) -> str:
+        return self.job["id"]
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        return self.job.get("params") or {}
+
+    async def progresso(self, percentual: float, mensagem: Optional[str] = None) -> None:
+        """Atualiza o progresso (0-100). Levanta JobCancelado se o job foi cancelado."""
+        campos: Dict[str, Any] = {"progresso": round(min(max(percentual, 0), 100), 1), "atualizado_em": _agora()}
+        if mensagem is not None:
+            campos["mensagem"] = mensagem
+        job = await self.fila.colecao.find_one_and_update(
+            {"id": self.id}, {"$set": campos}, projection={"_id": 0, "cancelar": 1}
+        )
+        if job and job.get("cancelar"):
+            raise JobCancelado()
+
+    async def salvar_arquivo(self, conteudo: Union[bytes, IO[bytes]], filename: str, media_type: str) -> Dict[str, Any]:
+        """Grava um arquivo de resultado (bytes ou arquivo aberto); o retorno pode ser usado como resultado do job"""
+        if isinstance(conteudo, bytes):
+            tamanho = len(conteudo)
+        else:
+            tamanho = conteudo.seek(0, 2)
+            conteudo.seek(0)
+        arquivo_id = await self.fila.salvar_arquivo(conteudo, filename, media_type, job_id=self.id)
+        return {"arquivo_id": arquivo_id, "filename": filename, "media_type": media_type, "tamanho": tamanho}
+
+
+Handler = Callable[[JobContext], Awaitable[Any]]
+
+
+class FilaJobs:
+    def __init__(
+        self,
+        db,
+        concorrencia: int = 2,
+        intervalo_poll: float = 2.0,
+        backoff_base: float = 5.0,
+        backoff_max: float = 600.0,
+        heartbeat: float = 30.0,
+        timeout_travado: float = 600.0,
+        retencao_dias: int = 7
+    ):
+        self.db = db
+        self.colecao = db[JOBS_COLLECTION]
+        self.concorrencia = concorrencia
+        self.intervalo_poll = intervalo_poll
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.heartbeat = heartbeat
+        self.timeout_travado = timeout_travado
+        self.retencao_dias = retencao_dias
+
+        self._handlers: Dict[str, Handler] = {}
+        self._workers: List[asyncio.Task] = []
+        self._tarefas: Dict[str, asyncio.Task] = {}
+        self._cancelados: set = set()
+        self._novo_job = asyncio.Event()
+        self._bucket: Optional[AsyncIOMotorGridFSBucket] = None
+
+    # ---------- registro e enfileiramento ----------
+
+    def handler(self, tipo: str):
+        """Decorator que registra a função que executa jobs de um tipo"""
+        def decorator(func: Handler) -> Handler:
+            self._handlers[tipo] = func
+            return func
+        return decorator
+
+    async def enfileirar(
+        self,
+        tipo: str,
+        params: Optional[Dict[str, Any]] = None,
+        empresa_id: Optional[str] = None,
+        user_id: Optional[str] = None,
+        max_tentativas: int = 3
+    ) -> Dict[str, Any]:
+        if tipo not in self._handlers:
+            raise ValueError(f"Tipo de job desconhecido: {tipo}")
+        agora = _agora()
+        job = {
+            "id": str(uuid.uuid4()),
+            "tipo": tipo,
+            "status": STATUS_PENDENTE,
+            "params": params or {},
+            "empresa_id": empresa_id,
+            "user_id": user_id,
+            "progresso": 0,
+            "mensagem": None,
+            "resultado": None,
+            "erro": None,
+            "tentativas": 0,
+            "max_tentativas": max_tentativas,
+            "cancelar": False,
+            "proxima_tentativa_em": agora,
+            "created_at": agora,
+            "atualizado_em": agora,
+            "started_at": None,
+            "finished_at": None,
+        }
+        await self.colecao.insert_one(job)
+        job.pop("_id", None)
+        self._novo_job.set()
+        return job
+
+    async def obter(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.colecao.find_one({"id": job_id}, {"_id": 0})
+
+    async def listar(self, filtro: Dict[str, Any], limit: int = 50) -> List[Dict[str, Any]]:
+        return await self.colecao.find(filtro, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit)
+
+    async def cancelar(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Pendente: cancela na hora. Executando: sinaliza e interrompe a tarefa local."""
+        job = await self.colecao.find_one_and_update(
+            {"id": job_id, "status": STATUS_PENDENTE},
+            {"$set": {"status": STATUS_CANCELADO, "cancelar": True, "finished_at": _agora()}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if job:
+            return job
+
+        job = await self.colecao.find_one_and_update(
+            {"id": job_id, "status": STATUS_EXECUTANDO},
+            {"$set": {"cancelar": True}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if job and job_id in self._tarefas:
+            # Em outro processo o heartbeat percebe a flag
+            self._cancelados.add(job_id)
+            self._tarefas[job_id].cancel()
+        return job or await self.obter(job_id)
+
+    # ---------- arquivos (GridFS) ----------
+
+    @property
+    def bucket(self) -> AsyncIOMotorGridFSBucket:
+        if self._bucket is None:
+            self._bucket = AsyncIOMotorGridFSBucket(self.db, bucket_name=ARQUIVOS_BUCKET)
+        return self._bucket
+
+    async def salvar_arquivo(self, conteudo: Union[bytes, IO[bytes]], filename: str, media_type: str, job_id: Optional[str] = None) -> str:
+        arquivo_id = await self.bucket.upload_from_stream(
+            filename, conteudo, metadata={"media_type": media_type, "job_id": job_id}
+        )
+        return str(arquivo_id)
+
+    async def ler_arquivo(self, arquivo_id: str) -> bytes:
+        stream = await self.bucket.open_download_stream(ObjectId(arquivo_id))
+        return await stream.read()
+
+    async def abrir_arquivo(self, arquivo_id: str):
+        """Stream de leitura (GridOut) para respostas em partes"""
+        return await self.bucket.open_download_stream(ObjectId(arquivo_id))
+
+    # ---------- workers ----------
+
+    async def iniciar(self) -> None:
+        if self._workers:
+            return
+        await self._recuperar_travados()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.concorrencia)]
+        self._workers.append(asyncio.create_task(self._manutencao()))
+        logger.info(f"✅ Fila de jobs iniciada com {self.concorrencia} workers")
+
+    async def parar(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _worker(self, numero: int) -> None:
+        while True:
+            try:
+                job = await self._reservar()
+            except Exception as e:
+                logger.warning(f"⚠️ Worker {numero}: erro ao buscar job: {e}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._novo_job.wait(), timeout=self.intervalo_poll)
+                except asyncio.TimeoutError:
+                    pass
+                self._novo_job.clear()
+                continue
+
+            await self._executar(job)
+
+    async def _reservar(self) -> Optional[Dict[str, Any]]:
+        """Pega atomicamente o próximo job pendente cujo horário já chegou"""
+        agora = _agora()
+        return await self.colecao.find_one_and_update(
+            {"status": STATUS_PENDENTE, "proxima_tentativa_em": {"$lte": agora}},
+            {
+                "$set": {"status": STATUS_EXECUTANDO, "started_at": agora, "atualizado_em": agora},
+                "$inc": {"tentativas": 1}
+            },
+            sort=[("proxima_tentativa_em", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _executar(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        handler = self._handlers.get(job["tipo"])
+        if handler is None:
+            await self._finalizar(job_id, STATUS_FALHOU, erro=f"Tipo de job desconhecido: {job['tipo']}")
+            return
+
+        tarefa = asyncio.create_task(handler(JobContext(self, job)))
+        self._tarefas[job_id] = tarefa
+        batimento = asyncio.create_task(self._batimento(job_id, tarefa))
+        try:
+            resultado = await tarefa
+            await self._finalizar(job_id, STATUS_CONCLUIDO, resultado=resultado)
+        except JobCancelado:
+            await self._finalizar(job_id, STATUS_CANCELADO)
+        except asyncio.CancelledError:
+            if job_id in self._cancelados:
+                await self._finalizar(job_id, STATUS_CANCELADO)
+            else:
+                # Worker encerrado (shutdown): a tentativa já foi contada em _reservar
+                if job.get("tentativas", 1) < job.get("max_tentativas", 1):
+                    await self.colecao.update_one(
+                        {"id": job_id}, {"$set": {"status": STATUS_PENDENTE, "proxima_tentativa_em": _agora()}}
+                    )
+                else:
+                    await self._finalizar(job_id, STATUS_FALHOU, erro=ERRO_INTERROMPIDO)
+                raise
+        except Exception as e:
+            await self._falha(job, e)
+        finally:
+            batimento.cancel()
+            self._tarefas.pop(job_id, None)
+            self._cancelados.discard(job_id)
+
+    async def _batimento(self, job_id: str, tarefa: asyncio.Task) -> None:
+        """Heartbeat do job em execução; também aplica cancelamentos feitos em outro processo"""
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                job = await self.colecao.find_one_and_update(
+                    {"id": job_id}, {"$set": {"atualizado_em": _agora()}}, projection={"_id": 0, "cancelar": 1}
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ Heartbeat do job {job_id} falhou: {e}")
+                continue
+            if job and job.get("cancelar"):
+                self._cancelados.add(job_id)
+                tarefa.cancel()
+                return
+
+    async def _finalizar(self, job_id: str, status: str, resultado: Any = None, erro: Optional[str] = None) -> None:
+        campos: Dict[str, Any] = {"status": status, "finished_at": _agora(), "atualizado_em": _agora()}
+        if status == STATUS_CONCLUIDO:
+            campos.update({"progresso": 100, "resultado": resultado, "erro": None})
+        if erro is not None:
+            campos["erro"] = erro
+        await self.colecao.update_one({"id": job_id}, {"$set": campos})
+
+    async def _falha(self, job: Dict[str, Any], erro: Exception) -> None:
+        tentativas = job.get("tentativas", 1)
+        mensagem = f"{type(erro).__name__}: {erro}"
+        if tentativas < job.get("max_tentativas", 1):
+            espera = min(self.backoff_base * (2 ** (tentativas - 1)), self.backoff_max)
+            await self.colecao.update_one(
+                {"id": job["id"]},
+                {"$set": {
+                    "status": STATUS_PENDENTE,
+                    "erro": mensagem,
+                    "proxima_tentativa_em": _agora() + timedelta(seconds=espera),
+                    "atualizado_em": _agora()
+                }}
+            )
+            logger.warning(f"⚠️ Job {job['tipo']} {job['id']} falhou (tentativa {tentativas}), nova tentativa em {espera:.0f}s: {mensagem}")
+        else:
+            await self._finalizar(job["id"], STATUS_FALHOU, erro=mensagem)
+            logger.error(f"Job {job['tipo']} {job['id']} falhou definitivamente: {mensagem}")
+
+    # ---------- manutenção ----------
+
+    async def _recuperar_travados(self) -> int:
+        """Jobs executando sem heartbeat recente voltam para a fila, ou falham se já esgotaram as tentativas"""
+        agora = _agora()
+        travados = {"status": STATUS_EXECUTANDO, "atualizado_em": {"$lt": agora - timedelta(seconds=self.timeout_travado)}}
+        esgotados = await self.colecao.update_many(
+            {**travados, "$expr": {"$gte": ["$tentativas", "$max_tentativas"]}},
+            {"$set": {"status": STATUS_FALHOU, "erro": ERRO_INTERROMPIDO, "finished_at": agora, "atualizado_em": agora}}
+        )
+        if esgotados.modified_count:
+            logger.error(f"{esgotados.modified_count} jobs travados falharam definitivamente (tentativas esgotadas)")
+        result = await self.colecao.update_many(
+            travados, {"$set": {"status": STATUS_PENDENTE, "proxima_tentativa_em": agora}}
+        )
+        if result.modified_count:
+            logger.warning(f"⚠️ {result.modified_count} jobs travados devolvidos para a fila")
+        return esgotados.modified_count + result.modified_count
+
+    async def limpar_antigos(self) -> int:
+        """Remove jobs finalizados há mais de retencao_dias e seus arquivos"""
+        limite = _agora() - timedelta(days=self.retencao_dias)
+        filtro = {"status": {"$in": STATUS_FINAIS}, "finished_at": {"$lt": limite}}
+        removidos = 0
+        async for job in self.colecao.find(filtro, {"_id": 0, "id": 1, "params": 1, "resultado": 1}):
+            for origem in (job.get("params") or {}, job.get("resultado") or {}):
+                arquivo_id = origem.get("arquivo_id") if isinstance(origem, dict) else None
+                if arquivo_id:
+                    try:
+                        await self.bucket.delete(ObjectId(arquivo_id))
+                    except Exception:
+                        pass
+            await self.colecao.delete_one({"id": job["id"]})
+            removidos += 1
+        return removidos
+
+    async def _manutencao(self) -> None:
+        while True:
+            await asyncio.sleep(3600)
+            try:
+                await self._recuperar_travados()
+                await self.limpar_antigos()
+            except Exception as e:
+                logger.warning(f"⚠️ Manutenção da fila de jobs falhou: {e}")
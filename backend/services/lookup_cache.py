@@ -0,0 +1,96 @@
+# Cache de resolução de nomes (categorias, centros de custo, usuários, clientes...)
+#
+# Enriquecer uma lista de N linhas com nomes custa um find com $in por coleção
+# referenciada, em vez de um find_one por linha. Os documentos resolvidos ficam
+# num cache TTL/LRU em processo compartilhado entre requests; as rotas que
+# alteram ou removem esses documentos chamam name_cache.invalidar().
+from typing import Any, Dict, Iterable, List, Optional
+
+from cachetools import TTLCache
+
+# Campos guardados no cache por coleção (nunca cachear senha_hash, tokens etc.)
+CAMPOS_POR_COLECAO: Dict[str, List[str]] = {
+    "categorias": ["nome"],
+    "centros_custo": ["nome"],
+    "users": ["nome"],
+    "clientes_venda": ["nome_completo", "telefone", "cpf"],
+    "planos_servico": ["nome"],
+}
+
+
+class NameCache:
+    """Cache (colecao, id) -> documento projetado, com TTL e descarte LRU"""
+
+    def __init__(self, maxsize: int = 10000, ttl: int = 60):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    async def carregar(self, db, colecao: str, ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Resolve vários ids de uma vez: o que não está no cache vem num único $in"""
+        encontrados: Dict[str, Dict[str, Any]] = {}
+        faltando = []
+        for doc_id in {i for i in ids if i}:
+            doc = self._cache.get((colecao, doc_id))
+            if doc is None:
+                faltando.append(doc_id)
+            else:
+                encontrados[doc_id] = doc
+        self.hits += len(encontrados)
+        self.misses += len(faltando)
+
+        if faltando:
+            campos = CAMPOS_POR_COLECAO.get(colecao, ["nome"])
+            projection = {"_id": 0, "id": 1, **{c: 1 for c in campos}}
+            async for doc in db[colecao].find({"id": {"$in": faltando}}, projection):
+                self._cache[(colecao, doc["id"])] = doc
+                encontrados[doc["id"]] = doc
+
+        return encontrados
+
+    async def nomes(self, db, colecao: str, ids: Iterable[str], campo: str = "nome") -> Dict[str, Any]:
+        """{id: campo} para os ids encontrados"""
+        docs = await self.carregar(db, colecao, ids)
+        return {doc_id: doc.get(campo) for doc_id, doc in docs.items()}
+
+    async def enriquecer(
+        self,
+        db,
+        linhas: List[Dict[str, Any]],
+        campo_id: str,
+        colecao: str,
+        destinos: Dict[str, str],
+        padrao: Any = None
+    ) -> List[Dict[str, Any]]:
+        """Copia campos do documento referenciado para cada linha.
+
+        destinos mapeia campo de origem -> campo na linha, ex:
+        {"nome": "tecnico_nome"}. Linhas sem referência recebem `padrao`.
+        """
+        docs = await self.carregar(db, colecao, (linha.get(campo_id) for linha in linhas))
+        for linha in linhas:
+            doc = docs.get(linha.get(campo_id))
+            for origem, destino in destinos.items():
+                linha[destino] = doc.get(origem, padrao) if doc else padrao
+        return linhas
+
+    def invalidar(self, colecao: str, doc_id: Optional[str] = None) -> None:
+        """Remove um documento (ou a coleção inteira) do cache"""
+        if doc_id is not None:
+            self._cache.pop((colecao, doc_id), None)
+            return
+        for chave in [k for k in list(self._cache.keys()) if k[0] == colecao]:
+            self._cache.pop(chave, None)
+
+    def estatisticas(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "itens": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0
+        }
+
+
+# Instância compartilhada por server.py e pelos routers
+name_cache = NameCache()
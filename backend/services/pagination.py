@@ -0,0 +1,192 @@
+# Paginação por cursor (keyset) e streaming NDJSON para endpoints de listagem
+#
+# A ordenação é sempre (campo, id) na mesma direção; o cursor codifica os
+# valores do último item da página e a próxima página começa com um filtro
+# "depois de (valor, id)", sem skip. O custo por página é constante mesmo em
+# páginas profundas. Com stream=True as linhas são escritas em NDJSON conforme
+# o cursor do Motor entrega, sem materializar a lista inteira.
+import base64
+import json
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from pymongo import ASCENDING, DESCENDING
+
+T = TypeVar("T")
+
+# Limite das listagens sem limit/cursor (comportamento antigo dos endpoints)
+LIMITE_LEGADO = 1000
+LIMITE_MAXIMO = 1000
+TAMANHO_LOTE_STREAM = 500
+
+# Header com o cursor da próxima página quando a listagem legada foi truncada
+HEADER_NEXT_CURSOR = "X-Next-Cursor"
+
+
+class Pagina(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str] = None
+
+
+def encode_cursor(valor: Any, doc_id: str) -> str:
+    """Codifica (valor do campo de ordenação, id) em base64 url-safe"""
+    if isinstance(valor, datetime):
+        valor = {"$date": valor.isoformat()}
+    bruto = json.dumps([valor, doc_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(bruto.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        valor, doc_id = json.loads(bruto)
+        if isinstance(valor, dict) and "$date" in valor:
+            valor = datetime.fromisoformat(valor["$date"])
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    if not isinstance(doc_id, str):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return valor, doc_id
+
+
+# Ordem de comparação do BSON entre os tipos que aparecem nos campos de
+# ordenação (created_at é string ISO na maioria dos documentos, datetime em
+# alguns). Documentos de outro tipo ficam inteiros antes ou depois do cursor.
+_TIPOS_BSON = [(type(None), None), ((int, float), "number"), (str, "string"), (datetime, "date")]
+
+
+def _rank(valor: Any) -> int:
+    for i, (tipo, _) in enumerate(_TIPOS_BSON):
+        if isinstance(valor, tipo) and not isinstance(valor, bool):
+            return i
+    return len(_TIPOS_BSON)
+
+
+def filtro_apos_cursor(campo: str, direcao: int, valor: Any, doc_id: str) -> Dict[str, Any]:
+    """Filtro para os documentos estritamente depois de (valor, id) na ordenação"""
+    op = "$lt" if direcao == DESCENDING else "$gt"
+    condicoes: List[Dict[str, Any]] = [{campo: valor, "id": {op: doc_id}}]
+    if valor is not None:
+        condicoes.append({campo: {op: valor}})
+
+    # Tipos que vêm depois na ordenação (menores na descendente, maiores na ascendente)
+    rank = _rank(valor)
+    for i, (_, nome_tipo) in enumerate(_TIPOS_BSON):
+        if (direcao == DESCENDING and i < rank) or (direcao == ASCENDING and i > rank):
+            condicoes.append({campo: None} if nome_tipo is None else {campo: {"$type": nome_tipo}})
+
+    return {"$or": condicoes}
+
+
+def _consulta(query: Dict[str, Any], sort_campo: str, direcao: int, cursor: Optional[str]) -> Dict[str, Any]:
+    if not cursor:
+        return query
+    valor, doc_id = decode_cursor(cursor)
+    return {"$and": [query, filtro_apos_cursor(sort_campo, direcao, valor, doc_id)]}
+
+
+async def buscar_pagina(
+    collection,
+    query: Dict[str, Any],
+    limit: int,
+    cursor: Optional[str] = None,
+    sort_campo: str = "created_at",
+    direcao: int = DESCENDING,
+    projection: Optional[Dict[str, Any]] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Uma página (limit itens) a partir do cursor. Retorna (itens, next_cursor)."""
+    projection = projection or {"_id": 0}
+    docs = await collection.find(_consulta(query, sort_campo, direcao, cursor), projection)\
+        .sort([(sort_campo, direcao), ("id", direcao)])\
+        .limit(limit + 1)\
+        .to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1].get(sort_campo), docs[-1]["id"])
+    return docs, next_cursor
+
+
+def stream_ndjson(
+    collection,
+    query: Dict[str, Any],
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    sort_campo: str = "created_at",
+    direcao: int = DESCENDING,
+    projection: Optional[Dict[str, Any]] = None,
+    enriquecer_lote: Optional[Callable[[List[Dict[str, Any]]], Awaitable[Any]]] = None
+) -> StreamingResponse:
+    """Escreve uma linha JSON por documento conforme o cursor do Motor entrega.
+
+    enriquecer_lote é chamado a cada TAMANHO_LOTE_STREAM documentos (ex: para
+    resolver nomes com um $in por lote), mantendo a memória constante.
+    """
+    filtro = _consulta(query, sort_campo, direcao, cursor)
+    projection = projection or {"_id": 0}
+
+    async def gerar():
+        mongo_cursor = collection.find(filtro, projection)\
+            .sort([(sort_campo, direcao), ("id", direcao)])\
+            .batch_size(TAMANHO_LOTE_STREAM)
+        if limit:
+            mongo_cursor = mongo_cursor.limit(limit)
+
+        lote: List[Dict[str, Any]] = []
+        async for doc in mongo_cursor:
+            lote.append(doc)
+            if len(lote) >= TAMANHO_LOTE_STREAM:
+                if enriquecer_lote:
+                    await enriquecer_lote(lote)
+                yield "".join(json.dumps(d, default=str) + "\n" for d in lote)
+                lote = []
+        if lote:
+            if enriquecer_lote:
+                await enriquecer_lote(lote)
+            yield "".join(json.dumps(d, default=str) + "\n" for d in lote)
+
+    return StreamingResponse(gerar(), media_type="application/x-ndjson")
+
+
+async def listar_paginado(
+    collection,
+    query: Dict[str, Any],
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    sort_campo: str = "created_at",
+    direcao: int = DESCENDING,
+    projection: Optional[Dict[str, Any]] = None,
+    enriquecer_lote: Optional[Callable[[List[Dict[str, Any]]], Awaitable[Any]]] = None
+):
+    """Atende os três modos de uma listagem:
+
+    - stream=True: NDJSON (StreamingResponse), a partir do cursor se informado;
+    - limit/cursor informados: {"items": [...], "next_cursor": ...};
+    - nenhum dos dois: lista simples como antes (até LIMITE_LEGADO itens), com
+      o header X-Next-Cursor quando há mais resultados.
+    """
+    if stream:
+        return stream_ndjson(
+            collection, query, cursor=cursor, limit=limit, sort_campo=sort_campo,
+            direcao=direcao, projection=projection, enriquecer_lote=enriquecer_lote
+        )
+
+    paginado = limit is not None or cursor is not None
+    itens, next_cursor = await buscar_pagina(
+        collection, query, min(limit or LIMITE_LEGADO, LIMITE_MAXIMO), cursor,
+        sort_campo=sort_campo, direcao=direcao, projection=projection
+    )
+    if enriquecer_lote:
+        await enriquecer_lote(itens)
+
+    if paginado:
+        return {"items": itens, "next_cursor": next_cursor}
+    if next_cursor:
+        response.headers[HEADER_NEXT_CURSOR] = next_cursor
+    return itens
@@ -0,0 +1,328 @@
+# Previsão de fluxo de caixa (GET /ai/previsao-fluxo)
+#
+# Receitas e despesas diárias dos últimos PREVISAO_HISTORICO_DIAS dias (uma
+# agregação por data e tipo, índice empresa_id + data_competencia;
+# transferências entre contas ficam fora) são ajustadas, cada série, por
+# mínimos quadrados com regularização ridge em NumPy:
+#
+#   valor do dia = nível + efeito do dia da semana + efeito do dia do mês
+#                  + b * cobranças recorrentes previstas para o dia
+#
+# O dia do mês captura contas fixas (aluguel no dia 5, folha no dia 30); o
+# regressor de recorrentes usa os contratos ativos em cada dia (vendas de
+# planos de serviço, contratos de venda e, para a empresa SAAS_EMPRESA_ID, as
+# assinaturas SaaS), e b estima a fração efetivamente recebida (1 enquanto não
+# há histórico). A projeção usa os contratos ativos hoje, então vendas
+# recentes já entram na previsão.
+#
+# As faixas de confiança do saldo acumulado vêm do desvio padrão diário dos
+# resíduos (desvio_diario): ±z*σ*sqrt(h) após h dias.
+#
+# O ajuste fica em cache por empresa até a virada do dia (ou PREVISAO_TTL_S).
+# Como (X'X + λI)^-1 só depende do calendário, uma transação nova dentro da
+# janela atualiza apenas X'y e os coeficientes (registrar), sem reler o banco.
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from cachetools import TTLCache
+
+# Regularização dos efeitos (em "dias de observação"): efeitos com poucos dados encolhem para zero
+RIDGE = 1.0
+# z das faixas de confiança (80% e 95%)
+Z_FAIXAS = {"80": 1.2816, "95": 1.96}
+TIPOS = ("receita", "despesa")
+# Nível + 7 dias da semana + 31 dias do mês
+COLUNAS_CALENDARIO = 1 + 7 + 31
+
+
+def _dia(valor: Any) -> Optional[date]:
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    if isinstance(valor, str) and len(valor) >= 10:
+        try:
+            return date.fromisoformat(valor[:10])
+        except ValueError:
+            return None
+    return None
+
+
+def _dia_cobranca(dia_vencimento: int, dia: date) -> int:
+    """Dia de vencimento no mês de `dia` (31 vira o último dia em meses curtos)"""
+    proximo_mes = (dia.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return min(dia_vencimento, (proximo_mes - timedelta(days=1)).day)
+
+
+def _calendario(dias: List[date]) -> Dict[str, np.ndarray]:
+    ordinais = np.array([d.toordinal() for d in dias])
+    dia_mes = np.array([d.day for d in dias])
+    ultimo = np.array([_dia_cobranca(31, d) for d in dias])
+    return {"ordinal": ordinais, "dia": dia_mes, "semana": (ordinais - 1) % 7, "ultimo": ultimo}
+
+
+def recorrentes_por_dia(itens: List[Dict[str, Any]], dias: List[date]) -> np.ndarray:
+    """Total de cobranças recorrentes com vencimento em cada dia, considerando a vigência de cada item.
+
+    Vigências viram um array de diferenças por dia de vencimento (+valor no
+    início, -valor no fim); a soma acumulada dá o total ativo em cada dia.
+    """
+    calendario = _calendario(dias)
+    primeiro = calendario["ordinal"][0]
+    ativos = np.zeros((32, len(dias) + 1))
+    for item in itens:
+        inicio = min(max(item["inicio"].toordinal() - primeiro, 0), len(dias))
+        fim = len(dias) if item["fim"] is None else min(max(item["fim"].toordinal() - primeiro, 0), len(dias))
+        if inicio < fim:
+            vencimento = min(max(item["dia"], 1), 31)
+            ativos[vencimento, inicio] += item["valor"]
+            ativos[vencimento, fim] -= item["valor"]
+    ativos = np.cumsum(ativos[:, :-1], axis=1)
+    # No último dia do mês vencem também os itens com vencimento depois dele (dia 31 em abril)
+    vencimentos = np.arange(32)[:, None]
+    vence = (vencimentos == calendario["dia"]) | (
+        (calendario["dia"] == calendario["ultimo"]) & (vencimentos > calendario["ultimo"])
+    )
+    return (ativos * vence).sum(axis=0)
+
+
+def matriz(dias: List[date], recorrentes: Optional[np.ndarray]) -> np.ndarray:
+    """Nível, dia da semana (7 colunas), dia do mês (31 colunas) e recorrentes
+
+    Sem categoria de referência: a regularização torna o sistema determinado e
+    encolhe cada efeito para a média geral, não para segunda-feira ou dia 1.
+    """
+    calendario = _calendario(dias)
+    linhas = np.arange(len(dias))
+    X = np.zeros((len(dias), COLUNAS_CALENDARIO + (1 if recorrentes is not None else 0)))
+    X[:, 0] = 1.0
+    X[linhas, 1 + calendario["semana"]] = 1.0
+    X[linhas, 7 + calendario["dia"]] = 1.0
+    if recorrentes is not None:
+        X[:, -1] = recorrentes
+    return X
+
+
+class Modelo:
+    """Ajuste ridge de uma série diária, atualizável valor a valor"""
+
+    def __init__(self, X: np.ndarray, y: np.ndarray):
+        self.X = X
+        self.y = y.astype(float)
+        penalidade = np.full(X.shape[1], RIDGE)
+        penalidade[0] = 0.0  # nível sem regularização
+        # Efeitos encolhem para zero; o coeficiente dos recorrentes, para 1 (cobrança paga
+        # integralmente), o que vale para contratos novos ainda sem histórico na janela
+        priori = np.zeros(X.shape[1])
+        if X.shape[1] > COLUNAS_CALENDARIO:
+            priori[-1] = 1.0
+        self._inversa = np.linalg.inv(X.T @ X + np.diag(penalidade))
+        self._xty = X.T @ self.y + penalidade * priori
+        self._graus = max(len(self.y) - np.linalg.matrix_rank(X), 1)
+        self._resolver()
+
+    def _resolver(self) -> None:
+        self.beta = self._inversa @ self._xty
+        residuos = self.y - self.X @ self.beta
+        self.sigma = float(np.sqrt(residuos @ residuos / self._graus))
+
+    def adicionar(self, indice: int, valor: float) -> None:
+        self.y[indice] += valor
+        self._xty += valor * self.X[indice]
+        self._resolver()
+
+    def prever(self, X: np.ndarray) -> np.ndarray:
+        return np.clip(X @ self.beta, 0, None)
+
+
+def ajustar(
+    series: Dict[str, Dict[date, float]],
+    inicio: date,
+    fim: date,
+    itens_recorrentes: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """Ajusta receitas e despesas diárias de inicio a fim (inclusive)"""
+    dias = [inicio + timedelta(days=i) for i in range((fim - inicio).days + 1)]
+    recorrentes = recorrentes_por_dia(itens_recorrentes, dias) if itens_recorrentes else None
+    modelos = {}
+    for tipo in TIPOS:
+        y = np.array([series.get(tipo, {}).get(dia, 0.0) for dia in dias])
+        modelos[tipo] = Modelo(matriz(dias, recorrentes if tipo == "receita" else None), y)
+    return {
+        "inicio": inicio,
+        "fim": fim,
+        "dias": len(dias),
+        "modelos": modelos,
+        "recorrentes": itens_recorrentes or [],
+    }
+
+
+def projetar(ajuste: Dict[str, Any], dias_futuros: int, saldo_inicial: float = 0.0) -> Dict[str, Any]:
+    """Projeção dia a dia a partir do dia seguinte ao fim do ajuste, com faixas de confiança"""
+    dias = [ajuste["fim"] + timedelta(days=i) for i in range(1, dias_futuros + 1)]
+    recorrentes = recorrentes_por_dia(ajuste["recorrentes"], dias) if ajuste["recorrentes"] else None
+    receitas = ajuste["modelos"]["receita"].prever(matriz(dias, recorrentes))
+    despesas = ajuste["modelos"]["despesa"].prever(matriz(dias, None))
+    saldo = receitas - despesas
+    acumulado = saldo_inicial + np.cumsum(saldo)
+    sigma = float(np.hypot(ajuste["modelos"]["receita"].sigma, ajuste["modelos"]["despesa"].sigma))
+    horizonte = np.sqrt(np.arange(1, dias_futuros + 1))
+
+    projecao = []
+    for i, dia in enumerate(dias):
+        linha = {
+            "data": dia.isoformat(),
+            "receitas": round(float(receitas[i]), 2),
+            "despesas": round(float(despesas[i]), 2),
+            "saldo": round(float(saldo[i]), 2),
+            "saldo_acumulado": round(float(acumulado[i]), 2),
+        }
+        for nivel, z in Z_FAIXAS.items():
+            linha[f"faixa_{nivel}"] = [
+                round(float(acumulado[i] - z * sigma * horizonte[i]), 2),
+                round(float(acumulado[i] + z * sigma * horizonte[i]), 2),
+            ]
+        projecao.append(linha)
+
+    return {
+        "receitas_estimadas": round(float(receitas.sum()), 2),
+        "despesas_estimadas": round(float(despesas.sum()), 2),
+        "saldo_estimado": round(float(saldo.sum()), 2),
+        "desvio_diario": round(sigma, 2),
+        "projecao": projecao,
+    }
+
+
+async def series_diarias(db, empresa_id: str, inicio: date, fim: date) -> Dict[str, Any]:
+    """{tipo: {dia: total}} e quantidade de transações, numa agregação por (data, tipo)"""
+    pipeline = [
+        {"$match": {
+            "empresa_id": empresa_id,
+            "data_competencia": {"$gte": inicio.isoformat(), "$lte": fim.isoformat() + "T99"},
+            "tipo": {"$in": list(TIPOS)},
+            "is_transferencia": {"$ne": True},
+        }},
+        {"$group": {
+            "_id": {"data": "$data_competencia", "tipo": "$tipo"},
+            "total": {"$sum": "$valor_total"},
+            "quantidade": {"$sum": 1},
+        }},
+    ]
+    series: Dict[str, Dict[date, float]] = {tipo: {} for tipo in TIPOS}
+    quantidade = 0
+    async for grupo in db.transacoes.aggregate(pipeline):
+        dia = _dia(grupo["_id"]["data"])
+        if dia is not None:
+            # Datas com horário caem no mesmo dia
+            series[grupo["_id"]["tipo"]][dia] = series[grupo["_id"]["tipo"]].get(dia, 0.0) + grupo["total"]
+            quantidade += grupo["quantidade"]
+    return {"series": series, "quantidade": quantidade}
+
+
+async def itens_recorrentes(db, empresa_id: str) -> List[Dict[str, Any]]:
+    """Cobranças mensais conhecidas da empresa, com início e fim de vigência"""
+    itens = []
+
+    def item(origem, doc, valor, inicio):
+        status = doc.get("status")
+        encerrado = status in ("cancelado", "cancelada", "suspenso", "suspensa")
+        inicio = _dia(inicio) or _dia(doc.get("created_at"))
+        if not valor or not doc.get("dia_vencimento") or inicio is None:
+            return
+        itens.append({
+            "origem": origem,
+            "valor": float(valor),
+            "dia": int(doc["dia_vencimento"]),
+            "inicio": inicio,
+            "fim": (_dia(doc.get("updated_at")) or inicio) if encerrado else None,
+        })
+
+    campos = {"_id": 0, "status": 1, "dia_vencimento": 1, "created_at": 1, "updated_at": 1}
+    async for venda in db.vendas_servico.find(
+        {"empresa_id": empresa_id, "status": {"$in": ["ativo", "suspenso", "cancelado"]}},
+        {**campos, "valor_venda": 1, "data_ativacao": 1}
+    ):
+        item("vendas_servico", venda, venda.get("valor_venda"), venda.get("data_ativacao"))
+    async for venda in db.vendas.find(
+        {"empresa_id": empresa_id, "status": {"$in": ["ativo", "ativa", "suspenso", "cancelado", "cancelada"]}},
+        {**campos, "valor_mensalidade": 1, "data_contratacao": 1}
+    ):
+        item("vendas", venda, venda.get("valor_mensalidade"), venda.get("data_contratacao"))
+    if empresa_id == os.environ.get("SAAS_EMPRESA_ID"):
+        # Assinaturas do próprio SaaS não têm empresa_id: são receita da empresa operadora
+        async for assinatura in db.assinaturas_saas.find(
+            {"status": {"$in": ["ativa", "suspensa", "cancelada"]}}, {**campos, "valor_mensal": 1}
+        ):
+            item("assinaturas_saas", assinatura, assinatura.get("valor_mensal"), None)
+    return itens
+
+
+class PrevisaoFluxo:
+    """Ajustes por empresa em cache; transações novas atualizam o ajuste sem reler o histórico"""
+
+    def __init__(self, maxsize: int = 500, ttl: Optional[int] = None):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl or int(os.environ.get("PREVISAO_TTL_S", "3600")))
+        self.hits = 0
+        self.misses = 0
+        self.incrementais = 0
+
+    async def ajuste(self, db, empresa_id: str, hoje: Optional[date] = None) -> Dict[str, Any]:
+        hoje = hoje or datetime.now(timezone.utc).date()
+        ajuste = self._cache.get(empresa_id)
+        # O ajuste vai até ontem: na virada do dia, um novo dia entra na janela
+        if ajuste is not None and ajuste["fim"] == hoje - timedelta(days=1):
+            self.hits += 1
+            return ajuste
+
+        self.misses += 1
+        fim = hoje - timedelta(days=1)
+        janela = int(os.environ.get("PREVISAO_HISTORICO_DIAS", "365"))
+        inicio = fim - timedelta(days=janela - 1)
+        dados = await series_diarias(db, empresa_id, inicio, fim)
+        # Empresas com menos histórico que a janela: o ajuste começa no primeiro lançamento
+        primeiros = [min(serie) for serie in dados["series"].values() if serie]
+        inicio = min(primeiros) if primeiros else fim
+        ajuste = ajustar(dados["series"], inicio, fim, await itens_recorrentes(db, empresa_id))
+        ajuste["transacoes"] = dados["quantidade"]
+        ajuste["janela_max_dias"] = janela
+        ajuste["ajustado_em"] = datetime.now(timezone.utc).isoformat()
+        self._cache[empresa_id] = ajuste
+        return ajuste
+
+    def registrar(self, empresa_id: str, transacao: Dict[str, Any], sinal: int = 1) -> bool:
+        """Aplica uma transação criada (sinal=1) ou excluída (sinal=-1) ao ajuste em cache"""
+        ajuste = self._cache.get(empresa_id)
+        dia = _dia(transacao.get("data_competencia"))
+        if ajuste is None or dia is None or transacao.get("tipo") not in TIPOS or transacao.get("is_transferencia"):
+            return False
+        if dia < ajuste["inicio"] and (ajuste["fim"] - dia).days < ajuste["janela_max_dias"]:
+            # Lançamento retroativo anterior ao primeiro: a janela muda, ajuste completo na próxima consulta
+            self.invalidar(empresa_id)
+            return False
+        if not ajuste["inicio"] <= dia <= ajuste["fim"]:
+            # Fora da janela (ex: lançamento de hoje ou futuro): entra no próximo ajuste
+            return False
+        indice = (dia - ajuste["inicio"]).days
+        ajuste["modelos"][transacao["tipo"]].adicionar(indice, sinal * float(transacao.get("valor_total") or 0))
+        ajuste["transacoes"] += sinal
+        self.incrementais += 1
+        return True
+
+    def invalidar(self, empresa_id: str) -> None:
+        self._cache.pop(empresa_id, None)
+
+    def estatisticas(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "itens": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "incrementais": self.incrementais,
+            "hit_rate": round(self.hits / total, 4) if total else 0
+        }
+
+
+# Instância compartilhada pelas rotas de transações e de IA
+previsao_fluxo = PrevisaoFluxo()
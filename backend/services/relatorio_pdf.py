@@ -0,0 +1,102 @@
+# Renderização do PDF do relatório financeiro (ReportLab)
+#
+# Função síncrona e sem acesso ao banco: recebe os totais e as transações a
+# listar e devolve os bytes do PDF. Roda no pool de processos
+# (services/executores.py), por isso fica fora de server.py.
+import io
+from typing import Any, Dict, List
+
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+# Transações listadas no PDF (o resumo considera todas)
+LIMITE_TRANSACOES_PDF = 50
+
+
+def renderizar_relatorio_pdf(
+    total_receitas: float,
+    total_despesas: float,
+    num_transacoes: int,
+    primeiras: List[Dict[str, Any]]
+) -> bytes:
+    lucro = total_receitas - total_despesas
+
+    # Criar PDF
+    output = io.BytesIO()
+    doc = SimpleDocTemplate(output, pagesize=landscape(A4))
+    elements = []
+
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#1f2937'),
+        spaceAfter=30,
+        alignment=TA_CENTER
+    )
+
+    # Título
+    elements.append(Paragraph("RELATÓRIO FINANCEIRO - ECHO SHOP", title_style))
+    elements.append(Spacer(1, 0.3*inch))
+
+    # Resumo
+    resumo_data = [
+        ['RESUMO FINANCEIRO', ''],
+        ['Total de Receitas', f'R$ {total_receitas:,.2f}'],
+        ['Total de Despesas', f'R$ {total_despesas:,.2f}'],
+        ['Lucro/Prejuízo', f'R$ {lucro:,.2f}'],
+        ['Número de Transações', str(num_transacoes)]
+    ]
+
+    resumo_table = Table(resumo_data, colWidths=[3*inch, 2*inch])
+    resumo_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4472C4')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 14),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+
+    elements.append(resumo_table)
+    elements.append(Spacer(1, 0.5*inch))
+
+    # Transações (primeiras 50)
+    if primeiras:
+        elements.append(Paragraph("TRANSAÇÕES (Primeiras 50)", styles['Heading2']))
+        elements.append(Spacer(1, 0.2*inch))
+
+        trans_data = [['Data', 'Tipo', 'Fornecedor', 'Valor', 'Status']]
+        for t in primeiras:
+            trans_data.append([
+                t.get('data_competencia', '')[:10],
+                t.get('tipo', ''),
+                t.get('fornecedor', '')[:20],
+                f'R$ {t.get("valor_total", 0):,.2f}',
+                t.get('status', '')
+            ])
+
+        trans_table = Table(trans_data, colWidths=[1.2*inch, 1*inch, 2.5*inch, 1.3*inch, 1*inch])
+        trans_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+            ('FONTSIZE', (0, 1), (-1, -1), 8),
+        ]))
+
+        elements.append(trans_table)
+
+    doc.build(elements)
+    return output.getvalue()
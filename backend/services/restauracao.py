@@ -0,0 +1,412 @@
+# Restauração de backups gerados por services/backup.py
+#
+# Uma restauração aplica uma cadeia: o backup completo (cada coleção é
+# esvaziada e recarregada) seguido dos incrementais em ordem (primeiro as
+# exclusões do membro _tombstones, depois os documentos alterados, com
+# upsert por _id). A ordem é validada pelos ids do manifesto
+# (anterior_id/base_id) antes de qualquer escrita.
+#
+# Restauração em paralelo (restaurar_backup, um backup completo): as coleções
+# são carregadas ao mesmo tempo (RESTAURACAO_CONCORRENCIA), cada uma com
+# insert_many em lotes e LOTES_EM_VOO lotes gravando enquanto o próximo é
+# descomprimido. Com staging (padrão), a carga vai para coleções
+# "_restauracao.<nome>" do mesmo banco; só depois dos índices criados e da
+# verificação (quantidade e sha256 por coleção) as originais são trocadas pelo
+# staging com renameCollection, uma a uma. Cada original é guardada como
+# "_restauracao_anterior.<nome>" até a última troca: se a carga, a verificação
+# ou qualquer troca falhar, as já trocadas voltam e o banco fica como estava.
+# A troca não é atômica entre coleções (por alguns instantes umas já estão
+# restauradas e outras não): restaure com o sistema em manutenção.
+#
+# O rollup de transações fica fora do backup e é reconstruído no fim; os
+# contadores de numeração (services/sequencias.py) também ficam fora e são
+# descartados, voltando a partir do maior número restaurado no próximo uso.
+#
+# Uso via linha de comando:
+#   python -m services.restauracao completo.tar                  # paralela, com staging
+#   python -m services.restauracao --sem-staging completo.tar
+#   python -m services.restauracao completo.tar incremental1.tar ...
+import asyncio
+import hashlib
+import logging
+import os
+import sys
+import tarfile
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from pymongo import ReplaceOne
+
+from services.backup import (
+    PREFIXO_ANTERIOR, PREFIXO_STAGING, TIPO_COMPLETO, TIPO_INCREMENTAL, decodificar, iterar_documentos, iterar_linhas,
+    ler_manifesto, serializar
+)
+from services.executores import executores
+from services.indexes import INDEX_REGISTRY, aplicar_indices
+from services.rollup import reconstruir_rollup
+from services.sequencias import TIPOS, limpar_contadores
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_LOTE = 1000
+LOTES_EM_VOO = 2
+
+Progresso = Callable[[float, str], Awaitable[None]]
+
+
+class ErroVerificacao(Exception):
+    """Conteúdo restaurado não confere com o manifesto do backup"""
+
+    def __init__(self, divergencias: List[Dict[str, Any]]):
+        self.divergencias = divergencias
+        super().__init__(", ".join(f"{d['colecao']}: {d['erro']}" for d in divergencias))
+
+
+def _lotes(tar: tarfile.TarFile, membro: str, compressao: str, tamanho: int = TAMANHO_LOTE) -> Iterator[List[Dict[str, Any]]]:
+    lote: List[Dict[str, Any]] = []
+    for doc in iterar_documentos(tar, membro, compressao):
+        lote.append(doc)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+async def lotes_do_membro(tar: tarfile.TarFile, membro: str, compressao: str, tamanho: int = TAMANHO_LOTE):
+    """Lotes de documentos de um membro; a descompressão roda no executor de threads"""
+    gerador = _lotes(tar, membro, compressao, tamanho)
+    while True:
+        lote = await executores.thread(next, gerador, None, nome="restauracao")
+        if lote is None:
+            return
+        yield lote
+
+
+def validar_cadeia(manifestos: Sequence[Dict[str, Any]]) -> None:
+    """Completo seguido de incrementais da mesma base, cada um apontando para o anterior"""
+    if not manifestos:
+        raise ValueError("Nenhum backup informado")
+    if manifestos[0]["tipo"] != TIPO_COMPLETO:
+        raise ValueError("A cadeia deve começar por um backup completo")
+    for anterior, atual in zip(manifestos, manifestos[1:]):
+        if atual["tipo"] != TIPO_INCREMENTAL:
+            raise ValueError(f"Backup {atual.get('id')} não é incremental")
+        if atual.get("base_id") != manifestos[0].get("id") or atual.get("anterior_id") != anterior.get("id"):
+            raise ValueError(f"Backup {atual.get('id')} não segue {anterior.get('id')} na cadeia")
+
+
+async def aplicar_backup(db, tar: tarfile.TarFile, manifesto: Dict[str, Any]) -> Dict[str, Any]:
+    """Aplica um backup (completo ou incremental) e retorna os documentos escritos por coleção"""
+    compressao = manifesto["compressao"]
+    resultado: Dict[str, Any] = {"id": manifesto.get("id"), "tipo": manifesto["tipo"], "colecoes": {}, "exclusoes": 0}
+
+    if manifesto["tipo"] == TIPO_INCREMENTAL and manifesto.get("tombstones"):
+        async for lote in lotes_do_membro(tar, manifesto["tombstones"]["arquivo"], compressao):
+            for tombstone in lote:
+                excluidos = await db[tombstone["colecao"]].delete_many(tombstone["filtro"])
+                resultado["exclusoes"] += excluidos.deleted_count
+
+    for nome, entrada in manifesto["colecoes"].items():
+        escritos = 0
+        if manifesto["tipo"] == TIPO_COMPLETO:
+            await db[nome].delete_many({})
+        async for lote in lotes_do_membro(tar, entrada["arquivo"], compressao):
+            if manifesto["tipo"] == TIPO_COMPLETO:
+                await db[nome].insert_many(lote, ordered=False)
+            else:
+                await db[nome].bulk_write([ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in lote], ordered=False)
+            escritos += len(lote)
+        resultado["colecoes"][nome] = escritos
+    return resultado
+
+
+def _abrir(arquivo) -> Tuple[tarfile.TarFile, Dict[str, Any]]:
+    tar = tarfile.open(arquivo, mode="r") if isinstance(arquivo, (str, os.PathLike)) else tarfile.open(fileobj=arquivo, mode="r")
+    return tar, ler_manifesto(tar)
+
+
+async def restaurar_cadeia(db, arquivos: Sequence[Any]) -> Dict[str, Any]:
+    """Restaura completo + incrementais (caminhos ou arquivos abertos, na ordem da cadeia)"""
+    abertos = [_abrir(a) for a in arquivos]
+    try:
+        validar_cadeia([m for _, m in abertos])
+        inicio = time.perf_counter()
+        aplicados = []
+        for tar, manifesto in abertos:
+            aplicados.append(await aplicar_backup(db, tar, manifesto))
+            logger.info(f"✅ Backup {manifesto['tipo']} {manifesto.get('id')} aplicado")
+        rollup = await reconstruir_rollup(db)
+        contadores = await limpar_contadores(db)
+        return {
+            "backups": aplicados, "rollup": rollup, "contadores_descartados": contadores,
+            "duracao_s": round(time.perf_counter() - inicio, 2)
+        }
+    finally:
+        for tar, _ in abertos:
+            tar.close()
+
+
+# ---------- restauração em paralelo ----------
+
+def _lotes_verificados(caminho, membro: str, compressao: str, tamanho: int, sha256) -> Iterator[List[Dict[str, Any]]]:
+    """Lotes de um membro, atualizando o sha256 com as linhas lidas (cada chamada abre o próprio tar)"""
+    with tarfile.open(caminho, mode="r") as tar:
+        lote: List[Dict[str, Any]] = []
+        for linha in iterar_linhas(tar, membro, compressao):
+            sha256.update(linha)
+            if not linha.strip():
+                continue
+            lote.append(decodificar(linha))
+            if len(lote) >= tamanho:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
+
+
+async def _inserir(colecao, lote: List[Dict[str, Any]]) -> int:
+    await colecao.insert_many(lote, ordered=False)
+    return len(lote)
+
+
+async def _carregar_colecao(
+    colecao,
+    caminho,
+    entrada: Dict[str, Any],
+    compressao: str,
+    tamanho_lote: int = TAMANHO_LOTE,
+    em_voo: int = LOTES_EM_VOO,
+) -> Dict[str, Any]:
+    """insert_many em lotes, com até `em_voo` lotes gravando enquanto o próximo é lido"""
+    sha256 = hashlib.sha256()
+    gerador = _lotes_verificados(caminho, entrada["arquivo"], compressao, tamanho_lote, sha256)
+    pendentes = set()
+    escritos = 0
+    lotes = 0
+    inicio = time.perf_counter()
+    try:
+        while True:
+            lote = await executores.thread(next, gerador, None, nome="restauracao")
+            if lote is None:
+                break
+            if len(pendentes) >= em_voo:
+                feitos, pendentes = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+                escritos += sum(f.result() for f in feitos)
+            pendentes.add(asyncio.ensure_future(_inserir(colecao, lote)))
+            lotes += 1
+        for tarefa in pendentes:
+            escritos += await tarefa
+        pendentes = set()
+    finally:
+        for tarefa in pendentes:
+            tarefa.cancel()
+        gerador.close()
+
+    duracao = time.perf_counter() - inicio
+    return {
+        "documentos": escritos,
+        "lotes": lotes,
+        "sha256_arquivo": sha256.hexdigest(),
+        "duracao_s": round(duracao, 3),
+        "documentos_por_s": round(escritos / duracao) if duracao else None,
+        "mb_por_s": round(entrada.get("bytes", 0) / (1024 * 1024) / duracao, 2) if duracao else None,
+    }
+
+
+async def sha256_colecao(colecao) -> str:
+    """sha256 do conteúdo da coleção no mesmo formato do backup (NDJSON ordenado por _id)"""
+    sha256 = hashlib.sha256()
+    lote: List[Dict[str, Any]] = []
+    async for doc in colecao.find({}).sort("_id", 1).batch_size(TAMANHO_LOTE):
+        lote.append(doc)
+        if len(lote) >= TAMANHO_LOTE:
+            sha256.update(await executores.thread(serializar, lote, nome="restauracao"))
+            lote = []
+    if lote:
+        sha256.update(await executores.thread(serializar, lote, nome="restauracao"))
+    return sha256.hexdigest()
+
+
+async def verificar_colecao(colecao, entrada: Dict[str, Any], carga: Dict[str, Any], conteudo: bool = True) -> List[str]:
+    """Divergências entre a coleção carregada e a entrada do manifesto"""
+    erros = []
+    if carga["sha256_arquivo"] != entrada["sha256"]:
+        erros.append("sha256 do arquivo não confere (backup corrompido)")
+    total = await colecao.count_documents({})
+    if total != entrada["documentos"]:
+        erros.append(f"{total} documentos no banco, {entrada['documentos']} no backup")
+    elif conteudo and total and not erros and await sha256_colecao(colecao) != entrada["sha256"]:
+        erros.append("sha256 do conteúdo gravado não confere")
+    return erros
+
+
+async def promover_staging(db, destino: Dict[str, Any]) -> List[str]:
+    """Troca cada coleção pela sua versão em staging; se uma troca falhar, desfaz as anteriores.
+
+    As originais ficam guardadas (PREFIXO_ANTERIOR) até a última troca dar
+    certo. Retorna os nomes trocados.
+    """
+    existentes = set(await db.list_collection_names())
+    guardadas: List[str] = []
+    trocadas: List[str] = []
+    try:
+        for nome, staging in destino.items():
+            if nome in existentes:
+                await db[nome].rename(PREFIXO_ANTERIOR + nome, dropTarget=True)
+                guardadas.append(nome)
+            await staging.rename(nome, dropTarget=True)
+            trocadas.append(nome)
+    except BaseException:
+        logger.error(f"Troca das coleções restauradas falhou após {trocadas}; desfazendo")
+        for nome in reversed(trocadas):
+            if nome not in guardadas:
+                await db[nome].drop()
+        for nome in reversed(guardadas):
+            await db[PREFIXO_ANTERIOR + nome].rename(nome, dropTarget=True)
+        raise
+    for nome in guardadas:
+        await db[PREFIXO_ANTERIOR + nome].drop()
+    return trocadas
+
+
+async def restaurar_backup(
+    db,
+    caminho,
+    colecoes: Optional[Sequence[str]] = None,
+    staging: bool = True,
+    concorrencia: Optional[int] = None,
+    tamanho_lote: int = TAMANHO_LOTE,
+    verificar_conteudo: bool = True,
+    progresso: Optional[Progresso] = None,
+) -> Dict[str, Any]:
+    """Restaura um backup completo (arquivo .tar em disco) com coleções em paralelo.
+
+    Sem staging, cada coleção é apagada e recarregada no lugar (mais rápido,
+    mas uma falha deixa o banco pela metade). Levanta ErroVerificacao se a
+    quantidade ou o sha256 de alguma coleção não conferir com o manifesto.
+    O retorno lista as coleções trocadas, o rollup reconstruído e os contadores
+    de numeração descartados.
+    """
+    caminho = os.fspath(caminho)
+    tar, manifesto = _abrir(caminho)
+    tar.close()
+    if manifesto["tipo"] != TIPO_COMPLETO:
+        raise ValueError("Restauração em paralelo requer um backup completo (incrementais: restaurar_cadeia)")
+
+    nomes = [n for n in manifesto["colecoes"] if colecoes is None or n in colecoes]
+    # Maiores primeiro: as pequenas preenchem os intervalos no fim
+    nomes.sort(key=lambda n: -manifesto["colecoes"][n].get("bytes", 0))
+    destino = {n: db[PREFIXO_STAGING + n] if staging else db[n] for n in nomes}
+    compressao = manifesto["compressao"]
+    semaforo = asyncio.Semaphore(concorrencia or int(os.environ.get("RESTAURACAO_CONCORRENCIA", "4")))
+    concluidas = 0
+    inicio = time.perf_counter()
+
+    for colecao in destino.values():
+        # drop também remove os índices: recriados depois da carga
+        await colecao.drop()
+
+    async def restaurar(nome: str) -> Dict[str, Any]:
+        nonlocal concluidas
+        async with semaforo:
+            entrada = manifesto["colecoes"][nome]
+            carga = await _carregar_colecao(destino[nome], caminho, entrada, compressao, tamanho_lote)
+            concluidas += 1
+            logger.info(f"Restored {carga['documentos']} documents into {nome} ({carga['documentos_por_s']} docs/s)")
+            if progresso:
+                await progresso(80 * concluidas / len(nomes), f"Coleção {nome} carregada ({concluidas}/{len(nomes)})")
+            return carga
+
+    try:
+        cargas = dict(zip(nomes, await asyncio.gather(*(restaurar(n) for n in nomes))))
+        duracao_carga = time.perf_counter() - inicio
+
+        if progresso:
+            await progresso(85, "Recriando índices")
+        registro = {n: INDEX_REGISTRY[n] for n in nomes if n in INDEX_REGISTRY}
+        indices = {"verificados": 0, "falhas": []}
+        if staging and registro:
+            # Índices criados no staging seguem a coleção no rename
+            indices = await aplicar_indices(db, {PREFIXO_STAGING + n: specs for n, specs in registro.items()})
+        elif registro:
+            indices = await aplicar_indices(db, registro)
+
+        if progresso:
+            await progresso(90, "Verificando quantidades e checksums")
+        divergencias = []
+        for nome in nomes:
+            erros = await verificar_colecao(destino[nome], manifesto["colecoes"][nome], cargas[nome], verificar_conteudo)
+            divergencias.extend({"colecao": nome, "erro": erro} for erro in erros)
+        if divergencias:
+            raise ErroVerificacao(divergencias)
+
+        trocadas = await promover_staging(db, destino) if staging else nomes
+    except BaseException:
+        if staging:
+            for colecao in destino.values():
+                await colecao.drop()
+        raise
+
+    rollup = None
+    if "transacoes" in nomes:
+        if progresso:
+            await progresso(95, "Reconstruindo o rollup de transações")
+        rollup = await reconstruir_rollup(db)
+    contadores = 0
+    if any(colecao in nomes for colecao, _ in TIPOS.values()):
+        contadores = await limpar_contadores(db)
+
+    duracao = time.perf_counter() - inicio
+    documentos = sum(c["documentos"] for c in cargas.values())
+    megabytes = sum(manifesto["colecoes"][n].get("bytes", 0) for n in nomes) / (1024 * 1024)
+    logger.info(
+        f"✅ Backup {manifesto.get('id')} restaurado: {len(nomes)} coleções, {documentos} documentos "
+        f"em {duracao:.2f}s ({documentos / duracao:.0f} docs/s)"
+    )
+    return {
+        "id": manifesto.get("id"),
+        "backup_date": manifesto.get("backup_date"),
+        "staging": staging,
+        "colecoes": cargas,
+        "trocadas": trocadas,
+        "rollup": rollup,
+        "contadores_descartados": contadores,
+        "documentos": documentos,
+        "indices": indices,
+        "duracao_carga_s": round(duracao_carga, 2),
+        "duracao_s": round(duracao, 2),
+        "documentos_por_s": round(documentos / duracao_carga) if duracao_carga else None,
+        "mb_por_s": round(megabytes / duracao_carga, 2) if duracao_carga else None,
+    }
+
+
+async def _main(args: List[str]):
+    from database import db
+    staging = "--sem-staging" not in args
+    arquivos = [a for a in args if a != "--sem-staging"]
+
+    if len(arquivos) == 1:
+        tar, manifesto = _abrir(arquivos[0])
+        tar.close()
+        if manifesto["tipo"] == TIPO_COMPLETO:
+            resultado = await restaurar_backup(db, arquivos[0], staging=staging)
+            for nome, carga in resultado["colecoes"].items():
+                print(f"{nome}: {carga['documentos']} documentos, {carga['documentos_por_s']} docs/s")
+            print(
+                f"{resultado['documentos']} documentos em {resultado['duracao_s']}s "
+                f"({resultado['documentos_por_s']} docs/s, {resultado['mb_por_s']} MB/s)"
+            )
+            return
+
+    resultado = await restaurar_cadeia(db, arquivos)
+    for backup in resultado["backups"]:
+        print(f"{backup['tipo']} {backup['id']}: {sum(backup['colecoes'].values())} documentos, {backup['exclusoes']} exclusões")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2:
+        print("Uso: python -m services.restauracao [--sem-staging] completo.tar [incremental.tar ...]")
+        sys.exit(1)
+    asyncio.run(_main(sys.argv[1:]))
@@ -0,0 +1,333 @@
+# Rollup mensal incremental de transações
+#
+# A coleção transacoes_rollup guarda um documento por
+# (empresa_id, mes, tipo, categoria_id, centro_custo_id, conta_bancaria_id)
+# com o total e a quantidade de transações. As rotas que criam ou removem
+# transações aplicam $inc nos buckets; dashboards e relatórios leem os buckets
+# dos meses completos e só agregam transações brutas nas bordas do período.
+#
+# Reconstrução (backfill no startup com o rollup vazio, reparo pelo admin):
+#   - completa: os buckets são montados numa coleção temporária, com os
+#     índices do registro, que é renomeada por cima da atual; quem lê nunca
+#     vê o rollup vazio ou pela metade;
+#   - por empresa: os buckets da empresa são regravados no lugar e os que
+#     sobraram (sem transações) são removidos no fim.
+# Cada $inc marca o bucket com atualizado_em; os meses movimentados enquanto
+# a reconstrução rodava são recalculados no fim, para que essas transações
+# não se percam nem contem duas vezes.
+#
+# Uso via linha de comando (reconstrução/reparo):
+#   python -m services.rollup                 # todas as empresas
+#   python -m services.rollup <empresa_id>    # apenas uma empresa
+import asyncio
+import logging
+import sys
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo import UpdateOne
+
+from services.indexes import INDEX_REGISTRY, aplicar_indices
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_COLLECTION = "transacoes_rollup"
+RECONSTRUCAO_COLLECTION = "transacoes_rollup_reconstrucao"
+TAMANHO_LOTE = 1000
+
+# Dimensões de cada bucket (além do mês)
+DIMENSOES = ["tipo", "categoria_id", "centro_custo_id", "conta_bancaria_id"]
+
+
+def mes_da_transacao(transacao: Dict[str, Any]) -> Optional[str]:
+    """Mês (YYYY-MM) de competência da transação"""
+    data = transacao.get("data_competencia")
+    if isinstance(data, datetime):
+        return data.strftime("%Y-%m")
+    if isinstance(data, str) and len(data) >= 7:
+        return data[:7]
+    return None
+
+
+def _chave(transacao: Dict[str, Any]) -> Optional[Tuple]:
+    mes = mes_da_transacao(transacao)
+    if not mes or not transacao.get("empresa_id"):
+        return None
+    return (transacao["empresa_id"], mes) + tuple(transacao.get(d) for d in DIMENSOES)
+
+
+def _filtro_bucket(chave: Tuple) -> Dict[str, Any]:
+    filtro = {"empresa_id": chave[0], "mes": chave[1]}
+    filtro.update(zip(DIMENSOES, chave[2:]))
+    return filtro
+
+
+async def registrar_transacoes(db, transacoes: Iterable[Dict[str, Any]], sinal: int = 1) -> int:
+    """Aplica (sinal=1) ou reverte (sinal=-1) transações nos buckets com $inc.
+
+    Transações do mesmo bucket são somadas antes, então um import de milhares
+    de linhas vira um bulk_write com um update por bucket.
+    """
+    deltas: Dict[Tuple, List[float]] = {}
+    for t in transacoes:
+        chave = _chave(t)
+        if chave is None:
+            continue
+        delta = deltas.setdefault(chave, [0.0, 0])
+        delta[0] += float(t.get("valor_total") or 0)
+        delta[1] += 1
+
+    if not deltas:
+        return 0
+
+    agora = datetime.now(timezone.utc)
+    operacoes = [
+        UpdateOne(
+            _filtro_bucket(chave),
+            {"$inc": {"total": sinal * total, "quantidade": sinal * quantidade}, "$set": {"atualizado_em": agora}},
+            upsert=True
+        )
+        for chave, (total, quantidade) in deltas.items()
+    ]
+    await db[ROLLUP_COLLECTION].bulk_write(operacoes, ordered=False)
+    return len(operacoes)
+
+
+async def registrar_transacao(db, transacao: Dict[str, Any], sinal: int = 1) -> None:
+    """Atalho para uma única transação"""
+    await registrar_transacoes(db, [transacao], sinal)
+
+
+async def _buckets(db, filtro_transacoes: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """Buckets recalculados a partir das transações brutas"""
+    group_id = {"empresa_id": "$empresa_id", "mes": {"$substrCP": ["$data_competencia", 0, 7]}}
+    group_id.update({d: f"${d}" for d in DIMENSOES})
+    pipeline = [
+        {"$match": {"data_competencia": {"$type": "string"}, **filtro_transacoes}},
+        {"$group": {
+            "_id": group_id,
+            "total": {"$sum": {"$ifNull": ["$valor_total", 0]}},
+            "quantidade": {"$sum": 1}
+        }}
+    ]
+    async for grupo in db.transacoes.aggregate(pipeline, allowDiskUse=True):
+        yield {**grupo["_id"], "total": grupo["total"], "quantidade": grupo["quantidade"]}
+
+
+async def _regravar(
+    db,
+    filtro_transacoes: Dict[str, Any],
+    filtro_rollup: Dict[str, Any],
+    preservar_desde: Optional[datetime] = None
+) -> int:
+    """Regrava no lugar os buckets de filtro_rollup e remove os que não têm mais transações.
+
+    Buckets movimentados a partir de preservar_desde não são removidos (o mês
+    é recalculado depois).
+    """
+    colecao = db[ROLLUP_COLLECTION]
+    marca = str(uuid.uuid4())
+    gravados = 0
+    lote: List[UpdateOne] = []
+    async for bucket in _buckets(db, filtro_transacoes):
+        chave = (bucket["empresa_id"], bucket["mes"]) + tuple(bucket.get(d) for d in DIMENSOES)
+        # $set (e não replace): preserva o atualizado_em de um $inc concorrente
+        lote.append(UpdateOne(_filtro_bucket(chave), {"$set": {
+            "total": bucket["total"], "quantidade": bucket["quantidade"], "reconstrucao": marca
+        }}, upsert=True))
+        if len(lote) >= TAMANHO_LOTE:
+            await colecao.bulk_write(lote, ordered=False)
+            gravados += len(lote)
+            lote = []
+    if lote:
+        await colecao.bulk_write(lote, ordered=False)
+        gravados += len(lote)
+
+    sobras: Dict[str, Any] = {**filtro_rollup, "reconstrucao": {"$ne": marca}}
+    if preservar_desde is not None:
+        sobras["atualizado_em"] = {"$not": {"$gte": preservar_desde}}
+    await colecao.delete_many(sobras)
+    return gravados
+
+
+async def _meses_movimentados(colecao, filtro: Dict[str, Any], desde: datetime) -> Set[Tuple[str, str]]:
+    cursor = colecao.find({**filtro, "atualizado_em": {"$gte": desde}}, {"_id": 0, "empresa_id": 1, "mes": 1})
+    return {(doc["empresa_id"], doc["mes"]) async for doc in cursor}
+
+
+async def _recalcular_meses(db, meses: Set[Tuple[str, str]]) -> None:
+    for empresa_id, mes in sorted(meses):
+        proximo = _inicio_mes_seguinte(date.fromisoformat(f"{mes}-01")).strftime("%Y-%m")
+        await _regravar(
+            db,
+            {"empresa_id": empresa_id, "data_competencia": {"$gte": mes, "$lt": proximo}},
+            {"empresa_id": empresa_id, "mes": mes}
+        )
+
+
+async def _reconstruir_completo(db, inicio: datetime) -> int:
+    temporaria = db[RECONSTRUCAO_COLLECTION]
+    await temporaria.drop()
+
+    buckets = 0
+    lote: List[Dict[str, Any]] = []
+    async for bucket in _buckets(db, {}):
+        lote.append(bucket)
+        if len(lote) >= TAMANHO_LOTE:
+            await temporaria.insert_many(lote, ordered=False)
+            buckets += len(lote)
+            lote = []
+    if lote:
+        await temporaria.insert_many(lote, ordered=False)
+        buckets += len(lote)
+
+    if not buckets:
+        await db[ROLLUP_COLLECTION].delete_many({})
+        return 0
+
+    await aplicar_indices(db, {RECONSTRUCAO_COLLECTION: INDEX_REGISTRY[ROLLUP_COLLECTION]})
+    # $inc feitos na coleção antiga durante a montagem somem com o rename
+    movimentados = await _meses_movimentados(db[ROLLUP_COLLECTION], {}, inicio)
+    await temporaria.rename(ROLLUP_COLLECTION, dropTarget=True)
+    movimentados |= await _meses_movimentados(db[ROLLUP_COLLECTION], {}, inicio)
+    await _recalcular_meses(db, movimentados)
+    return buckets
+
+
+async def reconstruir_rollup(db, empresa_id: Optional[str] = None) -> Dict[str, Any]:
+    """Recalcula os buckets a partir das transações brutas (backfill/reparo)"""
+    inicio = datetime.now(timezone.utc)
+    if empresa_id:
+        filtro = {"empresa_id": empresa_id}
+        buckets = await _regravar(db, filtro, filtro, preservar_desde=inicio)
+        await _recalcular_meses(db, await _meses_movimentados(db[ROLLUP_COLLECTION], filtro, inicio))
+    else:
+        buckets = await _reconstruir_completo(db, inicio)
+
+    logger.info(f"✅ Rollup reconstruído ({empresa_id or 'todas as empresas'}): {buckets} buckets")
+    return {"empresa_id": empresa_id, "buckets": buckets}
+
+
+async def backfill_rollup(db) -> Optional[Dict[str, Any]]:
+    """Reconstrói o rollup se ele estiver vazio e já houver transações (primeiro deploy, restauração)"""
+    if await db[ROLLUP_COLLECTION].find_one({}, {"_id": 1}):
+        return None
+    if not await db.transacoes.find_one({"data_competencia": {"$type": "string"}}, {"_id": 1}):
+        return None
+    return await reconstruir_rollup(db)
+
+
+def _para_data(valor: Any) -> date:
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return date.fromisoformat(str(valor)[:10])
+
+
+def _inicio_mes_seguinte(d: date) -> date:
+    return date(d.year + 1, 1, 1) if d.month == 12 else date(d.year, d.month + 1, 1)
+
+
+def _dividir_periodo(inicio: date, fim: Optional[date]):
+    """Divide [inicio, fim] em meses completos (lidos do rollup) e bordas (lidas das transações)"""
+    primeiro_mes = inicio if inicio.day == 1 else _inicio_mes_seguinte(inicio)
+
+    if fim is None:
+        # Período aberto: todos os meses a partir do primeiro mês completo
+        bordas = [(inicio, primeiro_mes)] if primeiro_mes > inicio else []
+        return (primeiro_mes.strftime("%Y-%m"), None), bordas
+
+    fim_exclusivo = fim + timedelta(days=1)
+    ultimo_mes_exclusivo = fim_exclusivo.replace(day=1)
+    if primeiro_mes >= ultimo_mes_exclusivo:
+        return None, [(inicio, fim_exclusivo)]
+
+    bordas = []
+    if primeiro_mes > inicio:
+        bordas.append((inicio, primeiro_mes))
+    if fim_exclusivo > ultimo_mes_exclusivo:
+        bordas.append((ultimo_mes_exclusivo, fim_exclusivo))
+    ultimo_mes = ultimo_mes_exclusivo - timedelta(days=1)
+    return (primeiro_mes.strftime("%Y-%m"), ultimo_mes.strftime("%Y-%m")), bordas
+
+
+async def agregar_periodo(
+    db,
+    empresa_id: str,
+    inicio: Any,
+    fim: Any = None,
+    filtro: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    """Totais por (tipo, categoria, centro de custo, conta) no período [inicio, fim].
+
+    inicio/fim são datas (ou strings ISO) inclusivas; fim=None deixa o período
+    aberto. `filtro` restringe as dimensões (ex: {"tipo": "despesa"}).
+    Retorna [{tipo, categoria_id, centro_custo_id, conta_bancaria_id, total, quantidade}].
+    """
+    filtro = filtro or {}
+    meses, bordas = _dividir_periodo(_para_data(inicio), _para_data(fim) if fim is not None else None)
+
+    resultado: Dict[Tuple, Dict[str, Any]] = {}
+
+    def acumular(dimensoes: Dict[str, Any], total: float, quantidade: int):
+        chave = tuple(dimensoes.get(d) for d in DIMENSOES)
+        linha = resultado.setdefault(chave, {**{d: dimensoes.get(d) for d in DIMENSOES}, "total": 0, "quantidade": 0})
+        linha["total"] += total
+        linha["quantidade"] += quantidade
+
+    group_id = {d: f"${d}" for d in DIMENSOES}
+
+    if meses:
+        filtro_meses: Dict[str, Any] = {"$gte": meses[0]}
+        if meses[1]:
+            filtro_meses["$lte"] = meses[1]
+        pipeline = [
+            {"$match": {"empresa_id": empresa_id, "mes": filtro_meses, **filtro}},
+            {"$group": {"_id": group_id, "total": {"$sum": "$total"}, "quantidade": {"$sum": "$quantidade"}}}
+        ]
+        async for grupo in db[ROLLUP_COLLECTION].aggregate(pipeline):
+            acumular(grupo["_id"], grupo["total"], grupo["quantidade"])
+
+    for borda_inicio, borda_fim in bordas:
+        pipeline = [
+            {"$match": {
+                "empresa_id": empresa_id,
+                "data_competencia": {"$gte": borda_inicio.isoformat(), "$lt": borda_fim.isoformat()},
+                **filtro
+            }},
+            {"$group": {
+                "_id": group_id,
+                "total": {"$sum": {"$ifNull": ["$valor_total", 0]}},
+                "quantidade": {"$sum": 1}
+            }}
+        ]
+        async for grupo in db.transacoes.aggregate(pipeline):
+            acumular(grupo["_id"], grupo["total"], grupo["quantidade"])
+
+    # Buckets zerados (todas as transações removidas) não interessam a quem lê
+    return [linha for linha in resultado.values() if linha["quantidade"]]
+
+
+def somar_por(linhas: List[Dict[str, Any]], campo: str) -> Dict[Any, Dict[str, Any]]:
+    """Reagrupa as linhas de agregar_periodo por um campo: {valor: {receitas, despesas, quantidade}}"""
+    grupos: Dict[Any, Dict[str, Any]] = {}
+    for linha in linhas:
+        grupo = grupos.setdefault(linha.get(campo), {"receitas": 0, "despesas": 0, "quantidade": 0})
+        if linha.get("tipo") == "receita":
+            grupo["receitas"] += linha["total"]
+        else:
+            grupo["despesas"] += linha["total"]
+        grupo["quantidade"] += linha["quantidade"]
+    return grupos
+
+
+async def _main(args: List[str]):
+    from database import db
+    await reconstruir_rollup(db, args[0] if args else None)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(sys.argv[1:]))
@@ -0,0 +1,407 @@
+# Saldos de contas bancárias a partir de um livro-razão (ledger) append-only
+#
+# Cada efeito no saldo de uma conta é um lançamento em saldos_lancamentos:
+# abertura (saldo inicial), transação, estorno (transação excluída, com o
+# valor invertido), perna de transferência ou ajuste. Lançamentos nunca são
+# alterados nem apagados, então escrever é só insert (sem disputa por um
+# documento de conta) e o histórico é completo.
+#
+# Saldo atual = snapshot da conta (saldos_snapshots, um por conta, com o
+# último _id de lançamento incluído) + soma da cauda de lançamentos depois
+# dele. consolidar_saldos() avança os snapshots e grava o mesmo valor em
+# contas_bancarias.saldo_atual (cópia para leitores que não passam pelo
+# ledger). O corte fica MARGEM_CORTE no passado para não pular lançamentos em
+# voo com ObjectId ligeiramente menor (relógios de workers diferentes).
+#
+# Saldo em uma data = soma dos lançamentos com data <= D, lida do índice
+# (conta_id, data, valor) sem tocar nos documentos.
+#
+# Uma conta só passa a ser lida do ledger depois do lançamento de abertura
+# (único por conta, índice parcial). Contas anteriores ao ledger recebem a
+# abertura em migrar_saldos(), executada no startup; até lá o saldo é o
+# saldo_atual gravado na conta mais os lançamentos já feitos nela, e a
+# consolidação não toca na conta.
+#
+# Uso via linha de comando:
+#   python -m services.saldos migrar [empresa_id]       # cria o ledger das contas existentes
+#   python -m services.saldos consolidar [empresa_id]
+#   python -m services.saldos divergencias [empresa_id]
+import asyncio
+import logging
+import sys
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+LEDGER_COLLECTION = "saldos_lancamentos"
+SNAPSHOTS_COLLECTION = "saldos_snapshots"
+
+ORIGEM_ABERTURA = "abertura"
+ORIGEM_TRANSACAO = "transacao"
+ORIGEM_ESTORNO = "estorno"
+ORIGEM_TRANSFERENCIA = "transferencia"
+ORIGEM_AJUSTE = "ajuste"
+
+MARGEM_CORTE = timedelta(minutes=1)
+# Contas por consulta com $or (um ramo por conta, cada um usando o índice)
+LOTE_CONTAS = 200
+TOLERANCIA = 0.005
+
+
+def _agora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _data(valor: Any) -> str:
+    """Data efetiva (YYYY-MM-DD) de um lançamento"""
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()[:10]
+    if isinstance(valor, str) and len(valor) >= 10:
+        return valor[:10]
+    return _agora().date().isoformat()
+
+
+def _lancamento(empresa_id: str, conta_id: str, valor: float, data: Any, origem: str, **extra) -> Dict[str, Any]:
+    return {
+        "id": str(uuid.uuid4()),
+        "empresa_id": empresa_id,
+        "conta_id": conta_id,
+        "valor": round(float(valor), 2),
+        "data": _data(data),
+        "origem": origem,
+        "criado_em": _agora(),
+        **extra,
+    }
+
+
+def lancamentos_da_transacao(transacao: Dict[str, Any], sinal: int = 1) -> List[Dict[str, Any]]:
+    """Lançamento de uma transação com conta bancária (sinal=-1: estorno)"""
+    conta_id = transacao.get("conta_bancaria_id")
+    direcao = {"receita": 1, "despesa": -1}.get(transacao.get("tipo"))
+    if not conta_id or direcao is None:
+        return []
+    if sinal < 0:
+        origem = ORIGEM_ESTORNO
+    else:
+        origem = ORIGEM_TRANSFERENCIA if transacao.get("is_transferencia") else ORIGEM_TRANSACAO
+    valor = direcao * sinal * float(transacao.get("valor_total") or 0)
+    return [_lancamento(
+        transacao["empresa_id"], conta_id, valor, transacao.get("data_competencia"), origem,
+        transacao_id=transacao.get("id")
+    )]
+
+
+async def registrar_lancamentos(db, transacoes: Iterable[Dict[str, Any]], sinal: int = 1) -> int:
+    """Lança (sinal=1) ou estorna (sinal=-1) transações no ledger, num único insert_many"""
+    lancamentos = [l for t in transacoes for l in lancamentos_da_transacao(t, sinal)]
+    if lancamentos:
+        await db[LEDGER_COLLECTION].insert_many(lancamentos, ordered=False)
+    return len(lancamentos)
+
+
+async def registrar_lancamento(db, transacao: Dict[str, Any], sinal: int = 1) -> int:
+    """Atalho para uma única transação"""
+    return await registrar_lancamentos(db, [transacao], sinal)
+
+
+async def abrir_conta(db, conta: Dict[str, Any]) -> None:
+    """Lançamento de abertura com o saldo inicial da conta"""
+    await db[LEDGER_COLLECTION].insert_one(_lancamento(
+        conta["empresa_id"], conta["id"], conta.get("saldo_inicial") or 0, conta.get("created_at"), ORIGEM_ABERTURA
+    ))
+
+
+def _lotes(itens: Sequence[Any], tamanho: int = LOTE_CONTAS):
+    for i in range(0, len(itens), tamanho):
+        yield itens[i:i + tamanho]
+
+
+async def _somar(db, filtro: Dict[str, Any]) -> Dict[str, float]:
+    pipeline = [
+        {"$match": filtro},
+        {"$group": {"_id": "$conta_id", "saldo": {"$sum": "$valor"}}},
+    ]
+    return {g["_id"]: g["saldo"] async for g in db[LEDGER_COLLECTION].aggregate(pipeline)}
+
+
+async def _somar_ate(db, cortes: Dict[str, Optional[ObjectId]], depois: bool) -> Dict[str, float]:
+    """Soma por conta dos lançamentos depois (ou até) o corte de cada conta; corte None = todos"""
+    somas: Dict[str, float] = {}
+    operador = "$gt" if depois else "$lte"
+    for lote in _lotes(list(cortes)):
+        ramos = [
+            {"conta_id": conta_id, "_id": {operador: cortes[conta_id]}} if cortes[conta_id] else {"conta_id": conta_id}
+            for conta_id in lote
+        ]
+        if not depois:
+            # Até o corte: conta sem snapshot não tem o que somar
+            ramos = [r for r in ramos if "_id" in r]
+            if not ramos:
+                continue
+        somas.update(await _somar(db, {"$or": ramos}))
+    return somas
+
+
+async def contas_com_abertura(db, conta_ids: Sequence[str]) -> set:
+    """Contas que já estão no ledger (têm o lançamento de abertura)"""
+    abertas = set()
+    for lote in _lotes(list(conta_ids)):
+        abertas.update(await db[LEDGER_COLLECTION].distinct(
+            "conta_id", {"conta_id": {"$in": list(lote)}, "origem": ORIGEM_ABERTURA}
+        ))
+    return abertas
+
+
+async def _snapshots(db, conta_ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+    cursor = db[SNAPSHOTS_COLLECTION].find({"_id": {"$in": list(conta_ids)}})
+    return {s["_id"]: s async for s in cursor}
+
+
+async def saldos_atuais(
+    db,
+    conta_ids: Sequence[str],
+    saldos_gravados: Optional[Dict[str, float]] = None
+) -> Dict[str, float]:
+    """Saldo atual de cada conta: snapshot + cauda do ledger.
+
+    Contas sem abertura (ainda não migradas) partem do saldo_atual gravado na
+    conta (lido do banco se não vier em saldos_gravados); lançamentos
+    preparados por uma migração em andamento (migracao=True) não entram.
+    """
+    conta_ids = list(dict.fromkeys(conta_ids))
+    if not conta_ids:
+        return {}
+    snapshots = await _snapshots(db, conta_ids)
+    sem_snapshot = [c for c in conta_ids if c not in snapshots]
+    abertas = await contas_com_abertura(db, sem_snapshot) if sem_snapshot else set()
+    pendentes = [c for c in sem_snapshot if c not in abertas]
+
+    gravados = dict(saldos_gravados or {})
+    faltando = [c for c in pendentes if gravados.get(c) is None]
+    if faltando:
+        async for conta in db.contas_bancarias.find({"id": {"$in": faltando}}, {"_id": 0, "id": 1, "saldo_atual": 1}):
+            gravados[conta["id"]] = conta.get("saldo_atual")
+
+    migradas = [c for c in conta_ids if c not in pendentes]
+    cauda = await _somar_ate(db, {c: snapshots[c]["ate_id"] if c in snapshots else None for c in migradas}, depois=True)
+    if pendentes:
+        cauda.update(await _somar(db, {"conta_id": {"$in": pendentes}, "migracao": {"$ne": True}}))
+
+    saldos = {}
+    for c in conta_ids:
+        if c in snapshots:
+            base = snapshots[c]["saldo"]
+        else:
+            base = (gravados.get(c) or 0) if c in pendentes else 0
+        saldos[c] = round(base + cauda.get(c, 0), 2)
+    return saldos
+
+
+async def saldo_atual(db, conta_id: str) -> float:
+    return (await saldos_atuais(db, [conta_id]))[conta_id]
+
+
+async def saldos_em(db, conta_ids: Sequence[str], data: Any) -> Dict[str, float]:
+    """Saldo de cada conta ao fim do dia `data` (lançamentos com data efetiva <= data)"""
+    conta_ids = list(dict.fromkeys(conta_ids))
+    somas = await _somar(db, {"conta_id": {"$in": conta_ids}, "data": {"$lte": _data(data)}})
+    return {c: round(somas.get(c, 0), 2) for c in conta_ids}
+
+
+async def aplicar_saldos(db, contas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Preenche saldo_atual (do ledger) nos documentos de conta, para respostas da API"""
+    saldos = await saldos_atuais(db, [c["id"] for c in contas], {c["id"]: c.get("saldo_atual") for c in contas})
+    for conta in contas:
+        conta["saldo_atual"] = saldos.get(conta["id"], conta.get("saldo_atual", 0))
+    return contas
+
+
+async def _contas(db, empresa_id: Optional[str]) -> List[Dict[str, Any]]:
+    filtro = {"empresa_id": empresa_id} if empresa_id else {}
+    return await db.contas_bancarias.find(filtro, {"_id": 0, "id": 1, "empresa_id": 1, "saldo_atual": 1}).to_list(None)
+
+
+async def consolidar_saldos(db, empresa_id: Optional[str] = None) -> Dict[str, Any]:
+    """Avança os snapshots até o corte e grava o saldo em contas_bancarias.saldo_atual.
+
+    Contas sem abertura ficam de fora: o saldo_atual delas ainda é a única
+    fonte do saldo anterior ao ledger e é o ponto de partida da migração.
+    """
+    corte = ObjectId.from_datetime(_agora() - MARGEM_CORTE)
+    todas = await _contas(db, empresa_id)
+    snapshots = await _snapshots(db, [c["id"] for c in todas])
+    abertas = await contas_com_abertura(db, [c["id"] for c in todas if c["id"] not in snapshots])
+    contas = [c for c in todas if c["id"] in snapshots or c["id"] in abertas]
+    conta_ids = [c["id"] for c in contas]
+
+    # Cauda entre o snapshot anterior e o novo corte
+    incrementos: Dict[str, float] = {}
+    for lote in _lotes(conta_ids):
+        ramos = [
+            {"conta_id": c, "_id": {"$gt": snapshots[c]["ate_id"], "$lte": corte}} if c in snapshots
+            else {"conta_id": c, "_id": {"$lte": corte}}
+            for c in lote
+        ]
+        incrementos.update(await _somar(db, {"$or": ramos}))
+
+    agora = _agora()
+    ops_snapshots = []
+    ops_contas = []
+    for conta in contas:
+        anterior = snapshots.get(conta["id"])
+        saldo = round((anterior["saldo"] if anterior else 0) + incrementos.get(conta["id"], 0), 2)
+        ops_snapshots.append(ReplaceOne(
+            {"_id": conta["id"]},
+            {"empresa_id": conta["empresa_id"], "saldo": saldo, "ate_id": corte, "consolidado_em": agora},
+            upsert=True
+        ))
+        ops_contas.append(UpdateOne(
+            {"id": conta["id"]},
+            {"$set": {"saldo_atual": saldo, "saldo_ate_id": corte, "saldo_consolidado_em": agora.isoformat()}}
+        ))
+    if ops_snapshots:
+        await db[SNAPSHOTS_COLLECTION].bulk_write(ops_snapshots, ordered=False)
+        await db.contas_bancarias.bulk_write(ops_contas, ordered=False)
+
+    nao_migradas = len(todas) - len(contas)
+    logger.info(
+        f"✅ Saldos consolidados ({empresa_id or 'todas as empresas'}): {len(contas)} contas"
+        + (f", {nao_migradas} sem abertura ignoradas" if nao_migradas else "")
+    )
+    return {"contas": len(contas), "nao_migradas": nao_migradas, "corte": str(corte)}
+
+
+async def verificar_divergencias(
+    db,
+    empresa_id: Optional[str] = None,
+    tolerancia: float = TOLERANCIA
+) -> Dict[str, Any]:
+    """Compara, por conta, o ledger recalculado do zero com o snapshot e com saldo_atual.
+
+    - snapshot: soma de todos os lançamentos até o corte do snapshot
+    - saldo_atual: soma até o corte gravado na conta (saldo_ate_id); contas
+      ainda não consolidadas são comparadas com o ledger inteiro
+    """
+    contas = await db.contas_bancarias.find(
+        {"empresa_id": empresa_id} if empresa_id else {},
+        {"_id": 0, "id": 1, "empresa_id": 1, "nome": 1, "saldo_atual": 1, "saldo_ate_id": 1}
+    ).to_list(None)
+    snapshots = await _snapshots(db, [c["id"] for c in contas])
+    abertas = await contas_com_abertura(db, [c["id"] for c in contas if c["id"] not in snapshots])
+    # Sem abertura não há ledger completo com que comparar
+    nao_migradas = [c["id"] for c in contas if c["id"] not in snapshots and c["id"] not in abertas]
+    contas = [c for c in contas if c["id"] not in nao_migradas]
+    conta_ids = [c["id"] for c in contas]
+
+    ate_snapshot = await _somar_ate(db, {c: snapshots[c]["ate_id"] if c in snapshots else None for c in conta_ids}, depois=False)
+    consolidadas = {c["id"]: c["saldo_ate_id"] for c in contas if c.get("saldo_ate_id")}
+    ate_conta = await _somar_ate(db, consolidadas, depois=False)
+    sem_corte = [c["id"] for c in contas if not c.get("saldo_ate_id")]
+    totais = await _somar(db, {"conta_id": {"$in": sem_corte}}) if sem_corte else {}
+
+    divergencias = []
+    for conta in contas:
+        conta_id = conta["id"]
+        if conta_id in snapshots:
+            esperado = round(ate_snapshot.get(conta_id, 0), 2)
+            if abs(esperado - snapshots[conta_id]["saldo"]) > tolerancia:
+                divergencias.append({
+                    "conta_id": conta_id, "nome": conta.get("nome"), "campo": "snapshot",
+                    "ledger": esperado, "registrado": snapshots[conta_id]["saldo"]
+                })
+        esperado = round(ate_conta.get(conta_id, 0) if conta_id in consolidadas else totais.get(conta_id, 0), 2)
+        registrado = conta.get("saldo_atual") or 0
+        if abs(esperado - registrado) > tolerancia:
+            divergencias.append({
+                "conta_id": conta_id, "nome": conta.get("nome"), "campo": "saldo_atual",
+                "ledger": esperado, "registrado": registrado, "diferenca": round(registrado - esperado, 2)
+            })
+
+    if divergencias:
+        logger.warning(f"⚠️ {len(divergencias)} divergências de saldo ({empresa_id or 'todas as empresas'})")
+    return {"contas": len(contas), "divergencias": divergencias, "nao_migradas": nao_migradas}
+
+
+async def migrar_saldos(db, empresa_id: Optional[str] = None) -> Dict[str, Any]:
+    """Cria o ledger das contas que ainda não têm abertura (idempotente).
+
+    Abertura (saldo_inicial) + um lançamento por transação anterior ao ledger
+    (vinculada à conta e sem lançamento próprio); a diferença para o
+    saldo_atual gravado vira um ajuste datado de hoje. Lançamentos feitos
+    depois do deploy do ledger (transações, estornos, transferências) não
+    estão no saldo_atual gravado e continuam somando por cima dele.
+
+    Os lançamentos da migração são gravados com migracao=True e a abertura
+    por último: até ela existir, leitores os ignoram, e uma migração
+    interrompida é refeita do zero na próxima execução. Uma execução por vez
+    (o startup usa um lease); a abertura é única por conta.
+    """
+    contas = await db.contas_bancarias.find({"empresa_id": empresa_id} if empresa_id else {}, {"_id": 0}).to_list(None)
+    abertas = await contas_com_abertura(db, [c["id"] for c in contas])
+
+    migradas = 0
+    lancamentos_criados = 0
+    ajustes = 0
+    for conta in contas:
+        if conta["id"] in abertas:
+            continue
+        # Sobras de uma migração interrompida desta conta
+        await db[LEDGER_COLLECTION].delete_many({"conta_id": conta["id"], "migracao": True})
+
+        transacoes = await db.transacoes.find({"conta_bancaria_id": conta["id"]}, {"_id": 0}).to_list(None)
+        # Lido depois das transações: uma transação criada entre as duas leituras não é lançada duas vezes
+        lancadas = set(await db[LEDGER_COLLECTION].distinct("transacao_id", {"conta_id": conta["id"]}))
+
+        anteriores = [l for t in transacoes if t.get("id") not in lancadas for l in lancamentos_da_transacao(t)]
+        abertura = _lancamento(
+            conta["empresa_id"], conta["id"], conta.get("saldo_inicial") or 0, conta.get("created_at"), ORIGEM_ABERTURA
+        )
+        diferenca = round((conta.get("saldo_atual") or 0) - abertura["valor"] - sum(l["valor"] for l in anteriores), 2)
+        if abs(diferenca) > TOLERANCIA:
+            anteriores.append(_lancamento(
+                conta["empresa_id"], conta["id"], diferenca, _agora(), ORIGEM_AJUSTE, motivo="migracao"
+            ))
+            ajustes += 1
+
+        for lancamento in anteriores + [abertura]:
+            lancamento["migracao"] = True
+        if anteriores:
+            await db[LEDGER_COLLECTION].insert_many(anteriores, ordered=False)
+        try:
+            await db[LEDGER_COLLECTION].insert_one(abertura)
+        except DuplicateKeyError:
+            # Aberta por outro processo no meio do caminho: descarta o que esta execução preparou
+            await db[LEDGER_COLLECTION].delete_many({"id": {"$in": [l["id"] for l in anteriores]}})
+            continue
+        migradas += 1
+        lancamentos_criados += len(anteriores) + 1
+
+    logger.info(f"✅ Ledger de saldos: {migradas} contas migradas, {lancamentos_criados} lançamentos, {ajustes} ajustes")
+    return {"contas_migradas": migradas, "lancamentos": lancamentos_criados, "ajustes": ajustes}
+
+
+async def _main(args: List[str]):
+    from database import db
+    acao = args[0] if args else "divergencias"
+    empresa_id = args[1] if len(args) > 1 else None
+    if acao == "migrar":
+        print(await migrar_saldos(db, empresa_id))
+        print(await consolidar_saldos(db, empresa_id))
+    elif acao == "consolidar":
+        print(await consolidar_saldos(db, empresa_id))
+    else:
+        resultado = await verificar_divergencias(db, empresa_id)
+        for d in resultado["divergencias"]:
+            print(d)
+        print(f"{resultado['contas']} contas, {len(resultado['divergencias'])} divergências")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(sys.argv[1:]))
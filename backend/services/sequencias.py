@@ -0,0 +1,133 @@
+# Numeração sequencial de documentos (OS-2025-0001, V-2025-0001, FAT-2025-0001)
+#
+# Um contador por (tipo, empresa, ano) na coleção sequences, incrementado
+# atomicamente com find_one_and_update($inc): duas vendas simultâneas nunca
+# recebem o mesmo número, e não há mais sort na coleção do documento.
+#
+# Na primeira vez que um contador é usado, ele parte do maior número já
+# gravado para aquela empresa/ano (dados anteriores à coleção sequences),
+# lido pelo índice (empresa_id, numero).
+#
+# Com SEQUENCIAS_BLOCO > 1 cada worker reserva um bloco de números de uma
+# vez e os distribui da memória: menos idas ao banco sob carga, ao custo de
+# números fora da ordem de criação entre workers e de buracos quando um
+# worker reinicia com parte do bloco sem uso. O padrão (1) não tem buracos.
+#
+# Os contadores são derivados dos documentos numerados: ficam fora do backup
+# e são descartados depois de uma restauração (limpar_contadores), para que o
+# próximo uso volte a partir do maior número restaurado.
+import asyncio
+import os
+import re
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+SEQUENCES_COLLECTION = "sequences"
+
+
+# tipo -> (coleção dos documentos numerados, prefixo)
+TIPOS: Dict[str, Tuple[str, str]] = {
+    "os": ("ordens_servico", "OS"),
+    "venda": ("vendas_servico", "V"),
+    "fatura": ("faturas", "FAT"),
+}
+
+
+def chave(tipo: str, empresa_id: str, ano: int) -> str:
+    return f"{tipo}:{empresa_id}:{ano}"
+
+
+def formatar(tipo: str, ano: int, seq: int) -> str:
+    return f"{TIPOS[tipo][1]}-{ano}-{seq:04d}"
+
+
+async def maior_existente(db, tipo: str, empresa_id: str, ano: int) -> int:
+    """Maior número já gravado nos documentos do tipo para a empresa/ano"""
+    colecao, prefixo = TIPOS[tipo]
+    padrao = f"{prefixo}-{ano}-"
+    cursor = db[colecao].find(
+        {"empresa_id": empresa_id, "numero": {"$regex": f"^{re.escape(padrao)}"}},
+        {"_id": 0, "numero": 1}
+    )
+    maior = 0
+    async for doc in cursor:
+        sufixo = doc["numero"][len(padrao):]
+        if sufixo.isdigit():
+            maior = max(maior, int(sufixo))
+    return maior
+
+
+async def reservar(db, tipo: str, empresa_id: str, ano: int, quantidade: int = 1) -> int:
+    """Reserva `quantidade` números consecutivos; devolve o último deles"""
+    _id = chave(tipo, empresa_id, ano)
+    colecao = db[SEQUENCES_COLLECTION]
+    doc = await colecao.find_one_and_update(
+        {"_id": _id}, {"$inc": {"valor": quantidade}}, return_document=ReturnDocument.AFTER
+    )
+    if doc is None:
+        # Contador novo: parte do maior número existente ($max é idempotente,
+        # então workers semeando ao mesmo tempo chegam ao mesmo valor)
+        inicial = await maior_existente(db, tipo, empresa_id, ano)
+        try:
+            await colecao.update_one(
+                {"_id": _id},
+                {"$max": {"valor": inicial}, "$setOnInsert": {"tipo": tipo, "empresa_id": empresa_id, "ano": ano}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Outro worker criou o contador entre o update e o insert do upsert
+            pass
+        doc = await colecao.find_one_and_update(
+            {"_id": _id}, {"$inc": {"valor": quantidade}}, return_document=ReturnDocument.AFTER
+        )
+    return doc["valor"]
+
+
+async def limpar_contadores(db) -> int:
+    """Remove todos os contadores; cada um é semeado de novo no próximo uso"""
+    return (await db[SEQUENCES_COLLECTION].delete_many({})).deleted_count
+
+
+class Sequencias:
+    """Alocador de números por (tipo, empresa, ano), com pré-alocação opcional em blocos"""
+
+    def __init__(self, db, bloco: Optional[int] = None):
+        self.db = db
+        self.bloco = max(1, bloco or int(os.environ.get("SEQUENCIAS_BLOCO", "1")))
+        # chave -> [próximo a entregar, último reservado]
+        self._blocos: Dict[str, List[int]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._reservas = 0
+
+    def _lock(self, k: str) -> asyncio.Lock:
+        if k not in self._locks:
+            self._locks[k] = asyncio.Lock()
+        return self._locks[k]
+
+    async def proximo(self, tipo: str, empresa_id: str, ano: Optional[int] = None) -> int:
+        ano = ano or datetime.now(timezone.utc).year
+        if self.bloco == 1:
+            self._reservas += 1
+            return await reservar(self.db, tipo, empresa_id, ano)
+
+        k = chave(tipo, empresa_id, ano)
+        async with self._lock(k):
+            atual = self._blocos.get(k)
+            if atual is None or atual[0] > atual[1]:
+                ultimo = await reservar(self.db, tipo, empresa_id, ano, self.bloco)
+                self._reservas += 1
+                atual = self._blocos[k] = [ultimo - self.bloco + 1, ultimo]
+            seq = atual[0]
+            atual[0] += 1
+            return seq
+
+    async def numero(self, tipo: str, empresa_id: str, data: Optional[datetime] = None) -> str:
+        """Próximo número formatado, ex: OS-2025-0042"""
+        ano = (data or datetime.now(timezone.utc)).year
+        return formatar(tipo, ano, await self.proximo(tipo, empresa_id, ano))
+
+    def estatisticas(self) -> Dict[str, int]:
+        return {"bloco": self.bloco, "reservas": self._reservas, "blocos_em_memoria": len(self._blocos)}
@@ -0,0 +1,139 @@
+# Servidor SMTP local para testes e desenvolvimento
+#
+# Aceita EHLO/HELO, AUTH PLAIN/LOGIN, MAIL, RCPT, DATA, NOOP, RSET e QUIT sem
+# TLS e guarda as mensagens recebidas em memória. Conta conexões e logins para
+# verificar o reaproveitamento do PoolSmtp.
+#
+#   stub = SmtpStub().iniciar()
+#   ConfigSmtp(host="127.0.0.1", porta=stub.porta, usuario="u", senha="s", ssl=False)
+#
+# Também roda sozinho: python -m services.smtp_stub [porta]
+# (com SMTP_HOST=127.0.0.1 SMTP_PORT=<porta> SMTP_SSL=false no backend).
+import email
+import socketserver
+import sys
+import threading
+from typing import List, Optional
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _responder(self, linha: str) -> None:
+        self.wfile.write((linha + "\r\n").encode())
+
+    def handle(self) -> None:
+        stub: "SmtpStub" = self.server.stub
+        with stub._lock:
+            stub.conexoes += 1
+        self._responder("220 smtp-stub pronto")
+        remetente: Optional[str] = None
+        destinatarios: List[str] = []
+
+        while True:
+            linha = self.rfile.readline()
+            if not linha:
+                return
+            comando = linha.decode(errors="replace").strip()
+            verbo = comando.split(" ", 1)[0].upper()
+
+            if verbo in ("EHLO", "HELO"):
+                if verbo == "EHLO":
+                    self._responder("250-smtp-stub")
+                    self._responder("250 AUTH PLAIN LOGIN")
+                else:
+                    self._responder("250 smtp-stub")
+            elif verbo == "AUTH":
+                partes = comando.split()
+                if len(partes) > 1 and partes[1].upper() == "LOGIN":
+                    # Usuário e senha em duas linhas (base64)
+                    self._responder("334 VXNlcm5hbWU6")
+                    self.rfile.readline()
+                    self._responder("334 UGFzc3dvcmQ6")
+                    self.rfile.readline()
+                elif len(partes) == 2:
+                    self._responder("334 ")
+                    self.rfile.readline()
+                with stub._lock:
+                    stub.logins += 1
+                self._responder("235 autenticado")
+            elif verbo == "MAIL":
+                remetente = comando.split(":", 1)[1].strip()
+                destinatarios = []
+                self._responder("250 ok")
+            elif verbo == "RCPT":
+                destinatario = comando.split(":", 1)[1].strip().strip("<>")
+                if destinatario in stub.recusar:
+                    self._responder("550 destinatário recusado")
+                else:
+                    destinatarios.append(destinatario)
+                    self._responder("250 ok")
+            elif verbo == "DATA":
+                self._responder("354 termine com <CRLF>.<CRLF>")
+                linhas = []
+                while True:
+                    dado = self.rfile.readline()
+                    if not dado or dado in (b".\r\n", b".\n"):
+                        break
+                    linhas.append(dado[1:] if dado.startswith(b"..") else dado)
+                with stub._lock:
+                    stub.mensagens.append({
+                        "de": remetente,
+                        "para": destinatarios,
+                        "mensagem": email.message_from_bytes(b"".join(linhas)),
+                    })
+                self._responder("250 recebida")
+            elif verbo in ("NOOP", "RSET"):
+                self._responder("250 ok")
+            elif verbo == "QUIT":
+                self._responder("221 tchau")
+                return
+            else:
+                self._responder("502 comando não implementado")
+
+
+class _Servidor(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SmtpStub:
+    def __init__(self, host: str = "127.0.0.1", porta: int = 0):
+        self.mensagens: List[dict] = []
+        self.recusar: set = set()
+        self.conexoes = 0
+        self.logins = 0
+        self._lock = threading.Lock()
+        self._servidor = _Servidor((host, porta), _Handler)
+        self._servidor.stub = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def host(self) -> str:
+        return self._servidor.server_address[0]
+
+    @property
+    def porta(self) -> int:
+        return self._servidor.server_address[1]
+
+    def iniciar(self) -> "SmtpStub":
+        self._thread = threading.Thread(target=self._servidor.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self) -> None:
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def __enter__(self) -> "SmtpStub":
+        return self.iniciar()
+
+    def __exit__(self, *exc) -> None:
+        self.parar()
+
+
+if __name__ == "__main__":
+    stub = SmtpStub(porta=int(sys.argv[1]) if len(sys.argv) > 1 else 1025).iniciar()
+    print(f"SMTP stub em {stub.host}:{stub.porta} (Ctrl+C para sair)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.parar()
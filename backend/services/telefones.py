@@ -0,0 +1,178 @@
+# Telefone canônico (E.164) para roteamento de mensagens
+#
+# users, leads e clientes_venda guardam, além do telefone digitado, o campo
+# telefone_normalizado no formato E.164 (+5511987654321). O WhatsApp entrega
+# o remetente como JID ("5511987654321@s.whatsapp.net"); normalizando os dois
+# lados, encontrar o usuário/lead de uma mensagem é uma busca indexada.
+#
+# Regras (Brasil como padrão):
+#   - "+" ou "00" no início: número já internacional
+#   - 10/11 dígitos (DDD + número, sem o 0 de tronco): recebe o DDI 55
+#   - celular brasileiro sem o nono dígito (WhatsApp de contas antigas)
+#     recebe o 9, para casar com o número digitado no cadastro
+#   - placeholders e números curtos/longos demais viram None
+#
+# Backfill dos documentos existentes (o startup do servidor roda o dos
+# documentos que ainda não têm o campo):
+#   python -m services.telefones                 # todas as coleções
+#   python -m services.telefones leads users     # apenas as informadas
+import asyncio
+import logging
+import re
+import sys
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+DDI_PADRAO = "55"
+CAMPO = "telefone_normalizado"
+
+# Campos de origem por coleção, em ordem de preferência
+ORIGEM_USERS = ("telefone",)
+ORIGEM_LEADS = ("whatsapp_phone", "telefone")
+ORIGEM_CLIENTES_VENDA = ("celular", "telefone")
+
+# Usuários-robô do WhatsApp guardam o telefone do primeiro remetente; não
+# podem ser encontrados pelo telefone
+PREFIXO_EMAIL_BOT = "whatsapp-bot-"
+
+MIGRACOES: Dict[str, Dict[str, Any]] = {
+    "users": {"origem": ORIGEM_USERS, "filtro": {"email": {"$not": re.compile(f"^{PREFIXO_EMAIL_BOT}")}}},
+    # Índice único (empresa_id, telefone_normalizado): o lead mais antigo fica com o número
+    "leads": {"origem": ORIGEM_LEADS, "filtro": {}, "unico_por": "empresa_id"},
+    "clientes_venda": {"origem": ORIGEM_CLIENTES_VENDA, "filtro": {}},
+}
+
+TAMANHO_LOTE = 1000
+
+
+def normalizar_telefone(valor: Any, ddi_padrao: str = DDI_PADRAO) -> Optional[str]:
+    """Telefone em E.164 (+DDI...) ou None se não for um número plausível"""
+    if not valor:
+        return None
+    texto = str(valor).split("@", 1)[0].strip()
+    internacional = texto.startswith("+")
+    digitos = re.sub(r"\D", "", texto)
+    if digitos.startswith("00"):
+        digitos = digitos[2:]
+        internacional = True
+
+    if not internacional:
+        # 0 de tronco (0xx11...) e placeholders como (00) 0000-0000
+        digitos = digitos.lstrip("0")
+        if len(digitos) in (10, 11):
+            digitos = ddi_padrao + digitos
+
+    if digitos.startswith("55"):
+        nacional = digitos[2:]
+        if len(nacional) == 10 and nacional[2] in "6789":
+            nacional = nacional[:2] + "9" + nacional[2:]
+        if len(nacional) not in (10, 11) or nacional[0] == "0":
+            return None
+        digitos = "55" + nacional
+
+    if not 8 <= len(digitos) <= 15 or len(set(digitos)) == 1:
+        return None
+    return "+" + digitos
+
+
+def telefone_de(doc: Dict[str, Any], origem: Sequence[str]) -> Optional[str]:
+    """Primeiro campo de origem que normaliza para um número válido"""
+    for campo in origem:
+        normalizado = normalizar_telefone(doc.get(campo))
+        if normalizado:
+            return normalizado
+    return None
+
+
+def campos_telefone(
+    alteracoes: Dict[str, Any],
+    origem: Sequence[str],
+    atual: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """{telefone_normalizado: ...} para um insert/$set que mexe em algum campo de origem.
+
+    Em updates parciais, `atual` é o documento antes da alteração (os campos
+    de origem não alterados continuam valendo).
+    """
+    if not any(campo in alteracoes for campo in origem):
+        return {}
+    return {CAMPO: telefone_de({**(atual or {}), **alteracoes}, origem)}
+
+
+async def migrar_colecao(db, colecao: str, pendentes: bool = False) -> Dict[str, Any]:
+    """pendentes=True só olha documentos sem telefone_normalizado (nem None)"""
+    config = MIGRACOES[colecao]
+    origem = config["origem"]
+    unico_por = config.get("unico_por")
+
+    projecao = {"_id": 0, "id": 1, CAMPO: 1, **{campo: 1 for campo in origem}}
+    if unico_por:
+        projecao[unico_por] = 1
+
+    verificados = 0
+    atualizados = 0
+    conflitos = 0
+    vistos = set()
+    ops: List[UpdateOne] = []
+    ids: List[str] = []
+
+    async def gravar():
+        nonlocal atualizados, conflitos
+        try:
+            resultado = await db[colecao].bulk_write(ops, ordered=False)
+            atualizados += resultado.modified_count
+        except BulkWriteError as e:
+            atualizados += e.details.get("nModified", 0)
+            duplicados = [w for w in e.details.get("writeErrors", []) if w.get("code") == 11000]
+            if len(duplicados) != len(e.details.get("writeErrors", [])):
+                raise
+            conflitos += len(duplicados)
+            # Número já de outro documento (fora desta passada): fica sem, como as duplicatas acima
+            sem_numero = [ids[w["index"]] for w in duplicados]
+            await db[colecao].update_many({"id": {"$in": sem_numero}}, {"$set": {CAMPO: None}})
+        ops.clear()
+        ids.clear()
+
+    filtro = {**config["filtro"], CAMPO: {"$exists": False}} if pendentes else config["filtro"]
+    cursor = db[colecao].find(filtro, projecao).sort([("created_at", 1), ("id", 1)])
+    async for doc in cursor:
+        verificados += 1
+        normalizado = telefone_de(doc, origem)
+        if normalizado and unico_por:
+            chave: Tuple = (doc.get(unico_por), normalizado)
+            if chave in vistos:
+                # Duplicata mais nova: fica sem o campo (não entra no índice único)
+                conflitos += 1
+                normalizado = None
+            else:
+                vistos.add(chave)
+        if CAMPO in doc and doc[CAMPO] == normalizado:
+            continue
+        ops.append(UpdateOne({"id": doc["id"]}, {"$set": {CAMPO: normalizado}}))
+        ids.append(doc["id"])
+        if len(ops) >= TAMANHO_LOTE:
+            await gravar()
+    if ops:
+        await gravar()
+
+    logger.info(f"✅ {colecao}: {verificados} verificados, {atualizados} atualizados, {conflitos} conflitos")
+    return {"verificados": verificados, "atualizados": atualizados, "conflitos": conflitos}
+
+
+async def migrar_telefones(db, colecoes: Optional[Sequence[str]] = None, pendentes: bool = False) -> Dict[str, Any]:
+    """Preenche/corrige telefone_normalizado nos documentos existentes (idempotente)"""
+    return {colecao: await migrar_colecao(db, colecao, pendentes) for colecao in (colecoes or MIGRACOES)}
+
+
+async def _main(args: List[str]):
+    from database import db
+    await migrar_telefones(db, args or None)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(sys.argv[1:]))
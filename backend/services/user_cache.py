@@ -0,0 +1,65 @@
+# Cache do usuário autenticado
+#
+# get_current_user roda em toda chamada da API. Em vez de um find_one em users
+# por request, o documento fica num cache TTL curto chaveado por
+# (user_id, sessao_id do token). As rotas que alteram o usuário (edição,
+# exclusão, troca de senha, logout, bloqueio da empresa) descartam as entradas.
+from typing import Any, Dict, Optional
+
+from cachetools import TTLCache
+
+
+class UserCache:
+    """Cache (user_id, sessao_id) -> documento do usuário"""
+
+    def __init__(self, maxsize: int = 5000, ttl: int = 30):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    async def obter(self, db, user_id: str, sessao_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Usuário do cache ou do banco; None se não existir (não é cacheado)"""
+        chave = (user_id, sessao_id)
+        user = self._cache.get(chave)
+        if user is not None:
+            self.hits += 1
+            # Cópia: as rotas às vezes alteram current_user
+            return dict(user)
+
+        self.misses += 1
+        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        if user is None:
+            return None
+        self._cache[chave] = user
+        return dict(user)
+
+    def _remover(self, condicao) -> None:
+        for chave in [k for k, v in list(self._cache.items()) if condicao(k, v)]:
+            self._cache.pop(chave, None)
+
+    def invalidar(self, user_id: str) -> None:
+        """Descarta todas as sessões de um usuário"""
+        self._remover(lambda chave, _: chave[0] == user_id)
+
+    def invalidar_sessao(self, sessao_id: str) -> None:
+        self._remover(lambda chave, _: chave[1] == sessao_id)
+
+    def invalidar_empresa(self, empresa_id: str) -> None:
+        """Descarta os usuários vinculados à empresa (ex: bloqueio por inadimplência)"""
+        self._remover(lambda _, user: empresa_id in (user.get("empresa_ids") or []))
+
+    def limpar(self) -> None:
+        self._cache.clear()
+
+    def estatisticas(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "itens": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0
+        }
+
+
+# Instância compartilhada por server.py e routers/auth.py
+user_cache = UserCache()
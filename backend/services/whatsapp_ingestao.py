@@ -0,0 +1,375 @@
+# Ingestão de mensagens do WhatsApp (CRM)
+#
+# O serviço Node (whatsapp-service/index.js) envia cada mensagem recebida para
+# /whatsapp/process e espera a resposta que devolve ao contato. Aqui as
+# mensagens passam por uma fila particionada pelo telefone do remetente:
+#   - mensagens do mesmo contato caem na mesma partição e são processadas em
+#     ordem de chegada (um worker por partição);
+#   - contatos diferentes são processados em paralelo (WHATSAPP_PARTICOES).
+#
+# O caminho quente de cada mensagem é: usuário pelo telefone_normalizado,
+# empresa (cache curto), usuário-robô da empresa (cache do processo, criado
+# com upsert e sem bcrypt a cada mensagem) e upsert atômico do lead por
+# (empresa_id, telefone_normalizado). As atividades dos leads novos são
+# gravadas em lote (insert_many) por LoteAtividades.
+#
+# Leads anteriores à normalização (sem telefone_normalizado até o backfill de
+# services/telefones rodar) são encontrados pelo whatsapp_phone/telefone
+# quando a busca normalizada não acha nada, e recebem o campo nesse momento,
+# em vez de um lead duplicado ser criado.
+import asyncio
+import logging
+import os
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from services.executores import executores
+from services.telefones import normalizar_telefone
+
+logger = logging.getLogger(__name__)
+
+PREFIXO_EMAIL_BOT = "whatsapp-bot-"
+TTL_EMPRESA = 60.0
+
+
+def _agora() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class LoteAtividades:
+    """Acumula atividades e grava com insert_many a cada `tamanho` itens ou `intervalo` segundos"""
+
+    def __init__(self, db, tamanho: int = 100, intervalo: float = 0.2):
+        self.db = db
+        self.tamanho = tamanho
+        self.intervalo = intervalo
+        self._pendentes: List[Dict[str, Any]] = []
+        self._timer: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.gravadas = 0
+        self.lotes = 0
+
+    async def adicionar(self, atividade: Dict[str, Any]) -> None:
+        self._pendentes.append(atividade)
+        if len(self._pendentes) >= self.tamanho:
+            await self.gravar()
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._gravar_depois())
+
+    async def _gravar_depois(self) -> None:
+        await asyncio.sleep(self.intervalo)
+        await self.gravar()
+
+    async def gravar(self) -> None:
+        async with self._lock:
+            if not self._pendentes:
+                return
+            lote, self._pendentes = self._pendentes, []
+            try:
+                await self.db.activities.insert_many(lote, ordered=False)
+                self.gravadas += len(lote)
+                self.lotes += 1
+            except Exception as e:
+                logger.error(f"Erro ao gravar {len(lote)} atividades do WhatsApp: {e}")
+
+    async def fechar(self) -> None:
+        if self._timer and not self._timer.done():
+            self._timer.cancel()
+        await self.gravar()
+
+
+class FilaParticionada:
+    """Fila em memória com um worker por partição; a chave define a partição"""
+
+    def __init__(self, processar: Callable[[Any], Awaitable[Any]], particoes: int = 8, tamanho_max: int = 1000):
+        self.processar = processar
+        self.particoes = particoes
+        self.tamanho_max = tamanho_max
+        self._filas: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+        self.processadas = 0
+        self.erros = 0
+
+    def _iniciar(self) -> None:
+        # Na primeira mensagem, já dentro do event loop
+        self._filas = [asyncio.Queue(self.tamanho_max) for _ in range(self.particoes)]
+        self._workers = [asyncio.create_task(self._worker(fila)) for fila in self._filas]
+
+    def particao(self, chave: str) -> int:
+        return zlib.crc32(chave.encode()) % self.particoes
+
+    async def submeter(self, chave: str, item: Any) -> Any:
+        """Enfileira o item na partição da chave e espera o resultado"""
+        if not self._workers:
+            self._iniciar()
+        futuro = asyncio.get_running_loop().create_future()
+        await self._filas[self.particao(chave)].put((item, futuro))
+        return await futuro
+
+    async def _worker(self, fila: asyncio.Queue) -> None:
+        while True:
+            item, futuro = await fila.get()
+            try:
+                resultado = await self.processar(item)
+                self.processadas += 1
+                if not futuro.done():
+                    futuro.set_result(resultado)
+            except asyncio.CancelledError:
+                if not futuro.done():
+                    futuro.cancel()
+                raise
+            except Exception as e:
+                self.erros += 1
+                if not futuro.done():
+                    futuro.set_exception(e)
+            finally:
+                fila.task_done()
+
+    async def parar(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._filas = []
+
+    def em_fila(self) -> int:
+        return sum(fila.qsize() for fila in self._filas)
+
+
+class IngestaoWhatsApp:
+    def __init__(
+        self,
+        db,
+        hash_senha: Callable[[str], str],
+        rotear: Optional[Callable[[str, str], Awaitable[Optional[str]]]] = None,
+        responder_ia: Optional[Callable[[str, str, str], Awaitable[Optional[str]]]] = None,
+        particoes: Optional[int] = None,
+        tamanho_lote_atividades: int = 100,
+        intervalo_atividades: float = 0.2,
+    ):
+        self.db = db
+        self.hash_senha = hash_senha
+        self.rotear = rotear
+        self.responder_ia = responder_ia
+        self.fila = FilaParticionada(
+            self._processar,
+            particoes=particoes or int(os.environ.get("WHATSAPP_PARTICOES", "8"))
+        )
+        self.atividades = LoteAtividades(db, tamanho_lote_atividades, intervalo_atividades)
+        self._bots: Dict[str, Dict[str, Any]] = {}
+        self._senha_bot: Optional[str] = None
+        self._lock_bots = asyncio.Lock()
+        self._empresas: Dict[Optional[str], Tuple[float, Optional[Dict[str, Any]]]] = {}
+        self.leads_criados = 0
+
+    async def processar(self, telefone: str, nome: str, mensagem: str) -> Dict[str, Any]:
+        """Processa a mensagem na partição do remetente e devolve {"response_message": ...}"""
+        normalizado = normalizar_telefone(telefone)
+        item = {"telefone": telefone, "telefone_normalizado": normalizado, "nome": nome, "mensagem": mensagem}
+        return await self.fila.submeter(normalizado or telefone, item)
+
+    # ---------- caches ----------
+
+    async def _empresa(self, empresa_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Empresa por id (ou a padrão, com empresa_id=None) com cache de TTL_EMPRESA segundos"""
+        agora = time.monotonic()
+        em_cache = self._empresas.get(empresa_id)
+        if em_cache and em_cache[0] > agora:
+            return em_cache[1]
+
+        projecao = {"_id": 0, "id": 1, "razao_social": 1}
+        if empresa_id:
+            empresa = await self.db.empresas.find_one({"id": empresa_id}, projecao)
+        else:
+            empresa = None
+            padrao = os.environ.get("WHATSAPP_DEFAULT_EMPRESA_ID")
+            if padrao:
+                empresa = await self.db.empresas.find_one({"id": padrao}, projecao)
+            if not empresa:
+                # Mais recente: mais provável de estar ativa
+                recentes = await self.db.empresas.find({}, projecao).sort("created_at", -1).limit(1).to_list(1)
+                empresa = recentes[0] if recentes else None
+        # Empresa inexistente não fica em cache (pode ser cadastrada a qualquer momento)
+        if empresa:
+            self._empresas[empresa_id] = (agora + TTL_EMPRESA, empresa)
+        return empresa
+
+    async def bot_da_empresa(self, empresa: Dict[str, Any], telefone: str) -> Dict[str, Any]:
+        """Usuário-robô da empresa (criado na primeira mensagem, depois só do cache)"""
+        bot = self._bots.get(empresa["id"])
+        if bot:
+            return bot
+        # Partições que chegam juntas com o cache frio esperam a primeira criar o robô
+        async with self._lock_bots:
+            if empresa["id"] in self._bots:
+                return self._bots[empresa["id"]]
+            if self._senha_bot is None:
+                # bcrypt é lento e bloqueante: uma vez por processo, fora do event loop
+                self._senha_bot = await executores.thread(self.hash_senha, "whatsapp-bot-user", nome="bcrypt")
+            filtro = {"email": f"{PREFIXO_EMAIL_BOT}{empresa['id'][:8]}@echoshop.com"}
+            novo = {
+                "id": str(uuid.uuid4()),
+                "nome": f"WhatsApp Bot - {empresa.get('razao_social', 'ECHO SHOP')}",
+                "telefone": telefone,
+                "perfil": "crm",
+                "empresa_ids": [empresa["id"]],
+                "senha_hash": self._senha_bot,
+                "created_at": _agora()
+            }
+            bot = await self._upsert(self.db.users, filtro, {"$setOnInsert": novo})
+            self._bots[empresa["id"]] = {"id": bot["id"], "email": bot["email"]}
+            return self._bots[empresa["id"]]
+
+    @staticmethod
+    async def _upsert(colecao, filtro: Dict[str, Any], atualizacao: Dict[str, Any]) -> Dict[str, Any]:
+        for tentativa in range(2):
+            try:
+                return await colecao.find_one_and_update(
+                    filtro, atualizacao, upsert=True, return_document=ReturnDocument.AFTER
+                )
+            except DuplicateKeyError:
+                # Dois upserts simultâneos: o outro inseriu, o retry só atualiza
+                if tentativa:
+                    raise
+
+    # ---------- lead ----------
+
+    async def lead_legado(self, empresa_id: str, item: Dict[str, Any], contato: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Lead sem telefone_normalizado com o mesmo whatsapp_phone/telefone; passa a ter o campo"""
+        normalizado = item["telefone_normalizado"]
+        telefones = list({item["telefone"], item["telefone"].split("@", 1)[0], normalizado, normalizado[1:]})
+        filtro = {
+            "empresa_id": empresa_id,
+            "telefone_normalizado": None,
+            "$or": [{"whatsapp_phone": {"$in": telefones}}, {"telefone": {"$in": telefones}}],
+        }
+        try:
+            return await self.db.leads.find_one_and_update(
+                filtro, {"$set": {**contato, "telefone_normalizado": normalizado}},
+                sort=[("created_at", 1)], return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Outro processo já deu o número a um lead: o upsert encontra esse
+            return None
+
+    async def upsert_lead(self, empresa_id: str, item: Dict[str, Any]) -> Tuple[str, bool]:
+        """(lead_id, criado): atualiza o contato do lead existente ou cria um novo, atomicamente"""
+        agora = _agora()
+        contato = {"last_contact_at": agora, "updated_at": agora}
+        if item["telefone_normalizado"]:
+            filtro = {"empresa_id": empresa_id, "telefone_normalizado": item["telefone_normalizado"]}
+            # Caminho quente: o lead já existe com o número normalizado
+            lead = await self.db.leads.find_one_and_update(filtro, {"$set": contato})
+            if lead is None:
+                lead = await self.lead_legado(empresa_id, item, contato)
+            if lead is not None:
+                return lead["id"], False
+        else:
+            filtro = {"empresa_id": empresa_id, "whatsapp_phone": item["telefone"]}
+        novo_id = str(uuid.uuid4())
+        atualizacao = {
+            "$set": contato,
+            "$setOnInsert": {
+                "id": novo_id,
+                "nome": item["nome"] or f"Contato {item['telefone']}",
+                "telefone": item["telefone"],
+                "whatsapp_phone": item["telefone"],
+                "telefone_normalizado": item["telefone_normalizado"],
+                "email": None,
+                "origem": "whatsapp",
+                "status_funil": "novo",
+                "tags": ["whatsapp"],
+                "valor_estimado": 0.0,
+                "assigned_to": None,
+                "notes": f"Lead criado automaticamente via WhatsApp. Primeira mensagem: {item['mensagem'][:100]}",
+                "created_at": agora,
+                "status_desde": agora,
+            }
+        }
+        lead = await self._upsert(self.db.leads, filtro, atualizacao)
+        return lead["id"], lead["id"] == novo_id
+
+    # ---------- processamento ----------
+
+    async def _processar(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        user = None
+        if item["telefone_normalizado"]:
+            user = await self.db.users.find_one(
+                {"telefone_normalizado": item["telefone_normalizado"]},
+                {"_id": 0, "id": 1, "empresa_ids": 1}
+            )
+
+        empresa = None
+        if user and user.get("empresa_ids"):
+            empresa = await self._empresa(user["empresa_ids"][0])
+        else:
+            empresa = await self._empresa(None)
+
+        if not empresa:
+            return {
+                "response_message": "❌ Nenhuma empresa cadastrada no sistema. Configure uma empresa primeiro."
+            }
+
+        # WhatsApp agora é usado APENAS para CRM - Não cria mais transações financeiras
+        response_text = "✅ Mensagem recebida!\\n\\n"
+        response_text += "Olá! Sua mensagem foi registrada no nosso sistema.\\n"
+        response_text += "Nossa equipe entrará em contato em breve.\\n"
+
+        try:
+            bot = await self.bot_da_empresa(empresa, item["telefone"])
+            lead_id, criado = await self.upsert_lead(empresa["id"], item)
+
+            if not criado:
+                response_text += "\\n👤 Lead atualizado!"
+            else:
+                self.leads_criados += 1
+                assigned_user = await self.rotear(empresa["id"], lead_id) if self.rotear else None
+
+                await self.atividades.adicionar({
+                    "id": str(uuid.uuid4()),
+                    "lead_id": lead_id,
+                    "empresa_id": empresa["id"],
+                    "tipo": "whatsapp",
+                    "descricao": f"Lead criado via WhatsApp: {item['mensagem'][:100]}",
+                    "user_id": bot["id"],
+                    "metadata": {"telefone": item["telefone"], "primeira_mensagem": item["mensagem"]},
+                    "created_at": _agora()
+                })
+
+                if assigned_user:
+                    response_text += "\\n🎯 Novo lead criado e atribuído automaticamente!"
+                else:
+                    response_text += "\\n🎯 Novo lead criado!"
+
+                # Tentar resposta automática do agente IA
+                if self.responder_ia:
+                    ai_response = await self.responder_ia(empresa["id"], lead_id, item["mensagem"])
+                    if ai_response:
+                        response_text += f"\\n\\n🤖 {ai_response}"
+        except Exception as e:
+            logger.error(f"Error creating/updating lead: {e}")
+            response_text += "\\n⚠️ Lead não foi criado automaticamente."
+
+        return {"response_message": response_text}
+
+    async def parar(self) -> None:
+        await self.fila.parar()
+        await self.atividades.fechar()
+
+    def estatisticas(self) -> Dict[str, Any]:
+        return {
+            "particoes": self.fila.particoes,
+            "em_fila": self.fila.em_fila(),
+            "processadas": self.fila.processadas,
+            "erros": self.fila.erros,
+            "leads_criados": self.leads_criados,
+            "atividades_gravadas": self.atividades.gravadas,
+            "lotes_atividades": self.atividades.lotes,
+            "bots_em_cache": len(self._bots),
+        }
@@ -103,7 +103,7 @@ function ConfiguracoesBackup({ token }) {
       
       // Create download link
       const timestamp = new Date().toISOString().replace(/[:.]/g, '-').slice(0, -5);
-      const filename = `backup_echoshop_${timestamp}.json`;
+      const filename = `backup_echoshop_${timestamp}.tar`;
       
       const url = window.URL.createObjectURL(new Blob([response.data]));
       const link = document.createElement('a');
@@ -295,7 +295,7 @@ function ConfiguracoesBackup({ token }) {
             <div style={{ fontSize: '40px', marginBottom: '1rem' }}>💾</div>
             <h3 style={{ fontSize: '18px', marginBottom: '0.5rem' }}>Download Local</h3>
             <p style={{ fontSize: '14px', color: '#6b7280', marginBottom: '1.5rem' }}>
-              Baixar backup em JSON para seu computador
+              Baixar backup compactado (NDJSON) para seu computador
             </p>
             <button
               onClick={createLocalBackup}
@@ -0,0 +1,164 @@
+"""
+Test suite for 'Anomalias de Despesas' feature
+Tests services/anomalias.py with planted outliers
+"""
+import asyncio
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("pandas")
+
+from services.anomalias import (  # noqa: E402
+    TIPO_CATEGORIA, TIPO_FORNECEDOR, MotorAnomalias, dataframe_despesas, detectar, pontuar_transacao
+)
+
+CATEGORIAS = 40
+FORNECEDORES = 500
+
+
+def gerar_despesas(quantidade, outliers=20, inicio=None, semente=0):
+    """Despesas ~ Normal(100 + 10 * categoria, 10) em 60 dias; a cada `passo` linhas, um valor 8x maior"""
+    rng = np.random.default_rng(semente)
+    inicio = inicio or date(2025, 1, 1)
+    dias = rng.integers(0, 60, quantidade)
+    valores = np.abs(rng.normal(100 + (np.arange(quantidade) % CATEGORIAS) * 10, 10))
+    passo = quantidade // outliers
+    plantados = [f"t{i}" for i in range(0, passo * outliers, passo)]
+    valores[::passo][:outliers] *= 8
+    despesas = [
+        {
+            "id": f"t{i}",
+            "tipo": "despesa",
+            "data_competencia": (inicio + timedelta(days=int(dias[i]))).isoformat(),
+            "fornecedor": f"Fornecedor {i % FORNECEDORES}",
+            "valor_total": float(valores[i]),
+            "categoria_id": f"cat-{i % CATEGORIAS}",
+        }
+        for i in range(quantidade)
+    ]
+    return despesas, plantados
+
+
+class TestDeteccao:
+    def test_encontra_outliers_plantados(self):
+        despesas, plantados = gerar_despesas(5000)
+        resultado = detectar(dataframe_despesas(despesas), limiar=3.5)
+
+        encontrados = {a["transacao_id"] for a in resultado["anomalias"]}
+        assert set(plantados) <= encontrados
+        assert resultado["anomalias"][0]["desvio"] > 10
+        assert resultado["anomalias"] == sorted(resultado["anomalias"], key=lambda a: a["desvio"], reverse=True)
+
+    def test_mediana_robusta_a_valores_extremos(self):
+        # Com média/desvio padrão, o valor extremo infla a própria régua (z < 2)
+        valores = [100, 101, 99, 100, 102, 98, 100, 5000]
+        despesas = [
+            {"id": f"t{i}", "data_competencia": "2025-01-10", "fornecedor": "", "valor_total": v, "categoria_id": "c"}
+            for i, v in enumerate(valores)
+        ]
+        resultado = detectar(dataframe_despesas(despesas), por_fornecedor=False)
+
+        assert [a["transacao_id"] for a in resultado["anomalias"]] == ["t7"]
+        assert resultado["anomalias"][0]["tipo_alerta"] == TIPO_CATEGORIA
+
+    def test_linha_de_base_por_fornecedor(self):
+        # Valor comum na categoria (valores de 10 a 590), mas alto para o fornecedor
+        despesas = [
+            {"id": f"o{i}", "data_competencia": "2025-01-10", "fornecedor": f"Outro {i}", "valor_total": 10 + 20 * i,
+             "categoria_id": "c"}
+            for i in range(30)
+        ] + [
+            {"id": f"b{i}", "data_competencia": "2025-01-10", "fornecedor": "Barato", "valor_total": 10 + i % 3,
+             "categoria_id": "c"}
+            for i in range(10)
+        ] + [{"id": "x", "data_competencia": "2025-01-11", "fornecedor": "Barato", "valor_total": 60, "categoria_id": "c"}]
+        resultado = detectar(dataframe_despesas(despesas), limiar=3.5)
+
+        assert [(a["transacao_id"], a["tipo_alerta"]) for a in resultado["anomalias"]] == [("x", TIPO_FORNECEDOR)]
+
+    def test_janela_movel_acompanha_mudanca_de_patamar(self):
+        # Aluguel reajustado de 1000 para 1500: destoa até o novo valor ser maioria na janela (3 meses)
+        despesas = [
+            {"id": f"m{mes}", "data_competencia": f"2024-{mes:02d}-05", "fornecedor": "Imobiliária",
+             "valor_total": 1000 + mes % 2 if mes < 7 else 1500 + mes % 2, "categoria_id": "aluguel"}
+            for mes in range(1, 13)
+        ]
+        resultado = detectar(dataframe_despesas(despesas), por_fornecedor=False, janela_dias=95)
+
+        assert sorted(a["transacao_id"] for a in resultado["anomalias"]) == ["m7", "m8"]
+
+    def test_pontua_transacao_nova_contra_a_linha_de_base(self):
+        despesas, _ = gerar_despesas(2000)
+        baselines = detectar(dataframe_despesas(despesas))["baselines"]
+        nova = {"id": "n", "data_competencia": "2025-02-01", "fornecedor": "Fornecedor 3", "categoria_id": "cat-3"}
+
+        assert pontuar_transacao({**nova, "valor_total": 2000}, baselines)["desvio"] > 10
+        assert pontuar_transacao({**nova, "valor_total": 130}, baselines) is None
+
+
+class TestMotorAnomalias:
+    def test_cache_e_pontuacao_incremental(self):
+        mongomock_motor = pytest.importorskip("mongomock_motor")
+        inicio = datetime.now(timezone.utc).date() - timedelta(days=59)
+        despesas, _ = gerar_despesas(500, outliers=5, inicio=inicio)
+
+        async def cenario():
+            db = mongomock_motor.AsyncMongoMockClient()["anomalias_test"]
+            await db.transacoes.insert_many([{**d, "empresa_id": "e1"} for d in despesas])
+            motor = MotorAnomalias(ttl=60)
+            primeira = await motor.analisar(db, "e1")
+            antes = len(primeira["anomalias"])
+            await db.transacoes.delete_many({})
+            # Sem reler o banco: a despesa nova é pontuada na análise em cache
+            alerta = motor.registrar("e1", {
+                "id": "nova", "tipo": "despesa", "data_competencia": datetime.now(timezone.utc).date().isoformat(),
+                "fornecedor": "Fornecedor 1", "valor_total": 5000.0, "categoria_id": "cat-1"
+            })
+            segunda = await motor.analisar(db, "e1")
+            motor.invalidar("e1")
+            terceira = await motor.analisar(db, "e1")
+            return antes, alerta, segunda, terceira, motor.estatisticas()
+
+        antes, alerta, segunda, terceira, estatisticas = asyncio.run(cenario())
+
+        assert antes >= 5
+        assert alerta["transacao_id"] == "nova"
+        assert segunda["anomalias"][0]["transacao_id"] == "nova"
+        assert len(segunda["anomalias"]) == antes + 1
+        assert terceira["transacoes"] == 0
+        assert estatisticas["hits"] == 1 and estatisticas["misses"] == 2 and estatisticas["incrementais"] == 1
+
+    def test_benchmark_100k(self):
+        resultado = benchmark(100000)
+        print(
+            f"\n{resultado['transacoes']} transações: {resultado['duracao_s']}s "
+            f"({resultado['anomalias']} anomalias, {resultado['plantados_encontrados']}/20 plantadas)"
+        )
+        assert resultado["plantados_encontrados"] == 20
+
+
+def benchmark(quantidade=100000, janela_dias=None):
+    despesas, plantados = gerar_despesas(quantidade)
+    inicio = time.perf_counter()
+    resultado = detectar(dataframe_despesas(despesas), janela_dias=janela_dias)
+    duracao = time.perf_counter() - inicio
+    encontrados = {a["transacao_id"] for a in resultado["anomalias"]}
+    return {
+        "transacoes": quantidade,
+        "duracao_s": round(duracao, 3),
+        "anomalias": len(resultado["anomalias"]),
+        "plantados_encontrados": len(set(plantados) & encontrados),
+    }
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:2]]
+    print(benchmark(*args))
+    print(benchmark(*args, janela_dias=30))
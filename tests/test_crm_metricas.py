@@ -0,0 +1,125 @@
+"""
+Test suite for 'Métricas do CRM' feature
+Tests services/crm_metricas.py on an in-memory MongoDB
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from services.crm_metricas import MetricasCRM, calcular_metricas, campos_mudanca_status, reconstruir_etapas  # noqa: E402
+
+AGORA = datetime(2025, 3, 15, 12, 0, tzinfo=timezone.utc)
+
+
+def lead(lead_id, status=None, empresa_id="e1", **extra):
+    documento = {"id": lead_id, "empresa_id": empresa_id, "created_at": "2025-03-01T00:00:00+00:00", **extra}
+    if status:
+        documento["status_funil"] = status
+    return documento
+
+
+async def mudar_status(db, lead_id, status, agora):
+    """O que update_lead_status faz com o lead"""
+    atual = await db.leads.find_one({"id": lead_id})
+    await db.leads.update_one({"id": lead_id}, campos_mudanca_status(atual, status, agora))
+
+
+class TestCamposMudancaStatus:
+    def test_acumula_tempo_da_etapa_que_termina(self):
+        entrada = AGORA - timedelta(days=2)
+        atualizacao = campos_mudanca_status(
+            {"status_funil": "contato", "status_desde": entrada.isoformat()}, "proposta", AGORA
+        )
+
+        assert atualizacao["$set"]["status_funil"] == "proposta"
+        assert atualizacao["$set"]["status_desde"] == AGORA.isoformat()
+        assert atualizacao["$inc"] == {"tempo_etapas.contato": 2 * 86400}
+
+    def test_lead_antigo_em_novo_conta_desde_a_criacao(self):
+        atualizacao = campos_mudanca_status({"created_at": "2025-03-14T12:00:00Z"}, "contato", AGORA)
+        assert atualizacao["$inc"] == {"tempo_etapas.novo": 86400}
+
+    def test_etapa_desconhecida_ou_mesmo_status_nao_acumula(self):
+        desconhecida = campos_mudanca_status({"status_funil": "contato"}, "proposta", AGORA)
+        mesmo = campos_mudanca_status({"status_funil": "contato", "status_desde": AGORA.isoformat()}, "contato", AGORA)
+
+        assert "$inc" not in desconhecida
+        assert "$inc" not in mesmo and "status_desde" not in mesmo["$set"]
+
+
+class TestCalcularMetricas:
+    def test_contagens_conversao_e_tempo_por_etapa(self):
+        async def cenario():
+            db = mongomock_motor.AsyncMongoMockClient()["crm_test"]
+            await db.leads.insert_many([
+                lead("l1", origem="whatsapp", valor_estimado=1000, assigned_to="v1"),
+                lead("l2", origem="whatsapp", valor_estimado=500, assigned_to="v1"),
+                lead("l3", valor_estimado=300, assigned_to="v2"),
+                lead("l4", valor_estimado=200),
+                lead("outra", empresa_id="e2", valor_estimado=9999),
+            ])
+            await mudar_status(db, "l1", "contato", AGORA - timedelta(days=10))
+            await mudar_status(db, "l1", "ganho", AGORA - timedelta(days=6))
+            await mudar_status(db, "l2", "contato", AGORA - timedelta(days=4))
+            await mudar_status(db, "l3", "perdido", AGORA - timedelta(days=2))
+            return await calcular_metricas(db, "e1", agora=AGORA)
+
+        metricas = asyncio.run(cenario())
+
+        assert metricas["total_leads"] == 4
+        assert metricas["leads_por_status"] == {"novo": 1, "contato": 1, "ganho": 1, "perdido": 1}
+        assert metricas["leads_por_origem"] == {"whatsapp": 2, "manual": 2}
+        assert metricas["taxa_conversao"]["ganho"] == 25.0
+        assert metricas["valor_total_pipeline"] == 700
+        assert metricas["leads_vencidos_mes"] == 1 and metricas["leads_perdidos_mes"] == 1
+        # "novo": l1 (4,5 dias), l2 (10,5 dias), l3 (12,5 dias); "contato": só l1 (4 dias)
+        assert metricas["tempo_medio_por_etapa"] == {"novo": round(27.5 / 3, 2), "contato": 4.0}
+        vendedores = {v["user_id"]: v for v in metricas["desempenho_vendedores"]}
+        assert vendedores["v1"]["total_leads"] == 2 and vendedores["v1"]["valor_ganho"] == 1000
+        assert vendedores["v2"]["leads_perdidos"] == 1
+
+    def test_reconstroi_etapas_a_partir_das_atividades(self):
+        async def cenario():
+            db = mongomock_motor.AsyncMongoMockClient()["crm_test"]
+            await db.leads.insert_one(lead("l1", status="proposta"))
+            await db.activities.insert_many([
+                {"lead_id": "l1", "empresa_id": "e1", "tipo": "status_change", "created_at": "2025-03-03T00:00:00+00:00",
+                 "metadata": {"old_status": "novo", "new_status": "contato"}},
+                {"lead_id": "l1", "empresa_id": "e1", "tipo": "status_change", "created_at": "2025-03-04T00:00:00+00:00",
+                 "metadata": {"old_status": "contato", "new_status": "proposta"}},
+            ])
+            resultado = await reconstruir_etapas(db, "e1")
+            return resultado, await db.leads.find_one({"id": "l1"})
+
+        resultado, reconstruido = asyncio.run(cenario())
+
+        assert resultado == {"leads": 1, "atualizados": 1}
+        assert reconstruido["tempo_etapas"] == {"novo": 2 * 86400, "contato": 86400}
+        assert reconstruido["status_desde"] == "2025-03-04T00:00:00+00:00"
+
+
+class TestMetricasCRM:
+    def test_cache_por_empresa_e_invalidacao(self):
+        async def cenario():
+            db = mongomock_motor.AsyncMongoMockClient()["crm_test"]
+            await db.leads.insert_one(lead("l1"))
+            cache = MetricasCRM(ttl=60)
+            primeira = await cache.obter(db, "e1")
+            await db.leads.insert_one(lead("l2"))
+            em_cache = await cache.obter(db, "e1")
+            cache.invalidar("e1")
+            recalculada = await cache.obter(db, "e1")
+            return primeira, em_cache, recalculada, cache.estatisticas()
+
+        primeira, em_cache, recalculada, estatisticas = asyncio.run(cenario())
+
+        assert primeira["total_leads"] == em_cache["total_leads"] == 1
+        assert recalculada["total_leads"] == 2
+        assert estatisticas["hits"] == 1 and estatisticas["misses"] == 2
@@ -0,0 +1,125 @@
+"""
+Test suite for 'Outbox de E-mails' feature
+Tests services/email_outbox.py against a local SMTP stub
+"""
+import asyncio
+import os
+import smtplib
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from services.email_outbox import ConfigSmtp, Outbox, PoolSmtp, montar_mensagem, renderizar  # noqa: E402
+from services.smtp_stub import SmtpStub  # noqa: E402
+
+
+@pytest.fixture
+def stub():
+    with SmtpStub() as servidor:
+        yield servidor
+
+
+def config_para(stub):
+    return ConfigSmtp(host=stub.host, porta=stub.porta, usuario="sistema@echoshop.test", senha="senha", ssl=False)
+
+
+class TestTemplates:
+    def test_renderizar_cobranca(self):
+        email = renderizar("cobranca", razao_social="ACME Ltda", valor_mensal="99.90")
+        assert email["assunto"] == "📋 Lembrete: Mensalidade Pendente"
+        assert "ACME Ltda" in email["html"]
+        assert "R$ 99.90" in email["html"]
+
+    def test_renderizar_aviso_suspensao(self):
+        email = renderizar("aviso_suspensao", razao_social="ACME", dias_atraso=3, dias_restantes=2)
+        assert "3 dias" in email["html"]
+        assert "suspenso em 2 dias" in email["html"]
+
+
+class TestPoolSmtp:
+    def test_reaproveita_conexao_entre_lotes(self, stub):
+        config = config_para(stub)
+        pool = PoolSmtp(config, tamanho=1)
+
+        for lote in range(3):
+            mensagens = [
+                montar_mensagem({"para": f"cliente{lote}{i}@teste.com", "assunto": "Oi", "html": "<p>oi</p>"}, config.usuario)
+                for i in range(5)
+            ]
+            assert pool.enviar_lote(mensagens) == [None] * 5
+        pool.fechar()
+
+        assert len(stub.mensagens) == 15
+        assert stub.conexoes == 1
+        assert stub.logins == 1
+
+    def test_destinatario_recusado_nao_derruba_o_lote(self, stub):
+        stub.recusar.add("ruim@teste.com")
+        config = config_para(stub)
+        pool = PoolSmtp(config)
+
+        resultados = pool.enviar_lote([
+            montar_mensagem({"para": "ok@teste.com", "assunto": "A", "html": "a"}, config.usuario),
+            montar_mensagem({"para": "ruim@teste.com", "assunto": "B", "html": "b"}, config.usuario),
+            montar_mensagem({"para": "ok2@teste.com", "assunto": "C", "html": "c"}, config.usuario),
+        ])
+        pool.fechar()
+
+        assert resultados[0] is None and resultados[2] is None
+        assert "recusado" in resultados[1]
+        assert len(stub.mensagens) == 2
+
+    def test_reconexao_apos_desconexao_do_servidor(self, stub):
+        config = config_para(stub)
+        pool = PoolSmtp(config, tamanho=1)
+        mensagem = montar_mensagem({"para": "ok@teste.com", "assunto": "A", "html": "a"}, config.usuario)
+        assert pool.enviar_lote([mensagem]) == [None]
+
+        derrubada, _ = pool._livres.queue[0]
+
+        def desconectado(msg):
+            raise smtplib.SMTPServerDisconnected("conexão encerrada pelo servidor")
+
+        derrubada.send_message = desconectado
+        resultados = pool.enviar_lote([mensagem, mensagem])
+        abertas = pool.conexoes_abertas
+        pool.fechar()
+
+        assert resultados == [None, None]
+        assert stub.conexoes == 2
+        assert abertas == 1
+        assert pool.conexoes_abertas == 0
+
+
+class TestOutbox:
+    def test_envia_pendentes_e_reagenda_falhas(self, stub):
+        mongomock_motor = pytest.importorskip("mongomock_motor")
+
+        async def cenario():
+            db = mongomock_motor.AsyncMongoMockClient()["outbox_test"]
+            outbox = Outbox(db, config=config_para(stub), conexoes=1, tamanho_lote=10, backoff_base=60)
+            stub.recusar.add("ruim@teste.com")
+
+            for i in range(25):
+                await outbox.enfileirar_template("cobranca", f"cliente{i}@teste.com", razao_social=f"Cliente {i}", valor_mensal="10.00")
+            ruim = await outbox.enfileirar("ruim@teste.com", "Assunto", "<p>x</p>")
+
+            while await outbox.processar_lote():
+                pass
+            await outbox.parar()
+
+            pendente = await db.email_outbox.find_one({"id": ruim["id"]}, {"_id": 0})
+            return pendente, await outbox.estatisticas()
+
+        pendente, stats = asyncio.run(cenario())
+
+        assert len(stub.mensagens) == 25
+        assert stub.logins == 1
+        # Falha volta para a fila com backoff
+        assert pendente["status"] == "pendente"
+        assert pendente["tentativas"] == 1
+        assert "recusado" in pendente["erro"]
+        assert stats["enviados_processo"] == 25
+        assert stats["pendentes"] == 1
@@ -0,0 +1,201 @@
+"""
+Test suite for 'Adaptador do Google Drive' feature
+Tests services/google_drive.py against an in-memory Drive fake
+"""
+import asyncio
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+pytest.importorskip("googleapiclient")
+
+import httplib2  # noqa: E402
+from googleapiclient.errors import HttpError  # noqa: E402
+from googleapiclient.http import MediaUploadProgress  # noqa: E402
+
+import services.google_drive as google_drive  # noqa: E402
+from services.google_drive import Drive, DriveClientes, DriveNaoConectado, excluir_backups_antigos  # noqa: E402
+
+
+class _Requisicao:
+    def __init__(self, resultado):
+        self.resultado = resultado
+
+    def execute(self, http=None, num_retries=0):
+        return self.resultado
+
+
+class _Upload:
+    def __init__(self, servidor, body, media):
+        self.servidor = servidor
+        self.body = body
+        self.media = media
+        self.recebido = b""
+
+    def next_chunk(self, http=None, num_retries=0):
+        if self.servidor.falhas_pendentes and len(self.recebido) >= self.media.chunksize():
+            self.servidor.falhas_pendentes -= 1
+            raise ConnectionResetError("conexão perdida")
+        if self.servidor.sessoes_expiradas and len(self.recebido) >= self.media.chunksize():
+            self.servidor.sessoes_expiradas -= 1
+            raise HttpError(httplib2.Response({"status": 404}), b"sessao de upload expirada")
+        parte = self.media.getbytes(len(self.recebido), self.media.chunksize())
+        self.recebido += parte
+        if len(self.recebido) < self.media.size():
+            return MediaUploadProgress(len(self.recebido), self.media.size()), None
+        arquivo = {"id": f"arquivo-{len(self.servidor.arquivos)}", "name": self.body["name"], "size": len(self.recebido)}
+        self.servidor.arquivos[arquivo["id"]] = {**arquivo, "conteudo": self.recebido}
+        return None, arquivo
+
+
+class _Lote:
+    def __init__(self, servidor, callback):
+        self.servidor = servidor
+        self.callback = callback
+        self.requisicoes = []
+
+    def add(self, requisicao, request_id=None):
+        self.requisicoes.append((request_id, requisicao))
+
+    def execute(self, http=None):
+        self.servidor.lotes += 1
+        for request_id, requisicao in self.requisicoes:
+            if requisicao.resultado in self.servidor.protegidos:
+                self.callback(request_id, None, PermissionError("sem permissão"))
+            else:
+                self.servidor.arquivos.pop(requisicao.resultado, None)
+                self.callback(request_id, None, None)
+
+
+class _Arquivos:
+    def __init__(self, servidor):
+        self.servidor = servidor
+
+    def create(self, body, media_body, fields=None):
+        self.servidor.sessoes += 1
+        return _Upload(self.servidor, body, media_body)
+
+    def list(self, q=None, fields=None, pageSize=100, pageToken=None):
+        ids = sorted(self.servidor.arquivos)
+        inicio = int(pageToken or 0)
+        pagina = [{"id": i, "name": self.servidor.arquivos[i]["name"]} for i in ids[inicio:inicio + 150]]
+        proxima = str(inicio + 150) if inicio + 150 < len(ids) else None
+        return _Requisicao({"files": pagina, "nextPageToken": proxima})
+
+    def delete(self, fileId):
+        return _Requisicao(fileId)
+
+
+class FakeDrive:
+    """Serviço do Drive em memória, com a interface usada pelo adaptador"""
+
+    def __init__(self, falhas=0, sessoes_expiradas=0):
+        self.arquivos = {}
+        self.protegidos = set()
+        self.falhas_pendentes = falhas
+        self.sessoes_expiradas = sessoes_expiradas
+        self.sessoes = 0
+        self.lotes = 0
+
+    def files(self):
+        return _Arquivos(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _Lote(self, callback)
+
+    def about(self):
+        return type("About", (), {"get": lambda _, fields=None: _Requisicao({"user": {"emailAddress": "a@b.com"}})})()
+
+
+class TestDrive:
+    def test_upload_retoma_apos_falha_com_progresso(self, monkeypatch):
+        monkeypatch.setattr(google_drive, "ESPERA_RETOMADA", 0)
+        servidor = FakeDrive(falhas=2)
+        conteudo = os.urandom(1024 * 1024 + 123)
+        progresso = []
+
+        async def registrar(percentual, _mensagem):
+            progresso.append(percentual)
+
+        async def cenario():
+            drive = Drive(servidor)
+            return await drive.upload(
+                io.BytesIO(conteudo), "backup_1.tar", "application/x-tar", progresso=registrar, chunk=256 * 1024
+            )
+
+        arquivo = asyncio.run(cenario())
+
+        assert servidor.arquivos[arquivo["id"]]["conteudo"] == conteudo
+        assert servidor.falhas_pendentes == 0
+        assert progresso == sorted(progresso) and len(progresso) == 4
+
+    def test_sessao_expirada_recomeca_o_upload(self, monkeypatch):
+        monkeypatch.setattr(google_drive, "ESPERA_RETOMADA", 0)
+        servidor = FakeDrive(sessoes_expiradas=1)
+        conteudo = os.urandom(700 * 1024)
+
+        async def cenario():
+            return await Drive(servidor).upload(io.BytesIO(conteudo), "b.tar", "application/x-tar", chunk=256 * 1024)
+
+        arquivo = asyncio.run(cenario())
+
+        assert servidor.arquivos[arquivo["id"]]["conteudo"] == conteudo
+        assert servidor.sessoes == 2
+
+    def test_upload_desiste_depois_das_retomadas(self, monkeypatch):
+        monkeypatch.setattr(google_drive, "ESPERA_RETOMADA", 0)
+        monkeypatch.setenv("DRIVE_RETOMADAS", "1")
+
+        async def cenario():
+            arquivo = io.BytesIO(b"x" * 600 * 1024)
+            await Drive(FakeDrive(falhas=5)).upload(arquivo, "b.tar", "application/x-tar", chunk=256 * 1024)
+
+        with pytest.raises(ConnectionResetError):
+            asyncio.run(cenario())
+
+    def test_exclusao_de_antigos_em_lotes(self):
+        servidor = FakeDrive()
+        servidor.arquivos = {f"id-{i:03d}": {"name": f"backup_{i}.tar"} for i in range(250)}
+        servidor.protegidos = {"id-007"}
+
+        excluidos = asyncio.run(excluir_backups_antigos(Drive(servidor), keep_days=30))
+
+        assert excluidos == 249
+        assert servidor.lotes == 3
+        assert list(servidor.arquivos) == ["id-007"]
+
+
+class TestDriveClientes:
+    def test_servico_em_cache_por_usuario(self):
+        mongomock_motor = pytest.importorskip("mongomock_motor")
+        construidos = []
+
+        def construir(credenciais):
+            construidos.append(credenciais)
+            return FakeDrive()
+
+        async def cenario():
+            db = mongomock_motor.AsyncMongoMockClient()["drive_test"]
+            await db.drive_credentials.insert_one({
+                "user_id": "u1", "access_token": "token", "refresh_token": "refresh",
+                "token_uri": "https://oauth2.googleapis.com/token", "client_id": "c", "client_secret": "s",
+                "scopes": google_drive.ESCOPOS, "expiry": None
+            })
+            clientes = DriveClientes(db, construir=construir)
+            drives = await asyncio.gather(*(clientes.do_usuario("u1") for _ in range(5)))
+            sobre = await drives[0].sobre()
+            clientes.invalidar("u1")
+            await clientes.do_usuario("u1")
+            with pytest.raises(DriveNaoConectado):
+                await clientes.do_usuario("u2")
+            return drives, sobre
+
+        drives, sobre = asyncio.run(cenario())
+
+        assert all(d is drives[0] for d in drives)
+        assert len(construidos) == 2
+        assert sobre["user"]["emailAddress"] == "a@b.com"
@@ -0,0 +1,82 @@
+"""
+Test suite for 'Importação de Transações' feature
+Tests services/importacao.py (row normalization and the bulk import)
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+pd = pytest.importorskip("pandas")
+
+from services.anomalias import motor_anomalias  # noqa: E402
+from services.importacao import importar_transacoes, normalizar_transacoes  # noqa: E402
+from services.previsao_fluxo import previsao_fluxo  # noqa: E402
+
+
+def normalizar(linhas):
+    return normalizar_transacoes(pd.DataFrame(linhas), "e1", "u1", "import_csv", categoria_padrao="cat")
+
+
+class TestNormalizarTransacoes:
+    @pytest.mark.parametrize("texto, esperado", [
+        ("1234.56", 1234.56),
+        ("1,234.56", 1234.56),
+        ("1.234,56", 1234.56),
+        ("R$ 10,00", 10.0),
+        ("1,234,567", 1234567.0),
+        ("1.234.567,89", 1234567.89),
+    ])
+    def test_separador_decimal(self, texto, esperado):
+        docs, erros = normalizar([{"data": "2024-06-01", "tipo": "despesa", "fornecedor": "F", "valor": texto}])
+
+        assert erros == []
+        assert docs[0]["valor_total"] == pytest.approx(esperado)
+
+    def test_tipo_fora_de_receita_despesa_e_aceito(self):
+        docs, erros = normalizar([
+            {"data": "2024-06-01", "tipo": "Transferencia", "fornecedor": "F", "valor": 10},
+            {"data": "2024-06-01", "tipo": "RECEITA", "fornecedor": "F", "valor": 20},
+        ])
+
+        assert erros == []
+        assert [d["tipo"] for d in docs] == ["transferencia", "receita"]
+
+    def test_erros_por_linha(self):
+        docs, erros = normalizar([
+            {"data": "01/06/2024", "tipo": "despesa", "fornecedor": None, "valor": "50"},
+            {"data": "2024-06-01", "tipo": "despesa", "fornecedor": "F", "valor": "abc"},
+            {"data": "32/13/2024", "tipo": "despesa", "fornecedor": "F", "valor": "5"},
+        ])
+
+        assert erros == [{"linha": 3, "erro": "valor inválido"}, {"linha": 4, "erro": "data inválida"}]
+        assert len(docs) == 1
+        assert docs[0]["data_competencia"] == "2024-06-01"
+        assert docs[0]["fornecedor"] == "Não informado"
+        assert docs[0]["categoria_id"] == "cat" and docs[0]["centro_custo_id"] is None
+        assert docs[0]["_linha"] == 2
+
+
+class TestImportarTransacoes:
+    def test_importacao_descarta_previsao_e_anomalias_da_empresa(self, monkeypatch):
+        mongomock_motor = pytest.importorskip("mongomock_motor")
+        # Ajustes/análises em cache de duas empresas; só os da empresa importada saem
+        monkeypatch.setattr(previsao_fluxo, "_cache", {"e1": {"fim": None}, "e2": {"fim": None}})
+        monkeypatch.setattr(motor_anomalias, "_cache", {("e1", 90): {}, ("e2", 90): {}})
+
+        async def cenario():
+            db = mongomock_motor.AsyncMongoMockClient()["importacao_test"]
+            df = pd.DataFrame([
+                {"data": "2024-06-01", "tipo": "despesa", "fornecedor": "F", "valor": "10,50"},
+                {"data": "2024-06-02", "tipo": "receita", "fornecedor": "C", "valor": "20"},
+            ])
+            return await importar_transacoes(db, df, "e1", "u1", "import_csv"), await db.transacoes.count_documents({})
+
+        resultado, gravadas = asyncio.run(cenario())
+
+        assert resultado["imported"] == gravadas == 2
+        assert list(previsao_fluxo._cache) == ["e2"]
+        assert list(motor_anomalias._cache) == [("e2", 90)]
@@ -0,0 +1,134 @@
+"""
+Test suite for 'Verificação de Inadimplência' feature
+Tests services/inadimplencia.py against a fake Asaas API on an in-memory MongoDB
+"""
+import asyncio
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+httpx = pytest.importorskip("httpx")
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from services.inadimplencia import LimiteTaxa, verificar_inadimplentes  # noqa: E402
+
+
+class FakeAsaas:
+    """GET /payments com o atraso configurado por assinatura; registra a concorrência"""
+
+    def __init__(self, atrasos, falhas=()):
+        self.atrasos = atrasos
+        self.falhas = set(falhas)
+        self.em_andamento = 0
+        self.max_em_andamento = 0
+        self.chamadas = 0
+
+    async def get(self, url, params=None, headers=None):
+        self.chamadas += 1
+        self.em_andamento += 1
+        self.max_em_andamento = max(self.max_em_andamento, self.em_andamento)
+        try:
+            await asyncio.sleep(0.01)
+            requisicao = httpx.Request("GET", url, params=params)
+            if params["subscription"] in self.falhas:
+                return httpx.Response(500, request=requisicao)
+            dias = self.atrasos.get(params["subscription"])
+            cobrancas = [] if dias is None else [{"dueDate": (date.today() - timedelta(days=dias)).isoformat()}]
+            return httpx.Response(200, json={"data": cobrancas}, request=requisicao)
+        finally:
+            self.em_andamento -= 1
+
+
+class FakeOutbox:
+    def __init__(self):
+        self.emails = []
+
+    async def enfileirar_templates(self, emails):
+        self.emails.extend(emails)
+
+
+def assinatura(n, **extra):
+    return {"id": f"a{n}", "asaas_subscription_id": f"sub{n}", "cnpj_cpf": f"cnpj{n}", "email": f"c{n}@teste.com",
+            "razao_social": f"Cliente {n}", "valor_mensal": 99.9, "status": "ativa", **extra}
+
+
+class TestVerificarInadimplentes:
+    def test_atualiza_em_lote_e_enfileira_emails(self):
+        asaas = FakeAsaas({"sub1": 1, "sub2": 3, "sub3": 7}, falhas={"sub5"})
+        outbox = FakeOutbox()
+        invalidadas = []
+
+        async def cenario():
+            db = mongomock_motor.AsyncMongoMockClient()["inadimplencia_test"]
+            await db.assinaturas_saas.insert_many([assinatura(n) for n in range(1, 6)] + [
+                assinatura(6, status="cancelada"), assinatura(7, asaas_subscription_id=None)
+            ])
+            await db.empresas.insert_one({"id": "emp3", "cnpj": "cnpj3"})
+            resultado = await verificar_inadimplentes(
+                db, "chave", "https://asaas.test", outbox, invalidadas.append, concorrencia=2, req_por_segundo=0,
+                upstream=asaas
+            )
+            assinaturas = {a["id"]: a async for a in db.assinaturas_saas.find({}, {"_id": 0})}
+            return resultado, assinaturas, await db.empresas.find_one({"id": "emp3"})
+
+        resultado, assinaturas, empresa = asyncio.run(cenario())
+
+        assert resultado["verificadas"] == 5 and resultado["processadas"] == 3
+        assert resultado["bloqueadas"] == 1
+        assert [e["id"] for e in resultado["erros"]] == ["a5"]
+        assert assinaturas["a1"]["dias_atraso"] == 1 and assinaturas["a1"]["status"] == "ativa"
+        assert assinaturas["a3"]["status"] == "suspensa" and "bloqueada_em" in assinaturas["a3"]
+        assert "dias_atraso" not in assinaturas["a4"]
+        assert empresa["is_blocked"] is True and invalidadas == ["emp3"]
+        templates = {e["para"]: e for e in outbox.emails}
+        assert templates["c1@teste.com"]["template"] == "cobranca"
+        assert templates["c1@teste.com"]["dados"]["valor_mensal"] == "99.90"
+        assert templates["c2@teste.com"]["template"] == "aviso_suspensao"
+        assert templates["c2@teste.com"]["dados"]["dias_restantes"] == 2
+        assert templates["c3@teste.com"]["template"] == "bloqueio"
+        assert asaas.max_em_andamento <= 2
+
+    def test_semaforo_e_limite_de_taxa(self):
+        asaas = FakeAsaas({})
+
+        async def cenario():
+            db = mongomock_motor.AsyncMongoMockClient()["inadimplencia_test"]
+            await db.assinaturas_saas.insert_many([assinatura(n) for n in range(10)])
+            inicio = time.monotonic()
+            await verificar_inadimplentes(
+                db, "chave", "https://asaas.test", FakeOutbox(), lambda _: None, concorrencia=3, req_por_segundo=50,
+                upstream=asaas
+            )
+            return time.monotonic() - inicio
+
+        duracao = asyncio.run(cenario())
+
+        assert asaas.chamadas == 10
+        assert asaas.max_em_andamento <= 3
+        # 10 inícios a 50/s: o último começa pelo menos 9 intervalos de 20 ms depois do primeiro
+        assert duracao >= 0.18
+
+
+class TestLimiteTaxa:
+    def test_espaca_os_inicios(self):
+        async def cenario():
+            limite = LimiteTaxa(100)
+            antes = time.monotonic()
+            inicios = []
+            for _ in range(5):
+                await limite.aguardar()
+                inicios.append(time.monotonic())
+            return antes, inicios
+
+        antes, inicios = asyncio.run(cenario())
+
+        # O k-ésimo início é agendado para k intervalos depois do primeiro
+        assert all(inicio - antes >= k * 0.01 - 0.001 for k, inicio in enumerate(inicios))
+
+    def test_sem_limite_nao_espera(self):
+        assert LimiteTaxa(0).intervalo == 0.0
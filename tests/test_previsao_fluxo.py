@@ -0,0 +1,136 @@
+"""
+Test suite for 'Previsão de Fluxo de Caixa' feature
+Tests services/previsao_fluxo.py with synthetic daily series
+"""
+import asyncio
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+np = pytest.importorskip("numpy")
+
+from services.previsao_fluxo import PrevisaoFluxo, ajustar, projetar, recorrentes_por_dia  # noqa: E402
+
+HOJE = date(2025, 7, 1)
+
+
+def gerar_series(dias=365, fim=HOJE - timedelta(days=1), contratos=None, semente=0):
+    """Receitas: 1000 em dias úteis, 200 no fim de semana; despesas: 300/dia + aluguel de 5000 no dia 5"""
+    rng = np.random.default_rng(semente)
+    inicio = fim - timedelta(days=dias - 1)
+    calendario = [inicio + timedelta(days=i) for i in range(dias)]
+    recorrentes = recorrentes_por_dia(contratos or [], calendario)
+    receitas = {
+        dia: max(0.0, (1000 if dia.weekday() < 5 else 200) + rng.normal(0, 50)) + recorrentes[i]
+        for i, dia in enumerate(calendario)
+    }
+    despesas = {dia: 300 + (5000 if dia.day == 5 else 0) + rng.normal(0, 30) for dia in calendario}
+    return {"receita": receitas, "despesa": despesas}, inicio, fim
+
+
+class TestModelo:
+    def test_recupera_sazonalidade_semanal_e_mensal(self):
+        series, inicio, fim = gerar_series()
+        projecao = projetar(ajustar(series, inicio, fim), 31)["projecao"]
+        por_data = {date.fromisoformat(d["data"]): d for d in projecao}
+
+        for dia, linha in por_data.items():
+            esperado = 1000 if dia.weekday() < 5 else 200
+            assert abs(linha["receitas"] - esperado) < 100
+        assert por_data[date(2025, 7, 5)]["despesas"] > 4500
+        assert all(abs(l["despesas"] - 300) < 100 for d, l in por_data.items() if d.day != 5)
+
+    def test_recorrentes_incluem_contratos_novos(self):
+        # Contrato do dia 10 desde o início; o do dia 31 começa dias antes do fim (quase sem histórico)
+        contratos = [
+            {"valor": 2000.0, "dia": 10, "inicio": date(2024, 1, 1), "fim": None},
+            {"valor": 800.0, "dia": 31, "inicio": HOJE - timedelta(days=10), "fim": None},
+        ]
+        series, inicio, fim = gerar_series(contratos=contratos)
+        projecao = {d["data"]: d for d in projetar(ajustar(series, inicio, fim, contratos), 31)["projecao"]}
+
+        assert abs(projecao["2025-07-10"]["receitas"] - 3000) < 150
+        # Julho tem 31 dias; em meses curtos o vencimento 31 cai no último dia
+        assert abs(projecao["2025-07-31"]["receitas"] - 1800) < 150
+        assert recorrentes_por_dia(contratos, [date(2025, 6, 30)])[0] == 800.0
+
+    def test_faixas_crescem_com_o_horizonte(self):
+        series, inicio, fim = gerar_series()
+        projecao = projetar(ajustar(series, inicio, fim), 60, saldo_inicial=1000)["projecao"]
+        larguras = [d["faixa_95"][1] - d["faixa_95"][0] for d in projecao]
+
+        assert larguras == sorted(larguras)
+        assert larguras[-1] > 5 * larguras[0]
+        assert all(d["faixa_80"][0] <= d["saldo_acumulado"] <= d["faixa_80"][1] for d in projecao)
+        assert projecao[0]["saldo_acumulado"] == pytest.approx(1000 + projecao[0]["saldo"], abs=0.01)
+
+
+class TestPrevisaoFluxo:
+    def test_cache_e_ajuste_incremental(self):
+        mongomock_motor = pytest.importorskip("mongomock_motor")
+        series, _, _ = gerar_series(dias=120)
+        transacoes = [
+            {"empresa_id": "e1", "tipo": tipo, "data_competencia": dia.isoformat(), "valor_total": float(valor)}
+            for tipo, valores in series.items() for dia, valor in valores.items()
+        ]
+        nova = {"empresa_id": "e1", "tipo": "receita", "data_competencia": "2025-06-20", "valor_total": 7000.0}
+
+        async def cenario():
+            db = mongomock_motor.AsyncMongoMockClient()["previsao_test"]
+            await db.transacoes.insert_many(transacoes + [
+                {"empresa_id": "e1", "tipo": "receita", "data_competencia": "2025-06-10",
+                 "valor_total": 9999.0, "is_transferencia": True},
+            ])
+            previsao = PrevisaoFluxo(ttl=60)
+            primeiro = dict(await previsao.ajuste(db, "e1", hoje=HOJE))
+            # Sem reler o banco: a transação nova atualiza o ajuste em cache
+            await db.transacoes.insert_one(dict(nova))
+            aplicada = previsao.registrar("e1", nova)
+            incremental = projetar(await previsao.ajuste(db, "e1", hoje=HOJE), 30)
+            previsao.invalidar("e1")
+            completo = projetar(await previsao.ajuste(db, "e1", hoje=HOJE), 30)
+            futura = previsao.registrar("e1", {**nova, "data_competencia": HOJE.isoformat()})
+            return primeiro, aplicada, incremental, completo, futura, previsao.estatisticas()
+
+        primeiro, aplicada, incremental, completo, futura, estatisticas = asyncio.run(cenario())
+
+        assert primeiro["dias"] == 120 and primeiro["transacoes"] == 240
+        assert aplicada and not futura
+        assert incremental["projecao"] == completo["projecao"]
+        assert estatisticas["hits"] == 1 and estatisticas["misses"] == 2 and estatisticas["incrementais"] == 1
+
+    def test_benchmark_um_ano(self):
+        resultado = benchmark(365)
+        print(f"\n{resultado['dias']} dias: ajuste {resultado['ajuste_ms']}ms, projeção de 90 dias {resultado['projecao_ms']}ms")
+        assert resultado["projecao_ms"] < 100
+
+
+def benchmark(dias=365, contratos=2000):
+    rng = np.random.default_rng(1)
+    itens = [
+        {"valor": float(rng.integers(50, 500)), "dia": int(rng.integers(1, 32)),
+         "inicio": HOJE - timedelta(days=int(rng.integers(1, dias))), "fim": None}
+        for _ in range(contratos)
+    ]
+    series, inicio, fim = gerar_series(dias, contratos=itens)
+    t0 = time.perf_counter()
+    ajuste = ajustar(series, inicio, fim, itens)
+    t1 = time.perf_counter()
+    projetar(ajuste, 90)
+    t2 = time.perf_counter()
+    return {
+        "dias": dias,
+        "contratos": contratos,
+        "ajuste_ms": round((t1 - t0) * 1000, 2),
+        "projecao_ms": round((t2 - t1) * 1000, 2),
+    }
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:2]]
+    print(benchmark(*args))
@@ -0,0 +1,203 @@
+"""
+Test suite for 'Restauração Paralela de Backups' feature
+Tests services/restauracao.py with backups produced by services/backup.py
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import tarfile
+from datetime import datetime, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from bson import ObjectId  # noqa: E402
+
+from services.backup import (  # noqa: E402
+    MANIFESTO, PREFIXO_ANTERIOR, PREFIXO_STAGING, TIPO_INCREMENTAL, gerar_backup, registrar_backup
+)
+from services.restauracao import ErroVerificacao, promover_staging, restaurar_backup, restaurar_cadeia  # noqa: E402
+from services.sequencias import SEQUENCES_COLLECTION, Sequencias, chave  # noqa: E402
+
+
+def novo_cliente():
+    import mongomock_motor
+    return mongomock_motor.AsyncMongoMockClient()
+
+
+async def popular(db, transacoes=2000):
+    data = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+    await db.transacoes.insert_many([
+        {"id": f"t{i}", "empresa_id": f"empresa-{i % 5}", "valor": i * 1.5, "data": data, "ref": ObjectId()}
+        for i in range(transacoes)
+    ])
+    await db.leads.insert_many([
+        {"id": f"l{i}", "empresa_id": "empresa-1", "nome": f"Lead {i} ção", "telefone_normalizado": f"+55119{i:08d}"}
+        for i in range(300)
+    ])
+    await db.categorias.insert_many([{"id": f"c{i}", "nome": f"Categoria {i}"} for i in range(10)])
+
+
+async def gravar_backup(db, caminho, modo="completo"):
+    arquivo, manifesto = await gerar_backup(db, compressao="gzip", modo=modo)
+    with arquivo, open(caminho, "wb") as saida:
+        saida.write(arquivo.read())
+    return manifesto
+
+
+async def criar_os(db, sequencias):
+    """O que create_ordem_servico grava: número alocado e a OS"""
+    numero = await sequencias.numero("os", "e1", datetime(2025, 3, 1))
+    await db.ordens_servico.insert_one(
+        {"id": numero, "empresa_id": "e1", "numero": numero, "created_at": datetime.now(timezone.utc).isoformat()}
+    )
+    return numero
+
+
+async def documentos(db, colecao):
+    return sorted([doc async for doc in db[colecao].find({})], key=lambda d: d["_id"])
+
+
+def corromper_manifesto(origem, destino, colecao):
+    """Copia o backup trocando o sha256 de uma coleção no manifesto"""
+    with tarfile.open(origem) as entrada, tarfile.open(destino, "w") as saida:
+        for membro in entrada.getmembers():
+            conteudo = entrada.extractfile(membro).read()
+            if membro.name == MANIFESTO:
+                manifesto = json.loads(conteudo)
+                manifesto["colecoes"][colecao]["sha256"] = "0" * 64
+                conteudo = json.dumps(manifesto).encode("utf-8")
+                membro.size = len(conteudo)
+            saida.addfile(membro, io.BytesIO(conteudo))
+
+
+class TestRestauracaoParalela:
+    @pytest.mark.parametrize("staging", [True, False])
+    def test_restaura_identico_ao_original(self, tmp_path, staging):
+        pytest.importorskip("mongomock_motor")
+        caminho = tmp_path / "backup.tar"
+
+        async def cenario():
+            cliente = novo_cliente()
+            origem, destino = cliente["origem"], cliente["destino"]
+            await popular(origem)
+            manifesto = await gravar_backup(origem, caminho)
+            # Dado antigo no destino: substituído pela restauração
+            await destino.leads.insert_one({"id": "antigo"})
+            resultado = await restaurar_backup(destino, caminho, staging=staging, concorrencia=2, tamanho_lote=250)
+            iguais = {
+                nome: await documentos(origem, nome) == await documentos(destino, nome)
+                for nome in manifesto["colecoes"]
+            }
+            restantes = [n for n in await destino.list_collection_names() if n.startswith(PREFIXO_STAGING)]
+            return manifesto, resultado, iguais, restantes
+
+        manifesto, resultado, iguais, restantes = asyncio.run(cenario())
+
+        assert all(iguais.values()), iguais
+        assert restantes == []
+        assert resultado["documentos"] == manifesto["documentos"] == 2310
+        assert resultado["colecoes"]["transacoes"]["lotes"] == 8
+        assert sorted(resultado["trocadas"]) == sorted(manifesto["colecoes"])
+        assert resultado["documentos_por_s"] > 0
+
+    def test_checksum_divergente_nao_altera_o_banco(self, tmp_path):
+        pytest.importorskip("mongomock_motor")
+        caminho = tmp_path / "backup.tar"
+        corrompido = tmp_path / "corrompido.tar"
+
+        async def cenario():
+            cliente = novo_cliente()
+            origem, destino = cliente["origem"], cliente["destino"]
+            await popular(origem, transacoes=100)
+            await gravar_backup(origem, caminho)
+            corromper_manifesto(caminho, corrompido, "leads")
+            await destino.leads.insert_one({"id": "existente"})
+            with pytest.raises(ErroVerificacao) as erro:
+                await restaurar_backup(destino, corrompido)
+            return erro.value, await documentos(destino, "leads"), await destino.list_collection_names()
+
+        erro, leads, colecoes = asyncio.run(cenario())
+
+        assert [d["colecao"] for d in erro.divergencias] == ["leads"]
+        assert [lead["id"] for lead in leads] == ["existente"]
+        assert not any(n.startswith(PREFIXO_STAGING) for n in colecoes)
+
+    def test_falha_na_troca_desfaz_as_colecoes_ja_trocadas(self):
+        pytest.importorskip("mongomock_motor")
+
+        class RenameFalha:
+            async def rename(self, *args, **kwargs):
+                raise RuntimeError("rename falhou")
+
+        async def cenario():
+            db = novo_cliente()["destino"]
+            await db.leads.insert_one({"id": "atual"})
+            await db.categorias.insert_one({"id": "atual"})
+            await db[PREFIXO_STAGING + "leads"].insert_one({"id": "restaurado"})
+            destino = {"leads": db[PREFIXO_STAGING + "leads"], "categorias": RenameFalha()}
+            with pytest.raises(RuntimeError):
+                await promover_staging(db, destino)
+            return await documentos(db, "leads"), await documentos(db, "categorias"), await db.list_collection_names()
+
+        leads, categorias, colecoes = asyncio.run(cenario())
+
+        assert [d["id"] for d in leads] == ["atual"]
+        assert [d["id"] for d in categorias] == ["atual"]
+        assert not any(n.startswith(PREFIXO_ANTERIOR) for n in colecoes)
+
+    def test_numeracao_continua_apos_restaurar_cadeia(self, tmp_path):
+        pytest.importorskip("mongomock_motor")
+        completo, incremental = tmp_path / "completo.tar", tmp_path / "incremental.tar"
+
+        async def cenario():
+            cliente = novo_cliente()
+            origem, destino = cliente["origem"], cliente["destino"]
+            sequencias = Sequencias(origem)
+            for _ in range(2):
+                await criar_os(origem, sequencias)
+            manifesto = await gravar_backup(origem, completo)
+            await registrar_backup(origem, manifesto, {"tipo": "local"})
+            for _ in range(3):
+                await criar_os(origem, sequencias)
+            manifesto = await gravar_backup(origem, incremental, modo=TIPO_INCREMENTAL)
+            # Contador do destino atrás dos documentos restaurados
+            await destino[SEQUENCES_COLLECTION].insert_one({"_id": chave("os", "e1", 2025), "valor": 1})
+            resultado = await restaurar_cadeia(destino, [completo, incremental])
+            return manifesto, resultado, await criar_os(destino, Sequencias(destino))
+
+        manifesto, resultado, proximo = asyncio.run(cenario())
+
+        assert manifesto["tipo"] == TIPO_INCREMENTAL
+        assert SEQUENCES_COLLECTION not in manifesto["colecoes"]
+        assert resultado["contadores_descartados"] == 1
+        assert proximo == "OS-2025-0006"
+
+    def test_benchmark_throughput(self, tmp_path):
+        pytest.importorskip("mongomock_motor")
+        resultado = asyncio.run(benchmark(tmp_path / "benchmark.tar", documentos=10000))
+        print(
+            f"\n{resultado['documentos']} documentos restaurados em {resultado['duracao_s']}s: "
+            f"{resultado['documentos_por_s']} docs/s, {resultado['mb_por_s']} MB/s"
+        )
+        assert resultado["documentos"] == 10310
+
+
+async def benchmark(caminho, documentos=50000):
+    cliente = novo_cliente()
+    await popular(cliente["origem"], transacoes=documentos)
+    await gravar_backup(cliente["origem"], caminho)
+    return await restaurar_backup(cliente["destino"], caminho)
+
+
+if __name__ == "__main__":
+    import tempfile
+    args = [int(a) for a in sys.argv[1:2]]
+    with tempfile.TemporaryDirectory() as pasta:
+        r = asyncio.run(benchmark(os.path.join(pasta, "backup.tar"), *args))
+    for nome, carga in r["colecoes"].items():
+        print(f"{nome}: {carga['documentos']} documentos em {carga['duracao_s']}s ({carga['documentos_por_s']} docs/s)")
+    print(f"{r['documentos']} documentos em {r['duracao_s']}s: {r['documentos_por_s']} docs/s, {r['mb_por_s']} MB/s")
@@ -0,0 +1,173 @@
+"""
+Test suite for 'Ledger de Saldos' feature
+Tests services/saldos.py on an in-memory MongoDB
+"""
+import asyncio
+import os
+import sys
+from datetime import timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from services import saldos  # noqa: E402
+from services.indexes import INDEX_REGISTRY  # noqa: E402
+from services.saldos import (  # noqa: E402
+    LEDGER_COLLECTION, abrir_conta, consolidar_saldos, migrar_saldos, registrar_lancamento, registrar_lancamentos,
+    saldo_atual, verificar_divergencias
+)
+
+
+@pytest.fixture(autouse=True)
+def corte_imediato(monkeypatch):
+    # Consolidação inclui os lançamentos recém-criados (sem a margem de 1 minuto)
+    monkeypatch.setattr(saldos, "MARGEM_CORTE", timedelta(seconds=-5))
+
+
+async def novo_db():
+    db = mongomock_motor.AsyncMongoMockClient()["saldos_test"]
+    # create_index um a um: o mongomock ignora partialFilterExpression em create_indexes
+    for spec in INDEX_REGISTRY[LEDGER_COLLECTION]:
+        opcoes = {k: v for k, v in spec.items() if k != "keys"}
+        await db[LEDGER_COLLECTION].create_index(spec["keys"], **opcoes)
+    return db
+
+
+def conta_legada(conta_id="c1", saldo_inicial=1000, saldo_atual=900):
+    """Conta anterior ao ledger: saldo_atual mantido com $inc, sem lançamentos"""
+    return {"id": conta_id, "empresa_id": "e1", "nome": conta_id, "saldo_inicial": saldo_inicial,
+            "saldo_atual": saldo_atual, "created_at": "2024-01-01T00:00:00"}
+
+
+def transacao(transacao_id, tipo, valor, conta_id="c1", **extra):
+    return {"id": transacao_id, "empresa_id": "e1", "tipo": tipo, "valor_total": valor,
+            "data_competencia": "2024-06-01", "conta_bancaria_id": conta_id, **extra}
+
+
+async def lancar(db, t):
+    """O que create_transacao faz: grava a transação e o lançamento"""
+    await db.transacoes.insert_one(dict(t))
+    await registrar_lancamento(db, t)
+
+
+class TestContasAnterioresAoLedger:
+    def test_consolidacao_nao_zera_conta_sem_abertura(self):
+        async def cenario():
+            db = await novo_db()
+            await db.contas_bancarias.insert_one(conta_legada(saldo_inicial=0, saldo_atual=1500))
+            consolidacao = await consolidar_saldos(db)
+            gravado = (await db.contas_bancarias.find_one({"id": "c1"}))["saldo_atual"]
+            antes = await saldo_atual(db, "c1")
+            await migrar_saldos(db)
+            await consolidar_saldos(db)
+            depois = (await db.contas_bancarias.find_one({"id": "c1"}))["saldo_atual"]
+            return consolidacao, gravado, antes, depois, await saldo_atual(db, "c1")
+
+        consolidacao, gravado, antes, depois, ledger = asyncio.run(cenario())
+
+        assert consolidacao["nao_migradas"] == 1
+        assert gravado == antes == 1500
+        assert depois == ledger == 1500
+
+    def test_lancamentos_anteriores_a_migracao_somam_ao_saldo_gravado(self):
+        async def cenario():
+            db = await novo_db()
+            await db.contas_bancarias.insert_one(conta_legada())
+            # Despesa de 100 anterior ao ledger (já no saldo_atual de 900)
+            await db.transacoes.insert_one(transacao("antiga", "despesa", 100))
+            # Depois do deploy, antes da migração: só no ledger
+            await lancar(db, transacao("nova", "despesa", 50))
+            antes = await saldo_atual(db, "c1")
+            migracao = await migrar_saldos(db)
+            repetida = await migrar_saldos(db)
+            await consolidar_saldos(db)
+            return antes, migracao, repetida, await saldo_atual(db, "c1"), await verificar_divergencias(db)
+
+        antes, migracao, repetida, depois, divergencias = asyncio.run(cenario())
+
+        assert antes == depois == 850
+        # Abertura + transação antiga; sem ajuste (900 = 1000 - 100)
+        assert migracao == {"contas_migradas": 1, "lancamentos": 2, "ajustes": 0}
+        assert repetida["contas_migradas"] == 0
+        assert divergencias["divergencias"] == [] and divergencias["nao_migradas"] == []
+
+    def test_migracao_interrompida_e_refeita(self):
+        async def cenario():
+            db = await novo_db()
+            await db.contas_bancarias.insert_one(conta_legada())
+            await db.transacoes.insert_one(transacao("antiga", "despesa", 100))
+            # Lançamentos preparados por uma migração que morreu antes da abertura
+            await db[LEDGER_COLLECTION].insert_one({
+                "id": "sobra", "empresa_id": "e1", "conta_id": "c1", "valor": -100.0, "data": "2024-06-01",
+                "origem": "transacao", "transacao_id": "antiga", "migracao": True
+            })
+            antes = await saldo_atual(db, "c1")
+            await migrar_saldos(db)
+            return antes, await saldo_atual(db, "c1"), await db[LEDGER_COLLECTION].count_documents({"conta_id": "c1"})
+
+        antes, depois, lancamentos = asyncio.run(cenario())
+
+        assert antes == depois == 900
+        assert lancamentos == 2
+
+    def test_ajuste_preserva_saldo_gravado_divergente(self):
+        async def cenario():
+            db = await novo_db()
+            await db.contas_bancarias.insert_one(conta_legada(saldo_atual=700))
+            await db.transacoes.insert_one(transacao("antiga", "despesa", 100))
+            migracao = await migrar_saldos(db)
+            ajuste = await db[LEDGER_COLLECTION].find_one({"origem": "ajuste"})
+            return migracao, ajuste, await saldo_atual(db, "c1")
+
+        migracao, ajuste, saldo = asyncio.run(cenario())
+
+        assert migracao["ajustes"] == 1 and ajuste["valor"] == -200
+        assert saldo == 700
+
+
+class TestTransferencias:
+    def test_transferencia_entre_conta_nova_e_conta_nao_migrada(self):
+        async def cenario():
+            db = await novo_db()
+            await db.contas_bancarias.insert_one(conta_legada("legada", saldo_inicial=0, saldo_atual=500))
+            nova = {"id": "nova", "empresa_id": "e1", "saldo_inicial": 100, "saldo_atual": 100, "created_at": "2025-01-01"}
+            await db.contas_bancarias.insert_one(nova)
+            await abrir_conta(db, nova)
+            # Origem ainda fora do ledger: o saldo disponível é o gravado
+            disponivel = await saldo_atual(db, "legada")
+            # O que criar_transferencia grava: as duas pernas num único insert_many
+            pernas = [
+                transacao("saida", "despesa", 300, "legada", is_transferencia=True),
+                transacao("entrada", "receita", 300, "nova", is_transferencia=True),
+            ]
+            await db.transacoes.insert_many([dict(p) for p in pernas])
+            await registrar_lancamentos(db, pernas)
+            depois = (await saldo_atual(db, "legada"), await saldo_atual(db, "nova"))
+            await migrar_saldos(db)
+            migradas = (await saldo_atual(db, "legada"), await saldo_atual(db, "nova"))
+            # Exclusão de uma perna estorna só ela
+            await registrar_lancamento(db, pernas[1], sinal=-1)
+            await consolidar_saldos(db)
+            return disponivel, depois, migradas, await saldo_atual(db, "nova"), await verificar_divergencias(db)
+
+        disponivel, depois, migradas, estornada, divergencias = asyncio.run(cenario())
+
+        assert disponivel == 500
+        assert depois == migradas == (200, 400)
+        assert estornada == 100
+        assert divergencias["divergencias"] == []
+
+    def test_abertura_unica_por_conta(self):
+        from pymongo.errors import DuplicateKeyError
+
+        async def cenario():
+            db = await novo_db()
+            conta = {"id": "c1", "empresa_id": "e1", "saldo_inicial": 10}
+            await abrir_conta(db, conta)
+            with pytest.raises(DuplicateKeyError):
+                await abrir_conta(db, conta)
+
+        asyncio.run(cenario())
@@ -0,0 +1,118 @@
+"""
+Test suite for 'Numeração de Documentos' feature
+Tests services/sequencias.py with concurrent workers on an in-memory MongoDB
+"""
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from services.indexes import INDEX_REGISTRY, aplicar_indices  # noqa: E402
+from services.sequencias import SEQUENCES_COLLECTION, TIPOS, Sequencias, reservar  # noqa: E402
+
+
+def novo_db():
+    import mongomock_motor
+    return mongomock_motor.AsyncMongoMockClient()["sequencias_test"]
+
+
+async def alocar_em_paralelo(db, alocacoes, workers=4, bloco=1, empresas=1):
+    """Dispara todas as alocações de uma vez, distribuídas entre os workers"""
+    instancias = [Sequencias(db, bloco=bloco) for _ in range(workers)]
+
+    async def alocar(i):
+        empresa_id = f"empresa-{i % empresas}"
+        return empresa_id, await instancias[i % workers].numero("os", empresa_id)
+
+    # (empresa, número): cada empresa tem a sua sequência
+    inicio = time.perf_counter()
+    numeros = await asyncio.gather(*(alocar(i) for i in range(alocacoes)))
+    duracao = time.perf_counter() - inicio
+    return numeros, duracao, instancias
+
+
+class TestSequencias:
+    @pytest.mark.parametrize("bloco", [1, 25])
+    def test_sem_duplicados_sob_concorrencia(self, bloco):
+        pytest.importorskip("mongomock_motor")
+
+        async def cenario():
+            db = novo_db()
+            numeros, _, instancias = await alocar_em_paralelo(db, 1000, workers=8, bloco=bloco, empresas=2)
+            contadores = await db[SEQUENCES_COLLECTION].find({}).to_list(None)
+            return numeros, instancias, contadores
+
+        numeros, instancias, contadores = asyncio.run(cenario())
+
+        assert len(set(numeros)) == 1000
+        assert len(contadores) == 2
+        if bloco == 1:
+            # Sem blocos não há buracos: exatamente 1..500 por empresa
+            assert sorted(c["valor"] for c in contadores) == [500, 500]
+            assert sum(i.estatisticas()["reservas"] for i in instancias) == 1000
+        else:
+            assert sum(i.estatisticas()["reservas"] for i in instancias) < 1000
+
+    def test_continua_a_partir_dos_numeros_existentes(self):
+        pytest.importorskip("mongomock_motor")
+
+        async def cenario():
+            db = novo_db()
+            await db.ordens_servico.insert_many([
+                {"empresa_id": "e1", "numero": "OS-2024-0007"},
+                {"empresa_id": "e1", "numero": "OS-2024-0012"},
+                {"empresa_id": "e1", "numero": "OS-2023-0099"},
+                {"empresa_id": "e2", "numero": "OS-2024-0050"},
+            ])
+            sequencias = Sequencias(db)
+            return [
+                await sequencias.proximo("os", "e1", 2024),
+                await sequencias.proximo("os", "e1", 2024),
+                await sequencias.proximo("os", "e1", 2025),
+                await reservar(db, "fatura", "e1", 2024, quantidade=3),
+            ]
+
+        assert asyncio.run(cenario()) == [13, 14, 1, 3]
+
+    def test_numero_unico_por_empresa(self):
+        pytest.importorskip("mongomock_motor")
+        from pymongo.errors import DuplicateKeyError
+
+        async def cenario():
+            db = novo_db()
+            colecoes = [colecao for colecao, _ in TIPOS.values()]
+            resultado = await aplicar_indices(db, {c: INDEX_REGISTRY[c] for c in colecoes})
+            for colecao in colecoes:
+                await db[colecao].insert_one({"id": "a", "empresa_id": "e1", "numero": "X-2025-0001"})
+                await db[colecao].insert_one({"id": "b", "empresa_id": "e2", "numero": "X-2025-0001"})
+                with pytest.raises(DuplicateKeyError):
+                    await db[colecao].insert_one({"id": "c", "empresa_id": "e1", "numero": "X-2025-0001"})
+            return resultado
+
+        assert asyncio.run(cenario())["falhas"] == []
+
+    def test_benchmark_concorrencia(self):
+        pytest.importorskip("mongomock_motor")
+        resultado = asyncio.run(benchmark(5000, bloco=1))
+        print(f"\n{resultado['alocacoes']} números em {resultado['duracao_s']}s: {resultado['por_s']} números/s")
+        assert resultado["duplicados"] == 0
+
+
+async def benchmark(alocacoes=20000, bloco=1, workers=16):
+    numeros, duracao, instancias = await alocar_em_paralelo(novo_db(), alocacoes, workers=workers, bloco=bloco)
+    return {
+        "alocacoes": alocacoes,
+        "duplicados": alocacoes - len(set(numeros)),
+        "reservas": sum(i.estatisticas()["reservas"] for i in instancias),
+        "duracao_s": round(duracao, 3),
+        "por_s": round(alocacoes / duracao) if duracao else 0,
+    }
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    print(asyncio.run(benchmark(*args)))
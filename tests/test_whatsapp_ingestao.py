@@ -0,0 +1,193 @@
+"""
+Test suite for 'Fila de Ingestão do WhatsApp' feature
+Tests services/whatsapp_ingestao.py on an in-memory MongoDB
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from services.whatsapp_ingestao import FilaParticionada, IngestaoWhatsApp  # noqa: E402
+
+
+def hash_lento(senha):
+    # Simula o custo do bcrypt
+    time.sleep(0.05)
+    return f"hash:{senha}"
+
+
+async def criar_db(nome):
+    import mongomock_motor
+    db = mongomock_motor.AsyncMongoMockClient()[nome]
+    await db.empresas.insert_one({"id": "empresa-1", "razao_social": "ACME", "created_at": "2024-01-01"})
+    await db.users.insert_one({
+        "id": "user-1", "email": "dono@acme.com", "telefone": "(11) 98888-7777",
+        "telefone_normalizado": "+5511988887777", "empresa_ids": ["empresa-1"]
+    })
+    return db
+
+
+async def enviar(ingestao, contatos, mensagens_por_contato):
+    async def contato(i):
+        telefone = f"55119{i:08d}@s.whatsapp.net"
+        for n in range(mensagens_por_contato):
+            await ingestao.processar(telefone, f"Contato {i}", f"mensagem {n}")
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(contato(i) for i in range(contatos)))
+    return time.perf_counter() - inicio
+
+
+class TestFilaParticionada:
+    def test_ordem_por_chave_e_paralelismo_entre_chaves(self):
+        async def cenario():
+            ordem = {}
+            ativos = {"agora": 0, "max": 0}
+
+            async def processar(item):
+                chave, seq = item
+                ativos["agora"] += 1
+                ativos["max"] = max(ativos["max"], ativos["agora"])
+                await asyncio.sleep(random.random() / 200)
+                ordem.setdefault(chave, []).append(seq)
+                ativos["agora"] -= 1
+                return seq
+
+            fila = FilaParticionada(processar, particoes=4)
+            resultados = await asyncio.gather(*(
+                fila.submeter(f"contato-{c}", (f"contato-{c}", seq))
+                for seq in range(10) for c in range(8)
+            ))
+            await fila.parar()
+            return ordem, ativos["max"], resultados
+
+        ordem, max_paralelo, resultados = asyncio.run(cenario())
+
+        assert all(seqs == list(range(10)) for seqs in ordem.values())
+        assert max_paralelo > 1
+        assert resultados == [seq for seq in range(10) for _ in range(8)]
+
+    def test_erro_volta_para_quem_submeteu(self):
+        async def cenario():
+            async def processar(item):
+                if item == "ruim":
+                    raise ValueError("falhou")
+                return item
+
+            fila = FilaParticionada(processar, particoes=2)
+            with pytest.raises(ValueError):
+                await fila.submeter("a", "ruim")
+            ok = await fila.submeter("a", "bom")
+            await fila.parar()
+            return ok, fila.erros
+
+        assert asyncio.run(cenario()) == ("bom", 1)
+
+
+class TestIngestaoWhatsApp:
+    def test_um_lead_por_contato_e_bot_em_cache(self):
+        pytest.importorskip("mongomock_motor")
+        chamadas_hash = []
+
+        def hash_contado(senha):
+            chamadas_hash.append(senha)
+            return hash_lento(senha)
+
+        async def cenario():
+            db = await criar_db("ingestao_test")
+            ingestao = IngestaoWhatsApp(db, hash_senha=hash_contado, particoes=4, intervalo_atividades=0.01)
+            await enviar(ingestao, contatos=20, mensagens_por_contato=3)
+            primeira = await ingestao.processar("5511977776666@s.whatsapp.net", "Novo", "preço?")
+            repetida = await ingestao.processar("+55 11 97777-6666", "Novo", "oi de novo")
+            await ingestao.parar()
+            return db, ingestao.estatisticas(), primeira, repetida
+
+        db, stats, primeira, repetida = asyncio.run(cenario())
+
+        async def contar():
+            return (
+                await db.leads.count_documents({"empresa_id": "empresa-1"}),
+                await db.activities.count_documents({}),
+                await db.users.count_documents({"email": {"$regex": "^whatsapp-bot-"}}),
+            )
+
+        leads, atividades, bots = asyncio.run(contar())
+        assert leads == 21
+        assert atividades == 21
+        assert bots == 1
+        assert len(chamadas_hash) == 1
+        assert "Novo lead criado" in primeira["response_message"]
+        # Mesmo número em outro formato cai no mesmo lead
+        assert "Lead atualizado" in repetida["response_message"]
+        assert stats["leads_criados"] == 21
+        assert stats["lotes_atividades"] < 21
+
+    def test_lead_anterior_a_normalizacao_nao_e_duplicado(self):
+        pytest.importorskip("mongomock_motor")
+        from services.telefones import migrar_telefones
+
+        async def cenario():
+            db = await criar_db("ingestao_legado")
+            # Leads gravados antes de telefone_normalizado existir
+            await db.leads.insert_many([
+                {"id": "legado-wa", "empresa_id": "empresa-1", "whatsapp_phone": "5511955554444",
+                 "telefone": "5511955554444", "created_at": "2024-01-01"},
+                {"id": "legado-manual", "empresa_id": "empresa-1", "telefone": "(11) 94444-3333",
+                 "created_at": "2024-01-02"},
+            ])
+            ingestao = IngestaoWhatsApp(db, hash_senha=hash_lento, particoes=2)
+            antes_do_backfill = await ingestao.processar("5511955554444@s.whatsapp.net", "Cliente", "oi")
+            backfill = await migrar_telefones(db, ["leads"], pendentes=True)
+            depois_do_backfill = await ingestao.processar("5511944443333@s.whatsapp.net", "Outro", "oi")
+            await ingestao.parar()
+            leads = {l["id"]: l async for l in db.leads.find({}, {"_id": 0})}
+            return antes_do_backfill, backfill, depois_do_backfill, leads
+
+        antes, backfill, depois, leads = asyncio.run(cenario())
+
+        assert "Lead atualizado" in antes["response_message"]
+        assert "Lead atualizado" in depois["response_message"]
+        assert set(leads) == {"legado-wa", "legado-manual"}
+        assert leads["legado-wa"]["telefone_normalizado"] == "+5511955554444"
+        assert leads["legado-manual"]["telefone_normalizado"] == "+5511944443333"
+        # O lead achado pela ingestão já saiu da fila do backfill
+        assert backfill["leads"]["verificados"] == 1
+
+    def test_benchmark_throughput(self):
+        pytest.importorskip("mongomock_motor")
+        resultado = asyncio.run(benchmark(contatos=100, mensagens_por_contato=5))
+        print(
+            f"\n{resultado['mensagens']} mensagens em {resultado['segundos']:.2f}s: "
+            f"{resultado['mensagens_por_segundo']:.0f} msg/s"
+        )
+        assert resultado["leads"] == 100
+        assert resultado["mensagens_por_segundo"] > 0
+
+
+async def benchmark(contatos=200, mensagens_por_contato=5, particoes=8):
+    db = await criar_db("ingestao_benchmark")
+    ingestao = IngestaoWhatsApp(db, hash_senha=hash_lento, particoes=particoes)
+    segundos = await enviar(ingestao, contatos, mensagens_por_contato)
+    await ingestao.parar()
+    mensagens = contatos * mensagens_por_contato
+    return {
+        "mensagens": mensagens,
+        "segundos": segundos,
+        "mensagens_por_segundo": mensagens / segundos,
+        "leads": await db.leads.count_documents({}),
+        **ingestao.estatisticas(),
+    }
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    r = asyncio.run(benchmark(*args))
+    print(
+        f"{r['mensagens']} mensagens / {r['leads']} leads em {r['segundos']:.2f}s: "
+        f"{r['mensagens_por_segundo']:.0f} msg/s ({r['lotes_atividades']} lotes de atividades)"
+    )
@@ -84,65 +84,85 @@ async function connectToWhatsApp() {
       if (msg.key.fromMe) continue;
 
       const from = msg.key.remoteJid;
-      const senderName = msg.pushName || from.split('@')[0];
-
-      // Process text messages
-      if (msg.message?.conversation || msg.message?.extendedTextMessage) {
-        const messageText = msg.message?.conversation || msg.message?.extendedTextMessage?.text;
-        
-        console.log('\n📩 Mensagem de texto recebida:');
-        console.log('De:', senderName);
-        console.log('Número:', from);
-        console.log('Mensagem:', messageText);
-        console.log('🔄 Chamando processMessageWithAI...');
-
-        try {
-          await processMessageWithAI(from, messageText, senderName);
-          console.log('✅ processMessageWithAI completado');
-        } catch (error) {
-          console.error('❌ Erro ao processar mensagem:', error);
-          console.error('Stack:', error.stack);
-          await sendWhatsAppMessage(from, '❌ Erro ao processar sua mensagem. Tente novamente.');
-        }
-      }
-      // Process audio messages
-      else if (msg.message?.audioMessage) {
-        console.log('\n🎤 Mensagem de áudio recebida:');
-        console.log('De:', senderName);
-        console.log('Número:', from);
-        
-        try {
-          await sendWhatsAppMessage(from, '🎤 Áudio recebido! Processando...');
-          
-          // Download audio
-          const buffer = await downloadMediaMessage(
-            msg,
-            'buffer',
-            {},
-            { 
-              logger: console,
-              reuploadRequest: sock.updateMediaMessage
-            }
-          );
-          
-          // Convert to text (send to backend for transcription)
-          const audioBase64 = buffer.toString('base64');
-          const transcription = await transcribeAudio(audioBase64);
-          
-          if (transcription) {
-            console.log('Transcrição:', transcription);
-            await sendWhatsAppMessage(from, `📝 Entendi: "${transcription}"\n\nProcessando com IA...`);
-            await processMessageWithAI(from, transcription, senderName);
-          } else {
-            await sendWhatsAppMessage(from, '❌ Não consegui entender o áudio. Tente enviar texto ou falar mais claramente.');
-          }
-        } catch (error) {
-          console.error('Erro ao processar áudio:', error);
-          await sendWhatsAppMessage(from, '❌ Erro ao processar áudio. Tente enviar mensagem de texto.');
+      // Mesmo contato: em ordem de chegada; contatos diferentes: em paralelo
+      enfileirarPorContato(from, () => handleIncomingMessage(msg, from));
+    }
+  });
+}
+
+// Fila por contato (JID): cada mensagem espera a anterior do mesmo contato
+const filasPorContato = new Map();
+
+function enfileirarPorContato(jid, tarefa) {
+  const anterior = filasPorContato.get(jid) || Promise.resolve();
+  const atual = anterior
+    .then(tarefa)
+    .catch((error) => console.error(`❌ Erro na fila de ${jid}:`, error))
+    .finally(() => {
+      if (filasPorContato.get(jid) === atual) filasPorContato.delete(jid);
+    });
+  filasPorContato.set(jid, atual);
+  return atual;
+}
+
+async function handleIncomingMessage(msg, from) {
+  const senderName = msg.pushName || from.split('@')[0];
+
+  // Process text messages
+  if (msg.message?.conversation || msg.message?.extendedTextMessage) {
+    const messageText = msg.message?.conversation || msg.message?.extendedTextMessage?.text;
+    
+    console.log('\n📩 Mensagem de texto recebida:');
+    console.log('De:', senderName);
+    console.log('Número:', from);
+    console.log('Mensagem:', messageText);
+    console.log('🔄 Chamando processMessageWithAI...');
+
+    try {
+      await processMessageWithAI(from, messageText, senderName);
+      console.log('✅ processMessageWithAI completado');
+    } catch (error) {
+      console.error('❌ Erro ao processar mensagem:', error);
+      console.error('Stack:', error.stack);
+      await sendWhatsAppMessage(from, '❌ Erro ao processar sua mensagem. Tente novamente.');
+    }
+  }
+  // Process audio messages
+  else if (msg.message?.audioMessage) {
+    console.log('\n🎤 Mensagem de áudio recebida:');
+    console.log('De:', senderName);
+    console.log('Número:', from);
+    
+    try {
+      await sendWhatsAppMessage(from, '🎤 Áudio recebido! Processando...');
+      
+      // Download audio
+      const buffer = await downloadMediaMessage(
+        msg,
+        'buffer',
+        {},
+        { 
+          logger: console,
+          reuploadRequest: sock.updateMediaMessage
         }
+      );
+      
+      // Convert to text (send to backend for transcription)
+      const audioBase64 = buffer.toString('base64');
+      const transcription = await transcribeAudio(audioBase64);
+      
+      if (transcription) {
+        console.log('Transcrição:', transcription);
+        await sendWhatsAppMessage(from, `📝 Entendi: "${transcription}"\n\nProcessando com IA...`);
+        await processMessageWithAI(from, transcription, senderName);
+      } else {
+        await sendWhatsAppMessage(from, '❌ Não consegui entender o áudio. Tente enviar texto ou falar mais claramente.');
       }
+    } catch (error) {
+      console.error('Erro ao processar áudio:', error);
+      await sendWhatsAppMessage(from, '❌ Erro ao processar áudio. Tente enviar mensagem de texto.');
     }
-  });
+  }
 }
 
 async function processMessageWithAI(phoneNumber, messageText, senderName) {